@@ -1,6 +1,8 @@
 import time
 import traceback
 import sys, os
+import threading, atexit
+from collections import OrderedDict
 
 if __name__ == "__main__":
     #import os.path as osp
@@ -56,6 +58,107 @@ pageTemplate = """
 </html>
 """ % Stylesheet
 
+EntryDtype = [  ## record array layout used by LogWidget to filter entries
+    ('index', 'int32'),
+    ('importance', 'int32'),
+    ('msgType', '|S10'),
+    ('directory', '|S100'),
+    ('entryId', 'int32')
+]
+
+
+class LogWriter(object):
+    """Appends log entries to a config-format log file from a background thread.
+
+    Entries passed to write() are queued and written in batches whenever
+    *flushEntries* entries have accumulated or *flushInterval* seconds have passed
+    since the oldest unwritten entry. This keeps file access out of logMsg(),
+    which may be called from tight acquisition loops. Entries are always written
+    in the order they were queued, even if the target file changes.
+    """
+    def __init__(self, flushEntries=50, flushInterval=0.5):
+        self.flushEntries = flushEntries
+        self.flushInterval = flushInterval
+        self.cond = threading.Condition()
+        self.queue = []          # list of (fileName, name, entry)
+        self.oldest = None
+        self.flushRequested = False
+        self.writing = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, entries, fileName):
+        """Queue a dict of {name: entry} to be appended to *fileName*.
+
+        Each entry is copied so that later changes made for display purposes
+        are not written to the file.
+        """
+        with self.cond:
+            if self.stopped:
+                raise Exception("Cannot write to closed LogWriter.")
+            for name, entry in entries.items():
+                if isinstance(entry, dict):
+                    entry = entry.copy()
+                self.queue.append((fileName, name, entry))
+            if self.oldest is None:
+                self.oldest = time.time()
+            self.cond.notify()
+
+    def flush(self):
+        """Write all queued entries and wait for the write to complete."""
+        with self.cond:
+            self.flushRequested = True
+            self.cond.notify()
+            while (len(self.queue) > 0 or self.writing) and self.thread.is_alive():
+                self.cond.wait(0.1)
+
+    def close(self):
+        """Write all queued entries and stop the writer thread."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not (self.stopped or self.flushRequested or len(self.queue) >= self.flushEntries):
+                    if self.oldest is None:
+                        self.cond.wait()
+                    else:
+                        remaining = self.oldest + self.flushInterval - time.time()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+                queue = self.queue
+                self.queue = []
+                self.oldest = None
+                self.flushRequested = False
+                self.writing = len(queue) > 0
+                stopped = self.stopped
+
+            try:
+                ## one write per run of consecutive entries that go to the same file
+                while len(queue) > 0:
+                    fileName = queue[0][0]
+                    batch = OrderedDict()
+                    while len(queue) > 0 and queue[0][0] == fileName:
+                        batch[queue[0][1]] = queue[0][2]
+                        queue.pop(0)
+                    configfile.appendConfigFile(batch, fileName)
+            except Exception:
+                printExc("Error writing log entries:")
+            finally:
+                with self.cond:
+                    self.writing = False
+                    self.cond.notify_all()
+
+            if stopped:
+                break
 
 
 class LogButton(FeedbackButton):
@@ -102,8 +205,9 @@ class LogWindow(QtGui.QMainWindow):
         self.logCount=0
         self.logFile = None
         configfile.writeConfigFile('', self.fileName())  ## start a new temp log file, destroying anything left over from the last session.
+        self.logWriter = LogWriter()  ## entries are written to disk in the background
         self.buttons = [] ## weak references to all Log Buttons get added to this list, so it's easy to make them all do things, like flash red.
-        self.lock = Mutex()
+        self.lock = Mutex(recursive=True)
         self.errorDialog = ErrorDialog()
         
         self.wid.ui.input.returnPressed.connect(self.textEntered)
@@ -289,24 +393,26 @@ class LogWindow(QtGui.QMainWindow):
         
         self.logMsg('Moving log storage to %s.' % (dh.name(relativeTo=self.manager.baseDir))) ## make this note before we change the log file, so when a log ends, you know where it went after.
         
-        if oldfName == 'tempLog.txt':
-            with self.lock:
+        ## saveEntry() is blocked until the new log file is in place, so that no entry
+        ## can be queued for the temporary log after it has been read back
+        with self.lock:
+            self.flushLog()  ## make sure all entries are on disk before reading them back
+            if oldfName == 'tempLog.txt':
                 temp = configfile.readConfigFile(oldfName)
-        else:
-            temp = {}
-                
-        if dh.exists('log.txt'):
-            self.logFile = dh['log.txt']
-            with self.lock:
+            else:
+                temp = {}
+                    
+            if dh.exists('log.txt'):
+                self.logFile = dh['log.txt']
                 self.msgCount = len(configfile.readConfigFile(self.logFile.name()))
-            newTemp = {}
-            for v in temp.values():
-                self.msgCount += 1
-                newTemp['LogEntry_'+str(self.msgCount)] = v
-            self.saveEntry(newTemp)
-        else:
-            self.logFile = dh.createFile('log.txt')
-            self.saveEntry(temp)
+                newTemp = OrderedDict()
+                for v in temp.values():
+                    self.msgCount += 1
+                    newTemp['LogEntry_'+str(self.msgCount)] = v
+                self.saveEntry(newTemp)
+            else:
+                self.logFile = dh.createFile('log.txt')
+                self.saveEntry(temp)
         
         self.logMsg('Moved log storage from %s to %s.' % (oldfName, self.fileName()))
         self.wid.ui.dirLabel.setText("Current Storage Directory: " + self.fileName())
@@ -320,17 +426,30 @@ class LogWindow(QtGui.QMainWindow):
     
     def saveEntry(self, entry):  
         with self.lock:
-            configfile.appendConfigFile(entry, self.fileName())
+            self.logWriter.write(entry, self.fileName())
+
+    def flushLog(self):
+        """Block until all logged entries have been written to the log file."""
+        self.logWriter.flush()
     
     def disablePopups(self, disable):
         self.errorDialog.disable(disable)
 
 
 class LogWidget(QtGui.QWidget):
+    """Displays log entries, filtered by type, importance, and directory.
+
+    All entries are kept in memory along with a record array (entryArray) that
+    allows the filters to be applied to every entry at once. Only the most recent
+    *pageSize* entries that pass the filters are rendered; older entries are
+    rendered on request by clicking the link at the top of the view.
+    """
     
     sigDisplayEntry = QtCore.Signal(object) ## for thread-safetyness
     sigAddEntry = QtCore.Signal(object) ## for thread-safetyness
     sigScrollToAnchor = QtCore.Signal(object)  # for internal use.
+
+    pageSize = 500  ## number of entries rendered at a time
     
     def __init__(self, parent, manager):
         QtGui.QWidget.__init__(self, parent)
@@ -342,18 +461,14 @@ class LogWidget(QtGui.QWidget):
         
         self.entries = [] ## stores all log entries in memory
         self.cache = {} ## for storing html strings of entries that have already been processed
-        self.displayedEntries = []
+        self.displayedEntries = []  ## all entries that pass the current filters (not all are necessarily rendered)
+        self.displayLimit = self.pageSize  ## number of most recent entries to render
+        self.renderedCount = 0  ## number of entries currently rendered
         #self.currentEntries = None ## recordArray that stores currently displayed entries -- so that if filters get more restrictive we can just refilter this list instead of filtering everything
         self.typeFilters = []
         self.importanceFilter = 0
         self.dirFilter = False
-        self.entryArrayBuffer = np.zeros(1000, dtype=[ ### a record array for quick filtering of entries
-            ('index', 'int32'),
-            ('importance', 'int32'),
-            ('msgType', '|S10'),
-            ('directory', '|S100'),
-            ('entryId', 'int32')
-        ])
+        self.entryArrayBuffer = np.zeros(1000, dtype=EntryDtype) ### a record array for quick filtering of entries
         self.entryArray = self.entryArrayBuffer[:0]
         
         self.filtersChanged()
@@ -374,24 +489,25 @@ class LogWidget(QtGui.QWidget):
         """Load the file, f. f must be able to be read by configfile.py"""
         log = configfile.readConfigFile(f)
         self.entries = []
-        self.entryArrayBuffer = np.zeros(len(log),dtype=[
-            ('index', 'int32'),
-            ('importance', 'int32'),
-            ('msgType', '|S10'),
-            ('directory', '|S100'),
-            ('entryId', 'int32')
-        ])
-        self.entryArray = self.entryArrayBuffer[:]
-                                   
-        i = 0
-        for k,v in log.iteritems():
+        self.cache = {}
+        records = []
+        for i, (k, v) in enumerate(log.iteritems()):
             v['id'] = k[9:]  ## record unique ID to facilitate HTML generation (javascript needs this ID)
             self.entries.append(v)
-            self.entryArray[i] = np.array([(i, v.get('importance', 5), v.get('msgType', 'status'), v.get('currentDir', ''), v.get('entryId', v['id']))], dtype=[('index', 'int32'), ('importance', 'int32'), ('msgType', '|S10'), ('directory', '|S100'), ('entryId', 'int32')])
-            i += 1
+            records.append(self.entryRecord(i, v, v.get('entryId', v['id'])))
+        self.entryArrayBuffer = np.array(records, dtype=EntryDtype)
+        self.entryArray = self.entryArrayBuffer[:]
             
         self.filterEntries() ## puts all entries through current filters and displays the ones that pass
         
+    @staticmethod
+    def entryRecord(index, entry, entryId):
+        """Return the entryArray record for *entry*."""
+        entryDir = entry.get('currentDir', None)
+        if entryDir is None:
+            entryDir = ''
+        return (index, entry.get('importance', 5), entry.get('msgType', 'status'), entryDir, entryId)
+        
     def addEntry(self, entry):
         ## All incoming messages begin here
 
@@ -404,22 +520,14 @@ class LogWidget(QtGui.QWidget):
         self.entries.append(entry)
         i = len(self.entryArray)
         
-        entryDir = entry.get('currentDir', None)
-        if entryDir is None:
-            entryDir = ''
-            
-        arr = np.array([(i, entry['importance'], entry['msgType'], entryDir, entry['id'])], dtype = [('index', 'int32'), ('importance', 'int32'), ('msgType', '|S10'), ('directory', '|S100'), ('entryId', 'int32')])
-        
         ## make more room if needed
         if len(self.entryArrayBuffer) == len(self.entryArray):
-            newArray = np.empty(len(self.entryArrayBuffer)+1000, self.entryArrayBuffer.dtype)
+            newArray = np.empty(max(1000, len(self.entryArrayBuffer)*2), self.entryArrayBuffer.dtype)
             newArray[:len(self.entryArray)] = self.entryArray
             self.entryArrayBuffer = newArray
         self.entryArray = self.entryArrayBuffer[:len(self.entryArray)+1]
-        #self.entryArray[i] = [(i, entry['importance'], entry['msgType'], entry['currentDir'])]
-        self.entryArray[i] = arr
+        self.entryArray[i] = self.entryRecord(i, entry, entry['id'])
         self.checkDisplay(entry) ## displays the entry if it passes the current filters
-        #np.append(self.entryArray, np.array(i, [[i, entry['importance'], entry['msgType'], entry['currentDir']]]), dtype = [('index', int), ('importance', int), ('msgType', str), ('directory', str)])
 
 
 
@@ -463,55 +571,52 @@ class LogWidget(QtGui.QWidget):
         else:
             self.dirFilter = False
         
-    
+    def filterMask(self, arr):
+        """Return a boolean mask of the records in *arr* that pass the current filters."""
+        mask = arr['msgType'] == ''  ## entries without a type are not filtered by type
+        for t in self.typeFilters:
+            mask |= arr['msgType'] == t
+        mask &= arr['importance'] > self.importanceFilter
+        if self.dirFilter is not False:
+            mask &= np.char.startswith(arr['directory'], str(self.dirFilter))
+        return mask
         
     def filterEntries(self):
-        """Runs each entry in self.entries through the filters and displays if it makes it through."""
-        ### make self.entries a record array, then filtering will be much faster (to OR true/false arrays, + them)
-        typeMask = self.entryArray['msgType'] == ''
-        for t in self.typeFilters:
-            typeMask += self.entryArray['msgType'] == t
-        mask = (self.entryArray['importance'] > self.importanceFilter) * typeMask
-        if self.dirFilter != False:
-            d = np.ascontiguousarray(self.entryArray['directory'])
-            j = len(self.dirFilter)
-            i = len(d)
-            d = d.view(np.byte).reshape(i, 100)[:, :j]
-            d = d.reshape(i*j).view('|S%d' % j)
-            mask *= (d == self.dirFilter)
-            
-            
-        self.ui.output.clear()
-        global Stylesheet
-        self.ui.output.document().setDefaultStyleSheet(Stylesheet)
-        #global pageTemplate
-        #self.ui.logView.setHtml(pageTemplate)
-        indices = list(self.entryArray[mask]['index'])
-        inds = indices
-        
-        #if self.dirFilter != False:
-            #j = len(self.dirFilter)
-            #for i, n in inds:
-                #if not self.entries[n]['currentDir'][:j] == self.dirFilter:
-                    #indices.pop(i)
-                    
-        self.displayEntry([self.entries[i] for i in indices])
+        """Runs all entries through the filters and displays the most recent ones that make it through."""
+        indices = np.argwhere(self.filterMask(self.entryArray))[:, 0]
+        self.displayedEntries = [self.entries[i] for i in self.entryArray['index'][indices]]
+        self.displayLimit = self.pageSize
+        self.renderEntries()
                           
     def checkDisplay(self, entry):
-        ### checks whether entry passes the current filters and displays it if it does.
-        if entry['msgType'] not in self.typeFilters:
-            return
-        elif entry['importance'] < self.importanceFilter:
-            return
-        elif self.dirFilter is not False:
-            if entry['currentDir'][:len(self.dirFilter)] != self.dirFilter:
-                return
-        else:
+        ### checks whether the most recently added entry passes the current filters and displays it if it does.
+        if self.filterMask(self.entryArray[-1:])[0]:
             self.displayEntry([entry])
     
+    def renderEntries(self):
+        """Regenerate the view from the most recent *displayLimit* displayed entries."""
+        global Stylesheet
+        entries = self.displayedEntries[-self.displayLimit:]
+        hidden = len(self.displayedEntries) - len(entries)
+        html = []
+        if hidden > 0:
+            html.append('<a href="more:">Show earlier entries (%d not shown)</a>' % hidden)
+        html.extend([self.entryHtml(entry) for entry in entries])
+        
+        self.ui.output.clear()
+        self.ui.output.document().setDefaultStyleSheet(Stylesheet)
+        self.ui.output.setHtml("\n".join(html))
+        self.renderedCount = len(entries)
+        if len(entries) > 0:
+            self.sigScrollToAnchor.emit(str(entries[-1]['id']))  ## queued connection
+        
+    def entryHtml(self, entry):
+        if not self.cache.has_key(id(entry)):
+            self.cache[id(entry)] = self.generateEntryHtml(entry)
+        return self.cache[id(entry)]
         
     def displayEntry(self, entries):
-        ## entries should be a list of log entries
+        ## entries should be a list of log entries that pass the current filters
         
         ## for thread-safetyness:
         isGuiThread = QtCore.QThread.currentThread() == QtCore.QCoreApplication.instance().thread()
@@ -519,32 +624,15 @@ class LogWidget(QtGui.QWidget):
             self.sigDisplayEntry.emit(entries)
             return
         
+        self.displayedEntries.extend(entries)
+        if self.renderedCount + len(entries) > self.displayLimit + self.pageSize:
+            ## too many entries have accumulated in the view; regenerate it with
+            ## only the most recent entries
+            self.renderEntries()
+            return
+        
         for entry in entries:
-            if not self.cache.has_key(id(entry)):
-                self.cache[id(entry)] = self.generateEntryHtml(entry)
-                
-                ## determine message color:
-                #if entry['msgType'] == 'status':
-                    #color = 'green'
-                #elif entry['msgType'] == 'user':
-                    #color = 'blue'
-                #elif entry['msgType'] == 'error':
-                    #color = 'red'
-                #elif entry['msgType'] == 'warning':
-                    #color = '#DD4400' ## orange
-                #else:
-                    #color = 'black'
-                    
-                #if entry.has_key('exception') or entry.has_key('docs') or entry.has_key('reasons'):
-                    ##self.displayComplexMessage(entry, color)
-                    #self.displayComplexMessage(entry)
-                #else: 
-                    #self.displayText(entry['message'], entry, color, timeStamp=entry['timestamp'])
-                    
-            #for x in self.cache[id(entry)]:
-                #self.ui.output.appendHtml(x)
-                
-            html = self.cache[id(entry)]
+            html = self.entryHtml(entry)
             #frame = self.ui.logView.page().currentFrame()
             #isMax = frame.scrollBarValue(QtCore.Qt.Vertical) == frame.scrollBarMaximum(QtCore.Qt.Vertical)
             sb = self.ui.output.verticalScrollBar()
@@ -552,7 +640,7 @@ class LogWidget(QtGui.QWidget):
             
             #frame.findFirstElement('body').appendInside(html)
             self.ui.output.append(html)
-            self.displayedEntries.append(entry)
+            self.renderedCount += 1
             
             if isMax:
                 ## can't scroll to end until the web frame has processed the html change
@@ -566,6 +654,7 @@ class LogWidget(QtGui.QWidget):
                 self.sigScrollToAnchor.emit(str(entry['id']))  ## queued connection
             #self.ui.logView.update()
             
+
     def scrollToAnchor(self, anchor):
         self.ui.output.scrollToAnchor(anchor)
                 
@@ -773,12 +862,13 @@ class LogWidget(QtGui.QWidget):
                 #doc = re.sub(r'<a href="exc:%s">(<[^>]+>)*Show traceback %s(<[^>]+>)*</a>'%(str(e['id']), str(e['id'])), e['tracebackHtml'], doc)
                 
         global pageTemplate
-        doc = pageTemplate
-        for e in self.displayedEntries:
-            doc += self.cache[id(e)]
+        doc = [pageTemplate]
         for e in self.displayedEntries:
+            html = self.entryHtml(e)
             if e.has_key('tracebackHtml'):
-                doc = re.sub(r'<a href="exc:%s">(<[^>]+>)*Show traceback %s(<[^>]+>)*</a>'%(str(e['id']), str(e['id'])), e['tracebackHtml'], doc)
+                html = re.sub(r'<a href="exc:%s">(<[^>]+>)*Show traceback %s(<[^>]+>)*</a>'%(str(e['id']), str(e['id'])), e['tracebackHtml'], html)
+            doc.append(html)
+        doc = "".join(doc)
             
             
         
@@ -816,6 +906,9 @@ class LogWidget(QtGui.QWidget):
         url = url.toString()
         if url[:4] == 'doc:':
             self.manager.showDocumentation(url[4:])
+        elif url[:5] == 'more:':
+            self.displayLimit += self.pageSize
+            self.renderEntries()
         elif url[:4] == 'exc:':
             cursor = self.ui.output.document().find('Show traceback %s' % url[4:])
             try:
@@ -831,7 +924,8 @@ class LogWidget(QtGui.QWidget):
     def clear(self):
         #self.ui.logView.setHtml("")
         self.ui.output.clear()
-        self.displayedEntryies = []
+        self.displayedEntries = []
+        self.renderedCount = 0
 
         
         
@@ -18,7 +18,7 @@ import os, sys, gc
 import acq4.pyqtgraph.exceptionHandling as exceptionHandling   
 exceptionHandling.setTracebackClearing(True)
 
-import time, atexit, weakref
+import time, atexit, weakref, threading, imp, Queue
 from acq4.pyqtgraph.Qt import QtCore, QtGui
 import acq4.util.reload as reload
 
@@ -31,6 +31,7 @@ from collections import OrderedDict
 import acq4.pyqtgraph as pg
 from .LogWindow import LogWindow
 from .util.HelpfulException import HelpfulException
+from .devices.Device import Device, DeviceTask
 
 
 LOG = None
@@ -314,21 +315,17 @@ class Manager(QtCore.QObject):
             try:
                 ## configure new devices
                 if key == 'devices':
+                    devs = OrderedDict()
                     for k in cfg['devices']:
                         if self.disableAllDevs or k in self.disableDevs:
                             print "    --> Ignoring device '%s' -- disabled by request" % k
                             logMsg("    --> Ignoring device '%s' -- disabled by request" % k)
                             continue
-                        print "  === Configuring device '%s' ===" % k
-                        logMsg("  === Configuring device '%s' ===" % k)
-                        try:
-                            conf = cfg['devices'][k]
-                            driverName = conf['driver']
-                            if 'config' in conf:  # for backward compatibility
-                                conf = conf['config']
-                            self.loadDevice(driverName, conf, k)
-                        except:
-                            printExc("Error configuring device %s:" % k)
+                        devs[k] = cfg['devices'][k]
+                    
+                    ## Devices that allow it are loaded concurrently (see DeviceLoader)
+                    loader = DeviceLoader(self, devs, threads=cfg.get('deviceLoadThreads', 4))
+                    loader.run()
                     print "=== Device configuration complete ==="
                     logMsg("=== Device configuration complete ===")
                             
@@ -385,6 +382,17 @@ class Manager(QtCore.QObject):
                         print "Warning: ignored config option 'defaultMouseMode'; value must be either 'oneButton' or 'threeButton'." 
                 elif key == 'useOpenGL':
                     pg.setConfigOption('useOpenGL', cfg[key])
+                
+                elif key == 'profile':
+                    ## names (or wildcard patterns) of Profiler sites to enable; see util.debug.ProfilerRegistry
+                    profilerRegistry.enable(cfg[key])
+
+                elif key == 'imagePyramidCache':
+                    ## store image pyramids on disk instead of in memory; see util.ImagePyramid
+                    import acq4.util.ImagePyramid as ImagePyramid
+                    ImagePyramid.setCacheDir(os.path.join(self.configDir, cfg[key]['path']))
+                    if 'maxSize' in cfg[key]:
+                        ImagePyramid.setMaxCacheSize(cfg[key]['maxSize'])
                     
                 ## Copy in any other configurations.
                 ## dicts are extended, all others are overwritten.
@@ -456,9 +464,20 @@ class Manager(QtCore.QObject):
     def loadDevice(self, driverName, conf, name):
         """Load the code for a device. For this to work properly, there must be 
         a python module called acq4.devices.driverName which contains a class called driverName."""
+        return self._createDevice(self.getDeviceClass(driverName), conf, name)
+    
+    def getDeviceClass(self, driverName):
+        """Return the device class for *driverName* (see loadDevice)."""
         mod = __import__('acq4.devices.%s' % driverName, fromlist=['*'])
-        devclass = getattr(mod, driverName)
+        return getattr(mod, driverName)
+        
+    def _createDevice(self, devclass, conf, name):
         dev = devclass(self, conf, name)
+        ## devices created in a worker thread (see DeviceLoader) must be handed to the GUI thread
+        if isinstance(dev, QtCore.QObject):
+            guiThread = QtCore.QCoreApplication.instance().thread()
+            if dev.thread() != guiThread:
+                dev.moveToThread(guiThread)
         with self.lock:
             self.devices[name] = dev
         return dev
@@ -874,12 +893,183 @@ class Manager(QtCore.QObject):
                 print "Closing windows.."
                 QtGui.QApplication.instance().closeAllWindows()
                 QtGui.QApplication.instance().processEvents()
+                self.logWindow.flushLog()
             #print "  done."
             print "\n    ciao."
         QtGui.QApplication.quit()
         #pg.exit()  # pg.exit() causes python to exit before Qt has a chance to clean up. 
                     # this avoids otherwise irritating exit crashes.
 
+class DeviceLoader(object):
+    """Loads the devices described in a configuration, using a pool of worker threads.
+    
+    A device depends on any other device whose name appears anywhere in its 
+    configuration (parentDevice, DAQ channel definitions, scopeDevice, ...) and which
+    is listed before it. Each device is loaded once all of its dependencies have
+    finished loading, so devices that are independent of each other (for example,
+    several serial-port devices) may perform their slow initialization concurrently.
+    
+    Only devices whose class sets threadSafeInit = True (see Device) are constructed
+    in worker threads; all others are constructed in the calling thread. For those,
+    Device.initHardware() (if reimplemented) is run in a worker thread before the device
+    is constructed. Errors are reported and devices are registered in configuration 
+    order, just as they would be if the devices were loaded one after another.
+    
+    ============== ============================================================
+    **Arguments:**
+    dm             The Manager. Must provide getDeviceClass(), _createDevice(), and
+                   the devices dict.
+    devConfigs     Ordered dict of {deviceName: {'driver': ..., ...}}.
+    threads        Maximum number of devices to load concurrently. If 0, all
+                   devices are loaded serially in the calling thread.
+    ============== ============================================================
+    """
+    def __init__(self, dm, devConfigs, threads=4):
+        self.dm = dm
+        self.devConfigs = devConfigs
+        self.names = list(devConfigs.keys())
+        self.threads = threads
+        self.deps = self.dependencies()
+        self.errors = {}  # name: exc_info for devices that failed to load
+        
+    def dependencies(self):
+        """Return a dict of {deviceName: set(names of devices it depends on)}."""
+        deps = {}
+        for i, name in enumerate(self.names):
+            deps[name] = configReferences(self.devConfigs[name], set(self.names[:i]))
+        return deps
+        
+    def run(self):
+        """Load all devices and report errors. Returns when all devices have been loaded
+        (or have failed to load)."""
+        ## Worker threads may need to import modules; that would deadlock if we
+        ## are called while the import lock is held.
+        threads = 0 if imp.lock_held() else self.threads
+        
+        pending = list(self.names)
+        finished = Queue.Queue()  # (name, exc_info) from worker threads
+        classes = {}
+        ready = []  # devices whose hardware was initialized by a worker; construct them here
+        done = set()
+        running = 0
+        reported = 0
+        workers = []
+        work = Queue.Queue()
+        try:
+            while reported < len(self.names):
+                ## start every device whose dependencies have finished loading
+                mainThread = []
+                for name in pending[:]:
+                    if not self.deps[name].issubset(done):
+                        continue
+                    pending.remove(name)
+                    print "  === Configuring device '%s' ===" % name
+                    logMsg("  === Configuring device '%s' ===" % name)
+                    try:
+                        devclass = self.dm.getDeviceClass(self.devConfigs[name]['driver'])
+                    except:
+                        self.errors[name] = sys.exc_info()
+                        done.add(name)
+                        continue
+                    classes[name] = devclass
+                    if threads > 0 and (getattr(devclass, 'threadSafeInit', False) or hasHardwareInit(devclass)):
+                        if len(workers) < threads:
+                            worker = threading.Thread(target=self._worker, args=(work, finished))
+                            worker.daemon = True
+                            worker.start()
+                            workers.append(worker)
+                        work.put((name, devclass))
+                        running += 1
+                    else:
+                        mainThread.append((name, devclass))
+                mainThread.extend(ready)
+                ready = []
+                        
+                if len(mainThread) > 0:
+                    for name, devclass in mainThread:
+                        self._load(name, devclass)
+                        done.add(name)
+                elif running > 0:
+                    name, exc = finished.get()
+                    running -= 1
+                    if exc is not None:
+                        self.errors[name] = exc
+                    elif not getattr(classes[name], 'threadSafeInit', False):
+                        ready.append((name, classes[name]))
+                        continue
+                    done.add(name)
+                    
+                ## report errors in configuration order
+                while reported < len(self.names) and self.names[reported] in done:
+                    name = self.names[reported]
+                    reported += 1
+                    if name in self.errors:
+                        exc = self.errors[name]
+                        try:
+                            raise exc[0], exc[1], exc[2]
+                        except:
+                            printExc("Error configuring device %s:" % name)
+        finally:
+            for worker in workers:
+                work.put(None)
+            
+        ## keep devices listed in configuration order
+        with self.dm.lock:
+            loaded = [(k, self.dm.devices.pop(k)) for k in self.names if k in self.dm.devices]
+            self.dm.devices.update(loaded)
+            
+    def _load(self, name, devclass):
+        try:
+            self.dm._createDevice(devclass, self.deviceConfig(name), name)
+        except:
+            self.errors[name] = sys.exc_info()
+            
+    def deviceConfig(self, name):
+        conf = self.devConfigs[name]
+        if 'config' in conf:  # for backward compatibility
+            conf = conf['config']
+        return conf
+            
+    def _worker(self, work, finished):
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            name, devclass = item
+            try:
+                if getattr(devclass, 'threadSafeInit', False):
+                    self.dm._createDevice(devclass, self.deviceConfig(name), name)
+                else:
+                    devclass.loadHardware(self.deviceConfig(name), name)
+                finished.put((name, None))
+            except:
+                finished.put((name, sys.exc_info()))
+
+
+def hasHardwareInit(devclass):
+    """Return True if *devclass* reimplements Device.initHardware()."""
+    init = getattr(devclass, 'initHardware', None)
+    return init is not None and getattr(init, '__func__', init) is not Device.initHardware.__func__
+
+
+def configReferences(conf, names):
+    """Return the subset of *names* that appear as strings anywhere in *conf*
+    (a nested structure of dicts, lists, and tuples), as keys or values."""
+    found = set()
+    stack = [conf]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if isinstance(obj, basestring):
+            if obj in names:
+                found.add(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return found
+
+
 class Task:
     id = 0
     
@@ -895,6 +1085,9 @@ class Task:
         self.startedDevs = []
         self.startTime = None
         self.stopTime = None
+        self._wakeEvent = threading.Event()  ## set by deviceTaskDone() to wake up execute()
+        self._wakeTimer = None  ## (wakeTime, Timer) used by _waitForWake()
+        self._rearmed = False  ## set by rearm(); the next execute() re-arms device tasks instead of configuring them
 
         #self.reserved = False
         try:
@@ -1020,10 +1213,16 @@ class Task:
                 ## Configure all subtasks. Some devices may need access to other tasks, so we make all available here.
                 ## This is how we allow multiple devices to communicate and decide how to operate together.
                 ## Each task may modify the startOrder list to suit its needs.
+                ## Subtasks of a re-armed task are still configured from the previous run (see rearm()).
                 #print "Configuring subtasks.."
                 for devName in configOrder:
-                    self.tasks[devName].configure()
-                    prof.mark('configure %s' % devName)
+                    if self._rearmed:
+                        self.tasks[devName].rearm()
+                        prof.mark('rearm %s' % devName)
+                    else:
+                        self.tasks[devName].configure()
+                        prof.mark('configure %s' % devName)
+                self._rearmed = False
                     
                 startOrder = self.getStartOrder()
                 #print "done"
@@ -1062,13 +1261,24 @@ class Task:
                 lastProcess = ptime.time()
                 isGuiThread = QtCore.QThread.currentThread() == QtCore.QCoreApplication.instance().thread()
                 #print "isGuiThread:", isGuiThread
-                while not self.isDone():
+                
+                ## If all device tasks report their completion via notifyDone(), then we
+                ## can sleep until woken instead of polling isDone().
+                polling = self._needsPolling()
+                while True:
+                    self._wakeEvent.clear()
+                    if self.isDone():
+                        break
                     now = ptime.time()
                     elapsed = now - self.startTime
                     if isGuiThread:
                         if processEvents and now-lastProcess > 20e-3:  ## only process Qt events every 20ms
                             QtGui.QApplication.processEvents()
                             lastProcess = ptime.time()
+                    
+                    if not polling:
+                        self._waitForWake(20e-3 if (isGuiThread and processEvents) else None)
+                        continue
                         
                     if elapsed < self.cfg['duration']-10e-3:  ## If the task duration has not elapsed yet, only wake up every 10ms, and attempt to wake up 5ms before the end
                         sleep = min(10e-3, self.cfg['duration']-elapsed-5e-3)
@@ -1086,9 +1296,70 @@ class Task:
                 self._releaseAll()
                 raise
             finally:
+                self._cancelWake()
                 prof.finish()
         
         
+    def deviceTaskDone(self, task):
+        """Called by device tasks (see DeviceTask.notifyDone) when they have completed."""
+        self._wakeEvent.set()
+        
+    def _needsPolling(self):
+        ## Return True if any device task can only report its completion through isDone().
+        ## Tasks that do not override DeviceTask.isDone are always done. A task is only 
+        ## trusted to notify if notifiesDone is set by the class that implements its 
+        ## isDone() or by a subclass; subclasses that override isDone() must declare it again.
+        for task in self.tasks.values():
+            if not task.notifiesDone:
+                for cls in type(task).__mro__:
+                    if 'isDone' in cls.__dict__:
+                        if cls is not DeviceTask:
+                            return True
+                        break
+                continue
+            for cls in type(task).__mro__:
+                if 'notifiesDone' in cls.__dict__:
+                    break
+                if 'isDone' in cls.__dict__:
+                    return True
+        return False
+        
+    def _waitForWake(self, maxWait=None):
+        ## Block until deviceTaskDone() is called, or until the next time at which 
+        ## isDone() may change its answer on its own: the end of the requested duration,
+        ## or the timeout. If maxWait is given, return after at most that many seconds.
+        timeout = self.cfg.get('timeout', self.cfg['duration'] + 10.0)
+        now = ptime.time()
+        wakeTimes = [self.startTime + t for t in (self.cfg['duration'], timeout) if t is not None and self.startTime + t > now]
+        if len(wakeTimes) == 0:
+            self._wakeEvent.wait(1e-3)
+            return
+        wakeAt = min(wakeTimes)
+        if maxWait is not None:
+            ## short wait between processing Qt events
+            self._wakeEvent.wait(min(maxWait, wakeAt - now))
+            return
+        ## Under python 2, Event.wait(timeout) polls with increasingly long sleeps, so
+        ## wait without a timeout and let a single timer wake us at the scheduled time.
+        self._scheduleWake(wakeAt)
+        self._wakeEvent.wait()
+        
+    def _scheduleWake(self, wakeAt):
+        ## Start a timer that sets _wakeEvent at time wakeAt, unless one is already scheduled.
+        if self._wakeTimer is not None:
+            if self._wakeTimer[0] == wakeAt:
+                return
+            self._wakeTimer[1].cancel()
+        timer = threading.Timer(max(0, wakeAt - ptime.time()), self._wakeEvent.set)
+        timer.daemon = True
+        timer.start()
+        self._wakeTimer = (wakeAt, timer)
+        
+    def _cancelWake(self):
+        if self._wakeTimer is not None:
+            self._wakeTimer[1].cancel()
+            self._wakeTimer = None
+        
     def isDone(self):
         """Return True if all tasks are completed and ready to return results.
 
@@ -1238,6 +1509,29 @@ class Task:
         """Stop all tasks, to not attempt to get data."""
         self.stop(abort=True)
 
+    def rearm(self):
+        """Prepare a stopped task to be executed again with the same command.
+
+        Device tasks keep their configuration (DAQ channels, cached waveforms)
+        and the next call to execute() starts them without configuring them
+        again. This avoids creating and configuring a new task for each run of
+        a repeated acquisition.
+
+        Return False if any device task does not support being re-armed; in
+        that case a new task must be created instead.
+        """
+        with self.taskLock:
+            if self.startTime is None or not self.stopped:
+                raise Exception("Cannot re-arm a task that has not been executed and stopped.")
+            for devName in self.tasks:
+                if not self.tasks[devName].canRearm():
+                    return False
+            self._rearmed = True
+            self.result = None
+            self.startTime = None
+            self.stopTime = None
+            return True
+
     @staticmethod
     def toposort(deps, cost=None):
         """Topological sort. Arguments are:
@@ -2,7 +2,8 @@
 import acq4.util.DataManager as DataManager
 import acq4.util.SequenceRunner as SequenceRunner
 from collections import OrderedDict
-import functools
+import collections, functools, itertools
+from multiprocessing.pool import ThreadPool
 from acq4.util.metaarray import *
 import numpy as np
 
@@ -116,6 +117,12 @@ def buildSequenceArray(*args, **kargs):
         truncate: If join=True and some elements differ in shape, truncate to the smallest shape
         fill:    If join=True, pre-fill the empty array with this value. Any points in the
                  parameter space with no data will be left with this value.
+        workers: Number of threads used to call func on protocol directories ahead of time.
+                 The default (0) reads each directory serially in the calling thread. Only
+                 pass workers > 0 if func is thread-safe (it will be called concurrently
+                 for different directories).
+        prefetch: Maximum number of directories read ahead of the one currently being stored
+                 (default 2*workers).
         
     Example: Return an array of all primary-channel clamp recordings across a sequence 
         buildSequenceArray(seqDir, lambda protoDir: getClampFile(protoDir).read()['primary'])"""
@@ -124,12 +131,13 @@ def buildSequenceArray(*args, **kargs):
         if m is None:
             return i
         
-def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
+def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None, workers=0, prefetch=None):
     """Iterator for buildSequenceArray that yields progress updates."""
         
     if func is None:
         func = lambda dh: dh
         join = False
+        workers = 0  ## nothing to read
         
     params = listSequenceParams(dh)
     #inds = OrderedDict([(k, range(len(v))) for k,v in params.iteritems()])
@@ -141,6 +149,7 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
     subDirs = dh.subDirs()
     if len(subDirs) == 0:
         yield None, None
+        return
     
     ## set up meta-info for sequence axes
     seqShape = tuple([len(p) for p in params.itervalues()])
@@ -150,59 +159,94 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
         info[i] = {'name': k, 'values': np.array(v)}
         i += 1
     
-    ## get a data sample
-    first = func(dh[subDirs[0]])
+    ## Read protocol directories (in order), possibly several at a time in
+    ## background threads. Each item is (func(subd), subd.info())
+    def readDir(name):
+        subd = dh[name]
+        return func(subd), subd.info()
+    results = prefetchMap(readDir, subDirs, workers=workers, prefetch=prefetch)
     
-    ## build empty MetaArray
-    if join:
-        shape = seqShape + first.shape
-        if isinstance(first, MetaArray):
-            info = info + first._info
-        else:
-            info = info + [{} for i in range(first.ndim+1)]
-        data = MetaArray(np.empty(shape, first.dtype), info=info)
-        if fill is not None:
-            data[:] = fill
+    try:
+        ## get a data sample
+        first = next(results)
         
-    else:
-        shape = seqShape
-        info = info + []
-        data = MetaArray(np.empty(shape, object), info=info)
-
-    ## fill data
-    i = 0
-    if join and truncate:
-        minShape = first.shape
-        for name in subDirs:
-            subd = dh[name]
-            d = func(subd)
-            minShape = [min(d.shape[j], minShape[j]) for j in range(d.ndim)]
-            dhInfo = subd.info()
+        ## build empty MetaArray
+        if join:
+            shape = seqShape + first[0].shape
+            if isinstance(first[0], MetaArray):
+                info = info + first[0]._info
+            else:
+                info = info + [{} for i in range(first[0].ndim+1)]
+            data = MetaArray(np.empty(shape, first[0].dtype), info=info)
+            if fill is not None:
+                data[:] = fill
+            
+        else:
+            shape = seqShape
+            info = info + []
+            data = MetaArray(np.empty(shape, object), info=info)
+
+        ## fill data
+        i = 0
+        if join and truncate:
+            minShape = first[0].shape
+        for d, dhInfo in itertools.chain([first], results):
             ind = []
             for k in params:
                 ind.append(dhInfo[k])
-            sl = [slice(0,m) for m in minShape]
-            ind += sl
-            data[tuple(ind)] = d[sl]
+            if join and truncate:
+                minShape = [min(d.shape[j], minShape[j]) for j in range(d.ndim)]
+                sl = [slice(0,m) for m in minShape]
+                ind += sl
+                data[tuple(ind)] = d[sl]
+            else:
+                data[tuple(ind)] = d
             i += 1
             yield i, len(subDirs)
+    finally:
+        results.close()  ## stop reading ahead if the caller gave up early
+        
+    if join and truncate:
         sl = [slice(None)] * len(seqShape)
         sl += [slice(0,m) for m in minShape]
         data = data[sl]
-    else:
-        for name in subDirs:
-            subd = dh[name]
-            d = func(subd)
-            dhInfo = subd.info()
-            ind = []
-            for k in params:
-                ind.append(dhInfo[k])
-            data[tuple(ind)] = d
-            i += 1
-            yield i, len(subDirs)
 
     yield data, None
 
+def prefetchMap(func, items, workers=0, prefetch=None):
+    """Generator yielding func(item) for each item, in order.
+    
+    By default, func is called serially as each item is consumed. If *workers* > 0,
+    func is called from a pool of background threads so that up to *prefetch*
+    (default 2*workers) items are processed ahead of the consumer. This is
+    useful for overlapping slow file access (e.g. from network storage) with processing.
+    Exceptions raised by func are re-raised in the consumer when the item is reached.
+    """
+    if workers is None or workers < 1:
+        for item in items:
+            yield func(item)
+        return
+    
+    if prefetch is None:
+        prefetch = 2 * workers
+    prefetch = max(prefetch, 1)
+    pool = ThreadPool(workers)
+    pending = collections.deque()
+    try:
+        items = iter(items)
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= prefetch:
+                break
+        while len(pending) > 0:
+            result = pending.popleft().get()
+            for item in items:
+                pending.append(pool.apply_async(func, (item,)))
+                break
+            yield result
+    finally:
+        pool.terminate()
+
 def getParent(child, parentType):
     """Return the (grand)parent of child that matches parentType"""
     if dirType(child) == parentType:
@@ -0,0 +1,87 @@
+import tempfile, shutil, atexit, time, threading
+from collections import OrderedDict
+import numpy as np
+import acq4.util.DataManager as dm
+from acq4.util.metaarray import MetaArray
+from acq4.analysis.dataModels.PatchEPhys import buildSequenceArray, prefetchMap
+import acq4.pyqtgraph as pg
+
+app = pg.mkQApp()
+
+root = tempfile.mkdtemp()
+def remove_tempdir():
+    shutil.rmtree(root)
+atexit.register(remove_tempdir)
+
+
+def makeSequence(name, nx=4, ny=3, nPts=50, shortLastRow=False):
+    """Create a protocol sequence directory with one recording per point in a 2D parameter space.
+    If *shortLastRow*, recordings in the last row are shorter than the others."""
+    rh = dm.getDirHandle(root)
+    xKey = ('Clamp1', 'amplitude')
+    yKey = ('Clamp1', 'duration')
+    params = OrderedDict([(xKey, list(range(nx))), (yKey, list(range(ny)))])
+    seq = rh.mkdir(name, info={'dirType': 'ProtocolSequence', 'sequenceParams': params})
+    for i in range(nx):
+        for j in range(ny):
+            d = seq.mkdir('%03d_%03d' % (i, j), info={xKey: i, yKey: j})
+            n = nPts - 5 if (shortLastRow and i == nx - 1) else nPts
+            t = np.arange(n) * 1e-4
+            info = [{'name': 'Time', 'units': 's', 'values': t}, {'name': 'Channel', 'cols': [{'name': 'primary'}]}]
+            data = MetaArray((np.arange(n) + 1000 * i + 100 * j).reshape(n, 1).astype(float), info=info)
+            d.writeFile(data, 'Clamp1.ma')
+    return seq
+
+
+def readPrimary(protoDir):
+    return protoDir['Clamp1.ma'].read()['Channel': 'primary']
+
+
+def test_buildSequenceArray():
+    for truncate in (True, False):
+        seq = makeSequence('seq_%s' % truncate, shortLastRow=truncate)
+        serial = buildSequenceArray(seq, readPrimary, truncate=truncate, fill=0, workers=0)
+        parallel = buildSequenceArray(seq, readPrimary, truncate=truncate, fill=0, workers=3, prefetch=2)
+        assert serial.shape == parallel.shape == ((4, 3, 45) if truncate else (4, 3, 50))
+        assert np.array_equal(serial.asarray(), parallel.asarray())
+        assert np.all(serial.xvals('Time') == parallel.xvals('Time'))
+        assert np.all(parallel.xvals(0) == np.arange(4))
+        assert parallel[2, 1, 0] == 2100
+
+    # by default, func is only ever called from the calling thread
+    threads = set()
+    def readInThread(protoDir):
+        threads.add(threading.current_thread())
+        return readPrimary(protoDir)
+    default = buildSequenceArray(seq, readInThread, truncate=truncate, fill=0)
+    assert threads == set([threading.current_thread()])
+    assert np.array_equal(default.asarray(), serial.asarray())
+
+    # func=None gives an object array of the protocol directories
+    dirs = buildSequenceArray(seq)
+    assert dirs[1, 2] is seq['001_002']
+
+
+def test_prefetchMap():
+    # results are returned in order even when later items finish first
+    items = list(range(10))
+    delays = [0.02 * (10 - i) for i in items]
+    def func(i):
+        time.sleep(delays[i])
+        return i * 2
+    assert list(prefetchMap(func, items, workers=4, prefetch=3)) == [i * 2 for i in items]
+    assert list(prefetchMap(func, items, workers=0)) == [i * 2 for i in items]
+
+    # exceptions are raised when the failed item is reached
+    def fail(i):
+        if i == 5:
+            raise ValueError(i)
+        return i
+    out = []
+    try:
+        for x in prefetchMap(fail, items, workers=2):
+            out.append(x)
+        raise AssertionError("exception not raised")
+    except ValueError:
+        pass
+    assert out == list(range(5))
@@ -781,20 +781,19 @@ class IVCurve(AnalysisModule):
         self.spikes = [[] for i in range(ntr)]
         self.spikeIndices = [[] for i in range(ntr)]
         #print 'clamp start/end: ', self.Clamps.tstart, self.Clamps.tend
+        # detect spikes in all traces at once; peak mode is best for detection
+        (allspikes, allspkx) = Utility.findspikes2D(self.Clamps.time_base, self.Clamps.traces,
+                                                    threshold, t0=self.Clamps.tstart,
+                                                    t1=self.Clamps.tend,
+                                                    dt=self.Clamps.sample_interval)
         for i in range(ntr):
-            (spikes, spkx) = Utility.findspikes(self.Clamps.time_base, self.Clamps.traces[i],
-                                              threshold, t0=self.Clamps.tstart,
-                                              t1=self.Clamps.tend,
-                                              dt=self.Clamps.sample_interval,
-                                              mode='peak',  # best to use peak for detection
-                                              interpolate=False,
-                                              debug=False)
+            spikes = allspikes[i]
             if len(spikes) == 0:
                 #print 'no spikes found'
                 continue
             self.spikes[i] = spikes
             #print 'found %d spikes in trace %d' % (len(spikes), i)
-            self.spikeIndices[i] = [np.argmin(np.fabs(self.Clamps.time_base-t)) for t in spikes]
+            self.spikeIndices[i] = allspkx[i].tolist()
             self.spikecount[i] = len(spikes)
             self.fsl[i] = (spikes[0] - self.Clamps.tstart)*1e3
             if len(spikes) > 1:
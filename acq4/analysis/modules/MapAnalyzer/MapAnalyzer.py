@@ -526,6 +526,46 @@ class EventFilter:
         return events
         
 
+class EventGroups(object):
+    """Events sorted by a key (usually ProtocolDir), giving fast access to the
+    events that share each key value.
+
+    Grouping is done once (O(events)); afterward each group is a slice of the
+    sorted array rather than the result of filtering the whole table. Key values
+    need only be hashable, so this works for DirHandles.
+    
+    *key* is either the name of a field in *events* or an array of key values,
+    one per event.
+    """
+    def __init__(self, events, key='ProtocolDir'):
+        if isinstance(key, basestring):
+            key = events[key]
+        codes = {}
+        keyCodes = np.array([codes.setdefault(k, len(codes)) for k in key], dtype=int)
+        order = np.argsort(keyCodes, kind='mergesort')  ## stable; preserves event order within each group
+        self.events = events[order]
+        self.keys = sorted(codes, key=codes.get)
+        self.bounds = np.searchsorted(keyCodes[order], np.arange(len(codes)+1))
+        self.index = codes
+        
+    def __getitem__(self, key):
+        """Return the events whose key is equal to *key*."""
+        c = self.index.get(key, None)
+        if c is None:
+            return self.events[:0]
+        return self.events[self.bounds[c]:self.bounds[c+1]]
+        
+    def counts(self):
+        """Return a dict of the number of events for each key value."""
+        return dict(zip(self.keys, np.diff(self.bounds)))
+        
+    def minimum(self, field):
+        """Return a dict of the minimum value of *field* for each key value."""
+        if len(self.keys) == 0:
+            return {}
+        return dict(zip(self.keys, np.minimum.reduceat(self.events[field], self.bounds[:-1])))
+
+
 class SpontRateAnalyzer:
     def __init__(self, plot=None):
         self.plot = plot
@@ -571,10 +611,11 @@ class SpontRateAnalyzer:
         events = events[events['fitTime'] < stimTime]
         
         ## measure spont. rate for each handle
+        groups = EventGroups(events)
         spontRate = []
         amps = []
         for site in sites:
-            ev = events[events['ProtocolDir'] == site['ProtocolDir']]
+            ev = groups[site['ProtocolDir']]
             spontRate.append(len(ev) / stimTime)
             amps.extend(ev['fitAmplitude'])
         spontRate = np.array(spontRate)
@@ -649,6 +690,15 @@ class EventStatisticsAnalyzer:
     def parameters(self):
         return self.params
 
+    @staticmethod
+    def scoreEvents(events, timeOffset):
+        """Return events in the format expected by poissonScore, with times measured
+        from *timeOffset*."""
+        ev = np.empty(len(events), dtype=[('time', float), ('amp', float)])
+        ev['time'] = events['fitTime'] - timeOffset
+        ev['amp'] = events['fitAmplitude']
+        return ev
+
     def process(self, map, spontRateTable, events, ampMean, ampStdev):
         stimTime = self.params['Stimulus Time']
         
@@ -669,11 +719,16 @@ class EventStatisticsAnalyzer:
             events = np.empty(0, dtype=[('ProtocolDir', object), ('fitTime', float), ('fitAmplitude', float)])
             
         
-        ## filter events by time
+        ## filter events by time, then group by protocol so that each site's events
+        ## are a slice rather than a search of the whole table
         postMask = (events['fitTime'] > postStart)  &  (events['fitTime'] < postStop)
         postEvents = events[postMask]
+        postGroups = EventGroups(self.scoreEvents(postEvents, stimTime), postEvents['ProtocolDir'])
+        postLatency = postGroups.minimum('time')
+        postCount = postGroups.counts()
         preMask = (events['fitTime'] > preStart)  &  (events['fitTime'] < preStop)
         preEvents = events[preMask]
+        preGroups = EventGroups(self.scoreEvents(preEvents, 0), preEvents['ProtocolDir'])
         
         preScores = {'PoissonScore': [], 'PoissonAmpScore': [], 'SpontZScore':[]}
         postScores = {'PoissonScore': [], 'PoissonAmpScore': [], 'ZScore': [], 'FitAmpSum': []}
@@ -689,20 +744,12 @@ class EventStatisticsAnalyzer:
             ## generate lists of post-stimulus events for each site
             for scan,dh in site['data']['sites']:
                 ## collect post-stim events
-                ev = postEvents[postEvents['ProtocolDir'] == dh]
-                ev2 = np.empty(len(ev), dtype=[('time', float), ('amp', float)])
-                ev2['time'] = ev['fitTime'] - stimTime
-                ev2['amp'] = ev['fitAmplitude']
-                postSiteEvents.append(ev2)
-                latencies.append(ev2['time'].min() if len(ev2) > 0 else -1)
-                nEvents.append(len(ev2))
+                postSiteEvents.append(postGroups[dh])
+                latencies.append(postLatency.get(dh, -1))
+                nEvents.append(postCount.get(dh, 0))
                 
                 ## collect pre-stim events
-                ev = preEvents[preEvents['ProtocolDir'] == dh]
-                ev2 = np.empty(len(ev), dtype=[('time', float), ('amp', float)])
-                ev2['time'] = ev['fitTime']
-                ev2['amp'] = ev['fitAmplitude']
-                preSiteEvents.append(ev2)
+                preSiteEvents.append(preGroups[dh])
                 
                 rates.append(spontRate[dh]['filteredSpontRate'])
         
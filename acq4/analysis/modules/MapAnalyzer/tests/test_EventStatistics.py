@@ -0,0 +1,134 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+import acq4.analysis.tools.poissonScore as poissonScore
+from acq4.analysis.modules.MapAnalyzer.MapAnalyzer import EventStatisticsAnalyzer, EventGroups
+
+app = pg.mkQApp()
+
+
+class ProtocolDir(object):
+    """Stands in for the DirHandle of one stimulation."""
+    def __init__(self, name):
+        self.name = name
+
+
+class Scan(object):
+    def __init__(self, rng):
+        self.stats = {}
+        self.rng = rng
+
+    def getStats(self, dh):
+        if dh not in self.stats:
+            self.stats[dh] = {'ZScore': self.rng.normal(), 'directFitPeak': self.rng.normal(),
+                              'fitAmplitude_PostRegion_sum': self.rng.normal()}
+        return self.stats[dh]
+
+
+class Map(object):
+    def __init__(self, spots):
+        self.spots = spots
+
+
+def makeMap(nScans=4, nSites=60, seed=0):
+    """Synthetic map in which each spot was stimulated once in every scan."""
+    rng = np.random.RandomState(seed)
+    scans = [Scan(rng) for i in range(nScans)]
+    spots = []
+    dirs = []
+    for i in range(nSites):
+        sites = []
+        for scan in scans:
+            dh = ProtocolDir('%03d' % len(dirs))
+            dirs.append(dh)
+            sites.append((scan, dh))
+        spots.append({'data': {'sites': sites}})
+
+    spontRates = np.zeros(len(dirs), dtype=[('ProtocolDir', object), ('filteredSpontRate', float)])
+    spontRates['ProtocolDir'] = dirs
+    spontRates['filteredSpontRate'] = rng.uniform(0.5, 5, size=len(dirs))
+
+    nEvents = rng.poisson(3, size=len(dirs))
+    events = np.zeros(nEvents.sum(), dtype=[('ProtocolDir', object), ('fitTime', float), ('fitAmplitude', float)])
+    events['ProtocolDir'] = np.repeat(np.array(dirs, dtype=object), nEvents)
+    events['fitTime'] = rng.uniform(0, 0.8, size=len(events))
+    events['fitAmplitude'] = rng.normal(20e-12, 10e-12, size=len(events))
+    ## interleave events from different stimulations as in a concatenated event table
+    events = events[rng.permutation(len(events))]
+    return Map(spots), spontRates, events
+
+
+def referenceScores(map, spontRateTable, events, params, ampMean, ampStdev):
+    """Per-site scores computed by filtering the whole event table for every stimulation."""
+    spontRate = dict([(rec['ProtocolDir'], rec) for rec in spontRateTable])
+    postEvents = events[(events['fitTime'] > params['Post Start']) & (events['fitTime'] < params['Post Stop'])]
+    preEvents = events[(events['fitTime'] > params['Pre Start']) & (events['fitTime'] < params['Pre Stop'])]
+    postDt = params['Post Stop'] - params['Post Start']
+    scores = []
+    for site in map.spots:
+        post, pre, rates, latencies, nEvents = [], [], [], [], []
+        for scan, dh in site['data']['sites']:
+            ev = postEvents[postEvents['ProtocolDir'] == dh]
+            ev2 = np.empty(len(ev), dtype=[('time', float), ('amp', float)])
+            ev2['time'] = ev['fitTime'] - params['Stimulus Time']
+            ev2['amp'] = ev['fitAmplitude']
+            post.append(ev2)
+            latencies.append(ev2['time'].min() if len(ev2) > 0 else -1)
+            nEvents.append(len(ev2))
+            ev = preEvents[preEvents['ProtocolDir'] == dh]
+            ev2 = np.empty(len(ev), dtype=[('time', float), ('amp', float)])
+            ev2['time'] = ev['fitTime']
+            ev2['amp'] = ev['fitAmplitude']
+            pre.append(ev2)
+            rates.append(spontRate[dh]['filteredSpontRate'])
+        stats = [s[0].getStats(s[1]) for s in site['data']['sites']]
+        scores.append({
+            'PoissonScore': poissonScore.PoissonScore.score(post, rates, tMax=postDt),
+            'PoissonAmpScore': poissonScore.PoissonAmpScore.score(post, rates, tMax=postDt, ampMean=ampMean, ampStdev=ampStdev),
+            'PoissonScore_Pre': poissonScore.PoissonScore.score(pre, rates, tMax=postDt),
+            'PoissonAmpScore_Pre': poissonScore.PoissonAmpScore.score(pre, rates, tMax=postDt, ampMean=ampMean, ampStdev=ampStdev),
+            'ZScore': np.median([s['ZScore'] for s in stats]),
+            'DirectPeak': np.median([s['directFitPeak'] for s in stats]),
+            'FitAmpSum': np.median([s['fitAmplitude_PostRegion_sum'] for s in stats]),
+            'FirstLatency': np.median(latencies),
+            'NumEvents': np.median(nEvents),
+            'SpontRate': np.median(rates),
+        })
+    return scores
+
+
+def test_eventGroups():
+    map, spontRates, events = makeMap(nScans=2, nSites=10)
+    groups = EventGroups(events)
+    counts = groups.counts()
+    mins = groups.minimum('fitTime')
+    for dh in spontRates['ProtocolDir']:
+        expected = events[events['ProtocolDir'] == dh]
+        ## events keep their original order within each group
+        assert np.all(groups[dh]['fitTime'] == expected['fitTime'])
+        assert all(d is dh for d in groups[dh]['ProtocolDir'])
+        assert counts.get(dh, 0) == len(expected)
+        if len(expected) > 0:
+            assert mins[dh] == expected['fitTime'].min()
+    assert len(groups[ProtocolDir('missing')]) == 0
+    assert EventGroups(events[:0]).counts() == {}
+
+
+def test_scoresMatchReference():
+    map, spontRates, events = makeMap()
+    analyzer = EventStatisticsAnalyzer(pg.PlotItem())
+    analyzer.params['Threshold Parameter'] = 'PoissonScore'
+    ampMean, ampStdev = 20e-12, 10e-12
+    analyzer.process(map, spontRates, events, ampMean, ampStdev)
+
+    ref = referenceScores(map, spontRates, events, analyzer.params, ampMean, ampStdev)
+    assert any(s['NumEvents'] > 0 for s in ref)
+    for site, expected in zip(map.spots, ref):
+        for key, val in expected.items():
+            assert np.allclose(site['data'][key], val), key
+        assert site['data']['HasInput'] == (expected['PoissonScore'] > analyzer.params['Threshold'])
+
+    ## no events at all
+    analyzer.process(map, spontRates, None, 0, 0)
+    for site in map.spots:
+        assert site['data']['NumEvents'] == 0
+        assert site['data']['FirstLatency'] == -1
@@ -19,6 +19,7 @@ import weakref
 from MosaicEditorTemplate import *
 import acq4.util.DataManager as DataManager
 import acq4.analysis.atlas as atlas
+from acq4.util.ImagePyramid import isPyramidImage, levelCount
 
 
 class MosaicEditor(AnalysisModule):
@@ -196,55 +197,62 @@ class MosaicEditor(AnalysisModule):
         4. apply the scale.
         Use the min/max mosaic button to readjust the display scale after this
         automatic operation if the scaling is not to your liking.
+
+        The histograms, the mean image, and imageMax are computed from copies of the
+        images that are all downsampled by the same factor (see statsData()), chosen
+        so that the smallest selected image is still at least 128 pixels across.
+        The field flatness correction (steps 2 and 3) is currently disabled.
         """
         nsel =  len(self.canvas.selectedItems())
         if nsel == 0:
             return
-       # print dir(self.selectedItems()[0].data)
-        nxm = self.canvas.selectedItems()[0].data.shape
+        items = self.canvas.selectedItems()
+        ## statistics are computed from downsampled copies of each image (from the
+        ## image pyramids, when available) rather than the full-resolution data.
+        ## All images use the same level so that images of equal size can be averaged.
+        shapes = [item.data.shape for item in items if isPyramidImage(item.data)]
+        level = min([levelCount(sh) for sh in shapes]) - 1 if shapes else 0
+        stats = [item.statsData(level) for item in items]
+        nxm = stats[0].shape
         meanImage = np.zeros((nxm[0], nxm[1]))
         nhistbins = 100
         # generate a histogram of the global levels in the image (all images selected)
-        hm = np.histogram(np.dstack([x.data for x in self.canvas.selectedItems()]), nhistbins)
+        hm = np.histogram(np.concatenate([s.ravel() for s in stats]), nhistbins)
         print hm
-        #$meanImage = np.mean(self.selectedItems().asarray(), axis=0)
         n = 0
         self.imageMax = 0.0
         print 'nsel: ', nsel
         for i in range(nsel):
             try:
-                meanImage = meanImage + np.array(self.canvas.selectedItems()[i].data)
+                meanImage = meanImage + stats[i]
                 imagemax = np.amax(np.amax(meanImage, axis=1), axis=0)
                 if imagemax > self.imageMax:
                     self.imageMax = imagemax
                 n = n + 1
             except:
                 print 'image i = %d failed' % i
-                print 'file name: ', self.canvas.selectedItems()[i].name
+                print 'file name: ', items[i].name
                 print 'expected shape of nxm: ', nxm
-                print ' but got data shape: ', self.canvas.selectedItems()[i].data.shape
+                print ' but got data shape: ', stats[i].shape
 
         meanImage = meanImage/n # np.mean(meanImage[0:n], axis=0)
-        filtwidth = np.floor(nxm[0]/10+1)
-        blimg = scipy.ndimage.filters.gaussian_filter(meanImage, filtwidth, order = 0, mode='reflect')
-        #pg.image(blimg)
         
         m = np.argmax(hm[0]) # returns the index of the max count
         print 'm = ', m
         # now rescale each individually
         # rescaling is done against the global histogram, to keep the gain constant.
         for i in range(nsel):
-            d = np.array(self.canvas.selectedItems()[i].data)
+            d = np.array(items[i].data)
 #            hmd = np.histogram(d, 512) # return (count, bins)
             xh = d.shape # capture shape just in case it is not right (have data that is NOT !!)
             # flatten the illumination using the blimg average illumination pattern
             newImage = d # / blimg[0:xh[0], 0:xh[1]] # (d - imin)/(blimg - imin) # rescale image.
-            hn = np.histogram(newImage, bins = hm[1]) # use bins from global image
+            hn = np.histogram(stats[i], bins = hm[1]) # use bins from global image
             n = np.argmax(hn[0])
             newImage = (hm[1][m]/hn[1][n])*newImage # rescale to the global max.
-            self.canvas.selectedItems()[i].updateImage(newImage)
-         #   self.canvas.selectedItems()[i].levelRgn.setRegion([0, 2.0])
-            self.canvas.selectedItems()[i].levelRgn.setRegion([0., self.imageMax])
+            items[i].updateImage(newImage)
+         #   items[i].levelRgn.setRegion([0, 2.0])
+            items[i].levelRgn.setRegion([0., self.imageMax])
         print "MosaicEditor::self imageMax: ", self.imageMax
 
     def normalizeImages(self):
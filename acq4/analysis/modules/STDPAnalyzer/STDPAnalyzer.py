@@ -7,6 +7,7 @@ import acq4.pyqtgraph as pg
 import numpy as np
 from acq4.util.functions import measureResistance, measureResistanceWithExponentialFit
 from acq4.util.DatabaseGui.DatabaseGui import DatabaseGui
+from acq4.util.metaarray import MetaArray
 import STDPFileLoader
 
 class STDPAnalyzer(AnalysisModule):
@@ -152,6 +153,7 @@ class STDPAnalyzer(AnalysisModule):
         ### Set up internal information storage
         self.traces = np.array([], dtype=[('timestamp', float), ('data', object)]) 
         self.excludedTraces = np.array([], dtype=[('timestamp', float), ('data', object)])
+        self._traceStack = None  ## (traces, data of traces stacked into one array), see traceStack()
         self.averagedTraces = None
         self.resetAveragedTraces()
         self.lastAverageState = {}
@@ -395,74 +397,87 @@ class STDPAnalyzer(AnalysisModule):
         else:
             return False
 
+    def traceStack(self):
+        """Return the data of all loaded EPSP traces as one 2D array with a row for each trace.
+
+        The array is built once for each set of loaded traces. Use
+        self.traces[0]['data'].shape to recover the (channel, time) layout of a row.
+        """
+        if len(self.traces) == 0:
+            return np.empty((0, 0))
+        if self._traceStack is None or self._traceStack[0] is not self.traces:
+            template = self.traces[0]['data'].asarray()
+            data = np.empty((len(self.traces), template.size), dtype=template.dtype)
+            for i, trace in enumerate(self.traces['data']):
+                data[i] = trace.asarray().ravel()
+            self._traceStack = (self.traces, data)
+        return self._traceStack[1]
+
+    def apMask(self, timeWindow):
+        """Return a boolean array that is True for each loaded trace with an action potential
+        in the given timeWindow (tuple of start, stop). See checkForAP()."""
+        template = self.traces[0]['data']
+        times = template.axisValues('Time')
+        window = np.argwhere((times >= timeWindow[0]) & (times < timeWindow[1]))[:, 0]
+        if len(window) == 0:
+            return np.zeros(len(self.traces), dtype=bool)
+        data = self.traceStack().reshape((len(self.traces),) + template.shape)
+        primary = data[:, template.listColumns(0).index('primary'), window[0]:window[-1]+1]
+        return primary.max(axis=1) > -0.02
+
     def excludeAPs(self):
+        return self.includedTraces(excludeAPs=True)[0]
+
+    def includedTraces(self, excludeAPs=False):
+        """Return the loaded traces to be averaged and the corresponding rows of traceStack().
+        If excludeAPs is True, traces with an action potential in the window selected in
+        the UI are left out and stored in self.excludedTraces."""
+        data = self.traceStack()
+        if not excludeAPs:
+            return self.traces, data
         timeWindow = (self.ctrl.startExcludeAPsSpin.value(), self.ctrl.endExcludeAPsSpin.value())
-        APmask = np.zeros(len(self.traces), dtype=bool)
-        for i, trace in enumerate(self.traces):
-            APmask[i] = self.checkForAP(trace['data'], timeWindow)
+        APmask = self.apMask(timeWindow)
         self.excludedTraces = self.traces[APmask]
-        return self.traces[~APmask]
+        return self.traces[~APmask], data[~APmask]
 
-    def averageByTime(self, time, excludeAPs=False):
-        n = int((self.traces['timestamp'].max() - self.expStart)/time) + ((self.traces['timestamp'].max() - self.expStart) % time > 0) ### weird solution for rounding up
-        self.resetAveragedTraces(n)
-
-        if excludeAPs:
-            includedTraces = self.excludeAPs()
-        else:
-            includedTraces = self.traces
-
-        t = 0 ## how many traces we've gone through
-        i = 0 ## how many timesteps we've gone through
-        while t < len(includedTraces):
-            traces = includedTraces[(includedTraces['timestamp'] >= self.expStart+time*i)*(includedTraces['timestamp'] < self.expStart+time*i+time)]
-            if len(traces) > 1:
-                x = traces[0]['data']
-                for trace2 in traces[1:]:
-                    x += trace2['data']
-                x /= len(traces)
-            elif len(traces) == 1:
-                x = traces[0]['data']
-            else:
-                i += 1
-                continue
+    def averageGroups(self, traces, data, starts):
+        """Replace self.averagedTraces with the averages of groups of consecutive traces.
 
-            self.averagedTraces[i]['avgTimeStamp'] = traces['timestamp'].mean()
-            self.averagedTraces[i]['avgData'] = x
-            self.averagedTraces[i]['origTimes'] = list(traces['timestamp'])
-            
-            t += len(traces)
-            i += 1
+        traces - the structured trace array, ordered so that each group is contiguous
+        data   - the rows of traceStack() for *traces*
+        starts - the index of the first trace in each group
+        The input arrays are not modified.
+        """
+        self.resetAveragedTraces(len(starts))
+        if len(starts) == 0:
+            return
+        counts = np.diff(np.append(starts, len(traces)))
+        avg = np.add.reduceat(data, starts, axis=0)
+        avg /= counts[:, np.newaxis]
+        self.averagedTraces['avgTimeStamp'] = np.add.reduceat(traces['timestamp'], starts) / counts
+        shape = traces[0]['data'].shape
+        for i, start in enumerate(starts):
+            template = traces[start]['data']
+            self.averagedTraces[i]['avgData'] = MetaArray(avg[i].reshape(shape), info=template.infoCopy())
+            self.averagedTraces[i]['origTimes'] = list(traces['timestamp'][start:start+counts[i]])
 
-        self.averagedTraces = self.averagedTraces[self.averagedTraces['avgTimeStamp'] != 0] ## clean up any left over zeros from pauses in data collection
+    def averageByTime(self, time, excludeAPs=False):
+        traces, data = self.includedTraces(excludeAPs)
+        if len(traces) == 0:
+            self.resetAveragedTraces()
+            return
 
+        ## bin i holds the traces recorded from expStart+time*i up to (not including) expStart+time*(i+1)
+        nBins = int((traces['timestamp'].max() - self.expStart) / time) + 1
+        bins = np.digitize(traces['timestamp'], self.expStart + time*np.arange(nBins+1)) - 1
+        counts = np.bincount(bins)
+        counts = counts[counts > 0]  ## skip pauses in data collection
+        order = np.argsort(bins, kind='mergesort')  ## stable, so traces keep their order within a bin
+        self.averageGroups(traces[order], data[order], np.cumsum(counts) - counts)
 
     def averageByNumber(self, number, excludeAPs=False):
-        n = int(len(self.traces)/number) + (len(self.traces) % number > 0) ### weird solution for rounding up
-        self.resetAveragedTraces(n)
-
-        if excludeAPs:
-            includedTraces = self.excludeAPs()
-        else:
-            includedTraces = self.traces
-
-        t = 0
-        i = 0
-        while t < len(includedTraces):
-            traces = includedTraces[i*number:i*number+number]
-
-            x = traces[0]['data']
-            for t2 in traces[1:]:
-                x += t2['data']
-            x /= float(len(traces))
-
-            self.averagedTraces[i]['avgTimeStamp'] = traces['timestamp'].mean()
-            self.averagedTraces[i]['avgData'] = x
-            self.averagedTraces[i]['origTimes'] = list(traces['timestamp'])
-            t += len(traces)
-            i += 1
-
-        self.averagedTraces = self.averagedTraces[self.averagedTraces['avgTimeStamp'] != 0] ## clean up any left over zeros from pauses in data collection
+        traces, data = self.includedTraces(excludeAPs)
+        self.averageGroups(traces, data, np.arange(0, len(traces), int(number)))
 
     def defaultBtnClicked(self):
         self.ctrl.plasticityRgnStartSpin.setValue(27.0)
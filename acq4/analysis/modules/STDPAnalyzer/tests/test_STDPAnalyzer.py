@@ -0,0 +1,107 @@
+import numpy as np
+from acq4.util.metaarray import MetaArray
+from acq4.analysis.modules.STDPAnalyzer.STDPAnalyzer import STDPAnalyzer
+
+## recorded out of order, with a pause between 1035 and 1061
+timestamps = [1000., 1005., 1012., 1014., 1035., 1061., 1005.5, 1062., 1064.]
+
+
+class SpinBox(object):
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+
+class Controls(object):
+    def __init__(self, **kwds):
+        self.__dict__.update(kwds)
+
+
+def makeAnalyzer(apTraces=(), seed=0):
+    """Return an analysis module (without its GUI) holding synthetic EPSP traces;
+    the traces listed in apTraces have an action potential at 50 ms."""
+    rng = np.random.RandomState(seed)
+    sa = STDPAnalyzer.__new__(STDPAnalyzer)
+    times = np.arange(1000) * 1e-4
+    traces = np.zeros(len(timestamps), dtype=[('timestamp', float), ('data', object)])
+    for i, ts in enumerate(timestamps):
+        data = np.empty((2, len(times)))
+        data[0] = -0.065 + rng.normal(scale=1e-3, size=len(times))
+        data[1] = rng.normal(scale=1e-11, size=len(times))
+        if i in apTraces:
+            data[0, 500:520] = 0.02
+        info = [{'name': 'Channel', 'cols': [{'name': 'primary', 'units': 'V'}, {'name': 'secondary', 'units': 'A'}]},
+                {'name': 'Time', 'units': 's', 'values': times},
+                {'startTime': ts}]
+        traces[i]['timestamp'] = ts
+        traces[i]['data'] = MetaArray(data, info=info)
+    sa.traces = traces
+    sa.expStart = traces['timestamp'].min()
+    sa._traceStack = None
+    sa.excludedTraces = traces[:0]
+    sa.resetAveragedTraces()
+    sa.ctrl = Controls(startExcludeAPsSpin=SpinBox(0.04), endExcludeAPsSpin=SpinBox(0.06))
+    return sa
+
+
+def checkAverages(sa, groups):
+    """Compare sa.averagedTraces with averages of copies of the traces in each group
+    (a list of indices into sa.traces)."""
+    avg = sa.averagedTraces
+    assert len(avg) == len(groups)
+    for i, group in enumerate(groups):
+        ref = np.mean([sa.traces[j]['data'].asarray().copy() for j in group], axis=0)
+        assert np.allclose(avg[i]['avgData'].asarray(), ref, rtol=0, atol=1e-15)
+        assert np.allclose(avg[i]['avgTimeStamp'], np.mean([timestamps[j] for j in group]))
+        assert avg[i]['origTimes'] == [timestamps[j] for j in group]
+        assert np.all(avg[i]['avgData'].axisValues('Time') == sa.traces[0]['data'].axisValues('Time'))
+        assert np.all(avg[i]['avgData']['primary'] == avg[i]['avgData'].asarray()[0])
+
+
+def test_averageByTime():
+    sa = makeAnalyzer()
+    orig = [t.asarray().copy() for t in sa.traces['data']]
+    groups = [[0, 1, 6], [2, 3], [4], [5, 7, 8]]
+    sa.averageByTime(10.)
+    checkAverages(sa, groups)
+
+    ## the loaded traces are untouched, so averaging again gives the same result
+    for t, o in zip(sa.traces['data'], orig):
+        assert np.all(t.asarray() == o)
+    first = [d.asarray().copy() for d in sa.averagedTraces['avgData']]
+    sa.averageByTime(10.)
+    checkAverages(sa, groups)
+    for d, f in zip(sa.averagedTraces['avgData'], first):
+        assert np.all(d.asarray() == f)
+
+    sa.averageByTime(30.)
+    checkAverages(sa, [[0, 1, 2, 3, 6], [4], [5, 7, 8]])
+
+
+def test_averageByNumber():
+    sa = makeAnalyzer()
+    orig = [t.asarray().copy() for t in sa.traces['data']]
+    for i in range(2):
+        sa.averageByNumber(4)
+        checkAverages(sa, [[0, 1, 2, 3], [4, 5, 6, 7], [8]])
+    for t, o in zip(sa.traces['data'], orig):
+        assert np.all(t.asarray() == o)
+    sa.averageByNumber(1)
+    checkAverages(sa, [[i] for i in range(len(timestamps))])
+
+
+def test_excludeAPs():
+    sa = makeAnalyzer(apTraces=(1, 4))
+    mask = sa.apMask((0.04, 0.06))
+    assert list(np.argwhere(mask)[:, 0]) == [1, 4]
+    assert list(mask) == [sa.checkForAP(t, (0.04, 0.06)) for t in sa.traces['data']]
+    assert not sa.apMask((0.06, 0.08)).any()
+
+    sa.averageByNumber(3, excludeAPs=True)
+    assert list(sa.excludedTraces['timestamp']) == [1005., 1035.]
+    checkAverages(sa, [[0, 2, 3], [5, 6, 7], [8]])
+
+    sa.averageByTime(10., excludeAPs=True)
+    checkAverages(sa, [[0, 6], [2, 3], [5, 7, 8]])
@@ -11,7 +11,7 @@ import numpy as np
 from acq4.util.DirTreeWidget import DirTreeLoader
 from acq4.util.FileLoader import FileLoader
 import acq4.pyqtgraph.flowchart as fc
-import acq4.pyqtgraph.debug as debug
+import acq4.util.debug as debug
 import os
 
 class TraceAnalyzer(AnalysisModule):
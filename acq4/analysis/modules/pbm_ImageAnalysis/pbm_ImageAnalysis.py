@@ -32,7 +32,7 @@ import csv
 import os.path
 import pickle
 import acq4.pyqtgraph as pg
-import acq4.pyqtgraph.debug as debug
+import acq4.util.debug as debug
 import acq4.util.DatabaseGui as DatabaseGui
 import PIL as Image
 from acq4.util.metaarray import MetaArray
@@ -47,6 +47,7 @@ from acq4.analysis.tools import Fitting
 from acq4.analysis.tools import PlotHelpers as PH  # matlab plotting helpers
 from acq4.util import functions as FN
 from acq4.util.HelpfulException import HelpfulException
+from acq4.util.imaging.roi_means import ROIMeans
 from acq4.devices.Scanner.scan_program import rect
 
 try:
@@ -96,6 +97,7 @@ class pbm_ImageAnalysis(AnalysisModule):
         self.ratioImage = None
         self.useRatio = False
         self.AllRois = []
+        self.roiMeans = ROIMeans()  # sparse ROI weights, reused until an ROI moves
         self.nROI = 0  # count of ROI's in the window
         self.rois = []
         self.currentRoi = None
@@ -1027,40 +1029,45 @@ class pbm_ImageAnalysis(AnalysisModule):
             bl = np.mean(self.FData[roi.ID][it0:it1])
             self.BFData[roi.ID] /= bl
                 
-    def Baseline1(self, roi=None):       
+    def roiRows(self, rois=None):
+        """ return the row indices into FData/BFData for an ROI, a list of ROIs,
+        or all ROIs if rois is None
+        """
+        if rois is None:
+            rois = self.AllRois
+        elif type(rois) is not list:
+            rois = [rois]
+        return [roi.ID for roi in rois]
+
+    def Baseline1(self, rois=None):
     ### data correction routine to smooth out the baseline
-    ###
+    ### all rows are smoothed together; only the baseline polynomial is fit per ROI
         self.FilterKernel = 11
         self.FilterOrder = 3
         thr = 2.0 # self.ui.CorrTool_Threshold.value()
-        dds = self.BFData[:,0:-1].copy()
-        if roi is None:
-            lrois = range(0, self.nROI)
-        else:
-            lrois = [roi]
-        for roi in lrois:
-            d = self.BFData[roi.ID].copy().T
-            ds = Utility.savitzky_golay(d, kernel=31, order=5) # smooth data
-            dds[roi.ID] = np.diff(ds) # take derivative of smoothed data
-            stdev = np.std(dds[roi.ID])
-            pts = np.where(np.abs(dds[roi.ID]) < thr*stdev) # get subset of points to fit
-            dds2 = np.diff(np.diff(ds))
-            stdev2 = np.std(dds2)
-            pts2 = np.where(np.abs(dds2) < thr*stdev2)
-            s0 = set(np.transpose(pts).flat)
-            s1 = set(np.transpose(pts2).flat)
-            ptsok = list(s1.intersection(s0))
-
-            if len(ptsok) == 0:
-                return
-            tf = self.imageTimes[ptsok]
-            df = d[ptsok]
-            p = np.polyfit(tf, df, 5)
-            bd = np.polyval(p, self.imageTimes)
-#            dm = np.mean(d[0:10])
-            bl = Utility.savitzky_golay(d/bd, kernel=self.FilterKernel,
-                                                      order=self.FilterOrder)
-            self.BFData[roi.ID] = bl
+        rows = self.roiRows(rois)
+        if len(rows) == 0:
+            return(self.BFData)
+        d = self.BFData[rows]
+        ds = Utility.savitzky_golay(d, kernel=31, order=5) # smooth data
+        dds = np.diff(ds, axis=1) # take derivative of smoothed data
+        dds2 = np.diff(dds, axis=1)
+        # subset of points to fit: both derivatives are small
+        ptsok = ((np.abs(dds[:, :-1]) < thr*np.std(dds, axis=1)[:, np.newaxis]) &
+                 (np.abs(dds2) < thr*np.std(dds2, axis=1)[:, np.newaxis]))
+        bd = np.ones_like(d)
+        fit = np.zeros(len(rows), dtype=bool)
+        for i in range(len(rows)):
+            if not ptsok[i].any():
+                continue
+            pts = np.nonzero(ptsok[i])[0]
+            p = np.polyfit(self.imageTimes[pts], d[i, pts], 5)
+            bd[i] = np.polyval(p, self.imageTimes[0:d.shape[1]])
+            fit[i] = True
+        bl = Utility.savitzky_golay(d/bd, kernel=self.FilterKernel,
+                                    order=self.FilterOrder)
+        rows = np.array(rows)[fit]
+        self.BFData[rows] = bl[fit]
         return(self.BFData)
             #self.FData[roi, :] = self.BFData[roi,:]
             #self.plotdata(self.times, 100*(self.BFData-1.0), datacolor = 'blue', erase = True,
@@ -1068,9 +1075,10 @@ class pbm_ImageAnalysis(AnalysisModule):
             #          yLabel = u'\u0394F/F<sub>ROI %d</sub>')
        # self.makeROIDataFigure(clear=False, gcolor='g')
 
-    def SignalBPF(self, roi):
+    def SignalBPF(self, rois):
         """ data correction
         try to decrease baseline drift by high-pass filtering the data.
+        Returns the filtered traces (one row per roi) or None if the filter settings are invalid.
         """
         #self.BFData = np.array(self.FData).copy()
         HPF = self.ctrlROIFunc.ImagePhys_ImgHPF.value()
@@ -1082,20 +1090,20 @@ class pbm_ImageAnalysis(AnalysisModule):
         samplefreq = 1.0/dt
         if (LPF > 0.5*samplefreq):
             LPF = 0.5*samplefreq
-        d = self.BFData[roi.ID].copy().T
+        d = self.BFData[self.roiRows(rois)]
         return(Utility.SignalFilter(d, LPF, HPF, samplefreq))
 
-    def SignalHPF(self, roi): 
+    def SignalHPF(self, rois):
         """ data correction
         try to decrease baseline drift by high-pass filtering the data.
         """
         HPF = self.ctrlROIFunc.ImagePhys_ImgHPF.value()
         dt = np.mean(np.diff(self.imageTimes))
         samplefreq = 1.0/dt
-        d = self.BFData[roi.ID].copy().T
+        d = self.BFData[self.roiRows(rois)]
         return(Utility.SignalFilter_HPFButter(d, HPF, samplefreq))
 
-    def SignalLPF(self, roi): 
+    def SignalLPF(self, rois):
         """ data correction
         Low-pass filter the data.
         """
@@ -1104,7 +1112,7 @@ class pbm_ImageAnalysis(AnalysisModule):
         samplefreq = 1.0/dt
         if (LPF > 0.5*samplefreq):
             LPF = 0.5*samplefreq
-        d = self.BFData[roi.ID].copy().T
+        d = self.BFData[self.roiRows(rois)]
         return(Utility.SignalFilter_LPFButter(d, LPF, samplefreq))
         
 #
@@ -1702,17 +1710,26 @@ class pbm_ImageAnalysis(AnalysisModule):
 
     def calculateAllROIs(self):
         """
-        calculateAllROIs forces a fresh recalculation of all ROI values from the current image
+        calculateAllROIs forces a fresh recalculation of all ROI values from the current image.
+        The traces for all ROIs come from one sparse matrix product over the image stack
+        (see ROIMeans); the matrix is only rebuilt when an ROI moves.
         """
         self.FData = []
         self.BFData = []
+        if len(self.AllRois) == 0:
+            return
 
         currentROI = self.lastROITouched
-        for ourWidget in self.AllRois:
-            tr = self.updateThisROI(ourWidget, livePlot=False)
-            self.FData = self.insertFData(self.FData, tr, ourWidget)
+        if self.roiMeans.rois != self.AllRois:
+            self.roiMeans.setROIs(self.AllRois)
+        tr = self.roiMeans.traces(self.imageData, self.imageView.imageItem)  # rows are in roi.ID order
+        if self.dataState['Normalized'] is False:
+            tr /= tr.mean(axis=1)[:, np.newaxis]
+        self.FData = tr
+        self.BFData = tr.copy()
         self.applyROIFilters(self.AllRois)
-        self.updateThisROI(currentROI) # just update the latest plot with the new format.
+        if currentROI in self.AllRois:
+            self.showThisROI(currentROI) # just update the latest plot with the new format.
 
     def refilterCurrentROI(self):
         """
@@ -1739,26 +1756,24 @@ class pbm_ImageAnalysis(AnalysisModule):
         """
         if type(rois) is not list:
             rois = [rois]
-#        try:
-#            l = len(self.BFData)
-#        except:
-#            self.BFData = []
+        if len(rois) == 0:
+            return
         for roi in rois:
             self.BFData = self.insertFData(self.BFData, self.FData[roi.ID], roi) # replace current data with raw data
-            if self.ctrl.ImagePhys_CorrTool_BL1.isChecked():
-                bl = self.Baseline1(roi)
-                self.BFData = self.insertFData(self.BFData, bl, roi)
-            if self.ctrlROIFunc.ImagePhys_CorrTool_LPF.isChecked() and self.ctrlROIFunc.ImagePhys_CorrTool_HPF.isChecked():
-                bpf = self.SignalBPF(roi)
-                self.BFData = self.insertFData(self.BFData, bpf, roi)
+        # each filter is applied to all of the rows at once
+        rows = self.roiRows(rois)
+        if self.ctrl.ImagePhys_CorrTool_BL1.isChecked():
+            self.Baseline1(rois)
+        if self.ctrlROIFunc.ImagePhys_CorrTool_LPF.isChecked() and self.ctrlROIFunc.ImagePhys_CorrTool_HPF.isChecked():
+            bpf = self.SignalBPF(rois)
+            if bpf is not None:
+                self.BFData[rows] = bpf
 
-            else:
-                if self.ctrlROIFunc.ImagePhys_CorrTool_LPF.isChecked():
-                    lpf = self.SignalLPF(roi)
-                    self.BFData = self.insertFData(self.BFData, lpf, roi)
-                if self.ctrlROIFunc.ImagePhys_CorrTool_HPF.isChecked():
-                    hpf = self.SignalHPF(roi)
-                    self.BFData = self.insertFData(self.BFData, hpf, roi)
+        else:
+            if self.ctrlROIFunc.ImagePhys_CorrTool_LPF.isChecked():
+                self.BFData[rows] = self.SignalLPF(rois)
+            if self.ctrlROIFunc.ImagePhys_CorrTool_HPF.isChecked():
+                self.BFData[rows] = self.SignalHPF(rois)
 
     def optimizeAll(self):
         for roi in self.AllRois:
@@ -2577,7 +2592,7 @@ class pbm_ImageAnalysis(AnalysisModule):
                 dt = 1
             else:
                 dt = np.mean(np.diff(self.imageTimes))
-        self.calculate_all_xcorr(FData, dt)
+        self.calculate_all_xcorr(FData, dt, keepPairs=False)
         self.use_MPL = self.ctrlImageFunc.IAFuncs_MatplotlibCheckBox.checkState()
 
 
@@ -2605,7 +2620,16 @@ class pbm_ImageAnalysis(AnalysisModule):
             PH.cleanAxes(self.MPL_plots)
             PL.show()
 
-    def calculate_all_xcorr(self, FData = None, dt = None):
+    def calculate_all_xcorr(self, FData = None, dt = None, keepPairs = True):
+        """Compute the cross-correlation (as in ccf) between every pair of ROIs, after
+        removing a linear trend from each ROI.
+
+        Each ROI is detrended and Fourier transformed once; the correlation for each
+        pair then comes from the product of the cached spectra. The mean over all
+        pairs is stored in self.xcorr (with lags in self.lags). If *keepPairs* is
+        True, self.IXC_corr is an array with one row per pair (roi1, roi2 > roi1),
+        in the same order as the nested loops used by Analog_Xcorr_Individual.
+        """
         if FData is None:
             FData = self.FData
             nROI = self.nROI
@@ -2616,25 +2640,40 @@ class pbm_ImageAnalysis(AnalysisModule):
                 dt = 1
             else:
                 dt = np.mean(np.diff(self.imageTimes))
-        ndl = len(FData[0,:])
-        itime = self.imageTimes[0:ndl]
-        self.IXC_corr =  [[]]*(sum(range(1,nROI)))
-        self.xcorr = []
-        xtrace = 0
-        for roi1 in range(0, len(FData)-1):
-            for roi2 in range(roi1+1, len(FData)):
-                (a1, b1) = np.polyfit(itime, FData[roi1,:], 1)
-                (a2, b2) = np.polyfit(itime, FData[roi2,:], 1)
-                y1 = np.polyval([a1, b1], itime)
-                y2 = np.polyval([a2, b2], itime)
-                sc = self.ccf(FData[roi1,:]-y1, FData[roi2,:]-y2)
-                self.IXC_corr[xtrace] = sc
-                if xtrace == 0:
-                    self.xcorr = sc
-                else:
-                    self.xcorr = self.xcorr + sc
-                xtrace += 1
-        self.xcorr = self.xcorr/xtrace
+        FData = np.asarray(FData, dtype=float)[:nROI]
+        if nROI < 2:
+            raise HelpfulException("Cross-correlation requires at least two ROIs.", msgType='status')
+        ndl = FData.shape[1]
+        itime = np.asarray(self.imageTimes[0:ndl], dtype=float)
+
+        # remove linear trend and mean from every ROI once, then normalize so that
+        # products of spectra give correlation coefficients (see ccf)
+        (a, b) = np.polyfit(itime, FData.T, 1)
+        anom = FData - (a[:, None]*itime[None, :] + b[:, None])
+        anom -= anom.mean(axis=1)[:, None]
+        npad = 2*ndl
+        spectra = np.fft.rfft(anom, npad, axis=1)
+        spectra /= np.sqrt((anom*anom).sum(axis=1))[:, None]
+
+        # mean over pairs: sum_(i<j) conj(S_i)*S_j = sum_j S_j * conj(sum_(i<j) S_i)
+        nPairs = nROI*(nROI-1)/2
+        cumulative = np.cumsum(spectra, axis=0)
+        total = (spectra[1:] * cumulative[:-1].conj()).sum(axis=0)
+        self.xcorr = np.roll(np.fft.irfft(total, npad), npad/2) / nPairs
+
+        if keepPairs:
+            self.IXC_corr = np.empty((nPairs, npad))
+            half = npad/2
+            xtrace = 0
+            for roi1 in range(0, nROI-1):
+                n = nROI-1-roi1
+                sc = np.fft.irfft(spectra[roi1].conj() * spectra[roi1+1:], npad, axis=1)
+                # rotate so that zero lag is in the center
+                self.IXC_corr[xtrace:xtrace+n, :half] = sc[:, half:]
+                self.IXC_corr[xtrace:xtrace+n, half:] = sc[:, :half]
+                xtrace += n
+        else:
+            self.IXC_corr = []
         s = np.shape(self.xcorr)
         self.lags = dt*(np.arange(0, s[0])-s[0]/2.0)
 
@@ -0,0 +1,148 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.analysis.modules.pbm_ImageAnalysis.pbm_ImageAnalysis import pbm_ImageAnalysis
+from acq4.analysis.tools import Utility
+from acq4.util.imaging.roi_means import ROIMeans
+
+app = pg.mkQApp()
+
+
+def makeAnalyzer(nROI=12, nFrames=300, dt=0.02, seed=0):
+    """Return an analysis module (without its GUI) holding synthetic ROI traces
+    with a shared signal, linear drift, and noise."""
+    rng = np.random.RandomState(seed)
+    ia = pbm_ImageAnalysis.__new__(pbm_ImageAnalysis)
+    ia.imageTimes = np.arange(nFrames) * dt
+    common = np.convolve(rng.normal(size=nFrames), np.ones(10) / 3., mode='same')
+    drift = rng.normal(scale=0.01, size=(nROI, 1)) * np.arange(nFrames)[None, :]
+    ia.FData = 1.0 + rng.uniform(0.5, 1, size=(nROI, 1)) * np.roll(common, 3)[None, :] + drift + rng.normal(scale=0.2, size=(nROI, nFrames))
+    ia.nROI = nROI
+    return ia
+
+
+def referenceXcorr(ia, FData):
+    """Per-pair computation: detrend both ROIs of every pair and call ccf."""
+    itime = ia.imageTimes[0:FData.shape[1]]
+    corr = []
+    for roi1 in range(0, len(FData)-1):
+        for roi2 in range(roi1+1, len(FData)):
+            (a1, b1) = np.polyfit(itime, FData[roi1, :], 1)
+            (a2, b2) = np.polyfit(itime, FData[roi2, :], 1)
+            y1 = np.polyval([a1, b1], itime)
+            y2 = np.polyval([a2, b2], itime)
+            corr.append(ia.ccf(FData[roi1, :]-y1, FData[roi2, :]-y2))
+    return np.array(corr)
+
+
+def test_allPairsXcorr():
+    ia = makeAnalyzer()
+    ref = referenceXcorr(ia, ia.FData)
+    ia.calculate_all_xcorr(ia.FData, 0.02)
+    assert ia.IXC_corr.shape == ref.shape == (12*11/2, 600)
+    assert np.allclose(ia.IXC_corr, ref, atol=1e-12)
+    assert np.allclose(ia.xcorr, ref.mean(axis=0), atol=1e-12)
+    assert ia.lags.shape == (600,)
+    assert ia.lags[300] == 0
+    ## the shared signal gives strong correlation near zero lag
+    assert ia.xcorr.max() > 0.5
+
+    ## mean is the same without keeping the individual pairs
+    ia2 = makeAnalyzer()
+    ia2.calculate_all_xcorr(keepPairs=False)
+    assert np.allclose(ia2.xcorr, ia.xcorr, atol=1e-12)
+
+
+def test_xcorrOddLength():
+    ia = makeAnalyzer(nROI=5, nFrames=101)
+    ia.calculate_all_xcorr(ia.FData[:4], 0.02)
+    assert np.allclose(ia.IXC_corr, referenceXcorr(ia, ia.FData[:4]), atol=1e-12)
+
+
+class CheckBox(object):
+    """Stand-in for the filter checkboxes and spin boxes of the control panels."""
+    def __init__(self, checked=False, value=0.):
+        self.checked = checked
+        self._value = value
+
+    def isChecked(self):
+        return self.checked
+
+    def value(self):
+        return self._value
+
+
+class Controls(object):
+    def __init__(self, **kwds):
+        self.__dict__.update(kwds)
+
+
+def makeROIAnalyzer(BL1=False, LPF=False, HPF=False, nFrames=300, dt=0.02, seed=0):
+    """Return an analysis module (without its GUI) holding a synthetic image stack
+    and a set of ROIs, with the ROI filters selected by the arguments."""
+    rng = np.random.RandomState(seed)
+    ia = pbm_ImageAnalysis.__new__(pbm_ImageAnalysis)
+    t = np.arange(nFrames) * dt
+    ia.imageTimes = t
+    signal = 50 * np.sin(2 * np.pi * 1.3 * t)[:, None, None] * rng.uniform(0.5, 1, size=(1, 40, 30))
+    ia.imageData = 1000 + signal + 30 * t[:, None, None] + rng.normal(scale=20, size=(nFrames, 40, 30))
+    ia.dataState = {'Normalized': False}
+    ia.imageView = pg.ImageView()
+    ia.imageView.setImage(ia.imageData, xvals=t)
+    ia.AllRois = [pg.RectROI([3, 4], [5, 7]), pg.RectROI([3.5, 4.25], [5.3, 7.9]),
+                  pg.RectROI([10, 3], [12, 9], angle=30), pg.RectROI([30, 20], [8, 8])]
+    for i, roi in enumerate(ia.AllRois):
+        roi.ID = i
+        ia.imageView.addItem(roi)
+    ia.nROI = len(ia.AllRois)
+    ia.lastROITouched = []
+    ia.roiMeans = ROIMeans()
+    ia.ctrl = Controls(ImagePhys_CorrTool_BL1=CheckBox(BL1))
+    ia.ctrlROIFunc = Controls(ImagePhys_CorrTool_LPF=CheckBox(LPF), ImagePhys_CorrTool_HPF=CheckBox(HPF),
+                              ImagePhys_ImgLPF=CheckBox(value=5.0), ImagePhys_ImgHPF=CheckBox(value=0.5))
+    return ia
+
+
+def referenceROITraces(ia):
+    """Per-ROI extraction, as done by updateThisROI."""
+    traces = []
+    for roi in ia.AllRois:
+        tr = roi.getArrayRegion(ia.imageData, ia.imageView.imageItem, axes=(1, 2))
+        tr = tr.mean(axis=2).mean(axis=1)
+        traces.append(tr / tr.mean())
+    return np.array(traces)
+
+
+def test_calculateAllROIs():
+    ia = makeROIAnalyzer()
+    ia.calculateAllROIs()
+    assert ia.FData.shape == ia.BFData.shape == (4, 300)
+    assert np.allclose(ia.FData, referenceROITraces(ia), rtol=1e-10)
+    assert np.all(ia.BFData == ia.FData)
+
+    ## the weight matrix is reused until an ROI moves
+    matrix = ia.roiMeans._matrix
+    ia.calculateAllROIs()
+    assert ia.roiMeans._matrix is matrix
+    ia.AllRois[1].setPos([20, 10])
+    ia.calculateAllROIs()
+    assert ia.roiMeans._matrix is not matrix
+    assert np.allclose(ia.FData, referenceROITraces(ia), rtol=1e-10)
+
+
+def test_batchedROIFilters():
+    for BL1, LPF, HPF in [(False, True, False), (False, False, True), (False, True, True),
+                          (True, False, False), (True, True, False)]:
+        ia = makeROIAnalyzer(BL1, LPF, HPF)
+        ia.calculateAllROIs()
+        batched = ia.BFData.copy()
+        assert not np.allclose(batched, ia.FData)
+        ## filtering one ROI at a time gives the same traces
+        for roi in ia.AllRois:
+            ia.BFData[roi.ID] = 0
+            ia.applyROIFilters(roi)
+        assert np.allclose(ia.BFData, batched, rtol=0, atol=1e-12)
+
+    ia = makeROIAnalyzer(LPF=True)
+    ia.calculateAllROIs()
+    for i in range(len(ia.AllRois)):
+        assert np.allclose(ia.BFData[i], Utility.SignalFilter_LPFButter(ia.FData[i], 5.0, 50.0), atol=1e-12)
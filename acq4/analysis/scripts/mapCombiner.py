@@ -3,7 +3,7 @@ import numpy as np
 import acq4.analysis.tools.functions as afn
 import scipy
 #from acq4.util.pyqtgraph.multiprocess import Parallelize
-from acq4.pyqtgraph.debug import Profiler
+from acq4.util.debug import Profiler
 import os, sys
 try:
     import cv2
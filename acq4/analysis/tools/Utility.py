@@ -39,6 +39,7 @@ import numpy.ma as ma
 #import numpy.linalg.lstsq
 import scipy.fftpack as spFFT
 import scipy.signal as spSignal
+import scipy.ndimage as spImage
 from sets import Set
 
 from random import sample
@@ -122,7 +123,7 @@ def savitzky_golay(data, kernel = 11, order = 4):
     """
         applies a Savitzky-Golay filter
         input parameters:
-        - data => data as a 1D numpy array
+        - data => data as a numpy array; the last axis is smoothed
         - kernel => a positiv integer > 2*order giving the kernel size
         - order => order of the polynomal
         returns smoothed data as a numpy array
@@ -144,24 +145,9 @@ def savitzky_golay(data, kernel = 11, order = 4):
     b = numpy.mat([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
     # since we don't want the derivative, else choose [1] or [2], respectively
     m = numpy.linalg.pinv(b).A[0]
-    window_size = len(m)
-    half_window = (window_size-1) // 2
-    # precompute the offset values for better performance
-    offsets = range(-half_window, half_window+1)
-    offset_data = zip(offsets, m)
-    smooth_data = list()
-    # temporary data, with padded zeros (since we want the same length after smoothing)
-    #data = numpy.concatenate((numpy.zeros(half_window), data, numpy.zeros(half_window)))
-    # temporary data, with padded first/last values (since we want the same length after smoothing)
-    firstval=data[0]
-    lastval=data[len(data)-1]
-    data = numpy.concatenate((numpy.zeros(half_window)+firstval, data, numpy.zeros(half_window)+lastval))
-    for i in range(half_window, len(data) - half_window):
-            value = 0.0
-            for offset, weight in offset_data:
-                value += weight * data[i + offset]
-            smooth_data.append(value)
-    return numpy.array(smooth_data)
+    # data is padded with the first/last values (since we want the same length after smoothing)
+    data = numpy.asarray(data, dtype=float)
+    return spImage.correlate1d(data, m, axis=-1, mode='nearest')
 
 # filter signal with elliptical filter
 def SignalFilter(signal, LPF, HPF, samplefreq):
@@ -180,7 +166,7 @@ def SignalFilter(signal, LPF, HPF, samplefreq):
             gpass=1.0,
             gstop=60.0,
             ftype="ellip")
-    msig = numpy.mean(signal)
+    msig = numpy.mean(signal, axis=-1, keepdims=True)  # each trace along the last axis is filtered separately
     signal = signal - msig
     w=spSignal.lfilter(filter_b, filter_a, signal) # filter the incoming signal
     signal = signal + msig
@@ -194,11 +180,11 @@ def SignalFilter_LPFButter(signal, LPF, samplefreq, NPole = 8, bidir=False):
     sf = float(samplefreq)
     wn = [flpf/(sf/2.0)]
     b, a = spSignal.butter(NPole, wn, btype='low', output='ba')
-    zi = spSignal.lfilter_zi(b,a)
+    zi = spSignal.lfilter_zi(b,a)*signal[..., :1]  # each trace along the last axis starts at its first value
     if bidir:
-        out, zo = spSignal.filtfilt(b, a, signal, zi=zi*signal[0])
+        out, zo = spSignal.filtfilt(b, a, signal, zi=zi)
     else:
-        out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[0])
+        out, zo = spSignal.lfilter(b, a, signal, zi=zi)
     return(numpy.array(out))
 
 # filter with Butterworth high pass, using time-causal lfilter 
@@ -207,11 +193,11 @@ def SignalFilter_HPFButter(signal, HPF, samplefreq, NPole = 8, bidir=False):
     sf = float(samplefreq)
     wn = [flpf/(sf/2.0)]
     b, a = spSignal.butter(NPole, wn, btype='high', output='ba')
-    zi = spSignal.lfilter_zi(b,a)
+    zi = spSignal.lfilter_zi(b,a)*signal[..., :1]  # each trace along the last axis starts at its first value
     if bidir:
-        out, zo = spSignal.filtfilt(b, a, signal, zi=zi*signal[0])
+        out, zo = spSignal.filtfilt(b, a, signal, zi=zi)
     else:
-        out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[0])
+        out, zo = spSignal.lfilter(b, a, signal, zi=zi)
     return(numpy.array(out))
         
 # filter signal with low-pass Bessel
@@ -533,6 +519,56 @@ def findspikes(xin, vin, thresh, t0=None, t1= None, dt=1.0, mode=None, interpola
                 spk.append(spkp)
     return(st, spk)
 
+def findspikes2D(xin, vin, thresh, t0=None, t1=None, dt=1.0):
+    """ findspikes2D detects action potentials in all traces of the 2-D array vin
+    (traces x samples) at once, sharing the time base xin.
+    The result is the same as calling findspikes(xin, vin[i], thresh, t0, t1, dt,
+    mode='peak', interpolate=False) for every trace i, but the threshold crossings
+    and peak searches are done with array operations instead of a loop per trace.
+    Each crossing opens a window of 1 msec in which the peak is located; a new
+    crossing requires the voltage to fall below threshold first.
+    Returns (st, spk), where st is a list with one array of spike times per trace,
+    and spk is a list with one array of spike indices per trace. Unlike findspikes,
+    the indices are into xin (not into the t0-t1 window).
+    """
+    xt = numpy.asarray(xin.view(numpy.ndarray))
+    v = numpy.atleast_2d(vin.view(numpy.ndarray))
+    ntr = v.shape[0]
+    it0 = 0
+    if t1 is not None and t0 is not None:
+        it0 = int(t0/dt)
+        it1 = int(t1/dt)
+        xt = xt[it0:it1]
+        v = v[:, it0:it1]
+    npts = v.shape[1]
+    if npts == 0:
+        return([numpy.array([]) for i in range(ntr)], [numpy.array([], dtype=int) for i in range(ntr)])
+    above = v > thresh
+    # start of each run of points above threshold
+    starts = above.copy()
+    starts[:, 1:] &= ~above[:, :-1]
+    # as in findspikes, a trace needs at least one point that is above threshold
+    # and on a rising slope, or nothing is detected in it.
+    dv = numpy.zeros(v.shape, dtype=bool)
+    if npts > 1:
+        dv[:, 1:] = numpy.diff(v, axis=1) > 0
+        dv[:, 0] = dv[:, 1]
+    starts &= (above & dv).any(axis=1)[:, numpy.newaxis]
+
+    rows, cols = numpy.nonzero(starts) # sorted by trace, then by time
+    # locate the peak within 1 msec of each crossing
+    kpkw = max(int(1.0e-3/dt), 1)
+    win = cols[:, numpy.newaxis] + numpy.arange(kpkw)[numpy.newaxis, :]
+    valid = win < npts
+    vals = v[rows[:, numpy.newaxis], numpy.where(valid, win, npts-1)]
+    vals = numpy.where(valid, vals, -numpy.inf)
+    spkp = cols + numpy.argmax(vals, axis=1)
+
+    bounds = numpy.cumsum(numpy.bincount(rows, minlength=ntr))[:-1]
+    st = numpy.split(xt[spkp], bounds)
+    spk = numpy.split(spkp + it0, bounds)
+    return(st, spk)
+
 # getSpikes returns a dictionary with keys that are record numbers, each with values
 # that are the array of spike timesin the spike window.
 # data is studied from the "axis", and only ONE block should be in the selection.
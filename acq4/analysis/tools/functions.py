@@ -1,7 +1,8 @@
 import numpy as np
-import math
-from acq4.pyqtgraph.debug import Profiler
+import scipy.spatial, scipy.stats
+from acq4.util.debug import Profiler
 import acq4.util.functions as utilFn
+from acq4.util.HelpfulException import HelpfulException
 
 
 
@@ -50,25 +51,55 @@ def convertPtsToSparseImage(data, params, spacing=5e-6):
     return arr
 
 
+def countNeighbors(data, radius, isEvent):
+    """For each spot in *data* (an array with 'xPos' and 'yPos' fields), return the
+    number of spots within *radius* (including the spot itself) and how many of those
+    are flagged in the boolean array *isEvent*.
+
+    Spots are paired up with a KD-tree radius query, so the cost grows with the
+    number of neighbors rather than with the square of the number of spots.
+    """
+    x = np.asarray(data['xPos'], dtype=float)
+    y = np.asarray(data['yPos'], dtype=float)
+    isEvent = np.asarray(isEvent, dtype=bool)
+    if len(x) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    tree = scipy.spatial.cKDTree(np.column_stack([x, y]))
+    ## query slightly beyond radius, then apply the exact (strict) distance test
+    neighbors = tree.query_ball_point(np.column_stack([x, y]), radius * (1 + 1e-9))
+    nCandidates = np.array([len(n) for n in neighbors])
+    i = np.repeat(np.arange(len(x)), nCandidates)
+    j = np.concatenate([np.asarray(n, dtype=int) for n in neighbors])
+    inside = np.sqrt((x[j]-x[i])**2 + (y[j]-y[i])**2) < radius
+    i = i[inside]
+    nSpots = np.bincount(i, minlength=len(x))
+    nEventSpots = np.bincount(i[isEvent[j[inside]]], minlength=len(x))
+    return nSpots, nEventSpots
+
+
+def _spatialCorrelationProbs(data, radius, p, isEvent, printProcess):
+    ## for each spot, calculate the probability of having the events in nearby spots occur randomly:
+    ## P(X >= nEventSpots) for X ~ Binomial(nSpots, p)
+    nSpots, nEventSpots = countNeighbors(data, radius, isEvent)
+    prob = scipy.stats.binom.sf(nEventSpots - 1, nSpots, p)
+    if printProcess: ## for debugging
+        for i in range(len(prob)):
+            print "    %i out of %i spots had events. Probability: %f" %(nEventSpots[i], nSpots[i], prob[i])
+    return prob
+
+
 def bendelsSpatialCorrelationAlgorithm(data, radius, spontRate, timeWindow, printProcess=False, eventsKey='numOfPostEvents'):
     ## check that data has 'xPos', 'yPos' and 'numOfPostEvents'
     #SpatialCorrelator.checkArrayInput(data) 
-    #prof = Profiler("bendelsSpatialCorrelationAlgorithm", disabled=True)
     fields = data.dtype.names
     if 'xPos' not in fields or 'yPos' not in fields or eventsKey not in fields:
         raise HelpfulException("Array input needs to have the following fields: 'xPos', 'yPos', the field specified in *eventsKey*. Current fields are: %s" %str(fields))   
-    #prof.mark("checked fields")
     
     ## add 'prob' field to data array
     if 'prob' not in data.dtype.names:
         arr = utilFn.concatenateColumns([data, np.zeros(len(data), dtype=[('prob', float)])])
         #arr[:] = data     
         data = arr
-    else:
-        data['prob']=0
-    #prof.mark("set 'prob' field")
-        
-    table = np.zeros((200, 200)) ## add a lookup table so that we don't have to calculate the same probabilities over and over...saves a bit of time
     
     ## spatial correlation algorithm from :
     ## Bendels, MHK; Beed, P; Schmitz, D; Johenning, FW; and Leibold C. Detection of input sites in 
@@ -78,55 +109,23 @@ def bendelsSpatialCorrelationAlgorithm(data, radius, spontRate, timeWindow, prin
     p = 1-np.exp(-spontRate*timeWindow)
     if printProcess:
         print "======  Spontaneous Probability: %f =======" % p
-    #prof.mark('calculated spontaneous probability')
-        
-    ## for each spot, calculate the probability of having the events in nearby spots occur randomly
-    for x in data:
-        spots = data[(np.sqrt((data['xPos']-x['xPos'])**2+(data['yPos']-x['yPos'])**2)) < radius]
-        nSpots = len(spots)
-        nEventSpots = len(spots[spots[eventsKey] > 0])
         
-        prob = 0
-        if table[nEventSpots, nSpots] != 0: ## try looking up value in table (it was stored there if we calculated it before), otherwise calculate it now
-            prob = table[nEventSpots, nSpots]
-            #prof.mark('look-up')
-        else: 
-            for j in range(nEventSpots, nSpots+1):
-                a = ((p**j)*((1-p)**(nSpots-j))*math.factorial(nSpots))/(math.factorial(j)*math.factorial(nSpots-j))
-                if printProcess:
-                    print "        Prob for %i events: %f     Total: %f" %(j, a, prob+a)
-                prob += a
-            table[nEventSpots, nSpots] = prob
-            #prof.mark('calculate')
-        if printProcess: ## for debugging
-            print "    %i out of %i spots had events. Probability: %f" %(nEventSpots, nSpots, prob)
-        x['prob'] = prob
-        
-        
-    #prof.mark("calculated probabilities")
-    #prof.finish()
+    data['prob'] = _spatialCorrelationProbs(data, radius, p, data[eventsKey] > 0, printProcess)
     
     return data
 
 def spatialCorrelationAlgorithm_ZScore(data, radius, printProcess=False, eventsKey='ZScore', spontKey='SpontZScore', threshold=1.645):
     ## check that data has 'xPos', 'yPos' and 'numOfPostEvents'
     #SpatialCorrelator.checkArrayInput(data) 
-    #prof = Profiler("bendelsSpatialCorrelationAlgorithm", disabled=True)
     fields = data.dtype.names
     if 'xPos' not in fields or 'yPos' not in fields or eventsKey not in fields or spontKey not in fields:
         raise HelpfulException("Array input needs to have the following fields: 'xPos', 'yPos', the fields specified in *eventsKey* and *spontKey*. Current fields are: %s" %str(fields))   
-    #prof.mark("checked fields")
     
     ## add 'prob' field to data array
     if 'prob' not in data.dtype.names:
         arr = utilFn.concatenateColumns([data, np.zeros(len(data), dtype=[('prob', float)])])
         #arr[:] = data     
         data = arr
-    else:
-        data['prob']=0
-    #prof.mark("set 'prob' field")
-        
-    table = np.zeros((200, 200)) ## add a lookup table so that we don't have to calculate the same probabilities over and over...saves a bit of time
     
     ## spatial correlation algorithm from :
     ## Bendels, MHK; Beed, P; Schmitz, D; Johenning, FW; and Leibold C. Detection of input sites in 
@@ -134,36 +133,7 @@ def spatialCorrelationAlgorithm_ZScore(data, radius, printProcess=False, eventsK
     
     ## calculate probability of seeing a spontaneous event in time window -- for ZScore method, calculate probability that ZScore is spontaneously high
     p = len(data[data[spontKey] < -threshold])/float(len(data))
-    #p = 1-np.exp(-spontRate*timeWindow)
-    #if printProcess:
-    #    print "======  Spontaneous Probability: %f =======" % p
-    #prof.mark('calculated spontaneous probability')
     
-        
-    ## for each spot, calculate the probability of having the events in nearby spots occur randomly
-    for x in data:
-        spots = data[(np.sqrt((data['xPos']-x['xPos'])**2+(data['yPos']-x['yPos'])**2)) < radius]
-        nSpots = len(spots)
-        nEventSpots = len(spots[spots[eventsKey] < -threshold])
-        
-        prob = 0
-        if table[nEventSpots, nSpots] != 0: ## try looking up value in table (it was stored there if we calculated it before), otherwise calculate it now
-            prob = table[nEventSpots, nSpots]
-            #prof.mark('look-up')
-        else: 
-            for j in range(nEventSpots, nSpots+1):
-                a = ((p**j)*((1-p)**(nSpots-j))*math.factorial(nSpots))/(math.factorial(j)*math.factorial(nSpots-j))
-                if printProcess:
-                    print "        Prob for %i events: %f     Total: %f" %(j, a, prob+a)
-                prob += a
-            table[nEventSpots, nSpots] = prob
-            #prof.mark('calculate')
-        if printProcess: ## for debugging
-            print "    %i out of %i spots had events. Probability: %f" %(nEventSpots, nSpots, prob)
-        x['prob'] = prob
-        
-        
-    #prof.mark("calculated probabilities")
-    #prof.finish()
+    data['prob'] = _spatialCorrelationProbs(data, radius, p, data[eventsKey] < -threshold, printProcess)
     
     return data
\ No newline at end of file
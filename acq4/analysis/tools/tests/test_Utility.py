@@ -0,0 +1,65 @@
+import time
+import numpy as np
+from acq4.analysis.tools import Utility
+
+
+def makeTraces(ntr=20, dt=1e-4, dur=0.5, seed=0):
+    """Generate a stack of noisy voltage traces with spike trains of increasing rate
+    during a 100-400 ms current step."""
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(dur/dt)) * dt
+    traces = np.empty((ntr, len(t)))
+    spike = np.array([0., 0.03, 0.08, 0.1, 0.07, 0.02, -0.01, -0.005])  # ~0.8 ms spike shape
+    for i in range(ntr):
+        v = -0.065 + rng.normal(scale=0.0005, size=len(t))
+        v[(t >= 0.1) & (t < 0.4)] += 0.005
+        nspk = i % 12
+        if nspk > 0:
+            tspk = np.sort(rng.uniform(0.1, 0.39, size=nspk))
+            for ts in tspk:
+                k = int(ts / dt)
+                v[k:k+len(spike)] += spike[:len(v)-k]
+        traces[i] = v
+    return t, traces
+
+
+def loopSpikes(t, traces, thresh, t0, t1, dt):
+    spikes = []
+    indices = []
+    for i in range(traces.shape[0]):
+        st, spk = Utility.findspikes(t, traces[i], thresh, t0=t0, t1=t1, dt=dt,
+                                     mode='peak', interpolate=False)
+        spikes.append(np.asarray(st))
+        indices.append([np.argmin(np.fabs(t-x)) for x in st])
+    return spikes, indices
+
+
+def test_findspikes2D():
+    dt = 1e-4
+    t, traces = makeTraces(dt=dt)
+    # a trace that starts above threshold, and one with a long plateau
+    traces[0, :] = np.linspace(0.01, -0.07, traces.shape[1])
+    traces[1, 1000:3000] = 0.01
+    for (t0, t1) in [(0.1, 0.4), (None, None)]:
+        spikes, indices = loopSpikes(t, traces, -0.02, t0, t1, dt)
+        spikes2, indices2 = Utility.findspikes2D(t, traces, -0.02, t0=t0, t1=t1, dt=dt)
+        assert len(spikes2) == len(spikes) == traces.shape[0]
+        for i in range(traces.shape[0]):
+            assert len(spikes2[i]) == len(spikes[i])
+            assert np.all(spikes2[i] == spikes[i])
+            assert list(indices2[i]) == list(indices[i])
+    assert len(spikes2[1]) == 1
+    assert sum(map(len, spikes2)) > 50
+
+
+def test_findspikes2D_speed():
+    dt = 1e-4
+    t, traces = makeTraces(ntr=200, dt=dt, seed=1)
+    start = time.time()
+    spikes, indices = loopSpikes(t, traces, -0.02, 0.1, 0.4, dt)
+    tloop = time.time() - start
+    start = time.time()
+    spikes2, indices2 = Utility.findspikes2D(t, traces, -0.02, t0=0.1, t1=0.4, dt=dt)
+    t2d = time.time() - start
+    assert [len(s) for s in spikes2] == [len(s) for s in spikes]
+    print("findspikes loop: %0.3f s  findspikes2D: %0.3f s  speedup: %0.1fx" % (tloop, t2d, tloop / t2d))
@@ -0,0 +1,84 @@
+import math
+import time
+import numpy as np
+from acq4.analysis.tools import functions as fn
+
+
+def referenceProbs(data, radius, p, isEvent):
+    """Original O(N^2) implementation, with binomial tails summed from factorials."""
+    probs = np.zeros(len(data))
+    for i in range(len(data)):
+        near = np.sqrt((data['xPos']-data['xPos'][i])**2 + (data['yPos']-data['yPos'][i])**2) < radius
+        nSpots = near.sum()
+        nEventSpots = (near & isEvent).sum()
+        for j in range(nEventSpots, nSpots+1):
+            probs[i] += ((p**j)*((1-p)**(nSpots-j))*math.factorial(nSpots))/(math.factorial(j)*math.factorial(nSpots-j))
+    return probs
+
+
+def makeMap(nSpots, spacing=30e-6, seed=0, grid=True):
+    rng = np.random.RandomState(seed)
+    data = np.zeros(nSpots, dtype=[('xPos', float), ('yPos', float), ('numOfPostEvents', int),
+                                   ('ZScore', float), ('SpontZScore', float)])
+    if grid:
+        n = int(np.ceil(nSpots**0.5))
+        data['xPos'] = (np.arange(nSpots) % n) * spacing
+        data['yPos'] = (np.arange(nSpots) // n) * spacing
+    else:
+        data['xPos'] = rng.uniform(0, spacing * nSpots**0.5, size=nSpots)
+        data['yPos'] = rng.uniform(0, spacing * nSpots**0.5, size=nSpots)
+    data['numOfPostEvents'] = rng.poisson(0.3, size=nSpots)
+    data['ZScore'] = rng.normal(size=nSpots)
+    data['SpontZScore'] = rng.normal(size=nSpots)
+    return data
+
+
+def test_bendelsMatchesReference():
+    for grid in (True, False):
+        data = makeMap(150, grid=grid)
+        ## 90 um is an exact multiple of the grid spacing; spots on the boundary are excluded
+        for radius in (90e-6, 100e-6):
+            out = fn.bendelsSpatialCorrelationAlgorithm(data, radius, spontRate=3.0, timeWindow=0.1)
+            p = 1 - np.exp(-3.0 * 0.1)
+            ref = referenceProbs(data, radius, p, data['numOfPostEvents'] > 0)
+            assert np.allclose(out['prob'], ref, rtol=1e-10, atol=1e-14)
+            ## input without a 'prob' field is not modified
+            assert 'prob' not in data.dtype.names
+
+
+def test_zScoreMatchesReference():
+    data = makeMap(180, grid=False)
+    out = fn.spatialCorrelationAlgorithm_ZScore(data, 90e-6)
+    p = (data['SpontZScore'] < -1.645).sum() / float(len(data))
+    ref = referenceProbs(data, 90e-6, p, data['ZScore'] < -1.645)
+    assert np.allclose(out['prob'], ref, rtol=1e-10, atol=1e-14)
+
+    ## 'prob' field is updated in place when present
+    fn.spatialCorrelationAlgorithm_ZScore(out, 50e-6)
+    ref = referenceProbs(data, 50e-6, p, data['ZScore'] < -1.645)
+    assert np.allclose(out['prob'], ref, rtol=1e-10, atol=1e-14)
+
+
+def test_denseMap():
+    ## 5000 spots with ~300 spots per neighborhood; too many for the old 200x200 lookup table
+    data = makeMap(5000, spacing=5e-6)
+    start = time.time()
+    out = fn.bendelsSpatialCorrelationAlgorithm(data, 50e-6, spontRate=3.0, timeWindow=0.1)
+    assert time.time() - start < 5.0
+
+    nSpots, nEventSpots = fn.countNeighbors(data, 50e-6, data['numOfPostEvents'] > 0)
+    assert nSpots.max() > 200
+    for i in [0, 77, 2500, 4999]:
+        near = np.sqrt((data['xPos']-data['xPos'][i])**2 + (data['yPos']-data['yPos'][i])**2) < 50e-6
+        assert nSpots[i] == near.sum()
+        assert nEventSpots[i] == (near & (data['numOfPostEvents'] > 0)).sum()
+    assert np.all(np.isfinite(out['prob']))
+    assert np.all((out['prob'] >= 0) & (out['prob'] <= 1))
+
+    ## a cluster of active spots is highly significant
+    data['numOfPostEvents'] = 0
+    center = (data['xPos'] - 150e-6)**2 + (data['yPos'] - 150e-6)**2 < (40e-6)**2
+    data['numOfPostEvents'][center] = 1
+    out = fn.bendelsSpatialCorrelationAlgorithm(data, 50e-6, spontRate=1.0, timeWindow=0.01)
+    assert out['prob'][np.argmin((data['xPos'] - 150e-6)**2 + (data['yPos'] - 150e-6)**2)] < 1e-100
+    assert out['prob'][~center].max() == 1.0
@@ -0,0 +1,12 @@
+"""
+Performance benchmarks for ACQ4 hot paths, run on simulated hardware.
+
+Run all benchmarks from the command line with::
+
+    python tools/runBenchmarks.py > baseline.json
+    python tools/runBenchmarks.py --compare baseline.json
+
+See acq4.benchmarks.benchmark.main() for all options.
+"""
+from .benchmark import Benchmark, BENCHMARKS, register, runBenchmarks, compareResults, main
+from . import acquisition, storage
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+acquisition.py -  Benchmarks for task execution and camera acquisition on simulated hardware
+Distributed under MIT/X11 license. See license.txt for more infomation.
+"""
+
+import os, tempfile, shutil, atexit, threading
+from collections import OrderedDict
+import numpy as np
+import acq4.util.ptime as ptime
+from acq4.util import configfile
+from .benchmark import Benchmark, register
+
+
+## Simulated devices used by the acquisition benchmarks. These mirror the
+## example configuration, minus everything the benchmarks do not need.
+DEVICES = OrderedDict([
+    ('DAQ', OrderedDict([
+        ('driver', 'NiDAQ'),
+        ('mock', True),
+        ('defaultAIMode', 'NRSE'),
+        ('defaultAIRange', [-10, 10]),
+        ('defaultAORange', [-10, 10]),
+    ])),
+    ('DaqDevice', OrderedDict([
+        ('driver', 'DAQGeneric'),
+        ('channels', OrderedDict([
+            ('AIChan', {'device': 'DAQ', 'channel': '/Dev1/ai0', 'type': 'ai'}),
+            ('AOChan', {'device': 'DAQ', 'channel': '/Dev1/ao0', 'type': 'ao'}),
+        ])),
+    ])),
+    ('Camera', OrderedDict([
+        ('driver', 'MockCamera'),
+        ('transform', {'pos': (0, 0), 'scale': (5e-6, -5e-6), 'angle': 0}),
+        ('exposeChannel', {'device': 'DAQ', 'channel': '/Dev1/port0/line0', 'type': 'di'}),
+        ('triggerInChannel', {'device': 'DAQ', 'channel': '/Dev1/port0/line1', 'type': 'do'}),
+        ('defaults', {'exposure': 1e-3}),
+    ])),
+])
+
+
+def getManager():
+    """Return the Manager, creating one configured with the simulated DEVICES if
+    none exists yet."""
+    from acq4.Manager import Manager
+    if Manager.single is not None:
+        return Manager.single
+    path = tempfile.mkdtemp(prefix='acq4-benchmark-')
+    atexit.register(shutil.rmtree, path, True)
+    configFile = os.path.join(path, 'default.cfg')
+    configfile.writeConfigFile({'devices': DEVICES}, configFile)
+    return Manager(configFile=configFile)
+
+
+@register
+class ManagerTask(Benchmark):
+    """Manager task recording one AI and driving one AO channel on the mock DAQ"""
+    name = 'managerTask'
+    duration = 0.1
+    rate = 100e3
+
+    def setup(self):
+        self.manager = getManager()
+        nPts = int(self.duration * self.rate)
+        self.cmd = {
+            'protocol': {'duration': self.duration},
+            'DAQ': {'rate': self.rate, 'numPts': nPts},
+            'DaqDevice': {
+                'AIChan': {'record': True},
+                'AOChan': {'command': np.sin(np.linspace(0, 20*np.pi, nPts))},
+            },
+        }
+
+    def run(self):
+        ## the mock DAQ sleeps for the simulated acquisition; report only the time
+        ## spent configuring, starting, and collecting the task.
+        start = ptime.time()
+        task = self.manager.createTask(self.cmd)
+        task.execute()
+        result = task.getResult()
+        assert result['DaqDevice'].shape[-1] == self.cmd['DAQ']['numPts']
+        return ptime.time() - start - self.duration
+
+
+@register
+class CameraAcquire(Benchmark):
+    """Per-frame latency of MockCamera frames delivered through AcquireThread"""
+    name = 'cameraAcquire'
+    nFrames = 20
+
+    def setup(self):
+        self.camera = getManager().getDevice('Camera')
+        self.camera.setParam('exposure', 1e-3)
+        self.latency = []
+        self.done = threading.Event()
+
+    def newFrame(self, frame):
+        ## frame time is set when the camera is polled for new frames, so this
+        ## measures frame generation plus AcquireThread processing and delivery.
+        self.latency.append(ptime.time() - frame.info()['time'])
+        if len(self.latency) >= self.nFrames:
+            self.done.set()
+
+    def run(self):
+        self.latency = []
+        self.done.clear()
+        acq = self.camera.acqThread
+        acq.connectCallback(self.newFrame)
+        try:
+            self.camera.start()
+            self.done.wait(30.)
+            self.camera.stop(block=True)
+        finally:
+            acq.disconnectCallback(self.newFrame)
+        if len(self.latency) < self.nFrames:
+            raise Exception("Timed out waiting for camera frames (got %d)" % len(self.latency))
+        return np.median(self.latency)
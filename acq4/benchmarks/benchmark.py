@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py -  Timing and baseline comparison for ACQ4 performance benchmarks
+Distributed under MIT/X11 license. See license.txt for more infomation.
+"""
+
+import gc, json, sys, platform
+from collections import OrderedDict
+import numpy as np
+import acq4
+import acq4.util.ptime as ptime
+from acq4.util.debug import printExc
+
+
+BENCHMARKS = OrderedDict()
+
+def register(cls):
+    """Class decorator that adds a Benchmark subclass to the registry."""
+    BENCHMARKS[cls.name] = cls
+    return cls
+
+
+class Benchmark(object):
+    """Base class for benchmarks.
+
+    Subclasses set *name* and implement run(). setup() and teardown() are called
+    once before and after all repeats and are not timed; run() is called once
+    untimed to warm up caches, then *repeat* times.
+
+    Each repeat is timed by the wall clock unless run() returns a number, in which
+    case that value (in seconds) is recorded instead. This lets benchmarks whose
+    duration is paced by simulated hardware report only the time spent in ACQ4.
+    """
+    name = None
+    repeat = 5
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError()
+
+    def teardown(self):
+        pass
+
+    def measure(self, repeat=None):
+        """Run the benchmark and return the list of measured times."""
+        if repeat is None:
+            repeat = self.repeat
+        self.setup()
+        try:
+            self.run()
+            times = []
+            for i in range(repeat):
+                gc.collect()
+                start = ptime.time()
+                ret = self.run()
+                elapsed = ptime.time() - start
+                times.append(elapsed if ret is None else float(ret))
+            return times
+        finally:
+            self.teardown()
+
+
+def summarize(times):
+    """Return a dict of summary statistics for a list of times."""
+    times = np.array(times, dtype=float)
+    return OrderedDict([
+        ('min', float(times.min())),
+        ('median', float(np.median(times))),
+        ('mean', float(times.mean())),
+        ('std', float(times.std())),
+        ('times', times.tolist()),
+    ])
+
+
+def runBenchmarks(names=None, repeat=None):
+    """Run the named benchmarks (or all registered benchmarks) and return the results.
+
+    The return value is a JSON-serializable dict with a 'benchmarks' key mapping each
+    benchmark name to its summary statistics (see summarize()). Benchmarks that
+    raise an exception are reported with an 'error' key instead.
+    """
+    if names is None:
+        names = list(BENCHMARKS.keys())
+    results = OrderedDict()
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark '%s'. Options are: %s" % (name, ', '.join(BENCHMARKS.keys())))
+        try:
+            results[name] = summarize(BENCHMARKS[name]().measure(repeat))
+        except Exception as exc:
+            printExc("Error running benchmark '%s':" % name)
+            results[name] = OrderedDict([('error', str(exc))])
+    return OrderedDict([
+        ('acq4Version', acq4.__version__),
+        ('python', sys.version.split()[0]),
+        ('platform', platform.platform()),
+        ('benchmarks', results),
+    ])
+
+
+def compareResults(results, baseline, tolerance=0.25):
+    """Compare the median times in *results* against those in *baseline*.
+
+    Both arguments are dicts as returned by runBenchmarks(). Returns an OrderedDict
+    mapping each benchmark name to a dict with the baseline and current medians,
+    their ratio, and a status: 'regression' if the current time exceeds the
+    baseline by more than the fractional *tolerance*, 'improvement' if it is
+    faster by the same factor, 'ok' otherwise, or 'new' / 'error' if no
+    comparison could be made.
+    """
+    base = baseline.get('benchmarks', {})
+    comp = OrderedDict()
+    for name, res in results['benchmarks'].items():
+        if 'error' in res:
+            comp[name] = {'status': 'error'}
+            continue
+        if name not in base or 'median' not in base[name]:
+            comp[name] = {'status': 'new', 'current': res['median']}
+            continue
+        ref = base[name]['median']
+        ratio = res['median'] / ref if ref > 0 else np.inf
+        if ratio > 1.0 + tolerance:
+            status = 'regression'
+        elif ratio < 1.0 / (1.0 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comp[name] = OrderedDict([('baseline', ref), ('current', res['median']),
+                                  ('ratio', ratio), ('status', status)])
+    return comp
+
+
+def main(argv=None):
+    """Command-line entry point; see tools/runBenchmarks.py.
+
+    Timings are written as JSON to stdout (or to --output). Anything printed while
+    the benchmarks run is redirected to stderr so that it does not corrupt the
+    JSON. Returns 1 if any benchmark failed or regressed, 0 otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Run ACQ4 performance benchmarks on simulated hardware.")
+    parser.add_argument('names', nargs='*', help="Benchmarks to run (default: all)")
+    parser.add_argument('--list', action='store_true', help="List available benchmarks and exit")
+    parser.add_argument('--repeat', type=int, default=None, help="Number of timed repeats per benchmark")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file instead of stdout")
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help="JSON results from a previous run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Fractional slowdown allowed before a benchmark is flagged as a regression")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, cls in BENCHMARKS.items():
+            print("%-24s %s" % (name, (cls.__doc__ or '').strip().split('\n')[0]))
+        return 0
+
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = runBenchmarks(args.names or None, repeat=args.repeat)
+    finally:
+        sys.stdout = stdout
+
+    failed = any('error' in r for r in results['benchmarks'].values())
+    if args.compare is not None:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        comp = compareResults(results, baseline, tolerance=args.tolerance)
+        results['comparison'] = comp
+        for name, c in comp.items():
+            if c['status'] in ('regression', 'improvement'):
+                sys.stderr.write("%s: %s (%.3g s -> %.3g s, x%.2f)\n" % (
+                    name, c['status'].upper(), c['baseline'], c['current'], c['ratio']))
+        failed = failed or any(c['status'] == 'regression' for c in comp.values())
+
+    out = json.dumps(results, indent=2, separators=(',', ': '))
+    if args.output is None:
+        stdout.write(out + '\n')
+    else:
+        with open(args.output, 'w') as fh:
+            fh.write(out + '\n')
+    return 1 if failed else 0
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+storage.py -  Benchmarks for MetaArray file I/O and DataManager index updates
+Distributed under MIT/X11 license. See license.txt for more infomation.
+"""
+
+import os, tempfile, shutil
+import numpy as np
+from acq4.util.metaarray import MetaArray
+import acq4.util.DataManager as DataManager
+from .benchmark import Benchmark, register
+
+
+def makeRecording(nChannels=4, nPts=100000):
+    """Return a MetaArray laid out like a multi-channel DAQ recording."""
+    data = np.random.normal(size=(nChannels, nPts)).astype(np.float32)
+    info = [
+        {'name': 'Channel', 'cols': [{'name': 'chan%d' % i, 'units': 'V'} for i in range(nChannels)]},
+        {'name': 'Time', 'units': 's', 'values': np.arange(nPts) * 1e-5},
+        {'DAQ': {'rate': 1e5, 'numPts': nPts}},
+    ]
+    return MetaArray(data, info=info)
+
+
+class TempDirBenchmark(Benchmark):
+    """Benchmark base class that works in a temporary directory."""
+    def setup(self):
+        self.path = tempfile.mkdtemp(prefix='acq4-benchmark-')
+
+    def teardown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@register
+class MetaArrayWrite(TempDirBenchmark):
+    """Write a 4-channel, 100k-sample MetaArray to HDF5"""
+    name = 'metaArrayWrite'
+
+    def setup(self):
+        TempDirBenchmark.setup(self)
+        self.data = makeRecording()
+        self.fileName = os.path.join(self.path, 'data.ma')
+
+    def run(self):
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
+        self.data.writeHDF5(self.fileName)
+
+
+@register
+class MetaArrayRead(TempDirBenchmark):
+    """Read a 4-channel, 100k-sample MetaArray from HDF5"""
+    name = 'metaArrayRead'
+
+    def setup(self):
+        TempDirBenchmark.setup(self)
+        self.fileName = os.path.join(self.path, 'data.ma')
+        makeRecording().writeHDF5(self.fileName)
+
+    def run(self):
+        ma = MetaArray(file=self.fileName, readAllData=True)
+        assert ma.shape == (4, 100000)
+
+
+@register
+class DirIndexUpdate(TempDirBenchmark):
+    """Add 100 files to a DirHandle index, then update the meta-info of each"""
+    name = 'dirIndexUpdate'
+    nFiles = 100
+
+    def run(self):
+        root = DataManager.getDirHandle(self.path)
+        dh = root.mkdir('run', autoIncrement=True)
+        for i in range(self.nFiles):
+            dh.createFile('file_%03d.txt' % i, info={'index': i})
+        for i in range(self.nFiles):
+            dh['file_%03d.txt' % i].setInfo({'value': i * 2.0})
+        assert dh['file_%03d.txt' % (self.nFiles-1)].info()['value'] == (self.nFiles-1) * 2.0
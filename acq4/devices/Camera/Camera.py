@@ -414,6 +414,10 @@ class CameraTask(DAQGenericTask):
 
     Some of these methods may need to be reimplemented for subclasses.
     """
+    
+    ## newFrame() notifies when minFrames have been recorded, and the acquisition
+    ## thread notifies if the camera stops
+    notifiesDone = True
 
     def __init__(self, dev, cmd, parentTask):
         #print "Camera task:", cmd
@@ -505,14 +509,18 @@ class CameraTask(DAQGenericTask):
             
     def newFrame(self, frame):
         disconnect = False
+        notify = False
         with self.lock:
             if self.recording:
                 self.frames.append(frame)
+                notify = len(self.frames) == self.camCmd.get('minFrames', None)
             if self.stopRecording:
                 self.recording = False
                 disconnect = True
         if disconnect:   ## Must be done only after unlocking mutex
             self.dev.acqThread.disconnectCallback(self.newFrame)
+        if notify:
+            self.notifyDone()
 
         
     def start(self):
@@ -523,6 +531,10 @@ class CameraTask(DAQGenericTask):
             
         if not self.dev.isRunning():
             self.dev.start(block=True)  ## wait until camera is actually ready to acquire
+        
+        ## The acquisition thread emits finished from its own thread, so a direct connection
+        ## notifies us even if there is no event loop running here.
+        self.dev.acqThread.finished.connect(self.notifyDone, QtCore.Qt.DirectConnection)
             
         ## Last I checked, this does nothing. It should be here anyway, though..
         DAQGenericTask.start(self)
@@ -547,6 +559,10 @@ class CameraTask(DAQGenericTask):
         
         with self.lock:
             self.stopRecording = True
+        try:
+            self.dev.acqThread.finished.disconnect(self.notifyDone)
+        except TypeError:
+            pass  ## not connected (task was never started)
         
         if 'popState' in self.camCmd:
             self.dev.popState(self.camCmd['popState'])  ## restores previous settings, stops/restarts camera if needed
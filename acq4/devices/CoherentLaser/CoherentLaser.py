@@ -9,10 +9,14 @@ import time
 
 class CoherentLaser(Laser):
 
+    @classmethod
+    def initHardware(cls, config, name):
+        return Coherent(config['port']-1, config.get('baud', 19200))
+
     def __init__(self, dm, config, name):
         self.port = config['port']-1  ## windows com ports start at COM1, pyserial ports start at 0
         self.baud = config.get('baud', 19200)
-        self.driver = Coherent(self.port, self.baud)
+        self.driver = self.getHardware(config, name)
         self.driverLock = Mutex(QtCore.QMutex.Recursive)  ## access to low level driver calls
         
         self.coherentLock = Mutex(QtCore.QMutex.Recursive)  ## access to self.attributes
@@ -262,6 +262,10 @@ class DAQGeneric(Device):
             
 
 class DAQGenericTask(DeviceTask):
+    
+    ## isDone() is always True; the DAQ task reports completion for us
+    notifiesDone = True
+    
     def __init__(self, dev, cmd, parentTask):
         DeviceTask.__init__(self, dev, cmd, parentTask)
         self.daqTasks = {}
@@ -419,6 +423,14 @@ class DAQGenericTask(DeviceTask):
                 self.dev.setChanHolding(ch)
                 prof('reset to holding %s' % ch)
         
+    def canRearm(self):
+        return True
+        
+    def rearm(self):
+        ## Channels and waveforms remain on the DAQ task; only presets and holding
+        ## values need to be applied again.
+        DAQGenericTask.configure(self)
+        
     def getResult(self):
         ## Access data recorded from DAQ task
         ## create MetaArray and fill with MC state info
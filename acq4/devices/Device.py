@@ -1,11 +1,60 @@
 # -*- coding: utf-8 -*-
-import time, traceback, sys, weakref
+import time, traceback, sys, weakref, threading
 from PyQt4 import QtCore, QtGui
 from acq4.util.Mutex import Mutex
 from acq4.util.debug import *
 
 class Device(QtCore.QObject):
     """Abstract class defining the standard interface for Device subclasses."""
+    
+    ## Set to True in subclasses whose __init__ may be run in a worker thread, allowing
+    ## the Manager to load the device concurrently with others (see Manager.DeviceLoader).
+    ## This requires that __init__ creates no Qt objects other than the device itself 
+    ## (widgets, timers, signal proxies, or connections to plain python callables), since 
+    ## those would be owned by a thread that exits as soon as the device is loaded.
+    ## Devices that cannot meet this requirement may instead move their slow hardware 
+    ## initialization into initHardware().
+    threadSafeInit = False
+    
+    _hardware = {}  ## {deviceName: object returned by initHardware()} (see loadHardware)
+    _hardwareLock = threading.Lock()
+    
+    @classmethod
+    def initHardware(cls, config, name):
+        """Perform slow hardware initialization for the device *name*, such as opening
+        a serial port and handshaking with the controller, and return the resulting
+        object (usually a driver instance). 
+        
+        The Manager may call this in a worker thread (see loadHardware) while other 
+        devices are loading, and then construct the device in the GUI thread. It must
+        not create any Qt objects or modify *config*, and it may run at the same time
+        as initHardware() for other devices, so any driver state shared between
+        devices (such as one serial port used by several drives) must be protected
+        by a lock. Subclasses that implement this method retrieve its result in 
+        __init__ by calling getHardware().
+        
+        The default implementation does nothing.
+        """
+        return None
+    
+    @classmethod
+    def loadHardware(cls, config, name):
+        """Call initHardware() and keep its result to be returned by getHardware() 
+        when the device is constructed."""
+        hw = cls.initHardware(config, name)
+        with Device._hardwareLock:
+            Device._hardware[name] = hw
+    
+    @classmethod
+    def getHardware(cls, config, name):
+        """Return the object created by initHardware() for the device *name*.
+        If the hardware was not already loaded by loadHardware(), call initHardware() now.
+        """
+        with Device._hardwareLock:
+            if name in Device._hardware:
+                return Device._hardware.pop(name)
+        return cls.initHardware(config, name)
+    
     def __init__(self, deviceManager, config, name):
         QtCore.QObject.__init__(self)
         self._lock_ = Mutex(QtCore.QMutex.Recursive)  ## no, good idea
@@ -109,6 +158,13 @@ class DeviceTask(object):
     
     DeviceTask instances are usually created by calling Device.createTask().
     """
+    
+    ## Subclasses that call notifyDone() when they finish should set this to True
+    ## (in the same class that implements isDone()). Subclasses whose isDone() always 
+    ## returns True may also set it without calling notifyDone().
+    ## Otherwise, the parent task polls isDone() to determine when the task has completed.
+    notifiesDone = False
+    
     def __init__(self, dev, cmd, parentTask):
         """
         Initialization is provided 3 arguments: *dev* is the Device for which
@@ -215,6 +271,21 @@ class DeviceTask(object):
         """
         return True
     
+    def notifyDone(self):
+        """
+        Inform the parent task that this DeviceTask has completed, so that it 
+        does not need to poll isDone(). This may be called from any thread
+        (for example, from an acquisition thread as soon as the last data 
+        has arrived). 
+        
+        Subclasses that call this method must set notifiesDone = True and must
+        call notifyDone() every time the task completes; isDone() is still used
+        to confirm that the task has finished.
+        """
+        task = self.parentTask()
+        if task is not None:
+            task.deviceTaskDone(self)
+    
     def stop(self, abort=False):
         """
         Stop this DeviceTask. If abort is True, then the task should stop as
@@ -229,6 +300,28 @@ class DeviceTask(object):
         Release any resources that were acquired during the call to reserve().
         """
         self.dev.release()
+
+    def canRearm(self):
+        """
+        Return True if this DeviceTask can be started again with the same
+        command after it has been stopped, without being configured again
+        (see Task.rearm).
+        
+        The default implementation returns False, in which case a new task
+        must be created for each run.
+        """
+        return False
+        
+    def rearm(self):
+        """
+        Called by the parent task in place of configure() when a re-armed
+        task is executed again. Subclasses that return True from canRearm()
+        should use this method to restore any device state that the previous
+        run changed.
+        
+        The default implementation does nothing.
+        """
+        pass
     
     def getResult(self):
         """
@@ -6,6 +6,7 @@ from acq4.devices.DAQGeneric import DAQGeneric, DAQGenericTask
 from acq4.devices.OptomechDevice import OptomechDevice
 from LaserDevGui import LaserDevGui
 from LaserTaskGui import LaserTaskGui
+from PCellCalibration import PCellCalibration
 import os
 import time
 import numpy as np
@@ -68,6 +69,8 @@ class Laser(DAQGeneric, OptomechDevice):
             pulseRate: 100*kHz                      ## Laser's pulse rate; limits minimum pulse duration
             pCell:
                 channel: 'DAQ', '/Dev2/ao1'       ## channel for pockels cell control
+                calibrationRange: 0, 2            ## pCell voltages swept during calibration
+                calibrationSteps: 20
             namedWavelengths:
                 UV uncaging: 710*nm
                 AF488: 976*nm
@@ -133,6 +136,7 @@ class Laser(DAQGeneric, OptomechDevice):
         self.variableLock = Mutex(QtCore.QMutex.Recursive)
         self.calibrationIndex = None
         self.pCellCalibration = None
+        self._pCellCalibrationCache = {}
         self.getPowerHistory()
         
         #self.scope = manager.getDevice(self.config['scope'])
@@ -181,6 +185,7 @@ class Laser(DAQGeneric, OptomechDevice):
         with self.lock:
             self.writeConfigFile(index, 'index')
             self.calibrationIndex = index
+            self._pCellCalibrationCache = {}
         
     def setAlignmentMode(self, b):
         """If true, configures the laser for low-power alignment mode. 
@@ -248,6 +253,27 @@ class Laser(DAQGeneric, OptomechDevice):
             return None
         
         return vals['transmission']
+
+    def getPCellCalibration(self, opticState=None, wavelength=None):
+        """Return the PCellCalibration measured for the given optic state and wavelength.
+        If either argument is None, then it will be replaced with the currently known value.
+        Returns None if there is no calibration."""
+        if opticState is None:
+            opticState = self.getDeviceStateKey()
+        if wavelength is None:
+            wavelength = self.getWavelength()
+        wl = siFormat(wavelength, suffix='m')
+
+        with self.lock:
+            key = (opticState, wl)
+            if key not in self._pCellCalibrationCache:
+                vals = self.getCalibrationIndex().get(opticState, {}).get(wl, {})
+                if 'pCell' in vals:
+                    cal = PCellCalibration.restoreState(vals['pCell'])
+                else:
+                    cal = None
+                self._pCellCalibrationCache[key] = cal
+            return self._pCellCalibrationCache[key]
             
             
     def opticStateChanged(self, change):
@@ -292,11 +318,18 @@ class Laser(DAQGeneric, OptomechDevice):
         index = self.getCalibrationIndex()
         
         ## Run calibration
+        calibration = {}
         if not self.hasPCell:
             power, transmission = self.runCalibration(powerMeter=powerMeter, measureTime=mTime, settleTime=sTime)
             #self.setParam(currentPower=power, scopeTransmission=transmission)  ## wrong--power is samplePower, not outputPower.
         else:
-            raise Exception("Pockel Cell calibration is not yet implented.")
+            pCellCal = self.runPCellCalibration(powerMeter=powerMeter, measureTime=mTime, settleTime=sTime)
+            ## measure again at full transmission; this also checks that the meter can see the laser
+            power, transmission = self.runCalibration(powerMeter=powerMeter, measureTime=mTime, settleTime=sTime,
+                                                      pCellVoltage=pCellCal.voltageRange()[1])
+            ## full power for switchWaveform commands must map to the top of the lookup table
+            transmission = pCellCal.transmissionRange()[1]
+            calibration['pCell'] = pCellCal.saveState()
             #if index.has_key('pCellCalibration') and not self.ui.recalibratePCellCheck.isChecked():
                 #power, transmission = self.runCalibration() ## need to tell it to run with open pCell
             #else:
@@ -329,12 +362,35 @@ class Laser(DAQGeneric, OptomechDevice):
             #index[scope] = {}
         if opticState not in index:
             index[opticState] = {}
-        index[opticState][wavelength] = {'power': power, 'transmission':transmission, 'date': date}
+        calibration.update({'power': power, 'transmission':transmission, 'date': date})
+        index[opticState][wavelength] = calibration
 
         self.writeCalibrationIndex(index)
         self.updateSamplePower()
         
-    def runCalibration(self, powerMeter=None, measureTime=0.1, settleTime=0.005, pCellVoltage=None, rate = 100000):
+    def runPCellCalibration(self, powerMeter, measureTime=0.1, settleTime=0.005, voltages=None):
+        """Measure transmission through the optical path at a series of pCell voltages
+        and return a PCellCalibration.
+
+        By default, the voltages are taken from the 'calibrationRange' and
+        'calibrationSteps' (default 20) options in the pCell configuration.
+        """
+        if voltages is None:
+            pCellConfig = self.config['pCell']
+            if 'calibrationRange' not in pCellConfig:
+                raise HelpfulException("Cannot calibrate the Pockels cell for %s; no calibration voltages given." % self.name(),
+                                       reasons=["The 'pCell' section of the device configuration has no 'calibrationRange' option."])
+            minV, maxV = pCellConfig['calibrationRange']
+            voltages = np.linspace(minV, maxV, pCellConfig.get('calibrationSteps', 20))
+
+        transmission = []
+        for v in voltages:
+            p, t = self.runCalibration(powerMeter=powerMeter, measureTime=measureTime, settleTime=settleTime,
+                                       pCellVoltage=v, checkDetection=False)
+            transmission.append(t)
+        return PCellCalibration(voltages, transmission)
+
+    def runCalibration(self, powerMeter=None, measureTime=0.1, settleTime=0.005, pCellVoltage=None, rate = 100000, checkDetection=True):
         daqName = self.getDAQName()[0]
         duration = measureTime + settleTime
         nPts = int(rate * duration)
@@ -353,7 +409,7 @@ class Laser(DAQGeneric, OptomechDevice):
             if self.hasPCell:
                 a = np.zeros(nPts, dtype=float)
                 a[:] = pCellVoltage
-                cmdOff[self.name()]['pCell'] = a
+                cmdOff[self.name()]['pCell'] = {'command': a}
             else:
                 raise Exception("Laser device %s does not have a pCell, therefore no pCell voltage can be set." %self.name())
             
@@ -361,8 +417,9 @@ class Laser(DAQGeneric, OptomechDevice):
         wave = np.ones(nPts, dtype=np.byte)
         wave[-1] = 0
         shutterDelay = self.config.get('shutter', {}).get('delay', 0)
-        wave[:shutterDelay*rate] = 0
-        cmdOn[self.name()]={'shutterMode':'open', 'switchWaveform':wave}
+        wave[:int(shutterDelay*rate)] = 0
+        cmdOn[self.name()] = cmdOff[self.name()].copy()
+        cmdOn[self.name()].update({'shutterMode':'open', 'switchWaveform':wave})
         
         #print "cmdOff: ", cmdOff
         taskOff = getManager().createTask(cmdOff)
@@ -373,7 +430,7 @@ class Laser(DAQGeneric, OptomechDevice):
         taskOn.execute()
         resultOn = taskOn.getResult()
             
-        measurementStart = (shutterDelay+settleTime)*rate
+        measurementStart = int((shutterDelay+settleTime)*rate)
             
         if self.hasPowerIndicator:
             powerOutOn = resultOn[powerInd[0]][0][measurementStart:].mean()
@@ -383,13 +440,13 @@ class Laser(DAQGeneric, OptomechDevice):
         laserOff = resultOff[powerMeter][0][measurementStart:]
         laserOn = resultOn[powerMeter][0][measurementStart:]
     
-        t, prob = stats.ttest_ind(laserOn.asarray(), laserOff.asarray())
-        if prob > 0.001:
-            raise Exception("Power meter device %s could not detect laser." %powerMeter)
-        else:
-            powerSampleOn = laserOn.mean()
-            transmission = powerSampleOn/powerOutOn
-            return (powerSampleOn, transmission)
+        if checkDetection:
+            t, prob = stats.ttest_ind(laserOn.asarray(), laserOff.asarray())
+            if prob > 0.001:
+                raise Exception("Power meter device %s could not detect laser." %powerMeter)
+        powerSampleOn = laserOn.mean()
+        transmission = powerSampleOn/powerOutOn
+        return (powerSampleOn, transmission)
        
     def getCalibrationList(self):
         """Return a list of available calibrations."""
@@ -532,19 +589,40 @@ class Laser(DAQGeneric, OptomechDevice):
             #if self.getParam('powerAlert'):
                 #logMsg("%s power is outside expected range. Please adjust expected value or adjust the tuning of the laser." %self.name(), msgType='error')
         
+    def requirePCellCalibration(self):
+        """Return the PCellCalibration for the current optic state and wavelength,
+        or raise an exception if the Pockels cell has not been calibrated."""
+        cal = self.getPCellCalibration()
+        if cal is None:
+            raise HelpfulException("%s has no Pockels cell calibration for the current optics and wavelength." % self.name(),
+                                   reasons=["The laser must be calibrated from the device dock before using power commands."])
+        return cal
+
     def getPCellWaveform(self, powerCmd, cmd):
-        ### return a waveform of pCell voltages to give the power in powerCmd
-        return
-        #if self.hasPCell:
-            #print cmd
-            #print 'powercmd: ',powerCmd
-            #print np.amax(powerCmd)
-            
-            #raise Exception("Support for pockel cells is not yet implemented.")
+        """Return a waveform of pCell voltages that gives the sample power (in W)
+        requested by *powerCmd*, using the calibration for the current optic state
+        and wavelength."""
+        cal = self.requirePCellCalibration()
+        with self.variableLock:
+            if self.params['useExpectedPower']:
+                power = self.params['expectedPower']
+            else:
+                power = self.params['currentPower']
+        if not power:
+            raise Exception("Output power of %s is unknown; cannot compute Pockels cell voltages." % self.name())
+
+        try:
+            return cal.voltageForTransmission(np.asarray(powerCmd, dtype=float) / power)
+        except ValueError:
+            tMin, tMax = cal.transmissionRange()
+            raise ValueError("%s cannot produce sample powers %s-%s; the calibrated range at %s output power is %s-%s." % (
+                self.name(), siFormat(np.min(powerCmd), suffix='W'), siFormat(np.max(powerCmd), suffix='W'),
+                siFormat(power, suffix='W'), siFormat(tMin*power, suffix='W'), siFormat(tMax*power, suffix='W')))
     
 
     def getChannelCmds(self, cmd, rate):
         ### cmd is a dict and can contain 'powerWaveform' or 'switchWaveform' keys with the array as a value
+        ### If cmd also contains 'pCell', the pCell command is given explicitly and is not calculated here
         
         
         if 'switchWaveform' in cmd:
@@ -560,21 +638,16 @@ class Laser(DAQGeneric, OptomechDevice):
         nPts = len(cmdWaveform)
         daqCmd = {}
         #if self.dev.config.get('pCell', None) is not None:
-        if self.hasPCell:
+        if self.hasPCell and 'pCell' not in cmd:
             ## convert power values using calibration data
+            cal = self.requirePCellCalibration()
             if 'switchWaveform' in cmd:
-                with self.variableLock:
-                    if self.params['useExpectedPower']:
-                        power = self.params['expectedPower']
-                    else:
-                        power = self.params['currentPower']
-                    transmission = self.params['scopeTransmission']
-                    #transmission = 0.1
-                powerCmd = cmd['switchWaveform']*power*transmission
+                ## fractions of full power; full power maps to the maximum calibrated transmission
+                transmission = np.asarray(cmd['switchWaveform'], dtype=float) * cal.transmissionRange()[1]
+                daqCmd['pCell'] = cal.voltageForTransmission(transmission)
             else:
-                powerCmd = cmd['powerWaveform']
-            daqCmd['pCell'] = self.getPCellWaveform(powerCmd, cmd)
-        else:
+                daqCmd['pCell'] = self.getPCellWaveform(cmd['powerWaveform'], cmd)
+        elif not self.hasPCell:
             if len(np.unique(cmdWaveform)) > 2: ## check to make sure command doesn't specify powers we can't do
                 raise Exception("%s device does not have an analog power modulator, so can only have a binary power command." %str(self.name()))
             
@@ -590,7 +663,7 @@ class Laser(DAQGeneric, OptomechDevice):
             shutterCmd[cmdWaveform != 0] = 1 ## open shutter when we expect power
             ## open shutter a little before we expect power because it has a delay
             delayPts = int(delay*rate) 
-            a = np.argwhere(shutterCmd[1:]-shutterCmd[:-1] == 1)+1
+            a = np.argwhere(shutterCmd[1:]-shutterCmd[:-1] == 1)[:, 0]+1
             for i in a:
                 start = i-delayPts
                 if start < 0:
@@ -734,10 +807,13 @@ class LaserTask(DAQGenericTask):
             
         ### send power/switch waveforms to device for pCell/qSwitch/shutter cmd calculation
         #print "Cmd:", self.cmd
+        chanCmd = {'pCell': self.cmd['pCell']} if 'pCell' in self.cmd else {}
         if 'powerWaveform' in self.cmd and not self.cmd.get('ignorePowerWaveform', False):
-            calcCmds = self.dev.getChannelCmds({'powerWaveform':self.cmd['powerWaveform']}, rate)
+            chanCmd['powerWaveform'] = self.cmd['powerWaveform']
+            calcCmds = self.dev.getChannelCmds(chanCmd, rate)
         elif 'switchWaveform' in self.cmd:
-            calcCmds = self.dev.getChannelCmds({'switchWaveform':self.cmd['switchWaveform']}, rate)
+            chanCmd['switchWaveform'] = self.cmd['switchWaveform']
+            calcCmds = self.dev.getChannelCmds(chanCmd, rate)
         elif 'pulse' in self.cmd:
             raise Exception('Support for (pulseTime/energy) pair commands is not yet implemented.')
         else:
@@ -782,6 +858,15 @@ class LaserTask(DAQGenericTask):
         
         DAQGenericTask.configure(self) ## DAQGenericTask will use self.cmd['daqProtocol']
         
+    def canRearm(self):
+        ## commands calculated from power or switch waveforms depend on the current
+        ## laser power, so they must be calculated again by configure()
+        if self.cmd.get('checkPower', False) or 'switchWaveform' in self.cmd:
+            return False
+        if 'powerWaveform' in self.cmd and not self.cmd.get('ignorePowerWaveform', False):
+            return False
+        return DAQGenericTask.canRearm(self)
+        
     def getResult(self):
         ## getResult from DAQGeneric, then add in command waveform
         result = DAQGenericTask.getResult(self)
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class PCellCalibration(object):
+    """Lookup table mapping Pockels cell voltages to the measured transmission of
+    the optical path.
+
+    A Pockels cell transmits sin^2(V) of the input, so a sweep over a wide voltage
+    range is not monotonic. Only the branch between the voltages giving minimum and
+    maximum transmission is kept; along this branch the transmission is forced to be
+    non-decreasing so that measurement noise cannot produce an ambiguous inverse.
+
+    ============== ============================================================
+    **Arguments:**
+    voltage        Array of pCell command voltages that were measured.
+    transmission   Array of transmission (sample power / output power)
+                   measured at each voltage.
+    ============== ============================================================
+    """
+
+    def __init__(self, voltage, transmission):
+        voltage = np.asarray(voltage, dtype=float)
+        transmission = np.asarray(transmission, dtype=float)
+        if voltage.shape != transmission.shape or voltage.ndim != 1 or len(voltage) < 2:
+            raise ValueError("Pockels cell calibration requires matching 1D voltage and transmission arrays with at least 2 points.")
+
+        order = np.argsort(voltage)
+        voltage = voltage[order]
+        transmission = transmission[order]
+
+        ## keep the monotonic branch between minimum and maximum transmission
+        iMin = np.argmin(transmission)
+        iMax = np.argmax(transmission)
+        if iMin == iMax:
+            raise ValueError("Pockels cell calibration has no transmission contrast.")
+        branch = np.arange(min(iMin, iMax), max(iMin, iMax) + 1)
+        if iMin > iMax:
+            branch = branch[::-1]
+        voltage = voltage[branch]
+        transmission = transmission[branch]
+
+        ## remove noise-induced reversals, then drop flat steps so that the
+        ## transmission values can be used as interpolation points
+        transmission = np.maximum.accumulate(transmission)
+        transmission, index = np.unique(transmission, return_index=True)
+        self._voltage = voltage[index]
+        self._transmission = transmission
+
+    def transmissionRange(self):
+        """Return the (minimum, maximum) calibrated transmission."""
+        return self._transmission[0], self._transmission[-1]
+
+    def voltageRange(self):
+        """Return the voltages giving (minimum, maximum) transmission."""
+        return self._voltage[0], self._voltage[-1]
+
+    def voltageForTransmission(self, transmission):
+        """Return the pCell voltage(s) needed to achieve *transmission*, which may be
+        a scalar or an array.
+
+        Zero transmission is mapped to the voltage giving the minimum calibrated
+        transmission. Any other value outside the calibrated range raises ValueError.
+        """
+        trans = np.asarray(transmission, dtype=float)
+        tMin, tMax = self.transmissionRange()
+        tol = 1e-9 * tMax
+        off = trans == 0
+        bad = ~off & ((trans < tMin - tol) | (trans > tMax + tol) | ~np.isfinite(trans))
+        if np.any(bad):
+            vals = trans[bad]
+            raise ValueError("Requested transmission %g-%g is outside the calibrated Pockels cell range %g-%g." % (
+                np.nanmin(vals), np.nanmax(vals), tMin, tMax))
+        return np.interp(trans, self._transmission, self._voltage)
+
+    def transmissionForVoltage(self, voltage):
+        """Return the calibrated transmission at *voltage* (scalar or array)."""
+        v = np.asarray(voltage, dtype=float)
+        if self._voltage[0] > self._voltage[-1]:
+            return np.interp(v, self._voltage[::-1], self._transmission[::-1])
+        return np.interp(v, self._voltage, self._transmission)
+
+    def saveState(self):
+        """Return a dict suitable for storing in the laser's calibration index."""
+        return {'voltage': [float(v) for v in self._voltage],
+                'transmission': [float(t) for t in self._transmission]}
+
+    @classmethod
+    def restoreState(cls, state):
+        return cls(state['voltage'], state['transmission'])
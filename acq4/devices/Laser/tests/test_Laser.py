@@ -0,0 +1,280 @@
+import copy
+import numpy as np
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.pyqtgraph.Qt import QtCore
+import acq4.Manager
+from acq4.devices.Laser import Laser, LaserTask
+from acq4.devices.DAQGeneric import DAQGenericTask
+from acq4.util.HelpfulException import HelpfulException
+
+app = pg.mkQApp()
+
+
+def pockelsResponse(v, vHalf=1.6, offset=0.3, leak=0.01):
+    """Transmission of a Pockels cell followed by a polarizer."""
+    return leak + (1.0 - leak) * np.sin(np.pi / 2. * (v - offset) / vHalf) ** 2
+
+
+def pathTransmission(v):
+    ## fraction of the laser output that reaches the power meter at pCell voltage v
+    return 0.4 * pockelsResponse(v)
+
+
+class Trace(np.ndarray):
+    ## stands in for the MetaArray returned by a task
+    def asarray(self):
+        return self.view(np.ndarray)
+
+
+class MockDAQ(object):
+    def __init__(self):
+        self.values = {}
+
+    def setChannelValue(self, chan, value, block=True, delaySetIfBusy=False):
+        self.values[chan] = value
+
+
+class MockPowerMeter(object):
+    def listChannels(self):
+        return {'Power': {}}
+
+
+class MockTask(object):
+    """Produces the power meter recording that a calibration task would acquire."""
+    def __init__(self, dm, cmd):
+        self.dm = dm
+        self.cmd = cmd
+
+    def execute(self):
+        self.dm.executed.append(self.cmd)
+
+    def getResult(self):
+        laserCmd = self.cmd['Laser']
+        nPts = self.cmd['DAQ']['numPts']
+        voltage = laserCmd.get('pCell', {}).get('command', np.zeros(nPts))
+        power = np.zeros(nPts)
+        if laserCmd['shutterMode'] == 'open':
+            power = laserCmd['switchWaveform'] * 1.0 * pathTransmission(voltage)
+        power = power + self.dm.rng.normal(scale=1e-5, size=nPts)
+        return {'PowerMeter': power[np.newaxis].view(Trace)}
+
+
+class MockManager(QtCore.QObject):
+    sigAbortAll = QtCore.Signal()
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.configFiles = {}
+        self.devices = {'DAQ': MockDAQ(), 'PowerMeter': MockPowerMeter()}
+        self.executed = []
+        self.rng = np.random.RandomState(0)
+
+    def declareInterface(self, name, interfaces, obj):
+        pass
+
+    def getDevice(self, name):
+        return self.devices[name]
+
+    def createTask(self, cmd):
+        return MockTask(self, cmd)
+
+    def readConfigFile(self, fileName):
+        return copy.deepcopy(self.configFiles.get(fileName, {}))
+
+    def writeConfigFile(self, data, fileName):
+        self.configFiles[fileName] = copy.deepcopy(data)
+
+    def appendConfigFile(self, data, fileName):
+        self.configFiles.setdefault(fileName, {}).update(copy.deepcopy(data))
+
+
+class SimulatedLaser(Laser):
+    """Laser whose calibration measurements read a sin^2 Pockels cell response
+    instead of running tasks."""
+    def __init__(self, *args):
+        Laser.__init__(self, *args)
+        self.calibrationCalls = []
+
+    def runCalibration(self, powerMeter=None, measureTime=0.1, settleTime=0.005, pCellVoltage=None, rate=100000, checkDetection=True):
+        self.calibrationCalls.append((pCellVoltage, checkDetection))
+        t = pathTransmission(pCellVoltage)
+        return self.outputPower() * t, t
+
+
+def laserConfig(pCell=True):
+    config = {
+        'shutter': {'device': 'DAQ', 'channel': '/Dev1/line10', 'type': 'do', 'delay': 0.002},
+        'power': 1.0,
+        'wavelength': 920e-9,
+    }
+    if pCell:
+        config['pCell'] = {'device': 'DAQ', 'channel': '/Dev1/ao1', 'type': 'ao',
+                           'calibrationRange': [0, 2.5], 'calibrationSteps': 30}
+    return config
+
+
+def makeLaser(cls=SimulatedLaser, pCell=True):
+    laser = cls(MockManager(), laserConfig(pCell), 'Laser')
+    laser.setParam(expectedPower=1.0, currentPower=1.0)
+    return laser
+
+
+def test_calibrate():
+    laser = makeLaser()
+    cal = laser.runPCellCalibration('PowerMeter')
+    voltages = np.linspace(0, 2.5, 30)
+    assert [c[0] for c in laser.calibrationCalls] == list(voltages)
+    ## the power meter cannot be expected to detect the laser at every voltage
+    assert not any(c[1] for c in laser.calibrationCalls)
+    assert np.allclose(cal.transmissionForVoltage(cal.voltageRange()), cal.transmissionRange())
+
+    assert laser.getPCellCalibration() is None
+    laser.calibrate('PowerMeter', 0.1, 0.005)
+    index = laser.readConfigFile('index')
+    vals = index[laser.getDeviceStateKey()]['920 nm']
+    tMin, tMax = laser.getPCellCalibration().transmissionRange()
+    assert 'pCell' in vals
+    assert vals['transmission'] == tMax
+    assert np.isclose(tMax, pathTransmission(1.9), rtol=0.01)
+    ## the full-transmission measurement is made at the top of the calibrated range
+    assert laser.calibrationCalls[-1] == (cal.voltageRange()[1], True)
+
+
+def test_calibrationCache():
+    laser = makeLaser()
+    laser.calibrate('PowerMeter', 0.1, 0.005)
+    cal = laser.getPCellCalibration()
+    assert laser.getPCellCalibration() is cal
+    assert laser.getPCellCalibration(wavelength=800e-9) is None
+
+    ## a new calibration replaces the cached one
+    index = laser.getCalibrationIndex()
+    vals = index[laser.getDeviceStateKey()]['920 nm']
+    state = vals['pCell']
+    state['transmission'] = list(np.array(state['transmission']) * 0.5)
+    laser.writeCalibrationIndex(index)
+    cal2 = laser.getPCellCalibration()
+    assert cal2 is not cal
+    assert np.allclose(cal2.transmissionRange(), np.array(cal.transmissionRange()) * 0.5)
+
+
+def test_pCellWaveform():
+    laser = makeLaser()
+    laser.calibrate('PowerMeter', 0.1, 0.005)
+    cal = laser.getPCellCalibration()
+    tMin, tMax = cal.transmissionRange()
+
+    power = np.linspace(tMin, tMax, 100) * 0.5
+    laser.setParam(expectedPower=0.5)
+    v = laser.getPCellWaveform(power, {})
+    assert np.allclose(cal.transmissionForVoltage(v) * 0.5, power)
+    assert np.abs(pathTransmission(v) * 0.5 - power).max() < 0.005
+
+    with pytest.raises(ValueError) as exc:
+        laser.getPCellWaveform(power * 4, {})
+    assert 'cannot produce sample powers' in str(exc.value)
+
+    laser.setParam(expectedPower=0)
+    with pytest.raises(Exception) as exc:
+        laser.getPCellWaveform(power, {})
+    assert 'Output power' in str(exc.value)
+
+
+def test_channelCmds():
+    laser = makeLaser()
+    switch = np.zeros(1000)
+    switch[200:400] = 0.5
+    switch[600:800] = 1.0
+
+    ## commands are rejected until the Pockels cell is calibrated
+    for cmd in [{'switchWaveform': switch}, {'powerWaveform': switch * 0.1}]:
+        with pytest.raises(HelpfulException) as exc:
+            laser.getChannelCmds(cmd, 10000)
+        assert 'no Pockels cell calibration' in str(exc.value)
+
+    laser.calibrate('PowerMeter', 0.1, 0.005)
+    cal = laser.getPCellCalibration()
+    tMax = cal.transmissionRange()[1]
+
+    ## full power maps to the maximum calibrated transmission
+    ## (zero power maps to the minimum calibrated transmission)
+    on = switch > 0
+    cmds = laser.getChannelCmds({'switchWaveform': switch}, 10000)
+    assert np.allclose(cal.transmissionForVoltage(cmds['pCell'][on]), switch[on] * tMax)
+    assert np.allclose(cmds['pCell'][600:800], cal.voltageRange()[1])
+    assert np.allclose(cmds['pCell'][~on], cal.voltageRange()[0])
+    ## the shutter opens 2 ms (20 samples) before each pulse
+    assert np.all(cmds['shutter'][180:400] == 1) and cmds['shutter'][179] == 0
+
+    cmds = laser.getChannelCmds({'powerWaveform': switch * 0.1}, 10000)
+    assert np.allclose(cal.transmissionForVoltage(cmds['pCell'][on]), switch[on] * 0.1)
+
+    ## an explicit pCell command is not recalculated
+    cmds = laser.getChannelCmds({'powerWaveform': switch * 10, 'pCell': {'command': switch}}, 10000)
+    assert 'pCell' not in cmds
+
+
+class MockDAQTask(object):
+    def getChanSampleRate(self, chan):
+        return 10000
+
+
+class MockParentTask(object):
+    def __init__(self):
+        self.tasks = {'DAQ': MockDAQTask()}
+
+
+def test_taskPCellCommand(monkeypatch):
+    ## record the DAQ command instead of configuring DAQ tasks
+    monkeypatch.setattr(DAQGenericTask, 'configure', lambda self: None)
+    laser = makeLaser()
+    laser.calibrate('PowerMeter', 0.1, 0.005)
+    parent = MockParentTask()
+    power = np.zeros(1000)
+    power[500:700] = 0.1
+
+    task = LaserTask(laser, {'powerWaveform': power}, parent)
+    task.configure()
+    daqCmd = task.cmd['daqProtocol']
+    assert np.all(daqCmd['pCell']['command'] == laser.getPCellWaveform(power, {}))
+    assert np.all(daqCmd['shutter']['command'][480:700] == 1)
+
+    ## an explicit pCell command is passed straight through, even with
+    ## powers the Pockels cell cannot produce
+    pCell = {'command': np.linspace(0, 2, 1000)}
+    task = LaserTask(laser, {'powerWaveform': power * 100, 'pCell': pCell}, parent)
+    task.configure()
+    assert task.cmd['daqProtocol']['pCell'] is pCell
+    assert np.all(task.cmd['daqProtocol']['shutter']['command'][480:700] == 1)
+
+
+def test_runCalibration(monkeypatch):
+    laser = makeLaser(cls=Laser)
+    dm = laser.dm
+    monkeypatch.setattr(acq4.Manager.Manager, 'single', dm)
+
+    ## durations and delays that do not convert to whole numbers of samples
+    power, trans = laser.runCalibration('PowerMeter', measureTime=0.0103, settleTime=0.0017, pCellVoltage=1.2, rate=33333)
+    assert np.isclose(trans, pathTransmission(1.2), rtol=0.01)
+    assert np.isclose(power, trans * 1.0)
+
+    cmdOff, cmdOn = dm.executed
+    assert cmdOff['Laser']['shutterMode'] == 'closed'
+    assert cmdOn['Laser']['shutterMode'] == 'open'
+    ## the pCell voltage is applied during both tasks as a DAQGeneric command
+    for cmd in (cmdOff, cmdOn):
+        assert np.all(cmd['Laser']['pCell']['command'] == 1.2)
+        assert len(cmd['Laser']['pCell']['command']) == cmd['DAQ']['numPts']
+    assert np.all(cmdOn['Laser']['switchWaveform'][:int(0.002*33333)] == 0)
+
+    ## without a pCell voltage, transmission is measured at the holding voltage
+    power, trans = laser.runCalibration('PowerMeter', measureTime=0.01, settleTime=0.002)
+    assert np.isclose(trans, pathTransmission(0), rtol=0.05)
+    assert 'pCell' not in dm.executed[-1]['Laser']
+
+    laser = makeLaser(cls=Laser, pCell=False)
+    monkeypatch.setattr(acq4.Manager.Manager, 'single', laser.dm)
+    with pytest.raises(Exception) as exc:
+        laser.runCalibration('PowerMeter', pCellVoltage=1.0)
+    assert 'does not have a pCell' in str(exc.value)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from acq4.devices.Laser.PCellCalibration import PCellCalibration
+
+
+def pockelsResponse(v, vHalf=1.6, offset=0.3, leak=0.01):
+    """Transmission of a Pockels cell followed by a polarizer."""
+    return leak + (1.0 - leak) * np.sin(np.pi / 2. * (v - offset) / vHalf) ** 2
+
+
+def measuredCalibration(voltages, noise=0.002, seed=0):
+    ## stands in for the power meter readings taken by Laser.runPCellCalibration
+    rng = np.random.RandomState(seed)
+    trans = 0.4 * pockelsResponse(voltages) + rng.normal(scale=noise, size=len(voltages))
+    return PCellCalibration(voltages, trans)
+
+
+def test_roundTrip():
+    voltages = np.linspace(0, 2.5, 60)
+    cal = measuredCalibration(voltages)
+    tMin, tMax = cal.transmissionRange()
+    assert cal.voltageRange()[0] < cal.voltageRange()[1] <= 2.5
+
+    requested = np.linspace(tMin, tMax, 1000)
+    v = cal.voltageForTransmission(requested)
+    assert v.shape == requested.shape
+    assert np.all(np.diff(v) >= 0)
+    assert np.allclose(cal.transmissionForVoltage(v), requested)
+    ## actual transmission differs from the request only by measurement noise and interpolation
+    assert np.abs(0.4 * pockelsResponse(v) - requested).max() < 0.02
+
+    ## zero power selects the minimum-transmission voltage
+    assert cal.voltageForTransmission(0) == cal.voltageRange()[0]
+
+    ## calibration survives storage in the calibration index
+    cal2 = PCellCalibration.restoreState(cal.saveState())
+    assert np.all(cal2.voltageForTransmission(requested) == v)
+
+
+def test_reversedBranch():
+    ## sweep covering a falling branch of the response
+    voltages = np.linspace(1.9, 3.5, 40)
+    cal = measuredCalibration(voltages, noise=0)
+    assert cal.voltageRange()[0] > cal.voltageRange()[1]
+    trans = np.linspace(*cal.transmissionRange(), num=50)
+    assert np.allclose(cal.transmissionForVoltage(cal.voltageForTransmission(trans)), trans)
+
+
+def test_outOfRange():
+    cal = measuredCalibration(np.linspace(0, 2.5, 30))
+    tMin, tMax = cal.transmissionRange()
+    with pytest.raises(ValueError) as exc:
+        cal.voltageForTransmission([0, tMax * 0.5, tMax * 1.2])
+    assert 'outside the calibrated' in str(exc.value)
+    with pytest.raises(ValueError):
+        cal.voltageForTransmission(tMin * 0.5)
+    with pytest.raises(ValueError):
+        PCellCalibration([1, 2, 3], [0.1, 0.1, 0.1])
@@ -55,6 +55,7 @@ class MockClamp(DAQGeneric):
         rsys.path.append(os.path.abspath(os.path.dirname(__file__)))
         if config['simulator'] == 'builtin':
             self.simulator = self.process._import('hhSim')
+            self.simulator.setIntegrator(config.get('integrator', 'odeint'))
         elif config['simulator'] == 'neuron':
             self.simulator = self.process._import('neuronSim')
         
@@ -162,6 +163,10 @@ class MockClamp(DAQGeneric):
         DAQGeneric.quit(self)
         
 class MockClampTask(DAQGenericTask):
+    
+    ## isDone() is always True
+    notifiesDone = True
+    
     def __init__(self, dev, cmd, parentTask):
         ## make a few changes for compatibility with multiclamp        
         if 'daqProtocol' not in cmd:
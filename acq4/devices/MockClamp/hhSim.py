@@ -4,6 +4,10 @@ Simple Hodgkin-Huxley simulator for Python. VERY slow.
 Includes Ih from Destexhe 1993 [disabled]
 Also simulates voltage clamp and current clamp with access resistance.
 
+runSimBatch() is a much faster fixed-step alternative to runSim() that can
+simulate many independent cells at once; run() uses it when
+setIntegrator('fixed') has been called.
+
 Luke Campagnola 2013
 """
 
@@ -79,7 +83,7 @@ def hh(y, t, mode, cmd, dt):
     else:
         # interpolate command -- sharp steps confuse the integrator.
         fInd = t/dt
-        ind = min(len(cmd)-1, np.floor(fInd))
+        ind = min(len(cmd)-1, int(fInd))
         ind2 = min(len(cmd)-1, ind+1)
         s = fInd - ind
         cmd = cmd[ind] * (1-s) + cmd[ind2] * s
@@ -152,6 +156,171 @@ def runSim(initState, mode='ic', cmd=None, dt=0.1, dur=100, **args):
     return result  ## result is array with dims: [npts, (time, Ie, Ve, Vm, Im, m, h, n, f, s)]
 
 
+def gateRates(Vm):
+    """Return (alpha, beta) arrays for the m, h, and n gates at membrane potential
+    Vm (in V); rates are in 1/ms and stacked along the last axis."""
+    Vm = (np.asarray(Vm) + 65e-3) * 1000.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        am = (2.5-0.1*Vm) / (np.exp(2.5-0.1*Vm) - 1.0)
+        an = (0.1 - 0.01*(Vm-gKShift)) / (np.exp(1.0 - 0.1*(Vm-gKShift)) - 1.0)
+    ## remove the removable singularities at 25 mV and 10 mV
+    am = np.where(np.isfinite(am), am, 1.0)
+    an = np.where(np.isfinite(an), an, 0.1)
+    bm = 4. * np.exp(-Vm / 18.)
+    ah = 0.07 * np.exp(-Vm / 20.)
+    bh = 1.0 / (np.exp(3.0 - 0.1 * Vm) + 1.0)
+    bn = 0.125 * np.exp(-Vm / 80.)
+    return np.stack([am, ah, an], axis=-1), np.stack([bm, bh, bn], axis=-1)
+
+
+_gateTableRange = (-150e-3, 100e-3)
+_gateTableStep = 10e-6
+_gateTables = {}
+
+def gateTable(dt):
+    """Return a table of exponential-Euler coefficients (A, B) for the m, h, and n
+    gates over a grid of membrane potentials, such that x(t+dt) = A*x(t) + B for
+    steps of dt ms. Tables are cached by dt."""
+    if dt not in _gateTables:
+        v = np.arange(_gateTableRange[0], _gateTableRange[1] + _gateTableStep, _gateTableStep)
+        a, b = gateRates(v)
+        A = np.exp(-dt * (a + b))
+        B = (1.0 - A) * a / (a + b)
+        _gateTables[dt] = (A, B)
+    return _gateTables[dt]
+
+
+def alphaConductance(t):
+    """Vectorized version of the synaptic conductance used by IAlpha (t in ms)."""
+    tn = t - Alpha_t0
+    g = gAlpha * (tn/Alpha_tau) * np.exp(-(tn-Alpha_tau)/Alpha_tau)
+    return np.where((tn > 0) & (tn <= 10.0 * Alpha_tau), g, 0.)
+
+
+def runSimBatch(initState, mode='ic', cmd=None, dt=0.1, dur=100, maxStep=0.05):
+    """Simulate many independent cells at once with a fixed-step integrator.
+
+    This is equivalent to runSim(), but each row of *cmd* (and optionally of
+    *initState*) describes a separate cell, and the whole batch is advanced with
+    array operations. Each command sample is divided into substeps no longer than
+    *maxStep* (ms), and the command is linearly interpolated between samples as
+    in runSim().
+
+    The pipette potential Ve relaxes with a time constant below 1 us, so it is
+    taken to follow the membrane potential quasi-statically rather than being
+    integrated; the pipette capacitance then simply adds to the membrane
+    capacitance. Vm and the gating variables are advanced by exponential Euler,
+    using tabulated gate rates.
+
+    ============== ============================================================
+    **Arguments:**
+    initState      Initial [Ve, Vm, m, h, n, f, s]; either a single state or an
+                   array of shape (N, 7).
+    mode           'ic' or 'vc'
+    cmd            Command array of shape (npts,) or (N, npts); None holds the
+                   cell at zero current.
+    dt             Time step of cmd (ms)
+    dur            Duration of the simulation (ms)
+    maxStep        Maximum integration step (ms)
+    ============== ============================================================
+
+    Returns an array of shape (N, npts, 9) with the same columns as runSim().
+    """
+    npts = int(dur/dt)
+    initState = np.asarray(initState, dtype=float)
+    if cmd is None:
+        mode = 'ic'
+        cmd = np.zeros((1, npts))
+    cmd = np.asarray(cmd, dtype=float)
+    if cmd.ndim == 1:
+        cmd = cmd[np.newaxis]
+    nCells = max(cmd.shape[0], initState.reshape(-1, 7).shape[0])
+    state = np.empty((nCells, 7))
+    state[:] = initState
+
+    nSub = max(1, int(np.ceil(dt / float(maxStep) - 1e-9)))
+    h = dt / nSub
+
+    ## command at the midpoint of every substep, interpolated as in hh()
+    fInd = (np.arange(npts * nSub) + 0.5) / nSub
+    ind = np.minimum(cmd.shape[1]-1, fInd.astype(int))
+    ind2 = np.minimum(cmd.shape[1]-1, ind+1)
+    frac = fInd - ind
+    cmdSub = cmd[:, ind] * (1-frac) + cmd[:, ind2] * frac
+    if cmdSub.shape[0] != nCells:
+        cmdSub = np.repeat(cmdSub, nCells, axis=0)
+    gSyn = alphaConductance((np.arange(npts * nSub) + 0.5) * h)
+
+    ## Current through the pipette tip is
+    ##     Iaccess = gClamp * (Vcmd - Vm) + Icmd - cPip * dVm/dt
+    ## where the last term charges the pipette capacitance.
+    if mode == 'vc':
+        G = 50e-6 # arbitrary VC gain (same as hh())
+        gClamp = G / (1.0 + G * Raccess)
+        cPip = Cpip / (1.0 + G * Raccess)
+        iSub = gClamp * cmdSub
+    else:
+        gClamp = 0.
+        cPip = Cpip
+        iSub = cmdSub
+    gSub = gL + gClamp + gSyn
+    iSub = iSub + (gL * EL + gSyn * EAlpha)[np.newaxis]
+    ## per-step values are indexed in the loop below; make them contiguous
+    iSub = np.ascontiguousarray(iSub.T)
+    gSub = gSub.tolist()
+
+    tableA, tableB = gateTable(h)
+    vscale = 1.0 / _gateTableStep
+    voffset = 0.5 - _gateTableRange[0] * vscale
+    tau = -h * 1e-3 / (C + cPip)  ## 1e-3 is because t is expressed in ms
+
+    result = np.empty((nCells, npts, 9))
+    Vm = state[:, 1].copy()
+    gates = state[:, 2:5].copy()
+    out = result[:, :, 2:]
+    out[:, :, 5:] = state[:, np.newaxis, 5:]
+    k = 0
+    for i in range(npts):
+        out[:, i, 1] = Vm
+        out[:, i, 2:5] = gates
+        for j in range(nSub):
+            ## gates: exact solution for constant Vm over the step
+            vi = (Vm * vscale + voffset).astype(int)
+            gates = gates * tableA.take(vi, axis=0, mode='clip') + tableB.take(vi, axis=0, mode='clip')
+
+            ## Vm: exact solution for constant conductances over the step
+            m, hg, n = gates.T
+            gna = m * m * m * hg * gNa
+            gk = n * n
+            gk *= gk * gK
+            g = gna + gk + gSub[k]
+            vinf = (gna * ENa + gk * EK + iSub[k]) / g
+            Vm = vinf + (Vm - vinf) * np.exp(tau * g)
+            k += 1
+
+    Vm = out[:, :, 1]
+    if mode == 'vc':
+        iAccess = gClamp * (cmd[:, :npts] - Vm)
+    else:
+        iAccess = np.broadcast_to(cmd[:, :npts], Vm.shape).copy()
+    if npts > 1:
+        iAccess -= cPip * np.gradient(Vm, dt * 1e-3, axis=1)
+    result[:, :, 0] = np.arange(npts) * dt
+    result[:, :, 1] = iAccess
+    result[:, :, 2] = Vm + iAccess * Raccess
+    return result
+
+
+integrator = 'odeint'
+
+def setIntegrator(name):
+    """Select the integrator used by run(): 'odeint' (runSim) or 'fixed' (runSimBatch)."""
+    global integrator
+    if name not in ('odeint', 'fixed'):
+        raise ValueError("Unknown integrator '%s'; options are 'odeint' and 'fixed'." % name)
+    integrator = name
+
+
 initState = [-65e-3, -65e-3, 0.05, 0.6, 0.3, 0.0, 0.0]
 
 def run(cmd):
@@ -173,7 +342,10 @@ def run(cmd):
     data = cmd['data']
     mode = cmd['mode']
     
-    result = runSim(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))
+    if integrator == 'fixed':
+        result = runSimBatch(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))[0]
+    else:
+        result = runSim(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))
     
     initState = result[-1, 2:]
     if mode == 'ic':
@@ -0,0 +1,66 @@
+import numpy as np
+from acq4.devices.MockClamp import hhSim
+
+
+dt = 0.1  # ms
+
+
+def spikeTimes(vm):
+    return np.argwhere((vm[1:] > 0) & (vm[:-1] <= 0))[:, 0] * dt
+
+
+def test_currentClampSpikes():
+    cmd = np.zeros(2000)
+    cmd[200:1500] = 0.3e-9
+    ref = hhSim.runSim(hhSim.initState, 'ic', cmd, dt, dt*len(cmd))
+    fast = hhSim.runSimBatch(hhSim.initState, 'ic', cmd, dt, dt*len(cmd))
+    assert fast.shape == (1,) + ref.shape
+
+    refSpikes = spikeTimes(ref[:, 3])
+    fastSpikes = spikeTimes(fast[0, :, 3])
+    assert len(refSpikes) > 5
+    assert len(fastSpikes) == len(refSpikes)
+    assert np.abs(fastSpikes - refSpikes).max() <= 0.2
+
+    ## subthreshold response
+    assert np.abs(fast[0, :200, 3] - ref[:200, 3]).max() < 0.1e-3
+
+
+def test_voltageClampCurrent():
+    for v in [-100e-3, -40e-3, -20e-3, 20e-3]:
+        cmd = np.ones(1000) * -65e-3
+        cmd[200:600] = v
+        ref = hhSim.runSim(hhSim.initState, 'vc', cmd, dt, dt*len(cmd))[:, 1]
+        fast = hhSim.runSimBatch(hhSim.initState, 'vc', cmd, dt, dt*len(cmd))[0, :, 1]
+
+        ## compare away from the capacitive transients at each step
+        mask = np.ones(len(cmd), dtype=bool)
+        mask[195:215] = False
+        mask[595:615] = False
+        assert np.abs(fast - ref)[mask].max() < 0.05 * np.abs(ref).max()
+
+
+def test_batch():
+    amps = np.linspace(0, 0.5e-9, 6)
+    cmd = np.zeros((len(amps), 1000))
+    cmd[:, 200:800] = amps[:, np.newaxis]
+    batch = hhSim.runSimBatch(hhSim.initState, 'ic', cmd, dt, dt*cmd.shape[1])
+    assert batch.shape == (len(amps), 1000, 9)
+    for i in [0, 3, 5]:
+        single = hhSim.runSimBatch(hhSim.initState, 'ic', cmd[i], dt, dt*cmd.shape[1])
+        assert np.allclose(single[0], batch[i])
+
+    ## one command applied to cells with different initial states
+    init = np.array([hhSim.initState] * 3)
+    init[:, :2] = np.array([-70e-3, -65e-3, -60e-3])[:, np.newaxis]
+    res = hhSim.runSimBatch(init, 'ic', cmd[0], dt, dt*cmd.shape[1])
+    assert np.all(np.diff(res[:, 10, 3]) > 0)
+
+
+def test_run():
+    hhSim.setIntegrator('fixed')
+    try:
+        out = hhSim.run({'dt': 1e-4, 'mode': 'vc', 'data': np.ones(500) * -65e-3})
+        assert out.shape == (500,)
+    finally:
+        hhSim.setIntegrator('odeint')
@@ -1,45 +1,177 @@
 # -*- coding: utf-8 -*-
-from acq4.devices.OptomechDevice import *
+import threading
+import numpy as np
+from acq4.devices.Stage import Stage, MoveFuture
+from acq4.util.Thread import Thread
+from acq4.util.debug import printExc
 import acq4.pyqtgraph as pg
+from acq4.pyqtgraph import ptime
+from PyQt4 import QtCore, QtGui
 
-class MockStage(Device, OptomechDevice):
 
-    sigPositionChanged = QtCore.Signal(object)
+class MockStage(Stage):
+    """Simulated motorized stage.
 
+    Programmed moves travel in a straight line at the requested speed. A
+    background thread updates the position while moving and reports completion
+    to the move's MoveFuture as soon as the target is reached.
+    """
     def __init__(self, dm, config, name):
-        Device.__init__(self, dm, config, name)
-        OptomechDevice.__init__(self, dm, config, name)
+        Stage.__init__(self, dm, config, name)
         
-        self.config = config
-        self.pos = [0, 0, 0]
-        self.speed = [0,0]
+        self.speed = [0, 0]
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.updatePosition)
-        dm.declareInterface(name, ['stage'], self)
+
+        self._moveLock = threading.RLock()
+        self._lastMove = None
+        self.moveThread = MockMoveThread(self)
+        self.moveThread.start()
+
+    def capabilities(self):
+        return {
+            'getPos': (True, True, True),
+            'setPos': (True, True, True),
+            'limits': (False, False, False),
+        }
 
     def updatePosition(self):
         if self.speed[0] == 0 and self.speed[1] == 0:
             self.timer.stop()
-        self.setPosition([self.pos[0]+self.speed[0], self.pos[1]+self.speed[1], self.pos[2]])
+        pos = self.getPosition()
+        self.setPosition([pos[0]+self.speed[0], pos[1]+self.speed[1], pos[2]])
         
     def setSpeed(self, spd):
         self.speed = spd
         self.timer.start(20)
 
-    def getPosition(self):
-        return self.pos[:]
-        
     def setPosition(self, pos):
-        self.pos = pos
-        tr = pg.SRTTransform3D()
-        tr.translate(pos)
-        self.setDeviceTransform(tr)
-        self.sigPositionChanged.emit(self)
+        self.posChanged(pos)
+
+    def _getPosition(self):
+        return self.getPosition()
+
+    def targetPosition(self):
+        with self._moveLock:
+            if self.isMoving():
+                return self._lastMove.targetPos[:]
+        return self.getPosition()
+
+    def isMoving(self):
+        with self._moveLock:
+            return self._lastMove is not None and not self._lastMove.isDone()
+
+    def _move(self, abs, rel, speed, linear):
+        with self._moveLock:
+            self._interruptMove()
+            pos = self._toAbsolutePosition(abs, rel)
+            speed = self._interpretSpeed(speed)
+            move = MockMoveFuture(self, pos, speed)
+            self._lastMove = move
+        self.moveThread.wake()
+        return move
+
+    def stop(self):
+        with self._moveLock:
+            self._interruptMove()
+
+    def _interruptMove(self):
+        # leave the stage wherever the current move has got to
+        move = self._lastMove
+        if move is None or move.isDone():
+            return
+        self.posChanged(move.positionAt(ptime.time())[0])
+        move._taskDone(interrupted=True, error="Move was interrupted before completion.")
+
+    def _updateMove(self):
+        """Advance the current move to the present time and return the number of
+        seconds until it reaches its target, or None if the stage is idle.
+        """
+        with self._moveLock:
+            move = self._lastMove
+            if move is None or move.isDone():
+                return None
+            pos, remaining = move.positionAt(ptime.time())
+            self.posChanged(pos)
+            if remaining == 0:
+                move._taskDone()
+                return None
+            return remaining
+
+    def _failMove(self, error):
+        with self._moveLock:
+            move = self._lastMove
+            if move is not None:
+                move._taskDone(interrupted=True, error=error)
+
+    def quit(self):
+        self.moveThread.stop()
+        Stage.quit(self)
 
     def deviceInterface(self, win):
         return MockStageInterface(self, win)
 
 
+class MockMoveFuture(MoveFuture):
+    """Move in progress on a MockStage. Completion is reported by the stage's
+    MockMoveThread.
+    """
+    def __init__(self, dev, pos, speed):
+        MoveFuture.__init__(self, dev, pos, speed)
+        dist = ((np.array(pos, dtype=float) - np.array(self.startPos))**2).sum()**0.5
+        self.duration = dist / speed
+
+    def positionAt(self, t):
+        """Return the simulated position at time *t* and the time remaining
+        until the target is reached.
+        """
+        remaining = max(0, self.startTime + self.duration - t)
+        if remaining == 0:
+            return list(self.targetPos), 0
+        frac = 1 - remaining / self.duration
+        s = np.array(self.startPos)
+        pos = s + frac * (np.array(self.targetPos, dtype=float) - s)
+        return list(pos), remaining
+
+    def isDone(self):
+        return self._taskFinished
+
+
+class MockMoveThread(Thread):
+    """Thread that animates MockStage moves.
+    """
+    def __init__(self, dev):
+        self.dev = dev
+        self.stopped = False
+        # interval between position updates while moving
+        self.interval = 20e-3
+        self._wake = threading.Event()
+        Thread.__init__(self)
+
+    def stop(self):
+        self.stopped = True
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        while not self.stopped:
+            try:
+                remaining = self.dev._updateMove()
+            except Exception as exc:
+                printExc('Error in MockStage move thread:')
+                # don't leave anyone waiting on a move that will never be updated
+                self.dev._failMove("Error while simulating move: %s" % exc)
+                remaining = None
+            # sleep until the next position update, the end of the move, or a new move
+            if remaining is None:
+                self._wake.wait()
+            else:
+                self._wake.wait(min(self.interval, remaining))
+            self._wake.clear()
+
+
 class MockStageInterface(QtGui.QWidget):
     def __init__(self, dev, win):
         self.win = win
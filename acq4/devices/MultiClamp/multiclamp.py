@@ -7,7 +7,7 @@ from acq4.util.Mutex import Mutex
 from acq4.pyqtgraph import multiprocess
 from PyQt4 import QtCore
 from numpy import *
-import sys, traceback
+import sys, traceback, threading
 from DeviceGui import *
 from taskGUI import *
 from acq4.util.debug import *
@@ -20,6 +20,10 @@ class MultiClamp(Device):
 
     # remote process used to connect to commander from 32-bit python
     proc = None
+    _procLock = threading.Lock()  # protects proc while channels are loaded concurrently
+    
+    ## __init__ creates no Qt objects, so waiting for the commander may be done in a worker thread
+    threadSafeInit = True
 
     def __init__(self, dm, config, name):
         Device.__init__(self, dm, config, name)
@@ -43,38 +47,39 @@ class MultiClamp(Device):
 
         # Get a handle to the multiclamp driver object, whether that is hosted locally or in a remote process.
         executable = self.config.get('pythonExecutable', None)
-        if executable is not None:
-            # Run a remote python process to connect to the MC commander. 
-            # This is used on 64-bit systems where the MC connection must be run with 
-            # 32-bit python.
-            if MultiClamp.proc is False:
-                raise Exception("Already connected to multiclamp locally; cannot connect via remote process at the same time.")
-            if MultiClamp.proc is None:
-                MultiClamp.proc = multiprocess.Process(executable=executable, copySysPath=False)
-                try:
-                    self.proc.mc_mod = self.proc._import('acq4.drivers.MultiClamp')
-                    self.proc.mc_mod._setProxyOptions(deferGetattr=False)
-                except:
-                    MultiClamp.proc.close()
-                    MultiClamp.proc = None
-                    raise
-            mc = self.proc.mc_mod.MultiClamp.instance()
-        else:
-            if MultiClamp.proc not in (None, False):
-                raise Exception("Already connected to multiclamp via remote process; cannot connect locally at the same time.")
+        with MultiClamp._procLock:
+            if executable is not None:
+                # Run a remote python process to connect to the MC commander. 
+                # This is used on 64-bit systems where the MC connection must be run with 
+                # 32-bit python.
+                if MultiClamp.proc is False:
+                    raise Exception("Already connected to multiclamp locally; cannot connect via remote process at the same time.")
+                if MultiClamp.proc is None:
+                    MultiClamp.proc = multiprocess.Process(executable=executable, copySysPath=False)
+                    try:
+                        self.proc.mc_mod = self.proc._import('acq4.drivers.MultiClamp')
+                        self.proc.mc_mod._setProxyOptions(deferGetattr=False)
+                    except:
+                        MultiClamp.proc.close()
+                        MultiClamp.proc = None
+                        raise
+                mc = self.proc.mc_mod.MultiClamp.instance()
             else:
-                # don't allow remote process to be used for other channels.
-                MultiClamp.proc = False
-
-            try:
-                from acq4.drivers.MultiClamp import MultiClamp as MultiClampDriver
-            except RuntimeError as exc:
-                if "32-bit" in exc.message:
-                    raise Exception("MultiClamp commander does not support access by 64-bit processes. To circumvent this problem, "
-                                    "Use the 'pythonExecutable' device configuration option to connect via a 32-bit python instead.")
+                if MultiClamp.proc not in (None, False):
+                    raise Exception("Already connected to multiclamp via remote process; cannot connect locally at the same time.")
                 else:
-                    raise
-            mc = MultiClampDriver.instance()
+                    # don't allow remote process to be used for other channels.
+                    MultiClamp.proc = False
+
+                try:
+                    from acq4.drivers.MultiClamp import MultiClamp as MultiClampDriver
+                except RuntimeError as exc:
+                    if "32-bit" in exc.message:
+                        raise Exception("MultiClamp commander does not support access by 64-bit processes. To circumvent this problem, "
+                                        "Use the 'pythonExecutable' device configuration option to connect via a 32-bit python instead.")
+                    else:
+                        raise
+                mc = MultiClampDriver.instance()
 
 
         # get a handle to our specific multiclamp channel
@@ -274,6 +279,9 @@ class MultiClamp(Device):
 
 class MultiClampTask(DeviceTask):
     
+    ## isDone() is always True; the DAQ task reports completion for us
+    notifiesDone = True
+    
     recordParams = ['Holding', 'HoldingEnable', 'PipetteOffset', 'FastCompCap', 'SlowCompCap', 'FastCompTau', 'SlowCompTau', 'NeutralizationEnable', 'NeutralizationCap', 'WholeCellCompEnable', 'WholeCellCompCap', 'WholeCellCompResist', 'RsCompEnable', 'RsCompBandwidth', 'RsCompCorrection', 'PrimarySignalLPF', 'PrimarySignalHPF', 'OutputZeroEnable', 'OutputZeroAmplitude', 'LeakSubEnable', 'LeakSubResist', 'BridgeBalEnable', 'BridgeBalResist']
     
     def __init__(self, dev, cmd, parentTask):
@@ -2,7 +2,7 @@
 from acq4.util.debug import *
     
 from acq4.devices.Device import *
-import time, traceback, sys
+import time, traceback, sys, threading
 from taskGUI import *
 #from numpy import byte
 import numpy
@@ -11,6 +11,7 @@ import scipy.signal, scipy.ndimage
 import acq4.util.advancedTypes as advancedTypes
 from acq4.util.debug import *
 import acq4.util.Mutex as Mutex
+import acq4.util.ptime as ptime
 
 class NiDAQ(Device):
     """
@@ -19,6 +20,10 @@ class NiDAQ(Device):
         defaultAIRange: [-10, 10]  # default voltage range to use for AI ports
         defaultAORange: [-10, 10]  # default voltage range to use for AO ports
     """
+    
+    ## only driver calls happen in __init__, so the DAQ may be loaded in a worker thread
+    threadSafeInit = True
+    
     def __init__(self, dm, config, name):
         Device.__init__(self, dm, config, name)
         self.config = config
@@ -222,9 +227,15 @@ class NiDAQ(Device):
         return d6
 
 class Task(DeviceTask):
+    
+    ## a monitor thread started by start() calls notifyDone() when the acquisition finishes
+    notifiesDone = True
+    
     def __init__(self, dev, cmd, parentTask):
         DeviceTask.__init__(self, dev, cmd, parentTask)
         self.cmd = cmd
+        self._monitorLock = threading.Lock()
+        self._stopMonitor = False
         
         ## get DAQ device
         #daq = self.devm.getDevice(...)
@@ -294,6 +305,29 @@ class Task(DeviceTask):
     def start(self):
         if self.st.hasTasks():
             self.st.start()
+            self._stopMonitor = False
+            monitor = threading.Thread(target=self._monitorDone)
+            monitor.daemon = True
+            monitor.start()
+        
+    def _monitorDone(self):
+        ## Block in the driver until the acquisition is done, then notify the parent task.
+        ## Each wait allows for the expected duration plus a margin; if the task is still
+        ## running after that (for example, waiting for its trigger), wait again unless
+        ## the task has been stopped.
+        timeout = self.st.numPts / float(self.st.rate) + 1.0
+        try:
+            while not self.st.wait(timeout):
+                with self._monitorLock:
+                    if self._stopMonitor:
+                        break
+        except:
+            ## stopping the task may interrupt the wait
+            with self._monitorLock:
+                stopped = self._stopMonitor
+            if not stopped:
+                printExc("Error waiting for DAQ task completion:")
+        self.notifyDone()
         
     def isDone(self):
         if self.st.hasTasks():
@@ -304,10 +338,19 @@ class Task(DeviceTask):
         
     def stop(self, wait=False, abort=False):
         if self.st.hasTasks():
+            with self._monitorLock:
+                self._stopMonitor = True
             #print "stopping ST..."
             self.st.stop(wait=wait, abort=abort)
             #print "   ST stopped"
         
+    def canRearm(self):
+        return True
+        
+    def rearm(self):
+        ## channels and clocks stay configured; output waveforms are rewritten from cache on start()
+        self.st.rearm()
+        
     def getResult(self):
         ## Results should be collected by individual devices using getData
         return None
@@ -23,6 +23,12 @@ class OptomechDevice(object):
     In most cases, the transformation will be in the form of an affine matrix multiplication.
     Devices are free, however, to define an arbitrary transformation as well.
     
+    Global transforms are cached. Each device keeps a version number that is incremented
+    whenever its own transform or its current subdevice changes; a cached global transform
+    is reused as long as the versions of all devices in the parent chain are unchanged.
+    Thus moving a stage does not require any work from its child devices until they are
+    next asked to map coordinates.
+    
     Devices may also have selectable sub-devices, providing a set of interchangeable transforms.
     For example, a microscope with multiple objectives may define one sub-device per objective.
     This does not affect the hierarchy of devices, but instead simply affects the way the microscope
@@ -85,10 +91,11 @@ class OptomechDevice(object):
         self.__config = config
         self.__children = []
         self.__parent = None
-        self.__globalTransform = 0  ## 0 indicates the cache is invalid. None indicates the transform is non-affine.
-        self.__inverseGlobalTransform = 0
+        self.__transformVersion = 0  ## incremented whenever the local transform or current subdevice changes
+        self.__globalTransform = None  ## (versionKey, transform, matrix); transform is None if non-affine.
+        self.__inverseGlobalTransform = None  ## (versionKey, transform, matrix)
         self.__transform = pg.SRTTransform3D()
-        self.__inverseTransform = 0
+        self.__inverseTransform = None  ## (version, transform)
         self.__lock = Mutex(recursive=True)
         self.__subdevices = collections.OrderedDict()
         self.__subdevice = None
@@ -140,6 +147,7 @@ class OptomechDevice(object):
             parent.sigGlobalSubdeviceChanged.connect(self.__parentSubdeviceChanged)
             parent.sigGlobalSubdeviceListChanged.connect(self.__parentSubdeviceListChanged)
             self.__parent = parent
+            self.invalidateCachedTransforms()
         
     def mapToParentDevice(self, obj, subdev=None):
         """Map from local coordinates to the parent device (or to global if there is no parent)"""
@@ -165,6 +173,20 @@ class OptomechDevice(object):
             else:
                 return parent.mapToGlobal(o2, subdev)
     
+    def mapPointsToGlobal(self, points, subdev=None):
+        """Map an array of points with shape (N, 3) or (N, 2) from local coordinates to global.
+        
+        Unlike mapToGlobal, which expects the coordinate axis first, the coordinates
+        here are along the last axis. The array is mapped with a single matrix
+        multiplication.
+        """
+        with self.__lock:
+            m = self.__globalMatrix(subdev)
+            points = np.asarray(points, dtype=float)
+            if m is None:
+                return self.mapToGlobal(points.T, subdev).T
+            return _mapPoints(m, points)
+    
     def mapToDevice(self, device, obj, subdev=None):
         """Map *obj* from local coordinates to *device*'s coordinate system."""
         with self.__lock:
@@ -193,6 +215,17 @@ class OptomechDevice(object):
                 obj = parent.mapFromGlobal(obj, subdev)
             return self.mapFromParent(obj, subdev)
     
+    def mapPointsFromGlobal(self, points, subdev=None):
+        """Map an array of points with shape (N, 3) or (N, 2) from global to local coordinates.
+        See mapPointsToGlobal.
+        """
+        with self.__lock:
+            m = self.__globalMatrix(subdev, inverse=True)
+            points = np.asarray(points, dtype=float)
+            if m is None:
+                return self.mapFromGlobal(points.T, subdev).T
+            return _mapPoints(m, points)
+    
     def mapFromDevice(self, device, obj, subdev=None):
         """Map *obj* from the coordinate system of the specified *device* to local coordiantes."""
         with self.__lock:
@@ -248,13 +281,11 @@ class OptomechDevice(object):
             return ret
 
         elif isinstance(obj, np.ndarray):
-            # m = np.array(tr.copyDataTo()).reshape(4,4)
-            # m1 = m[:2,:2, np.newaxis]
-            # obj = obj[np.newaxis,...]
-            # m2 = (m1*obj).sum(axis=0)
-            # m2 += m[:2,3,np.newaxis]
-            m2 = pg.transformCoordinates(tr, obj)
-            return m2
+            ## coordinate axis is first: shape is (2, ...) or (3, ...)
+            m = transformMatrix(tr)
+            if obj.ndim == 2:
+                return _mapPoints(m, obj.T).T
+            return pg.transformCoordinates(m[:3], obj)
         else:
             raise Exception('Cannot map--object of type %s ' % str(type(obj))) 
     
@@ -286,16 +317,12 @@ class OptomechDevice(object):
         See deviceTransform; this method returns the inverse.
         """
         with self.__lock:
-            if self.__inverseTransform == 0:
-                tr = QtGui.QMatrix4x4(self.__transform)
-                if tr is None:
-                    self.__inverseTransform = None
-                else:
-                    inv, invertible = tr.inverted()
-                    if not invertible:
-                        raise Exception("Transform is not invertible.")
-                    self.__inverseTransform = inv
-            tr = QtGui.QMatrix4x4(self.__inverseTransform)
+            if self.__inverseTransform is None or self.__inverseTransform[0] != self.__transformVersion:
+                inv, invertible = QtGui.QMatrix4x4(self.__transform).inverted()
+                if not invertible:
+                    raise Exception("Transform is not invertible.")
+                self.__inverseTransform = (self.__transformVersion, inv)
+            tr = QtGui.QMatrix4x4(self.__inverseTransform[1])
             if subdev == 0:  ## indicates we should skip any subdevices
                 return tr
             ## if a subdevice is specified, multiply by the subdevice's transform before returning
@@ -325,27 +352,30 @@ class OptomechDevice(object):
         If *subdev* is given, it must be a dictionary of {deviceName: subdevice} or
         {deviceName: subdeviceName} pairs specifying the state to compute.
         """
-        if subdev is None:
-            subdev = {}
-            
         with self.__lock:
-            #dev = self.getSubdevice(subdev)
-            if subdev is None: ## return cached transform
-                if self.__globalTransform == 0:
-                    self.__globalTransform = self.__computeGlobalTransform()
-                return QtGui.QMatrix4x4(self.__globalTransform)
-            else:
+            if subdev:
                 return self.__computeGlobalTransform(subdev)
+            tr = self.__cachedGlobalTransform()[1]
+            return None if tr is None else QtGui.QMatrix4x4(tr)
                 
+    def inverseGlobalTransform(self, subdev=None):
+        """
+        See globalTransform; this method returns the inverse.
+        """
+        with self.__lock:
+            if subdev:
+                return self.__computeGlobalTransform(subdev, inverse=True)
+            tr = self.__cachedGlobalTransform(inverse=True)[1]
+            return None if tr is None else QtGui.QMatrix4x4(tr)
+
     def __computeGlobalTransform(self, subdev=None, inverse=False):
-        ## subdev must be a dict
+        ## subdev must be a dict, or None to use the current subdevices
         with self.__lock:
             devices = self.parentDevices()
             transform = pg.SRTTransform3D()
             for d in devices:
-                tr = d.deviceTransform(subdev)
+                tr = d.deviceTransform() if subdev is None else d.deviceTransform(subdev)
                 if tr is None:
-                    self.__globalTransform = None
                     return None
                 transform = tr * transform
                 
@@ -357,25 +387,39 @@ class OptomechDevice(object):
         else:
             return transform
         
-    def inverseGlobalTransform(self, subdev=None):
-        """
-        See globalTransform; this method returns the inverse.
-        """
-        with self.__lock:
-            #dev = self.getSubdevice(subdev)
-            if subdev is None: ## return cached transform
-                if self.__inverseGlobalTransform == 0:
-                    tr = self.globalTransform()
-                    if tr is None:
-                        self.__inverseGlobalTransform = None
-                    else:
-                        inv, invertible = tr.inverted()
-                        if not invertible:
-                            raise Exception("Transform is not invertible.")
-                        self.__inverseGlobalTransform = inv
-                return QtGui.QMatrix4x4(self.__inverseGlobalTransform)
+    def __cachedGlobalTransform(self, inverse=False):
+        ## Return (versionKey, transform, matrix) for the current subdevice state,
+        ## recomputing only if any device in the parent chain has changed since the
+        ## last call. *matrix* is the transform as a 4x4 array.
+        key = self.__transformVersionKey()
+        cache = self.__inverseGlobalTransform if inverse else self.__globalTransform
+        if cache is None or cache[0] != key:
+            tr = self.__computeGlobalTransform(inverse=inverse)
+            cache = (key, tr, None if tr is None else transformMatrix(tr))
+            if inverse:
+                self.__inverseGlobalTransform = cache
             else:
-                return self.__computeGlobalTransform(subdev, inverse=True)
+                self.__globalTransform = cache
+        return cache
+
+    def __globalMatrix(self, subdev=None, inverse=False):
+        ## Return the global (or inverse global) transform as a 4x4 array, or None if non-affine.
+        if subdev:
+            tr = self.__computeGlobalTransform(subdev, inverse=inverse)
+            return None if tr is None else transformMatrix(tr)
+        return self.__cachedGlobalTransform(inverse)[2]
+
+    def __transformVersionKey(self):
+        ## Return a tuple that changes whenever the global transform of this device may have changed:
+        ## the versions of each device in the parent chain and of its current subdevice.
+        key = []
+        dev = self
+        while dev is not None:
+            sub = dev.__subdevice
+            key.append(dev.__transformVersion)
+            key.append(-1 if sub is None else sub.__transformVersion)
+            dev = dev.__parent
+        return tuple(key)
     
     def __emitGlobalTransformChanged(self):
         self.sigGlobalTransformChanged.emit(self, self)
@@ -392,18 +436,15 @@ class OptomechDevice(object):
     
     def __parentDeviceTransformChanged(self, sender, changed):
         ## called when any (grand)parent's transform has changed.
-        prof = pg.debug.Profiler(disabled=True)
-        self.invalidateCachedTransforms()
+        ## (cached transforms are checked against the parents' versions; no need to invalidate here)
         self.sigGlobalTransformChanged.emit(self, changed)
         
     def __parentSubdeviceTransformChanged(self, sender, parent, subdev):
         ## called when any (grand)parent's subdevice transform has changed.
-        self.invalidateCachedTransforms()
         self.sigGlobalSubdeviceTransformChanged.emit(self, parent, subdev)
         
     def __parentSubdeviceChanged(self, sender, parent, newDev, oldDev):
         ## called when any (grand)parent's current subdevice has changed.
-        self.invalidateCachedTransforms()
         self.sigGlobalSubdeviceChanged.emit(self, parent, newDev, oldDev)
         
     def __parentSubdeviceListChanged(self, sender, device):
@@ -425,10 +466,9 @@ class OptomechDevice(object):
         return parents
 
     def invalidateCachedTransforms(self):
+        """Mark the cached transforms of this device and all of its children as stale."""
         with self.__lock:
-            self.__inverseTransform = 0
-            self.__globalTransform = 0
-            self.__inverseGlobalTransform = 0
+            self.__transformVersion += 1
 
             
     def addSubdevice(self, subdev):
@@ -489,7 +529,6 @@ class OptomechDevice(object):
             return {self.name(): self.__subdevices[dev]}
             
     def setCurrentSubdevice(self, dev):
-        self.invalidateCachedTransforms()
         with self.__lock:
             oldDev = self.__subdevice
             if dev is None:
@@ -497,6 +536,7 @@ class OptomechDevice(object):
             else:
                 dev = self.getSubdevice(dev)
                 self.__subdevice = dev
+            self.invalidateCachedTransforms()
         self.sigSubdeviceChanged.emit(self, dev, oldDev)
         self.sigTransformChanged.emit(self)
         
@@ -542,6 +582,20 @@ class OptomechDevice(object):
         return tuple([dev + "__" + state[dev] for dev in devs])
         
         
+def transformMatrix(tr):
+    """Return the 4x4 array for a QMatrix4x4 (or SRTTransform3D)."""
+    return np.array(tr.copyDataTo()).reshape(4, 4)
+
+
+def _mapPoints(m, points):
+    ## map an array of points (coordinates along the last axis) through the 4x4 array *m*,
+    ## ignoring perspective. 2D points ignore the z axis of the transform.
+    nd = points.shape[-1]
+    if nd not in (2, 3):
+        raise TypeError("Cannot map points with %d coordinates." % nd)
+    return np.dot(points, m[:nd, :nd].T) + m[:nd, 3]
+
+
 class DeviceTreeItemGroup(pg.ItemGroup):
     """
     Extension of QGraphicsItemGroup that maintains a hierarchy of item groups
@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import scipy.ndimage
+import acq4.pyqtgraph as pg
+from acq4.util.imaging.frame import Frame
+from acq4.devices.Pipette.tracker import (TemplateStack, TemplatePyramid, matchTemplatePyramid,
+                                          downsample2D, _correlationPeaks, PipetteTracker)
+
+
+def bruteForceNCC(img, template):
+    """Reference implementation of skimage.feature.match_template (pad_input=False)"""
+    h, w = template.shape
+    t = template - template.mean()
+    out = np.zeros((img.shape[0]-h+1, img.shape[1]-w+1))
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            win = img[i:i+h, j:j+w]
+            win = win - win.mean()
+            denom = np.sqrt((win**2).sum() * (t**2).sum())
+            out[i, j] = 0 if denom == 0 else (win * t).sum() / denom
+    return out
+
+
+def legacyMatchTemplate(img, template, dsVals=(4, 2, 1)):
+    """Per-template coarse-to-fine search, as previously done in PipetteTracker.matchTemplate"""
+    imgDs = [downsample2D(img, n) for n in dsVals]
+    tmpDs = [downsample2D(template, n) for n in dsVals]
+    offset = np.array([0, 0])
+    for i, ds in enumerate(dsVals):
+        pos, val = _correlationPeaks(bruteForceNCC(imgDs[i], tmpDs[i])[np.newaxis])
+        pos = pos[0]
+        val = val[0]
+        if i == len(dsVals) - 1:
+            return offset + pos, val
+        scale = ds // dsVals[i+1]
+        offset *= scale
+        offset += np.clip(((pos-1) * scale), 0, imgDs[i+1].shape)
+        end = offset + np.array(tmpDs[i+1].shape) + 3
+        end = np.clip(end, 0, imgDs[i+1].shape)
+        imgDs[i+1] = imgDs[i+1][offset[0]:end[0], offset[1]:end[1]]
+
+
+def makeStack(nz=9, shape=(40, 32), seed=0):
+    """Generate a fake focus stack: a pattern that blurs with distance from the center frame,
+    mixed with a second pattern that fades in from one end of the stack to the other"""
+    rng = np.random.RandomState(seed)
+    pattern = scipy.ndimage.gaussian_filter(rng.normal(size=shape), 1.0)
+    pattern[shape[0]//2:, shape[1]//2-2:shape[1]//2+2] += 2
+    pattern2 = scipy.ndimage.gaussian_filter(rng.normal(size=shape), 2.0)
+    frames = [scipy.ndimage.gaussian_filter(pattern, 0.5 + 0.3 * abs(z - nz//2)) + pattern2 * z / float(nz) 
+              for z in range(nz)]
+    return np.array(frames)
+
+
+def test_correlate():
+    rng = np.random.RandomState(1)
+    img = rng.normal(size=(30, 27))
+    templates = rng.normal(size=(3, 8, 6))
+    expected = np.array([bruteForceNCC(img, t) for t in templates])
+
+    ts = TemplateStack(templates)
+    for limit in (0, 10**6):  # FFT and direct paths
+        ts.directLimit = limit
+        cc = ts.correlate(img)
+        assert cc.shape == expected.shape
+        assert np.allclose(cc, expected)
+        assert np.allclose(ts.correlate(img, [2]), expected[2:3])
+
+    # template FFTs are computed once per image shape
+    assert list(ts._spectra.keys()) == [(30, 27)]
+
+    # only the most recently used shapes are kept
+    ts.directLimit = 0
+    ts.maxSpectra = 2
+    ts.correlate(img[:29])
+    ts.correlate(img)
+    ts.correlate(img[:28])
+    assert list(ts._spectra.keys()) == [(30, 27), (28, 27)]
+    assert np.allclose(ts.correlate(img[:29]), expected[:, :22])
+
+
+def test_matchTemplatePyramid():
+    frames = makeStack()
+    rng = np.random.RandomState(2)
+    img = rng.normal(size=(120, 100)) * 0.05
+    z0, x0, y0 = 6, 37, 51
+    img[x0:x0+frames.shape[1], y0:y0+frames.shape[2]] += frames[z0]
+
+    pyramid = TemplatePyramid(frames)
+    ind, offsets, corr = matchTemplatePyramid(img, pyramid)
+    assert ind == z0
+    assert tuple(offsets[ind]) == (x0, y0)
+    assert corr[ind] > 0.95
+
+    # batched search must agree with matching each template separately
+    for z in range(len(frames)):
+        offset, val = legacyMatchTemplate(img, frames[z])
+        assert tuple(offsets[z]) == tuple(offset)
+        assert np.allclose(corr[z], val)
+
+    # coarse-to-fine search over z refines fewer templates but finds the same match
+    ind2, offsets2, corr2 = matchTemplatePyramid(img, pyramid, zCandidates=1)
+    assert ind2 == ind
+    assert tuple(offsets2[ind2]) == (x0, y0)
+    assert np.isnan(corr2).sum() >= len(frames) - 3
+
+
+class MockPipette(object):
+    def configFileName(self, fileName):
+        return os.path.join(os.path.dirname(__file__), 'no_such_dir', fileName)
+
+
+class DetachedPipette(object):
+    """Stands in for a device that may not be accessed from worker threads."""
+    def __getattr__(self, name):
+        raise AssertionError("Pipette device accessed: %s" % name)
+
+
+def test_measureTipPositionFromState():
+    tracker = PipetteTracker(MockPipette())
+    frames = makeStack()
+    reference = {
+        'frames': np.array([tracker.filterImage(f) for f in frames]),
+        'zStep': 1e-6,
+        'centerInd': 4,
+        'centerPos': (5, 7),
+        'pixelSize': (1e-6, 1e-6),
+        'tipLength': 20e-6,
+    }
+
+    # 1 um pixels; the expected tip position is at pixel (100, 100)
+    rng = np.random.RandomState(3)
+    img = rng.normal(size=(200, 200)) * 0.05
+    z0, x0, y0 = 6, 60, 80
+    img[x0:x0+frames.shape[1], y0:y0+frames.shape[2]] += frames[z0]
+    tr = pg.SRTTransform3D()
+    tr.scale(1e-6, 1e-6, 1)
+    frame = Frame(img[np.newaxis], {'pixelSize': (1e-6, 1e-6), 'transform': tr})
+
+    # with the device state given, the measurement does not touch the device
+    tracker.dev = DetachedPipette()
+    pos, corr = tracker.measureTipPosition(frame=frame, pos=np.array([100e-6, 100e-6, 0]), yawAngle=0,
+                                           reference=reference)
+    assert corr > 0.9
+    assert np.allclose(pos, [(x0 + 5) * 1e-6, (y0 + 7) * 1e-6, (z0 - 4) * 1e-6])
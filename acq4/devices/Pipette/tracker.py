@@ -1,12 +1,191 @@
 import pickle
+import threading
 import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import scipy.optimize, scipy.ndimage
 
 import acq4.pyqtgraph as pg
 from acq4.Manager import getManager
 
 
+def downsample2D(data, n):
+    """Downsample the last two axes of *data* by averaging blocks of n x n pixels.
+    """
+    ax = data.ndim - 2
+    return pg.downsample(pg.downsample(data, n, axis=ax), n, axis=ax+1)
+
+
+def windowSums(img, shape):
+    """Return the sum of *img* over every window of the given (h, w) *shape* that fits
+    entirely within the image.
+    """
+    h, w = shape
+    ii = np.zeros((img.shape[0]+1, img.shape[1]+1))
+    ii[1:, 1:] = img.cumsum(axis=0).cumsum(axis=1)
+    return ii[h:, w:] - ii[:-h, w:] - ii[h:, :-w] + ii[:-h, :-w]
+
+
+class TemplateStack(object):
+    """A stack of equally-sized template images with the quantities needed for normalized
+    cross-correlation precomputed.
+
+    Template FFTs are cached per image shape, so repeatedly matching images of the same
+    size (as when tracking in consecutive camera frames) costs one forward FFT per image and
+    one inverse FFT per template. Only the *maxSpectra* most recently used shapes are kept.
+    """
+    # search regions with at most this many candidate positions are correlated directly
+    # rather than via FFT
+    directLimit = 256
+    maxSpectra = 4
+
+    def __init__(self, templates):
+        templates = np.asarray(templates, dtype=float)
+        if templates.ndim == 2:
+            templates = templates[np.newaxis]
+        self.shape = templates.shape[1:]
+        self.size = self.shape[0] * self.shape[1]
+        means = templates.reshape(len(templates), -1).mean(axis=1)
+        self.zeroMean = templates - means[:, np.newaxis, np.newaxis]
+        self.ssd = (self.zeroMean**2).reshape(len(templates), -1).sum(axis=1)
+        self._spectra = OrderedDict()
+        self._spectraLock = threading.Lock()
+
+    def __len__(self):
+        return self.zeroMean.shape[0]
+
+    def spectra(self, shape):
+        """Return the conjugated FFTs of all zero-mean templates, zero-padded to *shape*.
+        """
+        shape = tuple(shape)
+        with self._spectraLock:
+            spec = self._spectra.pop(shape, None)
+            if spec is None:
+                spec = np.conj(np.fft.rfft2(self.zeroMean, s=shape))
+            self._spectra[shape] = spec
+            while len(self._spectra) > self.maxSpectra:
+                self._spectra.popitem(last=False)
+        return spec
+
+    def correlate(self, img, inds=None):
+        """Return the normalized cross-correlation of *img* with each template.
+
+        The output has shape (nTemplates, img.shape[0]-h+1, img.shape[1]-w+1), and is
+        equivalent to calling `skimage.feature.match_template(img, template)` for each
+        template. If *inds* is given, only the templates at those indexes are used.
+        """
+        img = np.asarray(img, dtype=float)
+        h, w = self.shape
+        if img.shape[0] < h or img.shape[1] < w:
+            raise ValueError("Image must be larger than template.  %s %s" % (img.shape, self.shape))
+        if inds is None:
+            inds = np.arange(len(self))
+        inds = np.asarray(inds)
+        ny = img.shape[0] - h + 1
+        nx = img.shape[1] - w + 1
+
+        if ny * nx <= self.directLimit:
+            windows = as_strided(img, shape=(ny, nx, h, w), strides=img.strides * 2)
+            num = np.tensordot(self.zeroMean[inds], windows, axes=([1, 2], [2, 3]))
+        else:
+            spec = self.spectra(img.shape)[inds]
+            num = np.fft.irfft2(np.fft.rfft2(img)[np.newaxis] * spec, s=img.shape)[:, :ny, :nx]
+
+        wsum = windowSums(img, self.shape)
+        wsum2 = windowSums(img**2, self.shape)
+        denom = (wsum2 - wsum**2 / self.size)[np.newaxis] * self.ssd[inds][:, np.newaxis, np.newaxis]
+        denom = np.sqrt(np.maximum(denom, 0))
+        cc = np.zeros(num.shape)
+        mask = denom > np.finfo(float).eps
+        cc[mask] = num[mask] / denom[mask]
+        return cc
+
+
+class TemplatePyramid(object):
+    """TemplateStacks generated from a stack of reference frames at each of the downsampling
+    factors in *dsVals* (see `matchTemplatePyramid()`).
+    """
+    def __init__(self, frames, dsVals=(4, 2, 1)):
+        for i in range(len(dsVals) - 1):
+            assert dsVals[i] % dsVals[i+1] == 0, "dsVals must satisfy constraint: dsVals[i] == dsVals[i+1] * int(x)"
+        frames = np.asarray(frames, dtype=float)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        self.dsVals = tuple(dsVals)
+        self.levels = [TemplateStack(downsample2D(frames, n)) for n in self.dsVals]
+
+    def __len__(self):
+        return len(self.levels[0])
+
+
+def _correlationPeaks(cc, unsharp=3):
+    """Return the (N, 2) peak positions and N peak values for a stack of correlation images.
+    """
+    # high-pass filter; we're looking for a fairly sharp peak.
+    if unsharp is not False:
+        filt = cc - scipy.ndimage.gaussian_filter(cc, (0, unsharp, unsharp))
+    else:
+        filt = cc
+    ind = filt.reshape(len(filt), -1).argmax(axis=1)
+    pos = np.vstack(np.unravel_index(ind, cc.shape[1:])).T
+    val = cc.reshape(len(cc), -1)[np.arange(len(cc)), ind]
+    return pos, val
+
+
+def matchTemplatePyramid(img, pyramid, zCandidates=None, unsharp=3):
+    """Match *img* against every template in a TemplatePyramid.
+
+    The image is downsampled once per level. All templates are matched at the coarsest
+    level; then, for each selected template, the match is refined at successively higher
+    resolutions within a small window around the previous best match.
+
+    If *zCandidates* is given, only that many templates with the best coarse match (plus their
+    immediate neighbors in the stack) are refined.
+
+    Return `(index, offsets, corr)`, where *index* is the index of the best matching template,
+    *offsets* is an (N, 2) array of the (x, y) pixel offset of each template, and *corr* is
+    an array of normalized cross-correlation values. Offsets and correlation values are NaN for
+    templates that were not refined.
+    """
+    dsVals = pyramid.dsVals
+    img = np.asarray(img, dtype=float)
+    imgDs = [downsample2D(img, n) for n in dsVals]
+    nTemplates = len(pyramid)
+
+    pos, val = _correlationPeaks(pyramid.levels[0].correlate(imgDs[0]), unsharp)
+
+    if zCandidates is None or zCandidates >= nTemplates:
+        inds = np.arange(nTemplates)
+    else:
+        best = np.argsort(val)[::-1][:zCandidates]
+        inds = np.unique(np.clip(np.concatenate([best-1, best, best+1]), 0, nTemplates-1))
+
+    offsets = np.empty((nTemplates, 2))
+    offsets[:] = np.nan
+    corr = np.empty(nTemplates)
+    corr[:] = np.nan
+    for z in inds:
+        offset = np.array([0, 0])
+        p = pos[z]
+        v = val[z]
+        for i in range(1, len(dsVals)):
+            # crop the next level to a window around the match at the previous level
+            scale = dsVals[i-1] // dsVals[i]
+            offset = offset * scale + np.clip((p - 1) * scale, 0, imgDs[i].shape)
+            end = np.clip(offset + np.array(pyramid.levels[i].shape) + 3, 0, imgDs[i].shape)
+            sub = imgDs[i][offset[0]:end[0], offset[1]:end[1]]
+            p, v = _correlationPeaks(pyramid.levels[i].correlate(sub, [z]), unsharp)
+            p = p[0]
+            v = v[0]
+        offsets[z] = offset + p
+        corr[z] = v
+
+    index = inds[np.argmax(corr[inds])]
+    return index, offsets, corr
+
+
 class PipetteTracker(object):
     """Provides functionality for automated tracking and recalibration of pipette tip position
     based on camera feedback.
@@ -22,6 +201,8 @@ class PipetteTracker(object):
             self.reference = pickle.load(open(fileName, 'rb'))
         except Exception:
             self.reference = {}
+        # precomputed template pyramids, keyed by id(reference['frames'])
+        self._templatePyramids = {}
 
     def takeFrame(self, imager=None, padding=40e-6):
         """Acquire one frame from an imaging device.
@@ -45,11 +226,13 @@ class PipetteTracker(object):
             imager = man.getDevice('Camera')
         return imager
 
-    def getTipImageArea(self, frame, padding, pos=None, tipLength=None):
+    def getTipImageArea(self, frame, padding, pos=None, tipLength=None, yawAngle=None):
         """Generate coordinates needed to clip a camera frame to include just the
         tip of the pipette and some padding.
 
         By default, images will include the tip of the pipette to a length of 100 pixels.
+        If *pos* (the global tip position) or *yawAngle* (in degrees) are not given,
+        they are read from the pipette device.
 
         Return a tuple (minImgPos, maxImgPos, tipRelPos), where the first two
         items are (x,y) coordinate pairs giving the corners of the image region to 
@@ -69,7 +252,9 @@ class PipetteTracker(object):
         else:
             tipPos = self.dev.globalPosition()
         tipPos = np.array([tipPos[0], tipPos[1]])
-        angle = self.dev.getYawAngle() * np.pi / 180.
+        if yawAngle is None:
+            yawAngle = self.dev.getYawAngle()
+        angle = yawAngle * np.pi / 180.
         da = 10 * np.pi / 180  # half-angle of the tip
         pxw = frame.info()['pixelSize'][0]
         # compute back points of a triangle that circumscribes the tip
@@ -248,7 +433,22 @@ class PipetteTracker(object):
         # Store with pickle because configfile does not support arrays
         pickle.dump(self.reference, open(self.dev.configFileName('ref_frames.pk'), 'wb'))
 
-    def measureTipPosition(self, padding=50e-6, threshold=0.7, frame=None, pos=None, tipLength=None, show=False):
+        # precompute downsampled templates now rather than on the first match
+        self._getTemplatePyramid(self.reference[key])
+
+    def _getTemplatePyramid(self, reference, dsVals=(4, 2, 1)):
+        """Return the TemplatePyramid for a set of reference frames, creating it if needed.
+        """
+        frames = reference['frames']
+        key = (id(frames), tuple(dsVals))
+        cached = self._templatePyramids.get(key)
+        if cached is None or cached[0] is not frames:
+            cached = (frames, TemplatePyramid(frames, dsVals))
+            self._templatePyramids[key] = cached
+        return cached[1]
+
+    def measureTipPosition(self, padding=50e-6, threshold=0.7, frame=None, pos=None, tipLength=None, show=False,
+                           zCandidates=3, yawAngle=None, reference=None):
         """Find the pipette tip location by template matching within a region surrounding the
         expected tip position.
 
@@ -256,19 +456,29 @@ class PipetteTracker(object):
         the best template match.
 
         If the strength of the match is less than *threshold*, then raise RuntimeError.
+
+        All reference frames are matched at the lowest resolution; only the *zCandidates* best
+        frames (and their immediate neighbors in z) are refined at higher resolution. Use
+        zCandidates=None to refine every frame.
+
+        This method does not modify the device. To call it from a worker thread, read the
+        device state on the calling thread with `deviceState()` and pass the resulting *pos*,
+        *yawAngle* and *reference* along with *frame*; the device is then not accessed at all.
         """
         # Grab one frame (if it is not already supplied) and crop it to the region around the pipette tip.
         if frame is None:
             frame = self.takeFrame()
 
         # load up template images
-        reference = self._getReference()
+        if reference is None:
+            reference = self._getReference()
 
         if tipLength is None:
             # select a tip length similar to template images
             tipLength = reference['tipLength']
 
-        minImgPos, maxImgPos, tipRelPos = self.getTipImageArea(frame, padding, pos=pos, tipLength=tipLength)
+        minImgPos, maxImgPos, tipRelPos = self.getTipImageArea(frame, padding, pos=pos, tipLength=tipLength,
+                                                               yawAngle=yawAngle)
         img = frame.data()
         if img.ndim == 3:
             img = img[0]
@@ -281,26 +491,28 @@ class PipetteTracker(object):
             img = scipy.ndimage.zoom(img, pxr)
 
         # run template match against all template frames, find the frame with the strongest match
-        match = [self.matchTemplate(img, t) for t in reference['frames']]
+        if show:
+            zCandidates = None
+        pyramid = self._getTemplatePyramid(reference)
+        maxInd, offsets, corr = matchTemplatePyramid(img, pyramid, zCandidates=zCandidates)
 
         if show:
-            pg.plot([m[0][0] for m in match], title='x match vs z')
-            pg.plot([m[0][1] for m in match], title='y match vs z')
-            pg.plot([m[1] for m in match], title='match correlation vs z')
+            pg.plot(offsets[:, 0], title='x match vs z')
+            pg.plot(offsets[:, 1], title='y match vs z')
+            pg.plot(corr, title='match correlation vs z')
 
-        maxInd = np.argmax([m[1] for m in match])
-        if match[maxInd][1] < threshold:
-            raise RuntimeError("Unable to locate pipette tip (correlation %0.2f < %0.2f)" % (match[maxInd][1], threshold))
+        if corr[maxInd] < threshold:
+            raise RuntimeError("Unable to locate pipette tip (correlation %0.2f < %0.2f)" % (corr[maxInd], threshold))
 
         # measure z error
         zErr = (maxInd - reference['centerInd']) * reference['zStep']
 
         # measure xy position
-        offset = match[maxInd][0]
+        offset = offsets[maxInd]
         tipImgPos = (minImgPos[0] + (offset[0] + reference['centerPos'][0]) / pxr, 
                      minImgPos[1] + (offset[1] + reference['centerPos'][1]) / pxr)
         tipPos = frame.mapFromFrameToGlobal(pg.Vector(tipImgPos))
-        return (tipPos.x(), tipPos.y(), tipPos.z() + zErr), match[maxInd][1]
+        return (tipPos.x(), tipPos.y(), tipPos.z() + zErr), corr[maxInd]
 
     def measureError(self, padding=50e-6, threshold=0.7, frame=None, pos=None):
         """Return an (x, y, z) tuple indicating the error vector from the calibrated tip position to the
@@ -314,6 +526,16 @@ class PipetteTracker(object):
         measuredTipPos, corr = self.measureTipPosition(padding, threshold, frame, pos=pos)
         return tuple([measuredTipPos[i] - expectedTipPos[i] for i in (0, 1, 2)])
 
+    def deviceState(self):
+        """Return a dict of the current global tip position, yaw angle, and reference frames,
+        which may be passed as keyword arguments to `measureTipPosition()`.
+        """
+        return {
+            'pos': np.array(self.dev.globalPosition()),
+            'yawAngle': self.dev.getYawAngle(),
+            'reference': self._getReference(),
+        }
+
     def _getReference(self):
         key = self._getImager().getDeviceStateKey()
         try:
@@ -328,22 +550,33 @@ class PipetteTracker(object):
 
         All keyword arguments are passed to `measureTipPosition()`.
         """
+        tipPos, corr = self._measureTipPositionWithRetry(**kwds)
+        localError = self.applyTipPosition(tipPos)
+        return localError, corr
+
+    def _measureTipPositionWithRetry(self, **kwds):
         # If no image padding is given, then use the template tip length as a first guess
         if 'padding' not in kwds:
-            ref = self._getReference()
+            ref = kwds.get('reference') or self._getReference()
             kwds['padding'] = ref['tipLength']
 
         try:
-            tipPos, corr = self.measureTipPosition(**kwds)
+            return self.measureTipPosition(**kwds)
         except RuntimeError:
             kwds['padding'] *= 2
-            tipPos, corr = self.measureTipPosition(**kwds)
+            return self.measureTipPosition(**kwds)
+
+    def applyTipPosition(self, tipPos):
+        """Correct the device transform such that the pipette tip is located at *tipPos*
+        (in global coordinates).
 
+        Return the correction in pipette-local coordinates.
+        """
         localError = self.dev.mapFromGlobal(tipPos)
         tr = self.dev.deviceTransform()
         tr.translate(pg.Vector(localError))
         self.dev.setDeviceTransform(tr)
-        return localError, corr
+        return localError
 
     def filterImage(self, img):
         """Return a filtered version of an image to be used in template matching.
@@ -366,46 +599,21 @@ class PipetteTracker(object):
         iteratively re-matching at higher resolutions. The *dsVals* argument lists the downsampling values
         that will be used, in order. Each value in this list must be an integer multiple of
         the value that follows it.
-        """
-        # Recursively match at increasing image resolution
 
-        imgDs = [pg.downsample(pg.downsample(img, n, axis=0), n, axis=1) for n in dsVals]
-        tmpDs = [pg.downsample(pg.downsample(template, n, axis=0), n, axis=1) for n in dsVals]
-        offset = np.array([0, 0])
-        for i, ds in enumerate(dsVals):
-            pos, val = self._matchTemplateSingle(imgDs[i], tmpDs[i])
-            pos = np.array(pos)
-            if i == len(dsVals) - 1:
-                offset += pos
-                # [pg.image(imgDs[j], title=str(j)) for j in range(len(dsVals))]
-                return offset, val
-            else:
-                scale = ds // dsVals[i+1]
-                assert scale == ds / dsVals[i+1], "dsVals must satisfy constraint: dsVals[i] == dsVals[i+1] * int(x)"
-                offset *= scale
-                offset += np.clip(((pos-1) * scale), 0, imgDs[i+1].shape)
-                end = offset + np.array(tmpDs[i+1].shape) + 3
-                end = np.clip(end, 0, imgDs[i+1].shape)
-                imgDs[i+1] = imgDs[i+1][offset[0]:end[0], offset[1]:end[1]]
+        To match against many templates, build a `TemplatePyramid` once and use 
+        `matchTemplatePyramid()` instead.
+        """
+        ind, offsets, corr = matchTemplatePyramid(img, TemplatePyramid(template, dsVals))
+        return offsets[0].astype(int), corr[0]
 
     def _matchTemplateSingle(self, img, template, show=False, unsharp=3):
-        import skimage.feature
-        if img.shape[0] < template.shape[0] or img.shape[1] < template.shape[1]:
-            raise ValueError("Image must be larger than template.  %s %s" % (img.shape, template.shape))
-        cc = skimage.feature.match_template(img, template)
-        # high-pass filter; we're looking for a fairly sharp peak.
-        if unsharp is not False:
-            cc_filt = cc - scipy.ndimage.gaussian_filter(cc, (unsharp, unsharp))
-        else:
-            cc_filt = cc
+        cc = TemplateStack(template).correlate(img)
 
         if show:
-            pg.image(cc)
+            pg.image(cc[0])
 
-        ind = np.argmax(cc_filt)
-        pos = np.unravel_index(ind, cc.shape)
-        val = cc[pos[0], pos[1]]
-        return pos, val
+        pos, val = _correlationPeaks(cc, unsharp)
+        return tuple(pos[0]), val[0]
 
     def mapErrors(self, nSteps=(5, 5, 7), stepSize=(50e-6, 50e-6, 50e-6),  padding=60e-6,
                   threshold=0.4, speed='slow', show=False, intermediateDist=60e-6):
@@ -566,13 +774,21 @@ class PipetteTracker(object):
 
 
 class DriftMonitor(pg.QtGui.QWidget):
-    def __init__(self, trackers):
+    """Continuously measures and corrects the drift of one or more pipettes.
+
+    Each new camera frame is handed to a pool of worker threads that locate all pipette tips
+    in parallel; corrections are applied when the results return to the GUI thread. Frames
+    that arrive while the previous frame is still being analyzed are skipped.
+    """
+
+    sigMeasured = pg.QtCore.Signal(object, object)  # (time, [tipPos or exception, ...])
+
+    def __init__(self, trackers, workers=None):
         self.trackers = trackers
-        self.nextFrame = None
+        self.busy = False
+        self.running = True
 
         pg.QtGui.QWidget.__init__(self)
-        self.timer = pg.QtCore.QTimer()
-        self.timer.timeout.connect(self.update)
 
         self.layout = pg.QtGui.QGridLayout()
         self.setLayout(self.layout)
@@ -586,38 +802,70 @@ class DriftMonitor(pg.QtGui.QWidget):
         self.cumulative = np.zeros((len(trackers), 3))
         self.times = []
 
-        self.timer.start(2000)
-        trackers[0]._getImager().sigNewFrame.connect(self.newFrame)
+        self.pool = ThreadPool(workers or len(trackers))
+        self.sigMeasured.connect(self.measured)
+        self.imager = trackers[0]._getImager()
+        self.imager.sigNewFrame.connect(self.newFrame)
         self.show()
 
     def newFrame(self, frame):
-        self.nextFrame = frame
+        if self.busy or not self.running:
+            return
+        now = time.time()
 
-    def update(self):
+        # device transforms may be changed by the GUI thread while the workers run, so
+        # read everything the measurement needs here
         try:
-            if self.nextFrame is None:
-                return
-            frame = self.nextFrame
-            self.nextFrame = None
-
-            self.times.append(time.time())
-            x = np.array(self.times)
-            x -= x[0]
-
-            for i, t in enumerate(self.trackers):
-                try:
-                    err, corr = t.autoCalibrate(frame=frame, padding=50e-6)
-                    err = np.array(err)
-                    self.cumulative[i] += err
-                    err = (self.cumulative[i]**2).sum()**0.5
-                except RuntimeError:
-                    err = np.nan
-                self.errors[i].append(err)
-                self.lines[i].setData(x, self.errors[i])
+            states = [tracker.deviceState() for tracker in self.trackers]
         except Exception:
-            self.timer.stop()
+            self.stop()
             raise
+        self.busy = True
+
+        def measure(args):
+            tracker, state = args
+            try:
+                return tracker._measureTipPositionWithRetry(frame=frame, padding=50e-6, **state)[0]
+            except Exception as exc:
+                return exc
+
+        def done(results):
+            self.sigMeasured.emit(now, results)
+
+        self.pool.map_async(measure, list(zip(self.trackers, states)), callback=done)
+
+    def measured(self, now, results):
+        self.busy = False
+        if not self.running:
+            return
+        self.times.append(now)
+        x = np.array(self.times)
+        x -= x[0]
+
+        for i, t in enumerate(self.trackers):
+            res = results[i]
+            if isinstance(res, RuntimeError):
+                err = np.nan
+            elif isinstance(res, Exception):
+                self.stop()
+                raise res
+            else:
+                err = np.array(t.applyTipPosition(res))
+                self.cumulative[i] += err
+                err = (self.cumulative[i]**2).sum()**0.5
+            self.errors[i].append(err)
+            self.lines[i].setData(x, self.errors[i])
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self.imager.sigNewFrame.disconnect(self.newFrame)
+        except (TypeError, RuntimeError):
+            pass
+        self.pool.close()
 
     def closeEvent(self, event):
-        self.timer.stop()
-        return pg.QtGui.QWidget.closeEvent(self, event)
\ No newline at end of file
+        self.stop()
+        return pg.QtGui.QWidget.closeEvent(self, event)
@@ -389,6 +389,20 @@ class ScannerTask(DeviceTask):
                 clipped = np.clip(self.cmd[cmdName], mn, mx)
                 daqTask.setWaveform(chConf['channel'], clipped)
 
+    def canRearm(self):
+        ## shutter arrays are generated from the laser task in configure()
+        return not self.cmd.get('simulateShutter', False)
+        
+    def rearm(self):
+        with self.abortLock:
+            self.aborted = False
+        ## restore the mirror position set by configure(); command arrays remain on the DAQ task
+        with self.dev.lock:
+            if 'command' in self.cmd:
+                self.dev.setCommand(self.cmd['command'])
+            elif 'position' in self.cmd:
+                self.dev.setPosition(self.cmd['position'], self.cmd['laser'])
+
     def stop(self, abort=False):
         if abort:
             with self.abortLock:
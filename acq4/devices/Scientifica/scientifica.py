@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import time
+import threading
 import numpy as np
 from PyQt4 import QtGui, QtCore
 from ..Stage import Stage, MoveFuture, StageInterface
@@ -24,18 +25,22 @@ class Scientifica(Stage):
     The optional 'baudrate' parameter is used to set the baudrate of the device.
     Both valid rates will be attempted when initially connecting.
     """
+    @classmethod
+    def initHardware(cls, config, name):
+        baudrate = config.get('baudrate', None)
+        dev = ScientificaDriver(port=config.get('port', None), name=config.get('name', None), baudrate=baudrate)
+
+        # Controllers reset their baud to 9600 after power cycle
+        if baudrate is not None and dev.getBaudrate() != baudrate:
+            dev.setBaudrate(baudrate)
+        return dev
+
     def __init__(self, man, config, name):
-        # can specify 
-        port = config.pop('port', None)
-        name = config.pop('name', None)
+        self.dev = self.getHardware(config, name)
+        for key in ('port', 'name', 'baudrate'):
+            config.pop(key, None)
 
         self.scale = config.pop('scale', (1e-6, 1e-6, 1e-6))
-        baudrate = config.pop('baudrate', None)
-        self.dev = ScientificaDriver(port=port, name=name, baudrate=baudrate)
-
-        # Controllers reset their baud to 9600 after power cycle
-        if baudrate is not None and self.dev.getBaudrate() != baudrate:
-            self.dev.setBaudrate(baudrate)
 
         self._lastMove = None
         man.sigAbortAll.connect(self.abort)
@@ -110,8 +115,23 @@ class Scientifica(Stage):
 
     def _getPosition(self):
         # Called by superclass when user requests position refresh
+        return self._positionReceived(self.dev.getPos())
+
+    def _getStatus(self):
+        """Return (isMoving, position) using a single request to the controller.
+        The cached position is updated as in _getPosition().
+        """
+        with self.lock:
+            # only a status requested after the move was sent can complete it
+            move = self._lastMove
+        moving, pos = self.dev.getStatus()
+        pos = self._positionReceived(pos)
+        if move is not None:
+            move._statusReceived(moving, pos)
+        return moving, pos
+
+    def _positionReceived(self, pos):
         with self.lock:
-            pos = self.dev.getPos()
             pos = [pos[i] * self.scale[i] for i in (0, 1, 2)]
             if pos != self._lastPos:
                 self._lastPos = pos
@@ -143,8 +163,11 @@ class Scientifica(Stage):
             pos = self._toAbsolutePosition(abs, rel)
             speed = self._interpretSpeed(speed)
 
-            self._lastMove = ScientificaMoveFuture(self, pos, speed, self.userSpeed)
-            return self._lastMove
+            move = ScientificaMoveFuture(self, pos, speed, self.userSpeed)
+            self._lastMove = move
+        # let the monitor thread report completion without waiting out its idle interval
+        self.monitor.wake()
+        return move
 
     def deviceInterface(self, win):
         return ScientificaGUI(self, win)
@@ -165,6 +188,7 @@ class MonitorThread(Thread):
         self.lock = Mutex(recursive=True)
         self.stopped = False
         self.interval = 0.3
+        self._wake = threading.Event()
         
         Thread.__init__(self)
 
@@ -175,6 +199,12 @@ class MonitorThread(Thread):
     def stop(self):
         with self.lock:
             self.stopped = True
+        self._wake.set()
+
+    def wake(self):
+        """Poll the device immediately rather than at the end of the current interval.
+        """
+        self._wake.set()
 
     def setInterval(self, i):
         with self.lock:
@@ -182,6 +212,8 @@ class MonitorThread(Thread):
     
     def run(self):
         minInterval = 100e-3
+        # poll faster while a programmed move is waiting to be reported complete
+        moveInterval = 20e-3
         interval = minInterval
         lastPos = None
         while True:
@@ -191,15 +223,20 @@ class MonitorThread(Thread):
                         break
                     maxInterval = self.interval
 
-                pos = self.dev._getPosition()  # this causes sigPositionChanged to be emitted
-                if pos != lastPos:
+                # this causes sigPositionChanged to be emitted and completes the current move
+                moving, pos = self.dev._getStatus()
+                move = self.dev._lastMove
+                if move is not None and not move._taskFinished:
+                    interval = moveInterval
+                elif moving or pos != lastPos:
                     # if there was a change, then loop more rapidly for a short time.
                     interval = minInterval
-                    lastPos = pos
                 else:
                     interval = min(maxInterval, interval*2)
+                lastPos = pos
 
-                time.sleep(interval)
+                self._wake.wait(interval)
+                self._wake.clear()
             except:
                 debug.printExc('Error in Scientifica monitor thread:')
                 time.sleep(maxInterval)
@@ -208,22 +245,18 @@ class MonitorThread(Thread):
 class ScientificaMoveFuture(MoveFuture):
     """Provides access to a move-in-progress on a Scientifica manipulator.
     """
+    # completion is normally reported by the monitor thread; polling is only a fallback
+    pollInterval = 0.5
+
     def __init__(self, dev, pos, speed, userSpeed):
         MoveFuture.__init__(self, dev, pos, speed)
-        self._interrupted = False
-        self._errorMSg = None
-        self._finished = False
+        self._stopRequested = False
         pos = np.array(pos) / np.array(self.dev.scale)
         with self.dev.dev.lock:
             self.dev.dev.moveTo(pos, speed / self.dev.scale[0])
             # reset to user speed immediately after starting move
             # (the move itself will run with the previous speed)
             self.dev.dev.setSpeed(userSpeed / self.dev.scale[0])
-        
-    def wasInterrupted(self):
-        """Return True if the move was interrupted before completing.
-        """
-        return self._interrupted
 
     def isDone(self):
         """Return True if the move is complete.
@@ -233,45 +266,35 @@ class ScientificaMoveFuture(MoveFuture):
     def _getStatus(self):
         # check status of move unless we already know it is complete.
         # 0: still moving; 1: finished successfully; -1: finished unsuccessfully
-        if self._finished:
-            if self._interrupted:
-                return -1
-            else:
-                return 1
-        if self.dev.dev.isMoving():
-            # Still moving
+        if not self._taskFinished:
+            moving, pos = self.dev._getStatus()
+            self._statusReceived(moving, pos)
+        if not self._taskFinished:
             return 0
+        elif self._interrupted:
+            return -1
+        else:
+            return 1
+
+    def _statusReceived(self, moving, pos):
+        # Called with every status read from the controller after this move was started.
+        if moving or self._taskFinished:
+            return
         # did we reach target?
-        pos = self.dev._getPosition()
         dif = ((np.array(pos) - np.array(self.targetPos))**2).sum()**0.5
         if dif < 2.5e-6:
-            # reached target
-            self._finished = True
-            return 1
+            self._taskDone()
+        elif self._stopRequested:
+            self._taskDone(interrupted=True, error="Move was interrupted before completion.")
         else:
-            # missed
-            self._finished = True
-            self._interrupted = True
-            self._errorMsg = "Move did not complete (target=%s, position=%s, dif=%s)." % (self.targetPos, pos, dif)
-            return -1
+            self._taskDone(interrupted=True, error="Move did not complete (target=%s, position=%s, dif=%s)." % (self.targetPos, pos, dif))
 
     def _stopped(self):
         # Called when the manipulator is stopped, possibly interrupting this move.
-        status = self._getStatus()
-        if status == 1:
-            # finished; ignore stop
-            return
-        elif status == -1:
-            self._errorMsg = "Move was interrupted before completion."
-        elif status == 0:
+        self._stopRequested = True
+        if self._getStatus() == 0:
             # not actually stopped! This should not happen.
             raise RuntimeError("Interrupted move but manipulator is still running!")
-        else:
-            raise Exception("Unknown status: %s" % status)
-
-    def errorMessage(self):
-        return self._errorMsg
-
 
 
 class ScientificaGUI(StageInterface):
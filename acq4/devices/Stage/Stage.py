@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
-from PyQt4 import QtTest
+import threading
 from acq4.devices.Device import *
 from acq4.devices.OptomechDevice import *
 from acq4.util.Mutex import Mutex
+from acq4.util.debug import Profiler
 import acq4.pyqtgraph as pg
 from .calibration import *
 
@@ -226,7 +227,7 @@ class Stage(Device, OptomechDevice):
 
         See targetPosition().
         """
-        prof = pg.debug.Profiler()
+        prof = Profiler()
         tp = self.targetPosition()
         prof('1')
         lp = self.mapFromStage(tp)
@@ -384,13 +385,26 @@ class Stage(Device, OptomechDevice):
 
 class MoveFuture(object):
     """Used to track the progress of a requested move operation.
+
+    Devices that monitor their own moves (for example, from a position polling
+    thread) should call _taskDone() when a move finishes or is interrupted. This
+    releases wait() immediately and runs any callbacks registered with then().
+    For devices that do not, wait() falls back to polling isDone() every
+    *pollInterval* seconds.
     """
+    pollInterval = 0.1
+
     def __init__(self, dev, pos, speed):
         self.startTime = pg.ptime.time()
         self.dev = dev
         self.speed = speed
         self.targetPos = pos
         self.startPos = dev.getPosition()
+        self._interrupted = False
+        self._errorMsg = None
+        self._doneCond = threading.Condition()
+        self._taskFinished = False
+        self._callbacks = []
 
     def percentDone(self):
         """Return the percent of the move that has completed.
@@ -412,8 +426,10 @@ class MoveFuture(object):
 
     def wasInterrupted(self):
         """Return True if the move was interrupted before completing.
+
+        The default implementation reports the state passed to _taskDone().
         """
-        raise NotImplementedError()
+        return self._interrupted
 
     def isDone(self):
         """Return True if the move has completed or was interrupted.
@@ -424,8 +440,57 @@ class MoveFuture(object):
         """Return a string description of the reason for a move failure,
         or None if there was no failure (or if the reason is unknown).
         """
-        return None
-        
+        return self._errorMsg
+
+    def _taskDone(self, interrupted=False, error=None):
+        """Called by the device when the move has finished or was interrupted.
+
+        Wakes all threads blocked in wait() and runs callbacks registered with
+        then(). Calls after the first are ignored.
+        """
+        with self._doneCond:
+            if self._taskFinished:
+                return
+            self._interrupted = interrupted
+            self._errorMsg = error
+            self._taskFinished = True
+            self._doneCond.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for cb in callbacks:
+            self._runCallback(cb)
+
+    def then(self, callback):
+        """Register *callback* to be called with this future as its argument
+        when the move finishes or is interrupted.
+
+        If the device has already reported completion, *callback* is called
+        immediately. Otherwise it is called from the thread that reports
+        completion (often a device monitor thread), so callbacks that touch the
+        GUI must forward their work to the main thread, for example with a
+        signal.
+
+        Returns this future so that calls may be chained.
+        """
+        with self._doneCond:
+            if not self._taskFinished:
+                self._callbacks.append(callback)
+                return self
+        self._runCallback(callback)
+        return self
+
+    def _runCallback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            printExc("Error in move callback:")
+
+    def _waitForSignal(self, timeout):
+        with self._doneCond:
+            if not self._taskFinished:
+                self._doneCond.wait(timeout)
+            return self._taskFinished
+
     def wait(self, timeout=None, updates=False):
         """Block until the move has completed, been interrupted, or the
         specified timeout has elapsed.
@@ -435,13 +500,17 @@ class MoveFuture(object):
         If the move did not complete, raise an exception.
         """
         start = ptime.time()
-        while (timeout is None) or (ptime.time() < start + timeout):
-            if self.isDone():
-                break
+        while not self.isDone():
+            interval = self.pollInterval
+            if timeout is not None:
+                remaining = start + timeout - ptime.time()
+                if remaining <= 0:
+                    break
+                interval = min(interval, remaining)
             if updates is True:
-                QtTest.QTest.qWait(100)
-            else:
-                time.sleep(0.1)
+                QtGui.QApplication.processEvents()
+                interval = min(interval, 20e-3)
+            self._waitForSignal(interval)
         if not self.isDone() or self.wasInterrupted():
             err = self.errorMessage()
             if err is None:
@@ -450,6 +519,20 @@ class MoveFuture(object):
                 raise RuntimeError("Move did not complete: %s" % err)
 
 
+def waitForMoves(futures, timeout=None, updates=False):
+    """Block until all MoveFutures in *futures* have completed.
+
+    *timeout* applies to the whole group rather than to each move. Raises
+    RuntimeError if any of the moves fails or if the timeout elapses first.
+    """
+    start = ptime.time()
+    for fut in futures:
+        if timeout is None:
+            fut.wait(updates=updates)
+        else:
+            fut.wait(timeout=max(0, start + timeout - ptime.time()), updates=updates)
+
+
 class StageInterface(QtGui.QWidget):
     def __init__(self, dev, win):
         QtGui.QWidget.__init__(self)
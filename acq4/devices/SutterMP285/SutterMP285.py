@@ -19,13 +19,26 @@ class SutterMP285(Device, OptomechDevice):
     sigPositionChanged = QtCore.Signal(object)
     sigLimitsChanged = QtCore.Signal(object)
 
+    @staticmethod
+    def _portNumber(port):
+        ## windows com ports start at COM1, pyserial ports start at 0
+        # Interpret "COM1" as port 0
+        if isinstance(port, basestring) and port.lower()[:3] == 'com':
+            port = int(port[3:]) - 1
+        return port
+        
+    @classmethod
+    def initHardware(cls, config, name):
+        ## opening the controller takes more than a second
+        return SutterMP285Driver(cls._portNumber(config['port']), config.get('baud', 9600))
+        
     def __init__(self, dm, config, name):
         Device.__init__(self, dm, config, name)
         OptomechDevice.__init__(self, dm, config, name)
         self.config = config
         self.configFile = os.path.join('devices', name + '_config.cfg')
         self.lock = Mutex(QtCore.QMutex.Recursive)
-        self.port = config['port']  ## windows com ports start at COM1, pyserial ports start at 0
+        self.port = self._portNumber(config['port'])
 
         # whether this device has an arduino interface protecting it from roe/serial collisions
         # (see acq4/drivers/SutterMP285/mp285_hack)
@@ -33,9 +46,6 @@ class SutterMP285(Device, OptomechDevice):
         self.useArduino = config.get('useArduino', False)
 
         self.scale = config.pop('scale', (1, 1, 1))
-        # Interpret "COM1" as port 0
-        if isinstance(self.port, basestring) and self.port.lower()[:3] == 'com':
-            self.port = int(self.port[3:]) - 1
         
         self.baud = config.get('baud', 9600)   ## 9600 is probably factory default
         self.pos = [0, 0, 0]
@@ -47,7 +57,7 @@ class SutterMP285(Device, OptomechDevice):
         self.maxSpeed = 1e-3
         self.loadConfig()
         
-        self.mp285 = SutterMP285Driver(self.port, self.baud)
+        self.mp285 = self.getHardware(config, name)
         self.driverLock = Mutex(QtCore.QMutex.Recursive)
         
         self.mThread = SutterMP285Thread(self, self.mp285, self.driverLock, self.scale, self.limits, self.maxSpeed)
@@ -35,14 +35,19 @@ class SutterMPC200(Stage):
     _drives = [None] * 4
     slowSpeed = 4  # speed to move when user requests 'slow' movement
 
+    @classmethod
+    def initHardware(cls, config, name):
+        # open the controller's serial port; drives on the same port share one driver
+        return MPC200_Driver.getDevice(config['port'])
+
     def __init__(self, man, config, name):
+        self.dev = self.getHardware(config, name)
         self.port = config.pop('port')
         self.drive = config.pop('drive')
         self.scale = config.pop('scale', (1, 1, 1))
         if self._drives[self.drive-1] is not None:
             raise RuntimeError("Already created MPC200 device for drive %d!" % self.drive)
         self._drives[self.drive-1] = self
-        self.dev = MPC200_Driver.getDevice(self.port)
         # self._notifier.sigPosChanged.connect(self._mpc200PosChanged)
         man.sigAbortAll.connect(self.stop)
 
@@ -15,11 +15,15 @@ class ThorlabsMFC1(Stage):
     """Thorlabs motorized focus controller (MFC1)
     """
 
+    @classmethod
+    def initHardware(cls, config, name):
+        return MFC1_Driver(config['port'], **config.get('motorParams', {}))
+
     def __init__(self, man, config, name):
+        self.dev = self.getHardware(config, name)
         self.port = config.pop('port')
         self.scale = config.pop('scale', (1, 1, 1))
-        params = config.pop('motorParams', {})
-        self.dev = MFC1_Driver(self.port, **params)
+        config.pop('motorParams', None)
         man.sigAbortAll.connect(self.dev.stop)
 
         # Optionally use ROE-200 z axis to control focus
@@ -0,0 +1,113 @@
+import threading
+import pytest
+import numpy as np
+import acq4.pyqtgraph as pg
+import acq4.util.ptime as ptime
+from acq4.devices.MockStage import MockStage
+from acq4.devices.Stage import waitForMoves
+
+app = pg.mkQApp()
+
+
+class DummyManager(object):
+    def declareInterface(self, name, interfaces, obj):
+        pass
+
+
+def makeStage(name='stage'):
+    return MockStage(DummyManager(), {}, name)
+
+
+def test_moveSequence():
+    stage = makeStage()
+    try:
+        # 20 moves of 10 um at 1 mm/s, each taking 10 ms
+        n = 20
+        start = ptime.time()
+        for i in range(n):
+            stage.moveBy([10e-6, 0, 0], speed=1e-3).wait()
+        elapsed = ptime.time() - start
+        assert np.allclose(stage.getPosition(), [n * 10e-6, 0, 0])
+        # polling for completion every 100 ms would take at least 2 s
+        assert elapsed < 1.0
+    finally:
+        stage.quit()
+
+
+def test_interruptAndTimeout():
+    stage = makeStage()
+    try:
+        # 1 mm at 1 mm/s takes 1 s
+        fut = stage.moveTo([1e-3, 0, 0], speed=1e-3)
+        with pytest.raises(RuntimeError) as exc:
+            fut.wait(timeout=0.05)
+        assert 'Move did not complete' in str(exc.value)
+        assert not fut.isDone() and stage.isMoving()
+
+        threading.Timer(0.05, stage.stop).start()
+        start = ptime.time()
+        with pytest.raises(RuntimeError) as exc:
+            fut.wait()
+        assert 'interrupted' in str(exc.value)
+        assert ptime.time() - start < 0.5
+        assert fut.wasInterrupted() and not stage.isMoving()
+        assert 0 < stage.getPosition()[0] < 1e-3
+
+        # starting a new move interrupts the previous one
+        fut1 = stage.moveBy([1e-3, 0, 0], speed=1e-3)
+        fut2 = stage.moveBy([0, 10e-6, 0], speed=1e-3)
+        assert fut1.wasInterrupted()
+        fut2.wait()
+    finally:
+        stage.quit()
+
+
+def test_moveThreadError():
+    stage = makeStage()
+    try:
+        fut = stage.moveTo([1e-3, 0, 0], speed=1e-3)
+
+        def posChanged(pos):
+            raise ValueError("position update failed")
+        stage.posChanged = posChanged
+
+        with pytest.raises(RuntimeError) as exc:
+            fut.wait(timeout=1.0)
+        assert 'position update failed' in str(exc.value)
+        assert fut.wasInterrupted()
+    finally:
+        stage.quit()
+
+
+def test_callbacksAndGroups():
+    stages = [makeStage('stage1'), makeStage('stage2')]
+    try:
+        done = []
+        futs = [stage.moveTo([0, 20e-6 * (i + 1), 0], speed=1e-3).then(done.append)
+                for i, stage in enumerate(stages)]
+        start = ptime.time()
+        waitForMoves(futs, timeout=1.0)
+        assert ptime.time() - start < 0.5
+        assert set(done) == set(futs)
+
+        # callbacks registered after completion run immediately
+        later = []
+        futs[0].then(later.append)
+        assert later == [futs[0]]
+
+        # the timeout applies to the whole group
+        futs = [stage.moveBy([1e-3, 0, 0], speed=1e-3) for stage in stages]
+        start = ptime.time()
+        with pytest.raises(RuntimeError) as exc:
+            waitForMoves(futs, timeout=0.05)
+        assert 'Move did not complete' in str(exc.value)
+        assert ptime.time() - start < 0.5
+
+        # an interrupted move in the group is reported
+        threading.Timer(0.05, stages[0].stop).start()
+        with pytest.raises(RuntimeError) as exc:
+            waitForMoves(futs, timeout=2.0)
+        assert 'interrupted' in str(exc.value)
+    finally:
+        for stage in stages:
+            stage.quit()
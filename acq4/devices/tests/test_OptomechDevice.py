@@ -0,0 +1,108 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.pyqtgraph.Qt import QtGui
+from acq4.devices.OptomechDevice import OptomechDevice, transformMatrix
+
+
+def randomTransform(rng):
+    tr = pg.SRTTransform3D()
+    tr.setTranslate(rng.normal(size=3) * 1e-3)
+    tr.setScale(rng.uniform(0.5, 2.0, size=3))
+    tr.setRotate(rng.uniform(-180, 180), rng.normal(size=3))
+    return tr
+
+
+def buildTree(rng, nDevices=12):
+    """Return a list of devices with random transforms, each attached to a random earlier device
+    (or to no parent). Every fourth device gets a pair of subdevices."""
+    devices = []
+    for i in range(nDevices):
+        dev = OptomechDevice(None, {}, 'dev%d' % i)
+        dev.setDeviceTransform(randomTransform(rng))
+        if i > 0 and rng.uniform() < 0.8:
+            dev.setParentDevice(devices[rng.randint(len(devices))])
+        if i % 4 == 0:
+            for j in range(2):
+                sub = OptomechDevice(None, {}, 'dev%d_sub%d' % (i, j))
+                sub.setDeviceTransform(randomTransform(rng))
+                dev.addSubdevice(sub)
+        devices.append(dev)
+    return devices
+
+
+def referenceGlobalMatrix(dev):
+    """Global transform computed by walking the parent chain, without any caching."""
+    m = np.eye(4)
+    for d in dev.parentDevices():
+        m = np.dot(transformMatrix(d.deviceTransform()), m)
+    return m
+
+
+def checkDevice(dev, rng):
+    m = referenceGlobalMatrix(dev)
+    assert np.allclose(transformMatrix(dev.globalTransform()), m)
+    assert np.allclose(np.dot(transformMatrix(dev.inverseGlobalTransform()), m), np.eye(4))
+
+    pts = rng.normal(size=(20, 3))
+    expected = np.dot(pts, m[:3, :3].T) + m[:3, 3]
+
+    # single points, in all supported types
+    p = dev.mapToGlobal(QtGui.QVector3D(*pts[0]))
+    assert np.allclose([p.x(), p.y(), p.z()], expected[0], atol=1e-6)
+    assert np.allclose(dev.mapToGlobal(list(pts[0])), expected[0], atol=1e-6)
+    assert np.allclose(dev.mapToGlobal(tuple(pts[0])), expected[0], atol=1e-6)
+
+    # arrays: coordinate axis first for mapToGlobal, last for mapPointsToGlobal
+    assert np.allclose(dev.mapToGlobal(pts.T), expected.T)
+    assert np.allclose(dev.mapPointsToGlobal(pts), expected)
+    assert np.allclose(dev.mapPointsFromGlobal(expected), pts)
+    assert np.allclose(dev.mapFromGlobal(expected.T), pts.T)
+    assert np.allclose(dev.mapPointsToGlobal(pts[:, :2]), np.dot(pts[:, :2], m[:2, :2].T) + m[:2, 3])
+
+
+def test_randomTrees():
+    rng = np.random.RandomState(0)
+    for tree in range(5):
+        devices = buildTree(rng)
+        for dev in devices:
+            checkDevice(dev, rng)
+
+        # modify random devices (as a moving stage would) and check that every
+        # device picks up the change
+        for i in range(10):
+            dev = devices[rng.randint(len(devices))]
+            action = rng.randint(3)
+            if action == 0:
+                dev.setDeviceTransform(randomTransform(rng))
+            elif action == 1 and len(dev.listSubdevices()) > 0:
+                subs = dev.listSubdevices()
+                dev.setCurrentSubdevice(subs[rng.randint(len(subs))])
+            elif action == 2 and len(dev.listSubdevices()) > 0:
+                dev.getSubdevice().setDeviceTransform(randomTransform(rng))
+            for d in devices:
+                checkDevice(d, rng)
+
+
+def test_cacheReuse():
+    rng = np.random.RandomState(1)
+    root = OptomechDevice(None, {}, 'root')
+    child = OptomechDevice(None, {}, 'child')
+    other = OptomechDevice(None, {}, 'other')
+    child.setParentDevice(root)
+    other.setParentDevice(root)
+    for d in (root, child, other):
+        d.setDeviceTransform(randomTransform(rng))
+
+    # transforms are only recomputed after a device in the parent chain changes
+    m1 = child._OptomechDevice__cachedGlobalTransform()
+    assert child._OptomechDevice__cachedGlobalTransform() is m1
+    other.setDeviceTransform(randomTransform(rng))
+    assert child._OptomechDevice__cachedGlobalTransform() is m1
+    root.setDeviceTransform(randomTransform(rng))
+    m2 = child._OptomechDevice__cachedGlobalTransform()
+    assert m2 is not m1
+    assert np.allclose(m2[2], referenceGlobalMatrix(child))
+
+    # re-parenting is detected as well
+    child.setParentDevice(other)
+    assert np.allclose(transformMatrix(child.globalTransform()), referenceGlobalMatrix(child))
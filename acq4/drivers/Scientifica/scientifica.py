@@ -6,7 +6,7 @@ import serial, struct, time, collections
 import numpy as np
 
 from acq4.util.Mutex import RecursiveMutex as RLock
-from ..SerialDevice import SerialDevice, TimeoutError, DataError
+from ..SerialDevice import SerialDevice, SerialCommandQueue, TimeoutError, DataError
 
 
 # Data provided by Scientifica
@@ -44,9 +44,15 @@ class Scientifica(SerialDevice):
 
         # search for device with this description
         dev2 = Scientifica(name='SliceScope')
+
+    Commands from multiple threads are pipelined through a SerialCommandQueue, and
+    concurrent position/status queries are merged into a single request.
+    Several devices may be opened concurrently from different threads.
     """
     openDevices = {}
     availableDevices = None
+    _openingPorts = set()  # ports currently being opened
+    _openLock = RLock()  # protects the class attributes above
 
     @classmethod
     def enumerateDevices(cls):
@@ -58,33 +64,38 @@ class Scientifica(SerialDevice):
         (vid=0403, pid=6010) and sending a single serial request.
         """
         import serial.tools.list_ports
-        coms = serial.tools.list_ports.comports()
-        devs = {}
-        for com, name, ident in coms:
-            # several different ways this can appear:
-            #  VID_0403+PID_6010
-            #  VID_0403&PID_6010
-            #  VID:PID=0403:6010
-            if ('VID_0403' not in ident or 'PID_6010' not in ident) and '0403:6010' not in ident:
-                continue
-            com = cls.normalizePortName(com)
-            if com in cls.openDevices:
-                name = cls.openDevices[com].getDescription()
-                devs[name] = com
-            else:
-                s = Scientifica(port=com)
-                devs[s.getDescription()] = com
-                s.close()
-
-        cls.availableDevices = devs
+        with cls._openLock:
+            coms = serial.tools.list_ports.comports()
+            devs = {}
+            for com, name, ident in coms:
+                # several different ways this can appear:
+                #  VID_0403+PID_6010
+                #  VID_0403&PID_6010
+                #  VID:PID=0403:6010
+                if ('VID_0403' not in ident or 'PID_6010' not in ident) and '0403:6010' not in ident:
+                    continue
+                com = cls.normalizePortName(com)
+                if com in cls.openDevices:
+                    name = cls.openDevices[com].getDescription()
+                    devs[name] = com
+                elif com in cls._openingPorts:
+                    # being opened by another thread; it cannot be opened by name
+                    continue
+                else:
+                    s = Scientifica(port=com)
+                    devs[s.getDescription()] = com
+                    s.close()
+
+            cls.availableDevices = devs
 
     def __init__(self, port=None, name=None, baudrate=None):
         self.lock = RLock()
 
         if name is not None:
             assert port is None, "May not specify both name and port."
-            if self.availableDevices is None:
-                self.enumerateDevices()
+            with Scientifica._openLock:
+                if self.availableDevices is None:
+                    self.enumerateDevices()
             if name not in self.availableDevices:
                 raise ValueError('Could not find Scientifica device with description "%s". Options are: %s' % 
                     (name, list(self.availableDevices.keys())))
@@ -94,8 +105,19 @@ class Scientifica(SerialDevice):
             raise ValueError("Must specify either name or port.")
             
         self.port = self.normalizePortName(port)
-        if self.port in self.openDevices:
-            raise RuntimeError("Port %s is already in use by %s" % (port, self.openDevices[self.port]))
+        with Scientifica._openLock:
+            if self.port in self.openDevices or self.port in self._openingPorts:
+                raise RuntimeError("Port %s is already in use by %s" % (port, self.openDevices.get(self.port, 'another thread')))
+            Scientifica._openingPorts.add(self.port)
+        try:
+            self._open(baudrate)
+        finally:
+            with Scientifica._openLock:
+                Scientifica._openingPorts.discard(self.port)
+
+    def _open(self, baudrate):
+        # connect to the device at self.port; called only by __init__
+        port = self.port
 
         # try both baudrates, regardless of the requested rate
         # (but try the requested rate first)
@@ -121,24 +143,36 @@ class Scientifica(SerialDevice):
         if not connected:
             raise RuntimeError("No response received from Scientifica device at %s. (tried baud rates: %s)" % (port, ', '.join(map(str, baudrates))))
 
-        Scientifica.openDevices[self.port] = self
+        self.queue = SerialCommandQueue(self)
+        with Scientifica._openLock:
+            Scientifica.openDevices[self.port] = self
         self._readAxisScale()
 
     def close(self):
         port = self.port
         SerialDevice.close(self)
-        del Scientifica.openDevices[port]
+        with Scientifica._openLock:
+            del Scientifica.openDevices[port]
 
     def send(self, msg):
-        with self.lock:
-            self.write(msg + '\r')
-            result = self.readUntil('\r')[:-1]
+        return self.sendMany([msg])[0]
+
+    def sendMany(self, msgs, query=False):
+        """Send several commands and return the list of their responses.
+
+        The commands are written together and the responses are read back in order,
+        costing a single round trip. If *query* is True, the commands have no side
+        effects and may be merged with identical commands from other threads.
+        """
+        read = lambda: self.readUntil('\r')[:-1]
+        results = self.queue.requestMany([(msg + '\r', read, msg if query else None) for msg in msgs])
+        for msg, result in zip(msgs, results):
             if result.startswith('E,'):
                 errno = int(result.strip()[2:])
                 exc = RuntimeError("Received error %d from Scientifica controller (request: %r)" % (errno, msg))
                 exc.errno = errno
                 raise exc
-            return result
+        return results
 
     def getFirmwareVersion(self):
         return self.send('DATE').partition(' ')[2].partition('\t')[0]
@@ -171,10 +205,21 @@ class Scientifica(SerialDevice):
         Usually the stage reports this value in units of 0.1 micrometers (and it is converted to um
         before returning). However, this relies on having correct axis scaling--see get/setAxisScale().
         """
-        with self.lock:
-            ## request position
-            packet = self.send('POS')
-            return [int(x) / 10. for x in packet.split('\t')]
+        ## request position
+        packet = self.sendMany(['POS'], query=True)[0]
+        return self._parsePos(packet)
+
+    def getStatus(self):
+        """Return (isMoving, position) from a single request to the controller.
+
+        See isMoving() and getPos().
+        """
+        moving, packet = self.sendMany(['S', 'POS'], query=True)
+        return int(moving) != 0, self._parsePos(packet)
+
+    @staticmethod
+    def _parsePos(packet):
+        return [int(x) / 10. for x in packet.split('\t')]
 
     _param_commands = {
         'maxSpeed': ('TOP', 'TOP %f', float),
@@ -346,8 +391,7 @@ class Scientifica(SerialDevice):
                 self.setSpeed(speed)
 
             # Send move command
-            self.write(b'ABS %d %d %d\r' % tuple(pos))
-            self.readUntil('\r')
+            self.queue.request(b'ABS %d %d %d\r' % tuple(pos), lambda: self.readUntil('\r'))
 
     def zeroPosition(self):
         """Reset the stage coordinates to (0, 0, 0) without moving the stage.
@@ -376,7 +420,7 @@ class Scientifica(SerialDevice):
     def isMoving(self):
         """Return True if the manipulator is moving.
         """
-        return int(self.send('S')) != 0
+        return int(self.sendMany(['S'], query=True)[0]) != 0
 
     def reset(self):
         self.send('RESET')
@@ -387,7 +431,8 @@ class Scientifica(SerialDevice):
         """
         baudkey = {9600: '96', 38400: '38'}[baudrate]
         with self.lock:
-            self.write('BAUD %s\r' % baudkey)
-            self.close()
-            self.open(baudrate=baudrate)
+            with self.queue.exclusive():
+                self.write('BAUD %s\r' % baudkey)
+                SerialDevice.close(self)
+                self.open(baudrate=baudrate)
 
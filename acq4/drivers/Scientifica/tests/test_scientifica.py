@@ -0,0 +1,175 @@
+import os, sys, time, select, threading
+import pytest
+from acq4.drivers.Scientifica import Scientifica
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith('win'), reason="requires a pseudo-terminal")
+
+
+class FakeScientifica(object):
+    """Pseudo-terminal emulating a Scientifica controller.
+
+    Each group of commands received together is answered after *latency* seconds
+    (one round trip), with one '\\r'-terminated response per command.
+    """
+    def __init__(self, latency=0.005):
+        import pty
+        self.fd, self._slave = pty.openpty()
+        self.port = os.ttyname(self._slave)
+        self.latency = latency
+        self.roundTrips = 0
+        self.commands = []
+        self.pos = [0, 0, 0]
+        self.moving = 0
+        self._stop = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        buf = ''
+        while not self._stop:
+            if len(select.select([self.fd], [], [], 0.02)[0]) == 0:
+                continue
+            buf += os.read(self.fd, 4096)
+            cmds = buf.split('\r')
+            buf = cmds.pop()
+            if len(cmds) == 0:
+                continue
+            self.roundTrips += 1
+            time.sleep(self.latency)
+            os.write(self.fd, ''.join([self.respond(cmd) + '\r' for cmd in cmds]))
+
+    def respond(self, cmd):
+        self.commands.append(cmd)
+        if cmd == 'type':
+            return '1.11'
+        elif cmd in ('UUX', 'UUY', 'UUZ'):
+            return '-4.03'
+        elif cmd == 'POS':
+            self.pos[0] += 1
+            return '\t'.join(map(str, self.pos))
+        elif cmd == 'S':
+            return str(self.moving)
+        elif cmd == 'bad':
+            return 'E,3'
+        return 'A:' + cmd
+
+    def close(self):
+        self._stop = True
+        self.thread.join()
+        os.close(self.fd)
+        os.close(self._slave)
+
+
+def openDevice(**kwds):
+    fake = FakeScientifica(**kwds)
+    dev = Scientifica(port=fake.port)
+    fake.roundTrips = dev.queue.roundTrips = 0
+    fake.commands = []
+    return fake, dev
+
+
+def runThreads(fn, n):
+    errors = []
+    def run(i):
+        try:
+            fn(i)
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_pipelining():
+    fake, dev = openDevice()
+    try:
+        assert dev.getStatus() == (False, [0.1, 0.0, 0.0])
+        assert fake.roundTrips == 1
+        fake.moving = 1
+        assert dev.isMoving() is True
+        assert dev.getPos() == [0.2, 0.0, 0.0]
+        assert fake.roundTrips == 3
+
+        assert dev.sendMany(['desc', 'DATE', 'TOP']) == ['A:desc', 'A:DATE', 'A:TOP']
+        assert fake.roundTrips == 4
+
+        ## an error response is raised, and later commands stay in sync
+        with pytest.raises(RuntimeError) as exc:
+            dev.sendMany(['one', 'bad', 'two'])
+        assert exc.value.errno == 3
+        assert dev.send('three') == 'A:three'
+        assert fake.commands[-4:] == ['one', 'bad', 'two', 'three']
+    finally:
+        dev.close()
+        fake.close()
+
+
+def test_concurrentCallers():
+    fake, dev = openDevice(latency=0.01)
+    nThreads, nCmds = 8, 10
+    try:
+        def sendCommands(i):
+            for j in range(nCmds):
+                msg = 'CMD %d %d' % (i, j)
+                assert dev.send(msg) == 'A:' + msg
+        runThreads(sendCommands, nThreads)
+        assert len(fake.commands) == nThreads * nCmds
+        # commands from waiting threads were sent together
+        assert fake.roundTrips < nThreads * nCmds / 2
+        for i in range(nThreads):
+            mine = [c for c in fake.commands if c.startswith('CMD %d ' % i)]
+            assert mine == ['CMD %d %d' % (i, j) for j in range(nCmds)]
+    finally:
+        dev.close()
+        fake.close()
+
+
+def test_coalescedPolls():
+    fake, dev = openDevice(latency=0.01)
+    nThreads, nPolls = 8, 10
+    try:
+        results = [[] for i in range(nThreads)]
+        def poll(i):
+            for j in range(nPolls):
+                results[i].append(dev.getStatus()[1][0] if j % 2 else dev.getPos()[0])
+        runThreads(poll, nThreads)
+        for r in results:
+            # every caller sees a position read after its request was made
+            assert r == sorted(r)
+            assert len(set(r)) == nPolls
+        # redundant position queries from different threads were merged
+        assert fake.commands.count('POS') < nThreads * nPolls / 2
+        assert fake.roundTrips == dev.queue.roundTrips
+    finally:
+        dev.close()
+        fake.close()
+
+
+def test_concurrentOpen():
+    fakes = [FakeScientifica(latency=0.05) for i in range(2)]
+    devs = [None, None]
+    try:
+        def openPort(i):
+            devs[i] = Scientifica(port=fakes[i].port)
+        start = time.time()
+        runThreads(openPort, 2)
+        # each open takes several round trips (about 0.2 s); the handshakes overlapped
+        assert time.time() - start < 0.3
+        assert [dev.port for dev in devs] == [Scientifica.normalizePortName(f.port) for f in fakes]
+        assert set(Scientifica.openDevices.keys()) == set(dev.port for dev in devs)
+
+        # a port may not be opened twice
+        with pytest.raises(RuntimeError) as exc:
+            Scientifica(port=fakes[0].port)
+        assert 'already in use' in str(exc.value)
+        assert len(Scientifica._openingPorts) == 0
+    finally:
+        for dev in devs:
+            if dev is not None:
+                dev.close()
+        for fake in fakes:
+            fake.close()
@@ -1,4 +1,4 @@
-import serial, time, sys
+import serial, time, sys, select, errno, threading
 import logging
 
 class TimeoutError(Exception):
@@ -44,6 +44,7 @@ class SerialDevice(object):
             'bytesize': serial.EIGHTBITS, 
             'timeout': 0, # no timeout. See SerialDevice._readWithTimeout()
         }
+        self._fd = None
         self.__serialOpts.update(kwds)
 
         if 'port' in kwds and 'baudrate' in self.__serialOpts:
@@ -81,12 +82,14 @@ class SerialDevice(object):
             })
         self.__serialOpts.update(kwds)
         self.serial = serial.Serial(**self.__serialOpts)
+        self._fd = self._portFileno()
         logging.info('Opened serial port: %s', self.__serialOpts)
 
     def close(self):
         """Close the serial port."""
         self.serial.close()
         self.serial = None
+        self._fd = None
         logging.info('Closed serial port: %s', self.__serialOpts['port'])
 
     def readAll(self):
@@ -131,11 +134,13 @@ class SerialDevice(object):
         # serial data to be lost) so we implement our own in readWithTimeout().
         start = time.time()
         packet = ''
-        # Interval between serial port checks is adaptive:
+        # When the port has a file descriptor (posix), block in select() until data arrives.
+        # Otherwise the interval between serial port checks is adaptive:
         #   * start with very short interval for low-latency reads
         #   * iteratively increase interval duration to reduce CPU usage on long reads
         sleep = 100e-6  # initial sleep is 100 us
-        while time.time()-start < timeout:
+        signalled = False
+        while True:
             waiting = self.serial.inWaiting()
             if waiting > 0:
                 readBytes = min(waiting, nBytes-len(packet))
@@ -143,10 +148,38 @@ class SerialDevice(object):
                 sleep = 100e-6  # every time we read data, reset sleep time
             if len(packet) >= nBytes:
                 break
-            time.sleep(sleep)
-            sleep = min(0.05, 2*sleep) # wait a bit longer next time
+            remaining = timeout - (time.time()-start)
+            if remaining <= 0:
+                break
+            if self._fd is not None and not (signalled and waiting == 0):
+                signalled = self._waitReadable(remaining)
+            else:
+                # no file descriptor, or select() reported data that never arrived (eg. hangup)
+                time.sleep(min(sleep, remaining))
+                sleep = min(0.05, 2*sleep) # wait a bit longer next time
+                signalled = False
         return packet
 
+    def _waitReadable(self, timeout):
+        """Block until the port has data to read or *timeout* seconds have elapsed.
+        Return True if the port became readable."""
+        try:
+            return len(select.select([self._fd], [], [], timeout)[0]) > 0
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return False
+            raise
+
+    def _portFileno(self):
+        """Return the file descriptor of the open port, or None if it cannot be
+        used with select() (windows, or ports opened by URL)."""
+        if sys.platform.startswith('win'):
+            return None
+        try:
+            return self.serial.fileno()
+        except Exception:
+            return None
+
     def readUntil(self, term, minBytes=0, timeout=5):
         """Read from the serial port until *term* is received, or *timeout* has elapsed.
 
@@ -173,11 +206,23 @@ class SerialDevice(object):
 
                 return packet
 
-    def clearBuffer(self):
+    def clearBuffer(self, quietTime=None, timeout=1.0):
+        """Read and discard data until nothing more has arrived for *quietTime* seconds.
+
+        By default, *quietTime* is 10 ms or the time needed to receive 16 bytes at the
+        configured baud rate, whichever is longer. Data that keeps arriving is read for
+        at most *timeout* seconds. Returns the discarded data.
+        """
         ## not recommended..
+        if quietTime is None:
+            quietTime = max(0.01, 16 * 10. / float(self.__serialOpts['baudrate']))
+        start = time.time()
         d = self.readAll()
-        time.sleep(0.1)
-        d += self.readAll()
+        while time.time() - start < timeout:
+            chunk = self._readWithTimeout(1, min(quietTime, timeout - (time.time() - start)))
+            if len(chunk) == 0:
+                break
+            d += chunk + self.readAll()
         if len(d) > 0:
             print self, "Warning: discarded serial data ", repr(d)
         return d
@@ -193,6 +238,125 @@ class SerialDevice(object):
         return self.__serialOpts['baudrate']
 
 
+
+class SerialCommandQueue(object):
+    """Pipelines request/response commands from any number of threads over one serial port.
+
+    Requests that arrive while the port is busy are queued. When the port becomes
+    free, one of the waiting threads writes all queued commands at once and then
+    reads their responses back in the same order, so a group of commands costs a
+    single round trip. Queued requests that share a *key* (eg. two threads polling
+    the position) are sent once and receive the same response.
+
+    All communication on the port must go through the queue; use exclusive() for
+    anything that does not fit the request/response pattern.
+    """
+    def __init__(self, dev):
+        self.dev = dev
+        self.roundTrips = 0  # number of batches written to the port
+        self._cond = threading.Condition()
+        self._queue = []
+        self._busy = False
+
+    def request(self, cmd, read, key=None):
+        """Write *cmd* and return the result of calling *read*(), which must read
+        the complete response to *cmd* from the port.
+
+        Requests with the same *key* that are waiting together are merged; only
+        use a key for commands without side effects.
+        """
+        return self.requestMany([(cmd, read, key)])[0]
+
+    def requestMany(self, requests):
+        """Send a list of (cmd, read, key) requests in order and return a list of
+        their responses. See request().
+
+        Errors raised while reading a response (eg. TimeoutError) are raised here and
+        fail all later requests in the same batch, since their responses can no longer
+        be matched.
+        """
+        with self._cond:
+            reqs = [self._enqueue(*r) for r in requests]
+            while not all(r.done for r in reqs):
+                if self._busy:
+                    self._cond.wait()
+                    continue
+                batch = self._queue
+                self._queue = []
+                self._busy = True
+                self._cond.release()
+                try:
+                    self._process(batch)
+                finally:
+                    self._cond.acquire()
+                    self._busy = False
+                    self._cond.notify_all()
+
+        for r in reqs:
+            if r.error is not None:
+                raise r.error
+        return [r.result for r in reqs]
+
+    def exclusive(self):
+        """Return a context manager that holds the port exclusively (no queued
+        requests are processed until it exits)."""
+        return _ExclusivePort(self)
+
+    def _enqueue(self, cmd, read, key):
+        if key is not None:
+            for req in self._queue:
+                if req.key == key:
+                    return req
+        req = _SerialRequest(cmd, read, key)
+        self._queue.append(req)
+        return req
+
+    def _process(self, batch):
+        self.roundTrips += 1
+        error = None
+        try:
+            self.dev.write(''.join([r.cmd for r in batch]))
+        except Exception as exc:
+            error = exc
+        for r in batch:
+            if error is None:
+                try:
+                    r.result = r.read()
+                except Exception as exc:
+                    error = exc
+            r.error = error
+            r.done = True
+
+
+class _SerialRequest(object):
+    def __init__(self, cmd, read, key):
+        self.cmd = cmd
+        self.read = read
+        self.key = key
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class _ExclusivePort(object):
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __enter__(self):
+        q = self.queue
+        with q._cond:
+            while q._busy:
+                q._cond.wait()
+            q._busy = True
+        return q.dev
+
+    def __exit__(self, *args):
+        q = self.queue
+        with q._cond:
+            q._busy = False
+            q._cond.notify_all()
+
+
 if __name__ == '__main__':
     import sys, os
     try:
@@ -247,7 +247,7 @@ class SutterMP285(SerialDevice):
         self.write(cmd)
         
         ## wait for reset, check for error
-        s = self.clearBuffer()
+        s = self.clearBuffer(quietTime=0.1)
         if len(s) == 2 and s[1] == '\r':
             self.raiseError(s[0])
             
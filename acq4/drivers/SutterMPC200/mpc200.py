@@ -54,6 +54,7 @@ class SutterMPC200(SerialDevice):
     """
 
     DEVICES = {}
+    _devicesLock = RLock()  # serializes getDevice() so each port is opened only once
 
     speedTable = {
         # Measured 2015.03 for sutter stage. (see measureSpeedTable() below)
@@ -86,10 +87,11 @@ class SutterMPC200(SerialDevice):
         *port* must be a serial COM port (eg. COM3 or /dev/ttyACM0)        
         """
         port = SerialDevice.normalizePortName(port)
-        if port in cls.DEVICES:
-            return cls.DEVICES[port]
-        else:
-            return SutterMPC200(port=port)
+        with cls._devicesLock:
+            if port in cls.DEVICES:
+                return cls.DEVICES[port]
+            else:
+                return SutterMPC200(port=port)
 
     def __init__(self, port):
         port = SerialDevice.normalizePortName(port)
@@ -158,6 +158,14 @@ class SuperTask:
                     raise
                 self.taskInfo[k]['dataWritten'] = True
         
+    def rearm(self):
+        """Prepare to start all tasks again with the same waveforms.
+        
+        The cached waveform arrays are written to the output tasks again by
+        the next call to start(); they are not reassembled."""
+        for k in self.taskInfo:
+            self.taskInfo[k]['dataWritten'] = False
+        
     def hasTasks(self):
         return len(self.tasks) > 0
         
@@ -271,6 +279,16 @@ class SuperTask:
                 return False
         return True
         
+    def wait(self, timeout=None):
+        """Block until all tasks are done. Return False if any task is still
+        running after *timeout* seconds (by default, wait indefinitely)."""
+        end = None if timeout is None else ptime.time() + timeout
+        for t in self.tasks:
+            remaining = None if end is None else max(0, end - ptime.time())
+            if not self.tasks[t].wait(remaining):
+                return False
+        return True
+        
     def read(self):
         data = {}
         for t in self.tasks:
@@ -152,6 +152,16 @@ class MockNIDAQ:
         if diff > 0:
             time.sleep(diff)
 
+    def waitClock(self, clock, timeout=None):
+        start, dur = self.clocks[clock]
+        diff = (start+dur)-time.time()
+        if timeout is not None and diff > timeout:
+            time.sleep(timeout)
+            return False
+        if diff > 0:
+            time.sleep(diff)
+        return True
+
     def checkClock(self, clock):
         now = time.time()
         start, dur = self.clocks[clock]
@@ -256,6 +266,12 @@ class Task:
         else:
             return self.nd.checkClock(self.clock)
         
+    def wait(self, timeout=None):
+        if self.clock is None:
+            return self.nd.waitClock(self.nativeClock, timeout)
+        else:
+            return self.nd.waitClock(self.clock, timeout)
+        
 
     def GetTaskNumChans(self):
         return len(self.chans)
@@ -263,6 +263,20 @@ class Task:
     def isDone(self):
         return self.IsTaskDone()
 
+    def wait(self, timeout=None):
+        """Block until the task is done. Return False if it is still running
+        after *timeout* seconds (by default, wait indefinitely)."""
+        if timeout is None:
+            timeout = LIB.Val_WaitInfinitely
+        try:
+            self.WaitUntilTaskDone(timeout)
+        except NIDAQError as exc:
+            if exc.errCode == -200560:
+                # Timed out before the task finished
+                return False
+            raise
+        return True
+
     def read(self, samples=None, timeout=10., dtype=None):
         #reqSamps = samples
         #if samples is None:
@@ -0,0 +1,29 @@
+import numpy as np
+from acq4.drivers.nidaq.mock import MockNIDAQ
+
+
+def makeSuperTask(duration, nPts=1000):
+    st = MockNIDAQ().createSuperTask()
+    st.addChannel('/Dev1/ao0', 'ao')
+    st.addChannel('/Dev1/ai0', 'ai')
+    st.setWaveform('/Dev1/ao0', np.linspace(0, 1, nPts))
+    st.configureClocks(rate=nPts / float(duration), nPts=nPts)
+    return st
+
+
+def test_wait():
+    st = makeSuperTask(0.3)
+    for i in range(2):
+        if i > 0:
+            ## a re-armed task writes its cached waveforms again and runs with the same configuration
+            st.rearm()
+            assert not st.taskInfo[('Dev1', 'ao')]['dataWritten']
+        st.start()
+        assert st.taskInfo[('Dev1', 'ao')]['dataWritten']
+        assert not st.wait(0.05)
+        assert not st.isDone()
+        assert st.wait(2.0)
+        assert st.isDone()
+        st.stop()
+        result = st.getResult('/Dev1/ao0')
+        assert np.all(result['data'] == np.linspace(0, 1, 1000))
@@ -0,0 +1,135 @@
+import os, sys, time, threading
+import pytest
+from acq4.drivers.SerialDevice import SerialDevice, TimeoutError, DataError
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith('win'), reason="requires a pseudo-terminal")
+
+
+class PtyDevice(object):
+    """Pseudo-terminal standing in for a serial device. Bytes sent from here are
+    received by a SerialDevice opened on *port*."""
+    def __init__(self):
+        import pty
+        self.fd, self._slave = pty.openpty()
+        self.port = os.ttyname(self._slave)
+        self.sendTimes = []
+
+    def send(self, data, delay=0):
+        """Send *data* after *delay* seconds; the time it was sent is appended to sendTimes."""
+        def send():
+            self.sendTimes.append(time.time())
+            os.write(self.fd, data)
+        if delay == 0:
+            send()
+        else:
+            threading.Timer(delay, send).start()
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self._slave)
+
+
+def openDevice():
+    dev = PtyDevice()
+    return dev, SerialDevice(port=dev.port, baudrate=115200)
+
+
+def test_readLatency():
+    dev, sd = openDevice()
+    try:
+        latency = []
+        for i in range(5):
+            dev.send('packet%d\r' % i, delay=0.1)
+            assert sd.read(8, timeout=1.0, term='\r') == 'packet%d' % i
+            latency.append(time.time() - dev.sendTimes[-1])
+        # polling with sleeps added up to 50 ms here
+        assert max(latency) < 5e-3
+
+        ## packet arriving in pieces
+        dev.send('ab')
+        dev.send('cd', delay=0.02)
+        dev.send('e\r', delay=0.04)
+        start = time.time()
+        assert sd.read(6, term='\r') == 'abcde'
+        assert time.time() - dev.sendTimes[-1] < 5e-3
+        assert time.time() - start < 0.1
+    finally:
+        sd.close()
+        dev.close()
+
+
+def test_timeouts():
+    dev, sd = openDevice()
+    try:
+        dev.send('ab')
+        start = time.time()
+        with pytest.raises(TimeoutError) as exc:
+            sd.read(4, timeout=0.1)
+        assert 0.1 <= time.time() - start < 0.15
+        assert exc.value.data == 'ab'
+
+        dev.send('xy')
+        dev.send('z', delay=0.02)
+        start = time.time()
+        with pytest.raises(TimeoutError) as exc:
+            sd.readUntil('\n', timeout=0.1)
+        assert 0.1 <= time.time() - start < 0.15
+        assert exc.value.data == 'xyz'
+
+        dev.send('12')
+        with pytest.raises(TimeoutError) as exc:
+            sd.readUntil('\n', minBytes=4, timeout=0.1)
+        assert exc.value.data == '12'
+    finally:
+        sd.close()
+        dev.close()
+
+
+def test_terminators():
+    dev, sd = openDevice()
+    try:
+        dev.send('ok\r\n')
+        assert sd.read(4, term='\r\n') == 'ok'
+
+        ## corrupt packet; whatever follows it is reported as extra data
+        dev.send('abcdXYZ')
+        with pytest.raises(DataError) as exc:
+            sd.read(4, term='\r')
+        assert exc.value.data == 'abcd'
+        assert exc.value.extra == 'XYZ'
+
+        dev.send('one\ntwo')
+        dev.send('\n', delay=0.02)
+        assert sd.readUntil('\n') == 'one\n'
+        assert sd.readUntil('\n') == 'two\n'
+
+        ## terminator is not checked within the first minBytes
+        dev.send('\n\nab\n')
+        assert sd.readUntil('\n', minBytes=2) == '\n\nab\n'
+        assert sd.readAll() == ''
+    finally:
+        sd.close()
+        dev.close()
+
+
+def test_clearBuffer():
+    dev, sd = openDevice()
+    try:
+        start = time.time()
+        assert sd.clearBuffer() == ''
+        assert time.time() - start < 0.05
+
+        ## data still arriving is discarded as well
+        dev.send('junk')
+        dev.send('more', delay=0.005)
+        start = time.time()
+        assert sd.clearBuffer() == 'junkmore'
+        assert time.time() - start < 0.05
+
+        dev.send('late', delay=0.05)
+        assert sd.clearBuffer(quietTime=0.1) == 'late'
+        dev.send('ok\r')
+        assert sd.read(3, term='\r') == 'ok'
+    finally:
+        sd.close()
+        dev.close()
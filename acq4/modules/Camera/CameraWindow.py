@@ -14,6 +14,8 @@ from acq4.util.Thread import Thread
 from acq4.util.Mutex import Mutex
 from .sequencerTemplate import Ui_Form as SequencerTemplate
 from acq4.util.metaarray import MetaArray
+from acq4.util.RingBuffer import RingBuffer
+from acq4.util.imaging.roi_means import ROIMeans
 from acq4.pyqtgraph import ptime
 
 
@@ -388,6 +390,11 @@ class RulerROI(pg.LineSegmentROI):
 
 class ROIPlotter(QtGui.QWidget):
     # ROI plot ctrls
+
+    # number of frames of ROI history kept (20 s at 1 kHz); older frames are
+    # dropped even if they are within the plotted time range
+    historySize = 20000
+
     def __init__(self, mod):
         QtGui.QWidget.__init__(self)
         self.mod = weakref.ref(mod)
@@ -397,6 +404,9 @@ class ROIPlotter(QtGui.QWidget):
         self.lastPlotTime = None
         self.ROIs = []
         self.plotCurves = []
+        self.roiMeans = ROIMeans()
+        # history of [frame time, mean of each measured ROI]
+        self.roiHistory = RingBuffer(rowShape=(1,), size=self.historySize)
 
         # Set up UI
         self.roiLayout = QtGui.QGridLayout()
@@ -478,8 +488,9 @@ class ROIPlotter(QtGui.QWidget):
         roi.setPen(pen)
         self.view.addItem(roi)
         plot = self.roiPlot.plot(pen=pen)
-        self.ROIs.append({'roi': roi, 'plot': plot, 'vals': [], 'times': []})
+        self.ROIs.append({'roi': roi, 'plot': plot})
         roi.sigRemoveRequested.connect(self.removeROI)
+        self.measuredROIsChanged()
 
     def removeROI(self, roi):
         self.view.removeItem(roi)
@@ -489,12 +500,33 @@ class ROIPlotter(QtGui.QWidget):
                 self.roiPlot.removeItem(r['plot'])
                 self.ROIs.remove(r)
                 break
+        self.measuredROIsChanged()
         
     def clearROIs(self):
         for r in self.ROIs:
             self.view.removeItem(r['roi'])
             self.roiPlot.removeItem(r['plot'])
         self.ROIs = []
+        self.measuredROIsChanged()
+
+    def measuredROIs(self):
+        """Return the ROI entries whose mean values are recorded (all but rulers)."""
+        return [r for r in self.ROIs if not isinstance(r['roi'], RulerROI)]
+
+    def measuredROIsChanged(self):
+        # keep the history of ROIs that still exist; new ROIs have no history (NaN)
+        oldROIs = self.roiMeans.rois
+        rois = [r['roi'] for r in self.measuredROIs()]
+        old = self.roiHistory.data()
+        new = np.empty((len(old), len(rois)+1))
+        new[:] = np.nan
+        new[:, 0] = old[:, 0]
+        for i, roi in enumerate(rois):
+            if roi in oldROIs:
+                new[:, i+1] = old[:, oldROIs.index(roi)+1]
+        self.roiHistory = RingBuffer(rowShape=(len(rois)+1,), size=self.historySize)
+        self.roiHistory.extend(new)
+        self.roiMeans.setROIs(rois)
 
     def newFrame(self, iface, frame):
         """New frame has arrived; update ROI plot if needed.
@@ -508,42 +540,31 @@ class ROIPlotter(QtGui.QWidget):
             return
         
         # Get rid of old frames
-        minTime = None
         now = pg.time()
-        for r in self.ROIs:
-            while len(r['times']) > 0 and r['times'][0] < (now-self.roiTimeSpin.value()):
-                r['times'].pop(0)
-                r['vals'].pop(0)
-            if len(r['times']) > 0 and (minTime is None or r['times'][0] < minTime):
-                minTime = r['times'][0]
-        if minTime is None:
-            minTime = frame.info()['time']
+        hist = self.roiHistory
+        cutoff = now - self.roiTimeSpin.value()
+        hist.popFront(hist.searchsorted(cutoff))
+        frameTime = frame.info()['time']
+        minTime = hist[0][0] if len(hist) > 0 else frameTime
                 
         prof.mark('remove old frames')
             
-        # add new frame
-        draw = False
+        # add new frame; all ROI means are computed at once
+        row = np.empty(len(self.roiMeans.rois) + 1)
+        row[0] = frameTime
+        row[1:] = self.roiMeans.means(frame.data(), imageItem)
+        hist.append(row)
+        prof.mark('ROI means')
+
         if self.lastPlotTime is None or now - self.lastPlotTime > 0.05:
-            draw = True
             self.lastPlotTime = now
-            
-        for r in self.ROIs:
-            if isinstance(r['roi'], RulerROI):
-                continue
-            d = r['roi'].getArrayRegion(frame.data(), imageItem, axes=(0,1))
-            prof.mark('get array rgn')
-            if d is None:
-                continue
-            if d.size < 1:
-                val = 0
-            else:
-                val = d.mean()
-            r['vals'].append(val)
-            r['times'].append(frame.info()['time'])
-            prof.mark('append')
-            if draw:
-                r['plot'].setData(np.array(r['times'])-minTime, r['vals'])
-                prof.mark('draw')
+            data = hist.data()
+            t = data[:, 0] - minTime
+            for i, r in enumerate(self.measuredROIs()):
+                vals = data[:, i+1]
+                mask = np.isfinite(vals)
+                r['plot'].setData(t[mask], vals[mask])
+            prof.mark('draw')
         prof.finish()
 
 
@@ -42,7 +42,7 @@ from acq4.util import metaarray as MA
 from acq4.util.Mutex import Mutex
 from acq4.util import imaging
 from acq4.util.Thread import Thread
-from acq4.util.debug import printExc
+from acq4.util.debug import printExc, Profiler
 from .imagerTemplate import Ui_Form
 
 
@@ -428,6 +428,7 @@ class Imager(Module):
         self.param.child('Scan Control').sigTreeStateChanged.connect(self.updateParams)
         self.param.child('Image Control').sigTreeStateChanged.connect(self.updateDecomb)
         self.param.child('Image Control', 'Decomb', 'Auto').sigActivated.connect(self.autoDecomb)
+        self.updateDecomb()
 
         self.manager.sigAbortAll.connect(self.abortTask)
 
@@ -491,7 +492,7 @@ class Imager(Module):
         perhaps the stage position, etc. This needs to be obtained to re-align
         the scanner ROI
         """
-        prof = pg.debug.Profiler()
+        prof = Profiler()
         globalTr = self.scannerDev.globalTransform()
         pt1 = globalTr.map(self.currentRoi.scannerCoords[0])
         pt2 = globalTr.map(self.currentRoi.scannerCoords[1])
@@ -742,8 +743,10 @@ class Imager(Module):
         self.imagingThread.setProtocol(protocol, metainfo, system.copy())
 
     def updateDecomb(self):
+        decomb = (self.param['Image Control', 'Decomb'], self.param['Image Control', 'Decomb', 'Subpixel'])
+        self.imagingThread.setDecomb(*decomb)
         if self.lastFrame is not None:
-            self.lastFrame.setDecomb(self.param['Image Control', 'Decomb'], self.param['Image Control', 'Decomb', 'Subpixel'])
+            self.lastFrame.setDecomb(*decomb)
             self.frameDisplay.updateFrame()
 
     def autoDecomb(self):
@@ -1111,6 +1114,7 @@ class ImagingThread(Thread):
         self._abort = False
         self._video = True
         self._closeShutter = True  # whether to close shutter at end of acquisition
+        self._decomb = (0, False)
         self.lock = Mutex(recursive=True)
         self.manager = acq4.Manager.getManager()
         self.laserDev = laserDev
@@ -1125,6 +1129,11 @@ class ImagingThread(Thread):
             self.metainfo = meta
             self.system = sys
 
+    def setDecomb(self, offset, subpixel):
+        """Set the decomb parameters used to decode new frames in this thread."""
+        with self.lock:
+            self._decomb = (offset, subpixel)
+
     def abort(self):
         with self.lock:
             self._abort = True
@@ -1151,6 +1160,7 @@ class ImagingThread(Thread):
         self.start()
 
     def run(self):
+        running = []  # frames that have been started but not collected
         try:
             with self.lock:
                 videoRequested = self._video
@@ -1159,18 +1169,49 @@ class ImagingThread(Thread):
                 # force shutter to stay open for the duration of the acquisition
                 self.laserDev.openShutter()
 
+            # Frames are pipelined: as soon as one frame has been collected, its task is
+            # re-armed and started again for the next frame, reusing the DAQ configuration
+            # and cached scan waveforms. The data for the previous frame is then decoded
+            # while the next one is acquired. If the task cannot be re-armed, the task for
+            # the next frame is built while the hardware is busy instead.
+            running.append(self.startFrame(self.buildTask()))
+            rearm = True
             while True:
-                # take one frame
-                self.acquireFrame(allowBlanking=False)
+                with self.lock:
+                    video = self._video
+
+                nextTask = self.buildTask() if (video and not rearm) else None
+                frameTask = running[0]
+                data = self.waitForFrame(frameTask)
+                running.pop(0)
 
                 # See whether acquisition should end
                 with self.lock:
-                    video, abort = self._video, self._abort
+                    video, abort, prot = self._video, self._abort, self.protocol
                 if video is False:
+                    self.emitFrame(frameTask, data)
                     break
                 if abort is True:
                     raise Exception("Imaging acquisition aborted")
+
+                if rearm and frameTask[1] is prot:
+                    rearm = frameTask[0].rearm()
+                    if rearm:
+                        nextTask = frameTask[:4]
+                if nextTask is None or nextTask[1] is not prot:
+                    # protocol changed while the last frame was acquired, or the
+                    # task could not be re-armed
+                    nextTask = self.buildTask()
+                running.append(self.startFrame(nextTask))
+
+                # decode the last frame while the next one is acquired
+                self.emitFrame(frameTask, data)
         except Exception:
+            for frameTask in running:
+                try:
+                    frameTask[0].abort()
+                except Exception:
+                    printExc("Error aborting imaging task.")
             self.sigAborted.emit()
             printExc("Error in imaging acquisition thread.")
         finally:
@@ -1179,24 +1220,46 @@ class ImagingThread(Thread):
             if closeShutter and self.laserDev is not None and self.laserDev.hasShutter:
                 self.laserDev.closeShutter()
 
-    def acquireFrame(self, allowBlanking=True):
+    def acquireFrame(self):
         """Acquire one frame and emit sigNewFrame.
         """
+        task = self.startFrame(self.buildTask())
+        data = self.waitForFrame(task)
+        self.emitFrame(task, data)
+
+    def buildTask(self):
+        """Create (but do not start) a task for the current imaging protocol.
+
+        Returns a tuple (task, protocol, metainfo, rectSystem) so that the frame can
+        later be decoded with the settings that were used to acquire it.
+        """
         with self.lock:
             prot = self.protocol
             meta = self.metainfo
             rectSystem = self.system
 
-        # Need to build task from a deep copy of the protocol because 
-        # it will be modified after execution.
-        task = self.manager.createTask(copy.deepcopy(prot))
-        
-        dur = prot['protocol']['duration']
+        # The task is built from a copy of the protocol because it will be modified
+        # after execution. Waveform arrays are never modified, so they are shared
+        # with the cached protocol rather than copied for every task.
+        task = self.manager.createTask(copyProtocol(prot))
+        return (task, prot, meta, rectSystem)
+
+    def startFrame(self, frameTask):
+        """Start acquisition of a task returned by buildTask(), or of a finished
+        task that has been re-armed.
+        """
+        task, prot, meta, rectSystem = frameTask
         start = pg.ptime.time()
-        endtime = start + dur - 0.005 
+        task.execute(block=False)
+        return (task, prot, meta, rectSystem, start)
 
-        # Start the task
-        task.execute(block = False)
+    def waitForFrame(self, frameTask):
+        """Wait for a frame started with startFrame() to complete, then return
+        the raw photodetector data.
+        """
+        task, prot, meta, rectSystem, start = frameTask
+        dur = prot['protocol']['duration']
+        endtime = start + dur - 0.005 
 
         # Wait until the task has finished
         while not task.isDone():
@@ -1211,12 +1274,17 @@ class ImagingThread(Thread):
                 # long sleep until we expect the protocol to be almost done
                 time.sleep(min(0.1, endtime-now))
             else:
-                time.sleep(5e-3)
+                time.sleep(1e-3)
 
-        # Get acquired data and generate metadata
+        # Collect data; this also releases the hardware for the next frame
         data = task.getResult()
         pdDevice, pdChannel = meta['Photodetector']
-        pmtData = data[pdDevice][pdChannel].view(np.ndarray)
+        return data[pdDevice][pdChannel].view(np.ndarray)
+
+    def emitFrame(self, frameTask, pmtData):
+        """Generate an ImagingFrame from acquired data and emit sigNewFrame.
+        """
+        task, prot, meta, rectSystem, start = frameTask
         info = meta.copy()
         info['time'] = start
 
@@ -1225,11 +1293,23 @@ class ImagingThread(Thread):
         info['transform'] = pg.SRTTransform3D(tr)
 
         frame = ImagingFrame(pmtData, rectSystem.copy(), info)
+        # decode the image here rather than in the GUI thread
+        with self.lock:
+            decomb = self._decomb
+        frame.setDecomb(*decomb)
+        frame.getImage()
         self.sigNewFrame.emit(frame)
 
 
-
-
-
-
-
+def copyProtocol(prot):
+    """Return a copy of a task protocol in which all dicts and lists are copied,
+    but arrays are shared with the original.
+    """
+    if isinstance(prot, dict):
+        return prot.__class__((k, copyProtocol(v)) for k, v in prot.items())
+    elif isinstance(prot, list):
+        return [copyProtocol(v) for v in prot]
+    elif isinstance(prot, np.ndarray):
+        return prot
+    else:
+        return copy.deepcopy(prot)
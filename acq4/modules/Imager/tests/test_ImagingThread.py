@@ -0,0 +1,176 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+import acq4.Manager
+from acq4.modules.Imager.Imager import ImagingThread
+
+app = pg.mkQApp()
+
+
+class MockTask(object):
+    """Imaging task in which every run acquires the next frame number.
+    Runs after the manager's *stallAfter* frame never finish."""
+    def __init__(self, dm, cmd):
+        self.dm = dm
+        self.cmd = cmd
+        self.runs = 0
+        self.rearms = 0
+        self.running = False
+        self.aborted = False
+
+    def execute(self, block=True):
+        assert not self.running
+        self.dm.frames += 1
+        self.frame = self.dm.frames
+        self.runs += 1
+        self.running = True
+
+    def isDone(self):
+        return self.dm.stallAfter is None or self.frame <= self.dm.stallAfter
+
+    def getResult(self):
+        self.running = False
+        return {'PMT': {'Input': np.zeros((3, 4)) + self.frame}}
+
+    def rearm(self):
+        assert not self.running
+        self.rearms += 1
+        return self.dm.rearmable
+
+    def abort(self):
+        self.aborted = True
+        self.running = False
+
+
+class MockManager(object):
+    def __init__(self, rearmable=True, stallAfter=None):
+        self.rearmable = rearmable
+        self.stallAfter = stallAfter
+        self.frames = 0
+        self.tasks = []
+
+    def createTask(self, cmd):
+        task = MockTask(self, cmd)
+        self.tasks.append(task)
+        return task
+
+
+class MockRectScan(object):
+    def extractImage(self, data, offset=0, subpixel=False):
+        return data[np.newaxis]
+
+    def imageTransform(self):
+        return pg.QtGui.QTransform()
+
+    def copy(self):
+        return self
+
+
+class MockScanner(object):
+    def globalTransform(self):
+        return pg.SRTTransform3D()
+
+
+class MockLaser(object):
+    hasShutter = True
+
+    def __init__(self):
+        self.shutter = []
+
+    def openShutter(self):
+        self.shutter.append('open')
+
+    def closeShutter(self):
+        self.shutter.append('closed')
+
+
+def protocol(name):
+    prot = {'protocol': {'duration': 1e-3}, 'Scanner': {'xCommand': np.zeros(10)}}
+    meta = {'Photodetector': ('PMT', 'Input'), 'name': name}
+    return prot, meta, MockRectScan()
+
+
+class FrameRecorder(object):
+    """Collects frames emitted by the thread and calls *actions[n]* after frame n."""
+    def __init__(self, thread, actions):
+        self.thread = thread
+        self.actions = actions
+        self.frames = []
+        self.signals = []
+        thread.sigNewFrame.connect(self.newFrame)
+        thread.sigAborted.connect(lambda: self.signals.append('aborted'))
+        thread.sigVideoStopped.connect(lambda: self.signals.append('videoStopped'))
+
+    def newFrame(self, frame):
+        self.frames.append((int(frame.getImage()[0, 0]), frame.info()['name']))
+        action = self.actions.get(len(self.frames))
+        if action is not None:
+            action()
+
+
+def makeThread(monkeypatch, **kwds):
+    dm = MockManager(**kwds)
+    monkeypatch.setattr(acq4.Manager.Manager, 'single', dm)
+    thread = ImagingThread(MockLaser(), MockScanner())
+    thread.setProtocol(*protocol('A'))
+    return dm, thread
+
+
+def test_videoFrameOrder(monkeypatch):
+    dm, thread = makeThread(monkeypatch)
+    recorder = FrameRecorder(thread, {
+        3: lambda: thread.setProtocol(*protocol('B')),
+        6: thread.stopVideo,
+    })
+    thread.run()
+
+    ## the frame that was running when video stopped is still emitted
+    assert [f[0] for f in recorder.frames] == list(range(1, 8))
+    ## frame 4 was already running when the protocol changed
+    assert [f[1] for f in recorder.frames] == ['A'] * 4 + ['B'] * 3
+    assert recorder.signals == ['videoStopped']
+
+    ## one task per protocol, re-armed for each following frame
+    assert len(dm.tasks) == 2
+    assert [t.runs for t in dm.tasks] == [4, 3]
+    assert [t.rearms for t in dm.tasks] == [3, 2]
+    assert not any(t.running or t.aborted for t in dm.tasks)
+    assert thread.laserDev.shutter == ['open', 'closed']
+
+
+def test_videoWithoutRearm(monkeypatch):
+    dm, thread = makeThread(monkeypatch, rearmable=False)
+    recorder = FrameRecorder(thread, {4: thread.stopVideo})
+    thread.run()
+
+    assert [f[0] for f in recorder.frames] == list(range(1, 6))
+    ## after the first refused re-arm, the next task is built ahead of time
+    assert [t.runs for t in dm.tasks] == [1] * 5
+    assert dm.tasks[0].rearms == 1
+    assert sum(t.rearms for t in dm.tasks) == 1
+    assert not any(t.running for t in dm.tasks)
+
+
+def test_singleFrame(monkeypatch):
+    dm, thread = makeThread(monkeypatch)
+    thread.stopVideo()
+    recorder = FrameRecorder(thread, {})
+    thread.run()
+
+    assert recorder.frames == [(1, 'A')]
+    assert recorder.signals == []
+    assert len(dm.tasks) == 1 and dm.tasks[0].rearms == 0
+    assert thread.laserDev.shutter == ['closed']
+
+
+def test_abort(monkeypatch):
+    ## frame 3 never finishes; aborting while it runs stops the thread cleanly
+    dm, thread = makeThread(monkeypatch, stallAfter=2)
+    recorder = FrameRecorder(thread, {2: thread.abort})
+    thread.run()
+
+    assert [f[0] for f in recorder.frames] == [1, 2]
+    assert recorder.signals == ['aborted', 'videoStopped']
+    assert dm.frames == 3
+    task = dm.tasks[0]
+    assert task.aborted and not task.running
+    assert thread.laserDev.shutter == ['open', 'closed']
@@ -7,6 +7,7 @@ from acq4.pyqtgraph import PlotWidget
 from acq4.util.metaarray import *
 from acq4.util.Mutex import Mutex
 from acq4.util.Thread import Thread
+from acq4.util.TimeSeriesAppender import TimeSeriesAppender
 import traceback, sys, time
 from numpy import *
 import scipy.optimize
@@ -27,6 +28,8 @@ class PatchWindow(QtGui.QMainWindow):
         self.setWindowTitle(clampName)
         self.startTime = None
         self.redrawCommand = 1
+        self.storageFile = None
+        self.storageAppender = None
         
         self.analysisItems = {
             'inputResistance': u'Ω', 
@@ -161,6 +164,7 @@ class PatchWindow(QtGui.QMainWindow):
         Manager.getManager().writeConfigFile(uiState, self.stateFile)
         
         self.thread.stop(block=True)
+        self.closeStorageFile()
         #print "Patch thread exited; module quitting."
         
     def closeEvent(self, ev):
@@ -227,17 +231,27 @@ class PatchWindow(QtGui.QMainWindow):
         if self.ui.recordBtn.isChecked():
             data = self.makeAnalysisArray()
             if data.shape[0] == 0:  ## no data yet; don't start the file
-                self.storageFile = None
+                self.closeStorageFile()
                 return
             self.newFile(data)
         else:
-            self.storageFile = None
+            self.closeStorageFile()
             
     def newFile(self, data):
+        self.closeStorageFile()
         sd = self.storageDir()
         self.storageFile = sd.writeFile(data, self.clampName, autoIncrement=True, appendAxis='Time', newFile=True)
         if self.startTime is not None:
             self.storageFile.setInfo({'startTime': self.startTime})
+        ## subsequent rows are buffered and appended from a background thread
+        self.storageAppender = TimeSeriesAppender(self.storageFile, appendAxis='Time')
+        
+    def closeStorageFile(self):
+        """Write any buffered rows and stop recording to the current file."""
+        if self.storageAppender is not None:
+            self.storageAppender.close()
+            self.storageAppender = None
+        self.storageFile = None
                 
     def storageDir(self):
         return self.manager.getCurrentDir().getDir('Patch', create=True)
@@ -322,7 +336,7 @@ class PatchWindow(QtGui.QMainWindow):
             if self.storageFile is None:
                 self.newFile(arr)
             else:
-                arr.write(self.storageFile.name(), appendAxis='Time')
+                self.storageAppender.append(arr)
         prof.mark('10')
         prof.finish()
         
@@ -464,6 +464,7 @@ class Profiler(object):
     _depth = 0
     _msgs = []
     disable = False  # set this flag to disable all or individual profilers at runtime
+    _callerDepth = 1  # stack depth of the profiled function, as seen from __new__ (subclasses may wrap __new__)
     
     class DisabledProfiler(object):
         def __init__(self, *args, **kwds):
@@ -483,7 +484,7 @@ class Profiler(object):
             return cls._disabledProfiler
                         
         # determine the qualified name of the caller function
-        caller_frame = sys._getframe(1)
+        caller_frame = sys._getframe(cls._callerDepth)
         try:
             caller_object_type = type(caller_frame.f_locals["self"])
         except KeyError: # we are in a regular function
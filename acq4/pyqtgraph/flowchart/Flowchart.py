@@ -54,6 +54,9 @@ class Flowchart(Node):
         
         self.inputWasSet = False  ## flag allows detection of changes in the absence of input change.
         self._nodes = {}
+        self._plan = None  ## cached order of operations for process()
+        self._resultCache = {}  ## {node: (node._updateCount, result)} from the last call to process()
+        self._lastArgs = {}  ## arguments from the last call to process()
         self.nextZVal = 10
         #self.connects = []
         #self._chartGraphicsItem = FlowchartGraphicsItem(self)
@@ -193,6 +196,10 @@ class Flowchart(Node):
         node.sigClosed.connect(self.nodeClosed)
         node.sigRenamed.connect(self.nodeRenamed)
         node.sigOutputChanged.connect(self.nodeOutputChanged)
+        for signal in ['sigTerminalConnected', 'sigTerminalDisconnected', 'sigTerminalAdded', 
+                       'sigTerminalRemoved', 'sigTerminalRenamed']:
+            getattr(node, signal).connect(self._structureChanged)
+        self._structureChanged()
         self.sigChartChanged.emit(self, 'add', node)
         
     def removeNode(self, node):
@@ -206,6 +213,7 @@ class Flowchart(Node):
                 getattr(node, signal).disconnect(self.nodeClosed)
             except (TypeError, RuntimeError):
                 pass
+        self._structureChanged()
         self.sigChartChanged.emit(self, 'remove', node)
         
     def nodeRenamed(self, node, oldName):
@@ -241,21 +249,39 @@ class Flowchart(Node):
         Keyword arguments must be the names of input terminals. 
         The return value is a dict with one key per output terminal.
         
+        The order of operations is computed once and reused until nodes or
+        connections change. Every node is processed on every call, except nodes
+        for which result caching was enabled with Node.setResultCaching(True);
+        see that method for when their cached results are reused.
         """
         data = {}  ## Stores terminal:value pairs
         
         ## determine order of operations
         ## order should look like [('p', node1), ('p', node2), ('d', terminal1), ...] 
         ## Each tuple specifies either (p)rocess this node or (d)elete the result from this terminal
-        order = self.processOrder()
+        order = self._processPlan()
         #print "ORDER:", order
         
+        ## only keep previous arguments and results when some node asks for it
+        caching = False
+        for c, arg in order:
+            if c == 'p' and arg[0].resultCaching():
+                caching = True
+                break
+        if not caching:
+            self._resultCache = {}
+        
         ## Record inputs given to process()
+        changed = set()  ## terminals whose value may differ from the last call
         for n, t in self.inputNode.outputs().items():
             # if n not in args:
             #     raise Exception("Parameter %s required to process this chart." % n)
             if n in args:
                 data[t] = args[n]
+            if n in args or n in self._lastArgs:
+                if n not in args or n not in self._lastArgs or args[n] is not self._lastArgs[n]:
+                    changed.add(t)
+        self._lastArgs = args if caching else {}
         
         ret = {}
             
@@ -264,21 +290,13 @@ class Flowchart(Node):
             
             if c == 'p':     ## Process a single node
                 #print "===> process:", arg
-                node = arg
+                node, outs, ins, upstream = arg
                 if node is self.inputNode:
                     continue  ## input node has already been processed.
                 
-                            
-                ## get input and output terminals for this node
-                outs = list(node.outputs().values())
-                ins = list(node.inputs().values())
-                
                 ## construct input value dictionary
                 args = {}
-                for inp in ins:
-                    inputs = inp.inputTerminals()
-                    if len(inputs) == 0:
-                        continue
+                for inp, inputs in ins:
                     if inp.isMultiValue():  ## multi-input terminals require a dict of all inputs
                         args[inp.name()] = dict([(i, data[i]) for i in inputs if i in data])
                     else:                   ## single-inputs terminals only need the single input value available
@@ -287,14 +305,22 @@ class Flowchart(Node):
                 if node is self.outputNode:
                     ret = args  ## we now have the return value, but must keep processing in case there are other endpoint nodes in the chart
                 else:
-                    try:
-                        if node.isBypassed():
-                            result = node.processBypassed(args)
-                        else:
-                            result = node.process(display=False, **args)
-                    except:
-                        print("Error processing node %s. Args are: %s" % (str(node), str(args)))
-                        raise
+                    cached = self._resultCache.get(node, None)
+                    if not node.resultCaching() or cached is None or cached[0] != node._updateCount or not changed.isdisjoint(upstream):
+                        self._resultCache.pop(node, None)
+                        try:
+                            if node.isBypassed():
+                                result = node.processBypassed(args)
+                            else:
+                                result = node.process(display=False, **args)
+                        except:
+                            print("Error processing node %s. Args are: %s" % (str(node), str(args)))
+                            raise
+                        if node.resultCaching():
+                            self._resultCache[node] = (node._updateCount, result)
+                        changed.update(outs)
+                    else:
+                        result = cached[1]
                     for out in outs:
                         #print "    Output:", out, out.name()
                         #print out.name()
@@ -314,6 +340,15 @@ class Flowchart(Node):
         The order returned should look like [('p', node1), ('p', node2), ('d', terminal1), ...] 
         where each tuple specifies either (p)rocess this node or (d)elete the result from this terminal
         """
+        return [(c, arg[0] if c == 'p' else arg) for c, arg in self._processPlan()]
+        
+    def _processPlan(self):
+        ## Return the cached list of operations used by process(). This is the same as
+        ## processOrder(), except that each node is given as a tuple
+        ## (node, outputs, [(input, inputTerminals), ...], upstreamTerminals).
+        ## The plan is rebuilt only after the structure of the chart changes.
+        if self._plan is not None:
+            return self._plan
         
         ## first collect list of nodes/terminals and their dependencies
         deps = {}
@@ -328,9 +363,20 @@ class Flowchart(Node):
         #deps[self] = []
         order = fn.toposort(deps)
         #print "ORDER1:", order
+        index = dict([(n, i) for i, n in enumerate(order)])
         
         ## construct list of operations
-        ops = [('p', n) for n in order]
+        ops = []
+        for n in order:
+            ins = []
+            upstream = set()
+            for inp in n.inputs().values():
+                inputs = inp.inputTerminals()
+                if len(inputs) == 0:
+                    continue
+                ins.append((inp, inputs))
+                upstream.update(inputs)
+            ops.append(('p', (n, list(n.outputs().values()), ins, upstream)))
         
         ## determine when it is safe to delete terminal values
         dels = []
@@ -342,9 +388,8 @@ class Flowchart(Node):
                     lastInd = None
                     break
                 else:
-                    try:
-                        ind = order.index(n)
-                    except ValueError:
+                    ind = index.get(n, None)
+                    if ind is None:
                         continue
                 if lastNode is None or ind > lastInd:
                     lastNode = n
@@ -356,8 +401,16 @@ class Flowchart(Node):
         dels.sort(key=lambda a: a[0], reverse=True)
         for i, t in dels:
             ops.insert(i, ('d', t))
+        self._plan = ops
         return ops
         
+    def _structureChanged(self, *args):
+        ## Nodes, terminals, or connections have changed; discard the cached
+        ## processing plan and node results.
+        self._plan = None
+        self._resultCache = {}
+        self._lastArgs = {}
+        
         
     def nodeOutputChanged(self, startNode):
         """Triggered when a node's output values have changed. (NOT called during process())
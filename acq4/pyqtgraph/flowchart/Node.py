@@ -32,6 +32,8 @@ class Node(QtCore.QObject):
     sigTerminalRenamed = QtCore.Signal(object, object)  # term, oldName
     sigTerminalAdded = QtCore.Signal(object, object)  # self, term
     sigTerminalRemoved = QtCore.Signal(object, object)  # self, term
+    sigTerminalConnected = QtCore.Signal(object, object)  # localTerm, remoteTerm
+    sigTerminalDisconnected = QtCore.Signal(object, object)  # localTerm, remoteTerm
 
     
     def __init__(self, name, terminals=None, allowAddInput=False, allowAddOutput=False, allowRemove=True):
@@ -71,6 +73,8 @@ class Node(QtCore.QObject):
         self._allowAddInput = allowAddInput   ## flags to allow the user to add/remove terminals
         self._allowAddOutput = allowAddOutput
         self._allowRemove = allowRemove
+        self._updateCount = 0  ## incremented by update(); lets Flowchart detect stale cached results
+        self._resultCaching = False
         
         self.exception = None
         if terminals is None:
@@ -254,6 +258,23 @@ class Node(QtCore.QObject):
         """Return True if this Node is currently bypassed."""
         return self._bypass
 
+    def setResultCaching(self, cache):
+        """Set whether Flowchart.process() may reuse this node's result from the
+        previous call instead of processing the node again.
+        
+        A cached result is reused only if update() has not been called since the
+        node was last processed, no node connected (directly or indirectly) to its
+        inputs was processed again, and every flowchart input it depends on is the
+        same object as in the previous call. Enable this only for nodes whose
+        output depends on nothing but their inputs and state, and only if the
+        flowchart inputs are never modified in place between calls.
+        """
+        self._resultCaching = cache
+        
+    def resultCaching(self):
+        """Return True if result caching is enabled for this node (see setResultCaching)."""
+        return self._resultCaching
+
     def setInput(self, **args):
         """Set the values on input terminals. For most nodes, this will happen automatically through Terminal.inputChanged.
         This is normally only used for nodes with no connected inputs."""
@@ -295,6 +316,7 @@ class Node(QtCore.QObject):
         (such as when the user interacts with the Node's control widget). Update
         is automatically called when the inputs to the node are changed.
         """
+        self._updateCount += 1
         vals = self.inputValues()
         #print "  inputs:", vals
         try:
@@ -0,0 +1,124 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.pyqtgraph.flowchart import Flowchart, Node
+
+app = pg.mkQApp()
+
+
+class FuncNode(Node):
+    """Applies a function to its inputs and counts how many times it has been processed."""
+    nodeName = 'FuncNode'
+
+    def __init__(self, name, func, inputs=('In',)):
+        terms = dict([(n, {'io': 'in'}) for n in inputs])
+        terms['Out'] = {'io': 'out'}
+        Node.__init__(self, name, terminals=terms)
+        self.func = func
+        self.count = 0
+
+    def process(self, display=True, **args):
+        self.count += 1
+        return {'Out': self.func(**args)}
+
+
+def buildChart():
+    #  a -> scale -> combine -> out
+    #  b -> shift ----^
+    fc = Flowchart(terminals={'a': {'io': 'in'}, 'b': {'io': 'in'}, 'out': {'io': 'out'}})
+    scale = FuncNode('scale', lambda In: In * 2)
+    shift = FuncNode('shift', lambda In: In + 1)
+    combine = FuncNode('combine', lambda A, B: A - B, inputs=('A', 'B'))
+    for node in (scale, shift, combine):
+        fc.addNode(node, node.nodeName + '.' + node.name())
+    fc.connectTerminals(fc['a'], scale['In'])
+    fc.connectTerminals(fc['b'], shift['In'])
+    fc.connectTerminals(scale['Out'], combine['A'])
+    fc.connectTerminals(shift['Out'], combine['B'])
+    fc.connectTerminals(combine['Out'], fc['out'])
+    return fc, scale, shift, combine
+
+
+def counts(*nodes):
+    return [n.count for n in nodes]
+
+
+def test_process_cache():
+    fc, scale, shift, combine = buildChart()
+    nodes = (scale, shift, combine)
+    for node in nodes:
+        node.setResultCaching(True)
+    a = np.arange(10.)
+    b1 = np.ones(10)
+    b2 = np.linspace(0, 1, 10)
+
+    # plan is compiled once and reused until the chart structure changes
+    plan = fc._processPlan()
+    assert fc._processPlan() is plan
+    order = fc.processOrder()
+    procs = [arg for c, arg in order if c == 'p']
+    assert procs.index(scale) < procs.index(combine)
+    assert procs.index(shift) < procs.index(combine)
+
+    out = fc.process(a=a, b=b1)['out']
+    assert np.all(out == a * 2 - (b1 + 1))
+    assert counts(*nodes) == [1, 1, 1]
+
+    # only the branch whose input changed is processed again
+    out = fc.process(a=a, b=b2)['out']
+    assert np.all(out == a * 2 - (b2 + 1))
+    assert counts(*nodes) == [1, 2, 2]
+
+    # nothing changed; everything comes from the cache
+    out2 = fc.process(a=a, b=b2)['out']
+    assert out2 is out
+    assert counts(*nodes) == [1, 2, 2]
+
+    # a change to node state (signaled by update()) invalidates that node and its dependents
+    scale.func = lambda In: In * 3
+    scale.update()
+    before = counts(*nodes)
+    out = fc.process(a=a, b=b2)['out']
+    assert np.all(out == a * 3 - (b2 + 1))
+    assert counts(*nodes) == [before[0] + 1, before[1], before[2] + 1]
+
+    # results match a full evaluation of a freshly built chart
+    fc2, scale2, shift2, combine2 = buildChart()
+    scale2.func = scale.func
+    assert not scale2.resultCaching()
+    assert np.all(fc2.process(a=a, b=b2)['out'] == out)
+
+    # rewiring the chart rebuilds the plan
+    scale['Out'].disconnectFrom(combine['A'])
+    fc.connectTerminals(fc['a'], combine['A'])
+    assert fc._processPlan() is not plan
+    out = fc.process(a=a, b=b2)['out']
+    assert np.all(out == a - (b2 + 1))
+
+
+def test_process_inPlace():
+    # without result caching, every node is processed on every call, so inputs
+    # that are modified in place give up-to-date outputs
+    fc, scale, shift, combine = buildChart()
+    nodes = (scale, shift, combine)
+    a = np.arange(10.)
+    b = np.ones(10)
+    out = fc.process(a=a, b=b)['out']
+    assert np.all(out == a * 2 - (b + 1))
+    a *= 5
+    b[3] = 10
+    out = fc.process(a=a, b=b)['out']
+    assert np.all(out == a * 2 - (b + 1))
+    assert counts(*nodes) == [2, 2, 2]
+    
+    # no inputs or results are kept between calls
+    assert fc._lastArgs == {}
+    assert fc._resultCache == {}
+
+    # caching only one node: it is skipped, nodes downstream of it still run
+    scale.setResultCaching(True)
+    fc.process(a=a, b=b)
+    a += 1
+    out = fc.process(a=a, b=b)['out']
+    assert counts(*nodes) == [3, 4, 4]
+    assert np.all(out == (a - 1) * 2 - (b + 1))  # stale: a was modified in place
+    assert list(fc._resultCache.keys()) == [scale]
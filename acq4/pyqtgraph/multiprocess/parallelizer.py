@@ -1,4 +1,4 @@
-import os, sys, time, multiprocessing, re
+import os, sys, time, multiprocessing, re, select, errno
 from .processes import ForkedProcess
 from .remoteproxy import ClosedError
 
@@ -35,9 +35,14 @@ class Parallelize(object):
         
     The only major caveat is that *result* in the example above must be picklable,
     since it is automatically sent via pipe back to the parent process.
+    
+    By default, tasks are divided evenly among workers before they start. If the
+    cost of individual tasks varies widely, use dynamic=True: each worker then
+    takes the next *chunkSize* tasks from a shared queue whenever it finishes
+    its previous chunk, so that no worker sits idle while others are busy.
     """
 
-    def __init__(self, tasks=None, workers=None, block=True, progressDialog=None, randomReseed=True, **kwds):
+    def __init__(self, tasks=None, workers=None, block=True, progressDialog=None, randomReseed=True, dynamic=False, chunkSize=1, **kwds):
         """
         ===============  ===================================================================
         **Arguments:**
@@ -51,6 +56,9 @@ class Parallelize(object):
         randomReseed     If True, each forked process will reseed its random number generator
                          to ensure independent results. Works with the built-in random
                          and numpy.random.
+        dynamic          If True, workers pull tasks from a shared queue as they go rather
+                         than receiving a fixed set of tasks up front.
+        chunkSize        Number of tasks taken from the queue at a time when dynamic=True.
         kwds             objects to be shared by proxy with child processes (they will 
                          appear as attributes of the tasker)
         ===============  ===================================================================
@@ -75,6 +83,8 @@ class Parallelize(object):
             tasks = range(workers)
         self.tasks = list(tasks)
         self.reseed = randomReseed
+        self.dynamic = dynamic
+        self.chunkSize = max(1, int(chunkSize))
         self.kwds = kwds.copy()
         self.kwds['_taskStarted'] = self._taskStarted
         
@@ -111,19 +121,25 @@ class Parallelize(object):
     
     def runParallel(self):
         self.childs = []
-        
-        ## break up tasks into one set per worker
         workers = self.workers
-        chunks = [[] for i in xrange(workers)]
-        i = 0
-        for i in range(len(self.tasks)):
-            chunks[i%workers].append(self.tasks[i])
+        
+        if self.dynamic:
+            ## index of the next task to be processed; shared by all workers
+            queue = multiprocessing.Value('l', 0)
+        else:
+            ## break up tasks into one set per worker
+            chunks = [[] for i in xrange(workers)]
+            i = 0
+            for i in range(len(self.tasks)):
+                chunks[i%workers].append(self.tasks[i])
         
         ## fork and assign tasks to each worker
         for i in range(workers):
             proc = ForkedProcess(target=None, preProxy=self.kwds, randomReseed=self.reseed)
             if not proc.isParent:
                 self.proc = proc
+                if self.dynamic:
+                    return Tasker(self, proc, self.tasks, proc.forkedProxies, queue=queue)
                 return Tasker(self, proc, chunks[i], proc.forkedProxies)
             else:
                 self.childs.append(proc)
@@ -143,15 +159,14 @@ class Parallelize(object):
                 
             activeChilds = self.childs[:]
             self.exitCodes = []
-            pollInterval = 0.01
             while len(activeChilds) > 0:
-                waitingChildren = 0
+                ## block until at least one worker has sent a message (or exited);
+                ## wake up periodically to check for cancellation.
+                self._waitForChildren(activeChilds, timeout=0.1)
                 rem = []
                 for ch in activeChilds:
                     try:
-                        n = ch.processRequests()
-                        if n > 0:
-                            waitingChildren += 1
+                        ch.processRequests()
                     except ClosedError:
                         #print ch.childPid, 'process finished'
                         rem.append(ch)
@@ -178,15 +193,6 @@ class Parallelize(object):
                     for ch in activeChilds:
                         ch.kill()
                     raise CanceledError()
-                    
-                ## adjust polling interval--prefer to get exactly 1 event per poll cycle.
-                if waitingChildren > 1:
-                    pollInterval *= 0.7
-                elif waitingChildren == 0:
-                    pollInterval /= 0.7
-                pollInterval = max(min(pollInterval, 0.5), 0.0005) ## but keep it within reasonable limits
-                
-                time.sleep(pollInterval)
         finally:
             if self.showProgress:
                 self.progressDlg.__exit__(None, None, None)
@@ -198,6 +204,16 @@ class Parallelize(object):
         return []  ## no tasks for parent process.
     
     
+    @staticmethod
+    def _waitForChildren(childs, timeout):
+        ## Wait until a message is available from any of the child processes.
+        fds = [ch.conn.fileno() for ch in childs]
+        try:
+            select.select(fds, [], [], timeout)
+        except select.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+    
     @staticmethod
     def suggestedWorkerCount():
         if 'linux' in sys.platform:
@@ -234,24 +250,41 @@ class Parallelize(object):
     
     
 class Tasker(object):
-    def __init__(self, parallelizer, process, tasks, kwds):
+    def __init__(self, parallelizer, process, tasks, kwds, queue=None):
         self.proc = process
         self.par = parallelizer
         self.tasks = tasks
+        self.queue = queue
         for k, v in kwds.iteritems():
             setattr(self, k, v)
         
     def __iter__(self):
-        ## we could fix this up such that tasks are retrieved from the parent process one at a time..
-        for i, task in enumerate(self.tasks):
+        if self.queue is None:
+            indexes = xrange(len(self.tasks))
+        else:
+            indexes = self._queuedIndexes()
+        for i in indexes:
             self.index = i
             #print os.getpid(), 'starting task', i
             self._taskStarted(os.getpid(), i, _callSync='off')
-            yield task
+            yield self.tasks[i]
         if self.proc is not None:
             #print os.getpid(), 'no more tasks'
             self.proc.close()
     
+    def _queuedIndexes(self):
+        ## take chunks of task indexes from the shared queue until all have been claimed
+        nTasks = len(self.tasks)
+        chunk = self.par.chunkSize
+        while True:
+            with self.queue.get_lock():
+                start = self.queue.value
+                self.queue.value = start + chunk
+            if start >= nTasks:
+                return
+            for i in xrange(start, min(start + chunk, nTasks)):
+                yield i
+    
     def process(self):
         """
         Process requests from parent.
@@ -0,0 +1,36 @@
+import os, multiprocessing
+from collections import defaultdict
+from acq4.pyqtgraph.multiprocess import Parallelize
+
+
+def runTasks(nTasks, **kwds):
+    """Process tasks with two workers and return the list of tasks each worker
+    processed, in order. Task 0 blocks until the last task has been processed,
+    so the worker that takes it stays busy while the other worker runs."""
+    lastDone = multiprocessing.Event()
+    results = []
+    with Parallelize(range(nTasks), workers=2, results=results, **kwds) as tasker:
+        for task in tasker:
+            if task == 0:
+                lastDone.wait(10)
+            tasker.results.append((os.getpid(), task))
+            if task == nTasks - 1:
+                lastDone.set()
+    workers = defaultdict(list)
+    for pid, task in results:
+        workers[pid].append(task)
+    return sorted(workers.values())
+
+
+def test_dynamic():
+    # static: tasks are assigned round-robin before the workers start, so the
+    # busy worker still has half of the tasks waiting for it
+    assert runTasks(12) == [list(range(0, 12, 2)), list(range(1, 12, 2))]
+
+    # dynamic: the idle worker takes every task that the busy worker has not claimed
+    assert runTasks(12, dynamic=True) == [[0], list(range(1, 12))]
+
+
+def test_chunkSize():
+    # the busy worker claimed a single chunk of 4 tasks; the rest went to the other worker
+    assert runTasks(25, dynamic=True, chunkSize=4) == [[0, 1, 2, 3], list(range(4, 25))]
@@ -0,0 +1,198 @@
+import os, tempfile, shutil, threading, time
+from collections import OrderedDict
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.pyqtgraph.Qt import QtCore
+import acq4.util.configfile as configfile
+from acq4.LogWindow import LogWriter, LogWidget
+
+app = pg.mkQApp()
+
+
+def makeLogFile(root, name):
+    fileName = os.path.join(root, name)
+    configfile.writeConfigFile('', fileName)
+    return fileName
+
+
+def readLog(fileName):
+    if os.path.getsize(fileName) == 0:
+        return {}
+    return configfile.readConfigFile(fileName)
+
+
+def waitFor(check, timeout=2.0):
+    start = time.time()
+    while not check() and time.time() < start + timeout:
+        time.sleep(0.01)
+    return check()
+
+
+def test_writeOrder():
+    root = tempfile.mkdtemp()
+    writer = LogWriter(flushEntries=1000, flushInterval=100)
+    try:
+        files = [makeLogFile(root, 'log1.txt'), makeLogFile(root, 'log2.txt')]
+        expect = [OrderedDict(), OrderedDict()]
+        n = 0
+        for i in range(40):
+            ## switch files every few batches, as setLogDir does
+            f = (i // 7) % 2
+            entries = OrderedDict()
+            for j in range(i % 3 + 1):
+                name = 'LogEntry_%d' % n
+                entries[name] = {'message': 'msg %d' % n, 'id': n}
+                expect[f][name] = entries[name]
+                n += 1
+            writer.write(entries, files[f])
+
+        ## entries are copied when queued
+        entries['LogEntry_%d' % (n-1)]['message'] = 'changed after queueing'
+
+        writer.flush()
+        for f in (0, 1):
+            log = readLog(files[f])
+            assert list(log.keys()) == list(expect[f].keys())
+            assert [v['message'] for v in log.values()] == ['msg %d' % v['id'] for v in expect[f].values()]
+    finally:
+        writer.close()
+        shutil.rmtree(root)
+
+
+def test_batchAndIntervalFlush():
+    root = tempfile.mkdtemp()
+    batchWriter = LogWriter(flushEntries=5, flushInterval=100)
+    timedWriter = LogWriter(flushEntries=1000, flushInterval=0.1)
+    try:
+        fileName = makeLogFile(root, 'batch.txt')
+        count = lambda: len(readLog(fileName))
+        for i in range(4):
+            batchWriter.write({'LogEntry_%d' % i: {'message': 'batch'}}, fileName)
+        time.sleep(0.2)
+        assert count() == 0
+        batchWriter.write({'LogEntry_4': {'message': 'batch'}}, fileName)
+        assert waitFor(lambda: count() == 5)
+
+        fileName = makeLogFile(root, 'timed.txt')
+        start = time.time()
+        timedWriter.write({'LogEntry_0': {'message': 'timed'}}, fileName)
+        assert waitFor(lambda: count() == 1)
+        assert time.time() - start >= 0.09
+
+        ## closing the writer writes anything still queued
+        timedWriter.write({'LogEntry_1': {'message': 'timed'}}, fileName)
+        timedWriter.close()
+        assert count() == 2
+    finally:
+        batchWriter.close()
+        timedWriter.close()
+        shutil.rmtree(root)
+
+
+class DirHandle(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class MockManager(object):
+    def getDirOfSelectedFile(self):
+        return DirHandle('/data/2015.01.01')
+
+
+def makeEntry(i, rng):
+    return {
+        'id': i + 1,
+        'message': 'message %d' % i,
+        'timestamp': '2015.01.01 00:00:00',
+        'importance': rng.randint(0, 10),
+        'msgType': ['status', 'user', 'warning', 'error'][rng.randint(4)],
+        'currentDir': ['/data/2015.01.01', '/data/2015.01.01/cell_000', '/data/2015.01.02', None][rng.randint(4)],
+        'exception': None,
+    }
+
+
+def referenceFilter(wid, entries):
+    ## apply the filters to each entry individually
+    out = []
+    for entry in entries:
+        if entry['msgType'] not in wid.typeFilters + [''] or entry['importance'] <= wid.importanceFilter:
+            continue
+        if wid.dirFilter is not False and not (entry['currentDir'] or '').startswith(wid.dirFilter):
+            continue
+        out.append(entry)
+    return out
+
+
+def test_filterAndPaging():
+    rng = np.random.RandomState(0)
+    wid = LogWidget(None, MockManager())
+    wid.pageSize = 50
+    entries = [makeEntry(i, rng) for i in range(400)]
+    for entry in entries:
+        wid.addEntry(entry)
+
+    for typeFilters, importance, dirFilter in [
+            (['status', 'user', 'warning', 'error'], 0, False),
+            (['warning', 'error'], 4, False),
+            (['status', 'error'], 2, '/data/2015.01.01'),
+            ([], 0, False)]:
+        wid.typeFilters = typeFilters
+        wid.importanceFilter = importance
+        wid.dirFilter = dirFilter
+        wid.filterEntries()
+        expect = referenceFilter(wid, entries)
+        assert wid.displayedEntries == expect
+
+        ## only the most recent page is rendered, with a link to earlier entries
+        assert wid.renderedCount == min(len(expect), 50)
+        text = str(wid.ui.output.toPlainText())
+        hidden = len(expect) - wid.renderedCount
+        assert (('%d not shown' % hidden) in text) == (hidden > 0)
+        if len(expect) > 0:
+            assert expect[-1]['message'] in text
+
+        wid.linkClicked(QtCore.QUrl('more:'))
+        assert wid.renderedCount == min(len(expect), 100)
+        if len(expect) > 100:
+            assert ('%d not shown' % (len(expect) - 100)) in str(wid.ui.output.toPlainText())
+
+    ## entries added while filters are active are displayed the same way
+    wid.typeFilters = ['status', 'warning']
+    wid.importanceFilter = 3
+    wid.dirFilter = '/data/2015.01.01'
+    wid.filterEntries()
+    for i in range(400, 600):
+        entry = makeEntry(i, rng)
+        entries.append(entry)
+        wid.addEntry(entry)
+        assert wid.renderedCount <= wid.displayLimit + wid.pageSize
+    assert wid.displayedEntries == referenceFilter(wid, entries)
+
+
+def test_emptyMsgType():
+    ## entries without a message type pass any type filter
+    rng = np.random.RandomState(1)
+    wid = LogWidget(None, MockManager())
+    entries = [makeEntry(i, rng) for i in range(40)]
+    for entry in entries[::3]:
+        entry['msgType'] = ''
+    for entry in entries:
+        wid.addEntry(entry)
+
+    for typeFilters in (['status', 'user', 'warning', 'error'], ['error'], []):
+        wid.typeFilters = typeFilters
+        wid.importanceFilter = 0
+        wid.dirFilter = False
+        wid.filterEntries()
+        expect = referenceFilter(wid, entries)
+        assert wid.displayedEntries == expect
+        assert [e for e in entries[::3] if e['importance'] > 0] == [e for e in expect if e['msgType'] == '']
+
+    entry = makeEntry(40, rng)
+    entry['msgType'] = ''
+    entry['importance'] = 5
+    wid.addEntry(entry)
+    assert wid.displayedEntries[-1] is entry
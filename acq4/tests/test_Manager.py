@@ -0,0 +1,362 @@
+import threading, time
+from collections import OrderedDict
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.Manager import Task, DeviceLoader
+from acq4.devices.Device import Device, DeviceTask
+import acq4.util.ptime as ptime
+
+app = pg.mkQApp()
+
+
+class MockDevice(object):
+    """Minimal stand-in for a Device that records a value after a short acquisition delay."""
+    def __init__(self, name, taskClass):
+        self._name = name
+        self.taskClass = taskClass
+
+    def name(self):
+        return self._name
+
+    def createTask(self, cmd, parentTask):
+        return self.taskClass(self, cmd, parentTask)
+
+    def reserve(self, block=True, timeout=20):
+        return True
+
+    def release(self):
+        pass
+
+
+class MockManager(object):
+    def __init__(self, devices):
+        self.devices = devices
+
+    def getDevice(self, name):
+        return self.devices[name]
+
+    def lockReserv(self):
+        pass
+
+    def unlockReserv(self):
+        pass
+
+
+class PollingTask(DeviceTask):
+    """Finishes in a background thread *delay* seconds after the task duration."""
+    def __init__(self, dev, cmd, parentTask):
+        DeviceTask.__init__(self, dev, cmd, parentTask)
+        self.cmd = cmd
+        self.duration = parentTask.cfg['duration']
+        self.done = False
+        self.result = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        time.sleep(self.duration + self.cmd['delay'])
+        self.result = self.cmd['value'] * 2
+        self.finishTime = ptime.time()
+        self.done = True
+        self.finished()
+
+    def finished(self):
+        pass
+
+    def isDone(self):
+        return self.done
+
+    def getResult(self):
+        return self.result
+
+
+class NotifyingTask(PollingTask):
+    notifiesDone = True
+
+    def finished(self):
+        self.notifyDone()
+
+
+class OverriddenTask(NotifyingTask):
+    """Overrides isDone() without declaring that it notifies"""
+    def isDone(self):
+        return self.done
+
+
+class InstantTask(DeviceTask):
+    """Uses the default isDone(), which is always True"""
+    def getResult(self):
+        return 'instant'
+
+
+def runTasks(taskClass, delays, duration=20e-3, processEvents=False):
+    dm = MockManager({'dev1': MockDevice('dev1', taskClass), 'dev2': MockDevice('dev2', InstantTask)})
+    latency = []
+    results = []
+    for i, delay in enumerate(delays):
+        cmd = {'protocol': {'duration': duration}, 'dev1': {'delay': delay, 'value': i}, 'dev2': {}}
+        task = Task(dm, cmd)
+        task.execute(block=True, processEvents=processEvents)
+        finish = ptime.time()
+        devTask = task.tasks['dev1']
+        assert devTask.done
+        latency.append(finish - devTask.finishTime)
+        result = task.getResult()
+        results.append((result['dev1'], result['dev2']))
+        devTask.thread.join()
+    return np.array(latency), results
+
+
+def test_taskCompletion():
+    delays = np.random.RandomState(0).uniform(0, 5e-3, size=30)
+
+    # tasks that report completion do not need polling, but other tasks still do
+    dm = MockManager({'dev1': MockDevice('dev1', NotifyingTask), 'dev2': MockDevice('dev2', InstantTask)})
+    assert not Task(dm, {'protocol': {'duration': 0}, 'dev1': {}, 'dev2': {}})._needsPolling()
+    dm.devices['dev2'] = MockDevice('dev2', PollingTask)
+    assert Task(dm, {'protocol': {'duration': 0}, 'dev1': {}, 'dev2': {}})._needsPolling()
+    dm.devices['dev2'] = MockDevice('dev2', OverriddenTask)
+    assert Task(dm, {'protocol': {'duration': 0}, 'dev1': {}, 'dev2': {}})._needsPolling()
+
+    pollLatency, pollResults = runTasks(PollingTask, delays)
+    notifyLatency, notifyResults = runTasks(NotifyingTask, delays)
+    assert pollResults == notifyResults
+    assert pollResults[3] == (6, 'instant')
+    print("Mean latency after completion: polling %0.2f ms, notification %0.2f ms" % 
+          (pollLatency.mean() * 1e3, notifyLatency.mean() * 1e3))
+    assert notifyLatency.mean() < pollLatency.mean()
+
+
+def test_wakeTimers():
+    timers = []
+    Timer = threading.Timer
+    def recordTimer(*args, **kwds):
+        timer = Timer(*args, **kwds)
+        timers.append(timer)
+        return timer
+    threading.Timer = recordTimer
+    try:
+        # while processing Qt events, execute() waits on the wake event directly
+        latency, results = runTasks(NotifyingTask, [0.1], duration=20e-3, processEvents=True)
+        assert len(timers) == 0
+        assert latency[0] < 20e-3
+
+        # otherwise a single timer wakes execute() at the end of the duration, and another at the timeout
+        latency, results = runTasks(NotifyingTask, [0.1], duration=20e-3)
+        assert len(timers) == 2
+        assert all(timer.finished.is_set() for timer in timers)
+    finally:
+        threading.Timer = Timer
+
+
+def test_timeout():
+    dm = MockManager({'dev1': MockDevice('dev1', NotifyingTask)})
+    cmd = {'protocol': {'duration': 10e-3, 'timeout': 50e-3}, 'dev1': {'delay': 0.2, 'value': 1}}
+    task = Task(dm, cmd)
+    start = ptime.time()
+    try:
+        task.execute(block=True, processEvents=False)
+        raise AssertionError("task should have timed out")
+    except RuntimeError as exc:
+        assert 'timed out' in str(exc)
+    assert ptime.time() - start < 0.15
+    task.tasks['dev1'].thread.join()
+
+
+class RearmableTask(DeviceTask):
+    """Records calls from the parent task; the result is the number of runs so far."""
+    def __init__(self, dev, cmd, parentTask):
+        DeviceTask.__init__(self, dev, cmd, parentTask)
+        self.calls = []
+
+    def configure(self):
+        self.calls.append('configure')
+
+    def canRearm(self):
+        return True
+
+    def rearm(self):
+        self.calls.append('rearm')
+
+    def start(self):
+        self.calls.append('start')
+
+    def getResult(self):
+        return self.calls.count('start')
+
+
+def test_rearm():
+    dm = MockManager({'dev1': MockDevice('dev1', RearmableTask), 'dev2': MockDevice('dev2', InstantTask)})
+    task = Task(dm, {'protocol': {'duration': 0}, 'dev1': {}})
+    try:
+        task.rearm()
+        raise AssertionError("task should not be re-armed before it has run")
+    except Exception as exc:
+        assert 'Cannot re-arm' in str(exc)
+
+    # a re-armed task runs again without being configured again
+    results = []
+    for i in range(3):
+        if i > 0:
+            assert task.rearm()
+            assert task.result is None and task.startTime is None
+        task.execute(block=True, processEvents=False)
+        results.append(task.getResult()['dev1'])
+    assert results == [1, 2, 3]
+    assert task.tasks['dev1'].calls == ['configure', 'start', 'rearm', 'start', 'rearm', 'start']
+
+    # tasks that include a device that cannot be re-armed must be created again
+    task = Task(dm, {'protocol': {'duration': 0}, 'dev1': {}, 'dev2': {}})
+    task.execute(block=True, processEvents=False)
+    assert not task.rearm()
+    task.execute(block=True, processEvents=False)
+    assert task.tasks['dev1'].calls == ['configure', 'start', 'configure', 'start']
+
+
+class LoaderManager(object):
+    """Provides the parts of Manager used by DeviceLoader; records when each device was loaded."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.devices = OrderedDict()
+        self.loadTimes = {}
+
+    def getDeviceClass(self, driverName):
+        return globals()[driverName]
+
+    def getDevice(self, name):
+        with self.lock:
+            return self.devices[name]
+
+    def declareInterface(self, name, types, obj):
+        pass
+
+    def _createDevice(self, devclass, conf, name):
+        start = ptime.time()
+        dev = devclass(self, conf, name)
+        with self.lock:
+            self.devices[name] = dev
+            self.loadTimes[name] = (start, ptime.time())
+        return dev
+
+
+class SlowDevice(object):
+    """Mock device that takes a while to initialize and looks up the devices it refers to."""
+    threadSafeInit = True
+
+    def __init__(self, dm, config, name):
+        self.thread = threading.current_thread()
+        for key in ('parentDevice', 'scopeDevice'):
+            if key in config:
+                dm.getDevice(config[key])
+        for chan in config.get('channels', {}).values():
+            dm.getDevice(chan['device'])
+        time.sleep(config.get('delay', 0.1))
+
+
+class MainThreadDevice(SlowDevice):
+    threadSafeInit = False
+
+
+class BrokenDevice(SlowDevice):
+    def __init__(self, dm, config, name):
+        SlowDevice.__init__(self, dm, config, name)
+        raise Exception("Mock device failed to initialize")
+
+
+class SerialStyleDevice(Device):
+    """Mock serial device: opening the port takes a while and is done by initHardware(), 
+    but the rest of __init__ must run in the GUI thread."""
+    @classmethod
+    def initHardware(cls, config, name):
+        start = ptime.time()
+        time.sleep(config.get('delay', 0.1))
+        return {'port': config['port'], 'thread': threading.current_thread(), 'time': (start, ptime.time())}
+
+    def __init__(self, dm, config, name):
+        Device.__init__(self, dm, config, name)
+        self.hardware = self.getHardware(config, name)
+        self.thread = threading.current_thread()
+
+
+def deviceConfig():
+    return OrderedDict([
+        ('DAQ', {'driver': 'SlowDevice'}),
+        ('Stage1', {'driver': 'SlowDevice'}),
+        ('Stage2', {'driver': 'SlowDevice'}),
+        ('Microscope', {'driver': 'SlowDevice', 'config': {'parentDevice': 'Stage1'}}),
+        ('Camera', {'driver': 'MainThreadDevice', 'scopeDevice': 'Microscope', 'delay': 0.05}),
+        ('Broken', {'driver': 'BrokenDevice'}),
+        ('Clamp', {'driver': 'SlowDevice', 'channels': {'command': {'device': 'DAQ', 'channel': '/Dev1/ao0'}}}),
+        ('Missing', {'driver': 'SlowDevice', 'parentDevice': 'Broken'}),
+    ])
+
+
+def test_deviceLoader():
+    devConfig = deviceConfig()
+    dm = LoaderManager()
+    loader = DeviceLoader(dm, devConfig, threads=4)
+    assert loader.deps['Microscope'] == set(['Stage1'])
+    assert loader.deps['Camera'] == set(['Microscope'])
+    assert loader.deps['Clamp'] == set(['DAQ'])
+    assert loader.deps['Stage2'] == set()
+
+    start = ptime.time()
+    loader.run()
+    parallelTime = ptime.time() - start
+
+    # registration order and errors are the same as for serial loading
+    expected = ['DAQ', 'Stage1', 'Stage2', 'Microscope', 'Camera', 'Clamp']
+    assert list(dm.devices.keys()) == expected
+    assert sorted(loader.errors.keys()) == ['Broken', 'Missing']
+
+    # every device was loaded after the devices it refers to
+    for name in expected:
+        for dep in loader.deps[name]:
+            assert dm.loadTimes[name][0] >= dm.loadTimes[dep][1]
+    assert dm.devices['Camera'].thread is threading.current_thread()
+    assert dm.devices['DAQ'].thread is not threading.current_thread()
+
+    dm2 = LoaderManager()
+    loader = DeviceLoader(dm2, devConfig, threads=0)
+    start = ptime.time()
+    loader.run()
+    serialTime = ptime.time() - start
+    assert list(dm2.devices.keys()) == expected
+    assert sorted(loader.errors.keys()) == ['Broken', 'Missing']
+    assert all(dev.thread is threading.current_thread() for dev in dm2.devices.values())
+
+    print("Device loading time: serial %0.2f s, parallel %0.2f s" % (serialTime, parallelTime))
+    assert parallelTime < serialTime * 0.6
+
+
+def test_hardwareInit():
+    devConfig = OrderedDict([
+        ('Manipulator1', {'driver': 'SerialStyleDevice', 'port': 'COM1'}),
+        ('Manipulator2', {'driver': 'SerialStyleDevice', 'port': 'COM2'}),
+    ])
+    dm = LoaderManager()
+    loader = DeviceLoader(dm, devConfig, threads=4)
+    start = ptime.time()
+    loader.run()
+    elapsed = ptime.time() - start
+    assert loader.errors == {}
+    assert list(dm.devices.keys()) == ['Manipulator1', 'Manipulator2']
+
+    # ports were opened concurrently in worker threads; devices were constructed in this thread
+    devs = list(dm.devices.values())
+    for dev, port in zip(devs, ['COM1', 'COM2']):
+        assert dev.hardware['port'] == port
+        assert dev.hardware['thread'] is not threading.current_thread()
+        assert dev.thread is threading.current_thread()
+    t1, t2 = devs[0].hardware['time'], devs[1].hardware['time']
+    assert t1[0] < t2[1] and t2[0] < t1[1]
+    assert elapsed < 0.18
+
+    # loaded serially, each device opens its own port
+    dm2 = LoaderManager()
+    loader = DeviceLoader(dm2, devConfig, threads=0)
+    loader.run()
+    for dev in dm2.devices.values():
+        assert dev.hardware['thread'] is threading.current_thread()
@@ -6,6 +6,8 @@ import scipy.ndimage as ndimage
 import acq4.pyqtgraph as pg
 import acq4.util.DataManager as DataManager
 import acq4.util.debug as debug
+from acq4.util.ImagePyramid import ImagePyramid, isPyramidImage, downsample2x
+
 
 class ImageCanvasItem(CanvasItem):
     def __init__(self, image=None, **opts):
@@ -25,6 +27,7 @@ class ImageCanvasItem(CanvasItem):
         item = None
         self.data = None
         self.currentT = None
+        self.pyramid = None
         
         if isinstance(image, QtGui.QGraphicsItem):
             item = image
@@ -33,7 +36,12 @@ class ImageCanvasItem(CanvasItem):
         elif isinstance(image, DataManager.FileHandle):
             opts['handle'] = image
             self.handle = image
-            self.data = self.handle.read()
+            self.pyramid = ImagePyramid(self.handle)
+            if self.pyramid.isReady() and 'transform' in self.handle.info():
+                ## cached levels are memory-mapped; avoid reading the whole file
+                self.data = self.pyramid.level(0)
+            else:
+                self.data = self.handle.read()
 
             if 'name' not in opts:
                 opts['name'] = self.handle.shortName()
@@ -71,8 +79,16 @@ class ImageCanvasItem(CanvasItem):
             except:
                 debug.printExc('Error reading transformation for image file %s:' % image.name())
 
+        usePyramid = (self.pyramid is not None and self.data is not None and isPyramidImage(self.data) 
+                      and min(self.data.shape[:2]) >= 2 * self.pyramid.minSize)
+        if not usePyramid:
+            self.pyramid = None
+
         if item is None:
-            item = pg.ImageItem()
+            if usePyramid:
+                item = PyramidImageItem()
+            else:
+                item = pg.ImageItem()
         CanvasItem.__init__(self, item, **opts)
 
         self.histogram = pg.PlotWidget()
@@ -144,6 +160,46 @@ class ImageCanvasItem(CanvasItem):
         self.levelRgn.sigRegionChanged.connect(self.levelsChanged)
         self.levelRgn.sigRegionChangeFinished.connect(self.levelsChangeFinished)
 
+        if self.pyramid is not None:
+            ## display levels are generated in the background; the full-resolution
+            ## data is used until they are ready.
+            self._pyramidSource = self.data
+            self.pyramid.sigReady.connect(self.pyramidReady, QtCore.Qt.QueuedConnection)
+            self.pyramid.generate(self.data)
+
+    def pyramidReady(self):
+        levels = self.pyramid.levels()
+        gi = self.graphicsItem()
+        if levels is None or self.data is not self._pyramidSource or gi.sourceImage() is not self.data:
+            ## image has been modified since it was loaded; levels no longer apply
+            return
+        ## with a disk cache, swap the in-memory copy for the memory-mapped one
+        self.data = levels[0]
+        self._pyramidSource = self.data
+        gi.setPyramid(levels)
+
+    def statsData(self, level=0):
+        """Return the image data downsampled by 2**level along both image axes, for
+        computing statistics such as histograms. Levels are taken from the image
+        pyramid when it applies to the current data (waiting for it to be generated
+        if necessary) and computed otherwise, so images of equal size always give
+        arrays of equal shape. Data that is not a single image is returned at full
+        resolution."""
+        data = self.data
+        if level == 0 or not isPyramidImage(data):
+            return np.asarray(data)
+        levels = None
+        if self.pyramid is not None and data is self._pyramidSource:
+            self.pyramid.generate(data, block=True)
+            levels = self.pyramid.levels()
+        if levels is None:
+            levels = [data]
+        n = min(level, len(levels) - 1)
+        d = np.asarray(levels[n])
+        for i in range(level - n):
+            d = downsample2x(d)
+        return d
+
     @classmethod
     def checkFile(cls, fh):
         if not fh.isFile():
@@ -561,4 +617,93 @@ class ImageCanvasItem(CanvasItem):
             return out
 
 
-
+class PyramidImageItem(pg.ImageItem):
+    """ImageItem that draws from a multi-resolution image pyramid, choosing the
+    level that best matches the current zoom. Until setPyramid() is called (or
+    after the image is replaced with new data), it behaves exactly like ImageItem.
+    """
+    def __init__(self, *args, **kargs):
+        self._pyramid = None
+        self._source = None
+        self._renderedLevel = None
+        pg.ImageItem.__init__(self, *args, **kargs)
+
+    def setPyramid(self, levels):
+        """Set the list of image levels to draw from. Level 0 is full resolution and 
+        each following level is downsampled by 2x."""
+        self._pyramid = levels
+        self._renderedLevel = None
+        self.setImage(levels[0], autoLevels=False)
+
+    def sourceImage(self):
+        """Return the array most recently passed to setImage()."""
+        return self._source
+
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        if image is not None:
+            if self._pyramid is not None and image is not self._pyramid[0]:
+                self._pyramid = None
+            self._source = image
+        if self._pyramid is not None and autoLevels is not False and 'levels' not in kargs:
+            ## compute levels from the coarsest level instead of striding through
+            ## the full-resolution (memory-mapped) data
+            coarse = np.asarray(self._pyramid[-1])
+            mn, mx = coarse.min(), coarse.max()
+            if mn == mx:
+                mn = 0
+                mx = 255
+            kargs['levels'] = [mn, mx]
+            autoLevels = False
+        pg.ImageItem.setImage(self, image, autoLevels=autoLevels, **kargs)
+
+    def displayLevel(self):
+        """Return the index of the pyramid level matching the current zoom."""
+        if self._pyramid is None:
+            return 0
+        o = self.mapToDevice(QtCore.QPointF(0, 0))
+        x = self.mapToDevice(QtCore.QPointF(1, 0))
+        y = self.mapToDevice(QtCore.QPointF(0, 1))
+        if o is None or x is None or y is None:
+            return 0
+        size = max(pg.Point(x-o).length(), pg.Point(y-o).length())
+        if size <= 0 or size >= 0.5:
+            return 0
+        return int(min(len(self._pyramid) - 1, np.floor(np.log2(1. / size))))
+
+    def render(self):
+        if self._pyramid is None:
+            return pg.ImageItem.render(self)
+        level = self.displayLevel()
+        full = self.image
+        autoDownsample = self.autoDownsample
+        self.image = np.asarray(self._pyramid[level])
+        self.autoDownsample = False
+        try:
+            pg.ImageItem.render(self)
+        finally:
+            self.image = full
+            self.autoDownsample = autoDownsample
+        self._renderedLevel = level
+
+    def viewTransformChanged(self):
+        if self._pyramid is None:
+            return pg.ImageItem.viewTransformChanged(self)
+        if self.displayLevel() != self._renderedLevel:
+            self.qimage = None
+            self.update()
+
+    def getHistogram(self, *args, **kwds):
+        if self._pyramid is None:
+            return pg.ImageItem.getHistogram(self, *args, **kwds)
+        target = kwds.get('targetImageSize', 200)
+        level = self._pyramid[0]
+        for lvl in reversed(self._pyramid):
+            if min(lvl.shape[:2]) >= target:
+                level = lvl
+                break
+        full = self.image
+        self.image = np.asarray(level)
+        try:
+            return pg.ImageItem.getHistogram(self, *args, **kwds)
+        finally:
+            self.image = full
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+ImagePyramid.py -  Multi-resolution copies of image files
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Every level of a pyramid is downsampled by 2x along both image axes relative to
+the level before it. By default the levels are kept in memory, and level 0 is
+the original image array.
+
+Optionally, pyramids may be stored on disk (see setCacheDir). Each cached image
+is then stored as a series of .npy files, one per level (including a full-
+resolution copy). The files are memory-mapped when loaded so that only the parts
+of the image that are actually displayed need to be read into memory. The cache
+is limited in size (see setMaxCacheSize); whenever a new pyramid is written, the
+least recently used pyramids are removed to stay under the limit.
+"""
+
+import os, hashlib, json, shutil, tempfile, threading, time
+import numpy as np
+from acq4.pyqtgraph.Qt import QtCore
+from acq4.util.debug import printExc
+
+
+_cacheDir = None
+_maxCacheSize = 2 * 1024**3
+_pruneLock = threading.Lock()
+
+def cacheDir():
+    """Return the directory in which image pyramids are stored, or None if
+    pyramids are kept in memory."""
+    return _cacheDir
+
+def setCacheDir(path):
+    """Set the directory in which image pyramids are stored. If *path* is None
+    (the default), pyramids are kept in memory instead."""
+    global _cacheDir
+    _cacheDir = path
+
+def setMaxCacheSize(size):
+    """Set the maximum total size in bytes of the pyramid cache (None for no limit)."""
+    global _maxCacheSize
+    _maxCacheSize = size
+
+def pruneCache(maxSize=None, keep=()):
+    """Remove the least recently used pyramids until the total size of the cache
+    is at most *maxSize* bytes (default is the limit given to setMaxCacheSize).
+
+    Pyramid directories listed in *keep* are never removed. Temporary directories
+    left behind by interrupted pyramid generation are removed once they are an
+    hour old.
+    """
+    if maxSize is None:
+        maxSize = _maxCacheSize
+    root = cacheDir()
+    if root is None or not os.path.isdir(root):
+        return
+    with _pruneLock:
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                if name.startswith('tmp-'):
+                    ## a pyramid may still be being written here
+                    if now - os.path.getmtime(path) > 3600:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                ## levels() touches pyramid.json each time a pyramid is opened
+                meta = os.path.join(path, 'pyramid.json')
+                lastUse = os.path.getmtime(meta if os.path.exists(meta) else path)
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            except OSError:
+                ## removed by another process while we were looking
+                continue
+            entries.append((lastUse, path, size))
+            total += size
+
+        if maxSize is None or total <= maxSize:
+            return
+        keep = [os.path.abspath(k) for k in keep]
+        for lastUse, path, size in sorted(entries):
+            if total <= maxSize:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            ## memory-mapped levels that are still open may not be removable (Windows)
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                total -= size
+
+def clearCache():
+    """Remove all pyramids from the cache directory."""
+    pruneCache(maxSize=0)
+
+
+def isPyramidImage(data):
+    """Return True if *data* has the shape of a single (gray or color) image for which
+    a pyramid can be generated."""
+    return data.ndim == 2 or (data.ndim == 3 and data.shape[2] <= 4)
+
+
+def levelCount(shape, minSize=128):
+    """Return the number of levels buildLevels() generates for an image of *shape*."""
+    n = 1
+    size = min(shape[:2])
+    while size // 2 >= minSize:
+        size //= 2
+        n += 1
+    return n
+
+def buildLevels(data, minSize=128):
+    """Return a list of successively downsampled copies of the image *data*.
+
+    Level 0 is *data* itself; each following level is the 2x2 block average of
+    the level before it. Levels are generated until the smaller image axis would
+    drop below *minSize*. Each level retains the dtype of *data*.
+    """
+    levels = [data]
+    for i in range(levelCount(data.shape, minSize) - 1):
+        levels.append(downsample2x(levels[-1]))
+    return levels
+
+def downsample2x(data):
+    """Average 2x2 blocks along the first two axes of *data* (odd rows/columns are dropped)."""
+    w = data.shape[0] // 2
+    h = data.shape[1] // 2
+    d = np.asarray(data[:w*2, :h*2], dtype=float)
+    d = d.reshape((w, 2, h, 2) + d.shape[2:]).mean(axis=3).mean(axis=1)
+    if data.dtype.kind in 'ui':
+        d = np.round(d)
+    return d.astype(data.dtype)
+
+
+class ImagePyramid(QtCore.QObject):
+    """Multi-resolution copies of a single image file.
+
+    Levels are generated in a background thread by generate(). Unless a cache
+    directory has been set, they are kept in memory. Otherwise they are written to
+    cacheDir() and level(n) returns a read-only memory-mapped array for each level;
+    the cache is keyed by the file's path, size, and modification time, so a
+    modified file automatically gets a new pyramid.
+
+    ============== ============================================================
+    **Arguments:**
+    fileName       The image file (a FileHandle is also accepted).
+    minSize        Levels are generated until the smaller image axis would drop
+                   below this size.
+    ============== ============================================================
+
+    **Signals:**
+    sigReady(self)  Emitted (from the generating thread) when all levels are
+                    available.
+    """
+
+    sigReady = QtCore.Signal(object)
+
+    def __init__(self, fileName, minSize=128):
+        QtCore.QObject.__init__(self)
+        self.handle = None
+        if hasattr(fileName, 'name'):
+            self.handle = fileName
+            fileName = fileName.name()
+        self.fileName = os.path.abspath(fileName)
+        self.minSize = minSize
+        self._levels = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def cachePath(self):
+        """Return the directory that holds (or will hold) the levels for this file,
+        or None if pyramids are kept in memory."""
+        if cacheDir() is None:
+            return None
+        st = os.stat(self.fileName)
+        key = "%s|%d|%f|%d" % (self.fileName, st.st_size, st.st_mtime, self.minSize)
+        return os.path.join(cacheDir(), hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def isReady(self):
+        """Return True if all levels are available."""
+        if self._levels is not None:
+            return True
+        path = self.cachePath()
+        return path is not None and os.path.isfile(os.path.join(path, 'pyramid.json'))
+
+    def levels(self):
+        """Return the list of levels (level 0 is full resolution), or None if the
+        pyramid has not been generated yet."""
+        with self._lock:
+            if self._levels is None:
+                path = self.cachePath()
+                if path is None:
+                    return None
+                try:
+                    with open(os.path.join(path, 'pyramid.json')) as fh:
+                        meta = json.load(fh)
+                except IOError:
+                    return None
+                ## record the use so that pruneCache() evicts least recently used pyramids first
+                try:
+                    os.utime(os.path.join(path, 'pyramid.json'), None)
+                except OSError:
+                    pass
+                self._levels = [np.load(os.path.join(path, 'level_%d.npy' % i), mmap_mode='r')
+                                for i in range(meta['nLevels'])]
+            return self._levels
+
+    def level(self, n):
+        """Return the array for level *n*."""
+        levels = self.levels()
+        if levels is None:
+            raise Exception("Image pyramid for %s has not been generated." % self.fileName)
+        return levels[n]
+
+    def levelForDownsample(self, ds):
+        """Return the index of the finest level that is downsampled by no more than *ds*."""
+        n = len(self.levels())
+        if ds <= 1:
+            return 0
+        return int(min(n - 1, np.floor(np.log2(ds))))
+
+    def coarsestLevel(self, minSize=128):
+        """Return the coarsest level whose smaller image axis is at least *minSize*
+        (or level 0 if no level is that large)."""
+        levels = self.levels()
+        for lvl in reversed(levels):
+            if min(lvl.shape[:2]) >= minSize:
+                return lvl
+        return levels[0]
+
+    def generate(self, data=None, block=False):
+        """Generate and store the pyramid levels in a background thread.
+
+        If *data* is not given, the image is read from the file (this requires that
+        the pyramid was created from a FileHandle). If *block* is True, wait for the
+        levels to be written before returning.
+        """
+        if self.isReady():
+            self.sigReady.emit(self)
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._generate, args=(data,))
+                self._thread.daemon = True
+                self._thread.start()
+            thread = self._thread
+        if block:
+            thread.join()
+
+    def _generate(self, data):
+        try:
+            if data is None:
+                if self.handle is None:
+                    raise Exception("No image data given for %s" % self.fileName)
+                data = self.handle.read()
+            if not isPyramidImage(data):
+                raise ValueError("Cannot generate image pyramid for array with shape %s" % str(data.shape))
+            levels = buildLevels(np.asarray(data), self.minSize)
+            path = self.cachePath()
+            if path is None:
+                ## level 0 is the original image, not a copy
+                levels[0] = data
+                with self._lock:
+                    self._levels = levels
+            else:
+                self._writeLevels(levels, path)
+        except Exception:
+            printExc("Error generating image pyramid for %s:" % self.fileName)
+            return
+        finally:
+            with self._lock:
+                self._thread = None
+        if path is not None:
+            try:
+                pruneCache(keep=[path])
+            except Exception:
+                printExc("Error pruning image pyramid cache:")
+        self.sigReady.emit(self)
+
+    def _writeLevels(self, levels, path):
+        ## write levels to a private directory, then move it into place so that
+        ## readers never see a partially written pyramid
+        tmp = tempfile.mkdtemp(prefix='tmp-', dir=self._ensureCacheDir())
+        for i, lvl in enumerate(levels):
+            np.save(os.path.join(tmp, 'level_%d.npy' % i), lvl)
+        with open(os.path.join(tmp, 'pyramid.json'), 'w') as fh:
+            json.dump({'fileName': self.fileName, 'nLevels': len(levels),
+                       'shapes': [list(lvl.shape) for lvl in levels]}, fh)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            ## another process/thread finished first; use its copy.
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+
+    def _ensureCacheDir(self):
+        path = cacheDir()
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+        return path
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+RingBuffer.py -  Preallocated circular buffer for array rows
+Distributed under MIT/X11 license. See license.txt for more infomation.
+"""
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """First-in, first-out buffer of fixed-shape rows stored in a preallocated array.
+
+    Appending a row or removing rows from the front costs the same regardless of how
+    much data is stored, unlike list.pop(0). The storage is allocated once; when
+    the buffer is full, adding rows discards the oldest rows.
+
+    ============== ============================================================
+    **Arguments:**
+    rowShape       Shape of each row (default is a scalar per row).
+    dtype          Data type of the storage array.
+    size           Capacity in rows.
+    ============== ============================================================
+    """
+
+    def __init__(self, rowShape=(), dtype=float, size=1024):
+        self._data = np.empty((max(size, 1),) + tuple(rowShape), dtype=dtype)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def capacity(self):
+        return self._data.shape[0]
+
+    def rowShape(self):
+        return self._data.shape[1:]
+
+    def append(self, row):
+        """Add one row to the end of the buffer, discarding the oldest row if the
+        buffer is full."""
+        if self._len == self._data.shape[0]:
+            self.popFront(1)
+        self._data[(self._start + self._len) % self._data.shape[0]] = row
+        self._len += 1
+
+    def extend(self, rows):
+        """Add several rows to the end of the buffer, discarding the oldest rows if
+        the buffer is full."""
+        rows = np.asarray(rows)
+        cap = self._data.shape[0]
+        rows = rows[max(len(rows) - cap, 0):]
+        n = len(rows)
+        self.popFront(self._len + n - cap)
+        i = (self._start + self._len) % cap
+        first = min(n, cap - i)
+        self._data[i:i+first] = rows[:first]
+        self._data[:n-first] = rows[first:]
+        self._len += n
+
+    def popFront(self, n=1):
+        """Remove *n* rows from the front of the buffer."""
+        n = min(max(n, 0), self._len)
+        self._start = (self._start + n) % self._data.shape[0]
+        self._len -= n
+
+    def searchsorted(self, value, column=0):
+        """Return the number of rows at the front of the buffer whose *column* is
+        less than *value*, like np.searchsorted(self.data()[:, column], value).
+
+        Rows must be sorted by *column*. The search is a bisection of the storage
+        array in place, so it does not copy the rows as data() may. *column* is
+        ignored if rows are scalars.
+        """
+        keys = self._data if self._data.ndim == 1 else self._data[:, column]
+        cap = keys.shape[0]
+        lo = 0
+        hi = self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keys[(self._start + mid) % cap] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
+
+    def __getitem__(self, i):
+        """Return row *i* (negative indices count from the end)."""
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("RingBuffer index %d out of range" % i)
+        return self._data[(self._start + i) % self._data.shape[0]]
+
+    def data(self):
+        """Return all rows in order, oldest first.
+
+        The result is a view of the storage when the rows happen to be contiguous,
+        and a copy otherwise; it should not be modified.
+        """
+        end = self._start + self._len
+        if end <= self._data.shape[0]:
+            return self._data[self._start:end]
+        return np.concatenate([self._data[self._start:], self._data[:end - self._data.shape[0]]])
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+TimeSeriesAppender.py -  Buffered, background appending of rows to MetaArray files
+Distributed under MIT/X11 license. See license.txt for more infomation.
+"""
+
+import threading, atexit, weakref
+import numpy as np
+from acq4.util.metaarray import MetaArray
+from acq4.util.debug import printExc
+import acq4.util.ptime as ptime
+
+
+class TimeSeriesAppender(object):
+    """Collects small MetaArray chunks (usually one row per trial) and appends
+    them to a file from a background thread.
+
+    Modules that record one set of scalar values per trial (Patch, for example)
+    would otherwise reopen and extend the file on every trial. Instead, chunks
+    passed to append() are queued and written together whenever *flushRows*
+    rows have accumulated or *flushInterval* seconds have elapsed since the
+    oldest unwritten row, whichever comes first. At most those limits worth of
+    data is lost if the process dies; pending rows are also written by close()
+    and at interpreter exit.
+
+    All chunks must have the same layout on every axis other than *appendAxis*,
+    and the target file must already exist (create it with the first chunk,
+    for example via DirHandle.writeFile(..., appendAxis=...)).
+
+    ============== ============================================================
+    **Arguments:**
+    fileName       Name of the MetaArray file to append to (a FileHandle is
+                   also accepted).
+    appendAxis     Name or index of the axis along which rows are appended.
+    flushRows      Number of buffered rows that triggers a write.
+    flushInterval  Maximum time (seconds) a row may wait before being written.
+    ============== ============================================================
+    """
+
+    def __init__(self, fileName, appendAxis='Time', flushRows=100, flushInterval=2.0):
+        if hasattr(fileName, 'name'):
+            fileName = fileName.name()
+        self.fileName = fileName
+        self.appendAxis = appendAxis
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+
+        self._cond = threading.Condition()
+        self._pending = []       # chunks waiting to be written
+        self._pendingRows = 0
+        self._oldest = None      # time at which the oldest pending chunk arrived
+        self._flushRequested = False
+        self._writing = False
+        self._stop = False
+        self.rowsWritten = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        ## make sure buffered data reaches the disk if the program exits without closing us
+        ref = weakref.ref(self)
+        def closeAtExit():
+            app = ref()
+            if app is not None:
+                app.close()
+        self._atexit = closeAtExit
+        atexit.register(closeAtExit)
+
+    def append(self, data):
+        """Queue a MetaArray chunk to be appended to the file.
+
+        This method returns immediately; the write happens in the background.
+        """
+        if not isinstance(data, MetaArray):
+            raise TypeError("TimeSeriesAppender.append() requires a MetaArray (got %s)" % type(data))
+        with self._cond:
+            if self._stop:
+                raise Exception("Cannot append to closed TimeSeriesAppender (%s)" % self.fileName)
+            ax = data._interpretAxis(self.appendAxis)
+            self._pending.append(data)
+            self._pendingRows += data.shape[ax]
+            if self._oldest is None:
+                self._oldest = ptime.time()
+            ## wake the writer so it can re-evaluate its deadline
+            self._cond.notify()
+
+    def pendingRows(self):
+        """Return the number of rows that have been appended but not yet written."""
+        with self._cond:
+            return self._pendingRows
+
+    def flush(self, block=True):
+        """Request that all pending rows be written immediately.
+
+        If *block* is True, wait until the write has completed.
+        """
+        with self._cond:
+            self._flushRequested = True
+            self._cond.notify()
+            if block:
+                while (self._pendingRows > 0 or self._writing) and self._thread.is_alive():
+                    self._cond.wait(0.1)
+
+    def close(self):
+        """Write all pending rows and stop the background thread.
+
+        It is safe to call this method more than once.
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        try:
+            atexit._exithandlers.remove((self._atexit, (), {}))
+        except (AttributeError, ValueError):
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stop or self._flushRequested or self._pendingRows >= self.flushRows:
+                        break
+                    if self._oldest is None:
+                        self._cond.wait()
+                    else:
+                        remaining = self._oldest + self.flushInterval - ptime.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                chunks = self._pending
+                nRows = self._pendingRows
+                self._pending = []
+                self._pendingRows = 0
+                self._oldest = None
+                self._flushRequested = False
+                self._writing = len(chunks) > 0
+                stop = self._stop
+
+            try:
+                if len(chunks) > 0:
+                    self._write(chunks)
+                    self.rowsWritten += nRows
+            except Exception:
+                printExc("Error appending %d rows to %s:" % (nRows, self.fileName))
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+            if stop:
+                break
+
+    def _write(self, chunks):
+        ## merge consecutive chunks that share the same layout so each group
+        ## costs a single open/resize/close of the file
+        for group in self._groupChunks(chunks):
+            concatenateChunks(group, self.appendAxis).write(self.fileName, appendAxis=self.appendAxis)
+
+    def _groupChunks(self, chunks):
+        groups = [[chunks[0]]]
+        for chunk in chunks[1:]:
+            if sameLayout(groups[-1][0], chunk, self.appendAxis):
+                groups[-1].append(chunk)
+            else:
+                groups.append([chunk])
+        return groups
+
+
+def sameLayout(a, b, axis):
+    """Return True if MetaArrays *a* and *b* can be concatenated along *axis*."""
+    ax = a._interpretAxis(axis)
+    if a.ndim != b.ndim or a.dtype != b.dtype:
+        return False
+    for i in range(a.ndim):
+        if i == ax:
+            continue
+        if a.shape[i] != b.shape[i]:
+            return False
+        ca = [c.get('name') for c in a._info[i].get('cols', [])]
+        cb = [c.get('name') for c in b._info[i].get('cols', [])]
+        if ca != cb:
+            return False
+    return True
+
+
+def concatenateChunks(chunks, axis):
+    """Concatenate a list of MetaArrays along *axis*, including the axis values.
+    Meta info for all other axes is taken from the first chunk."""
+    if len(chunks) == 1:
+        return chunks[0]
+    first = chunks[0]
+    ax = first._interpretAxis(axis)
+    data = np.concatenate([c.view(np.ndarray) for c in chunks], axis=ax)
+    info = first.infoCopy()
+    if 'values' in info[ax]:
+        info[ax]['values'] = np.concatenate([np.asarray(c._info[ax]['values']) for c in chunks])
+    return MetaArray(data, info=info)
@@ -5,8 +5,12 @@ Copyright 2010  Luke Campagnola
 Distributed under MIT/X11 license. See license.txt for more infomation.
 """
 
+import os, sys, math, fnmatch, threading
+from collections import OrderedDict
+import numpy as np
 from acq4.pyqtgraph.debug import *
 import acq4.pyqtgraph.debug as pgdebug
+import acq4.pyqtgraph.ptime as ptime
 
 
 def printExc(msg='', indent=4, prefix='|', msgType='error'):
@@ -19,6 +23,193 @@ def printExc(msg='', indent=4, prefix='|', msgType='error'):
             acq4.Manager.logExc(msg=msg, msgType=msgType)
     except Exception:
         pgdebug.printExc("[failed to log this error to manager]")
-        
-    
-    
+
+
+class ProfilerRegistry(object):
+    """Collects timing statistics from Profiler sites that are enabled at runtime.
+
+    Profiler sites throughout ACQ4 are created with ``disabled=True`` so that they
+    cost nothing during normal operation. Sites whose name matches one of the
+    patterns given to enable() instead record the time between successive marks
+    (and the total time under the mark '<total>') into per-mark histograms.
+    A site's name is the *msg* argument given to Profiler, or the qualified name
+    of the calling function ("Class.method") if no message was given. Patterns use
+    shell-style wildcards, for example "Manager.Task.*" or "*".
+
+    Patterns are read from the comma-separated ACQ4_PROFILE environment variable
+    at startup and from the 'profile' key of the Manager configuration.
+    """
+    binsPerDecade = 20
+    minExponent = -7  # 100 ns
+    maxExponent = 3   # 1000 s
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._patterns = []
+        self._matches = {}
+        self._stats = OrderedDict()
+
+    def enable(self, patterns):
+        """Enable all Profiler sites matching *patterns* (a string or list of strings;
+        strings may contain several comma-separated patterns)."""
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        with self.lock:
+            for pat in patterns:
+                for p in pat.split(','):
+                    p = p.strip()
+                    if p != '' and p not in self._patterns:
+                        self._patterns.append(p)
+            self._matches = {}
+
+    def disable(self, patterns=None):
+        """Disable Profiler sites matching *patterns*, or all sites if no patterns are given.
+        Statistics collected so far are kept."""
+        with self.lock:
+            if patterns is None:
+                self._patterns = []
+            else:
+                if isinstance(patterns, basestring):
+                    patterns = patterns.split(',')
+                patterns = [p.strip() for p in patterns]
+                self._patterns = [p for p in self._patterns if p not in patterns]
+            self._matches = {}
+
+    def patterns(self):
+        return self._patterns[:]
+
+    def isEnabled(self, name):
+        """Return True if the Profiler site *name* matches any enabled pattern."""
+        try:
+            return self._matches[name]
+        except KeyError:
+            pass
+        match = any(fnmatch.fnmatchcase(name, p) for p in self._patterns)
+        with self.lock:
+            if len(self._matches) < 10000:
+                self._matches[name] = match
+        return match
+
+    def record(self, site, mark, dt):
+        """Add a duration *dt* (seconds) to the histogram for *mark* in *site*."""
+        if dt > 0:
+            b = int((math.log10(dt) - self.minExponent) * self.binsPerDecade)
+            b = min(max(b, 0), self.nBins() - 1)
+        else:
+            b = 0
+        with self.lock:
+            marks = self._stats.setdefault(site, OrderedDict())
+            stat = marks.get(mark)
+            if stat is None:
+                stat = marks[mark] = [0, 0.0, 0.0, np.zeros(self.nBins(), dtype=int)]
+            stat[0] += 1
+            stat[1] += dt
+            stat[2] = max(stat[2], dt)
+            stat[3][b] += 1
+
+    def nBins(self):
+        return (self.maxExponent - self.minExponent) * self.binsPerDecade
+
+    def binEdges(self):
+        """Return the upper edge (in seconds) of each histogram bin."""
+        return 10 ** (self.minExponent + (np.arange(self.nBins()) + 1.0) / self.binsPerDecade)
+
+    def stats(self):
+        """Return an OrderedDict {site: {mark: {'count', 'mean', 'p95', 'max', 'total'}}}.
+
+        p95 is estimated from the histogram as the upper edge of the bin containing the
+        95th percentile (limited to the maximum), so it is accurate to one bin width
+        (about 12%).
+        """
+        edges = self.binEdges()
+        out = OrderedDict()
+        with self.lock:
+            for site, marks in self._stats.items():
+                out[site] = OrderedDict()
+                for mark, (count, total, maxVal, hist) in marks.items():
+                    ind = np.searchsorted(np.cumsum(hist), 0.95 * count)
+                    out[site][mark] = OrderedDict([
+                        ('count', count),
+                        ('mean', total / count),
+                        ('p95', min(edges[ind], maxVal)),
+                        ('max', maxVal),
+                        ('total', total),
+                    ])
+        return out
+
+    def reset(self):
+        """Discard all collected statistics."""
+        with self.lock:
+            self._stats = OrderedDict()
+
+    def dump(self, fh=None):
+        """Write a table of the collected statistics to *fh* (default sys.stdout)."""
+        if fh is None:
+            fh = sys.stdout
+        fh.write("%-40s %8s %10s %10s %10s\n" % ('site / mark', 'count', 'mean ms', 'p95 ms', 'max ms'))
+        for site, marks in self.stats().items():
+            fh.write(site + '\n')
+            for mark, s in marks.items():
+                fh.write("    %-36s %8d %10.3f %10.3f %10.3f\n" % (
+                    mark, s['count'], s['mean']*1e3, s['p95']*1e3, s['max']*1e3))
+
+
+profilerRegistry = ProfilerRegistry()
+profilerRegistry.enable(os.environ.get('ACQ4_PROFILE', ''))
+
+
+def _callerName(frame):
+    ## same naming scheme as pyqtgraph's Profiler: "Class.method" or "module.function"
+    try:
+        return type(frame.f_locals["self"]).__name__ + '.' + frame.f_code.co_name
+    except KeyError:
+        return frame.f_globals["__name__"].split(".", 1)[-1] + '.' + frame.f_code.co_name
+
+
+class Profiler(pgdebug.Profiler):
+    """Profiler that can also be enabled at runtime through profilerRegistry.
+
+    When no registry patterns are enabled this behaves exactly like pyqtgraph's
+    Profiler (and ``Profiler(..., disabled=True)`` costs only a function call).
+    For sites that match an enabled pattern, an AggregatingProfiler is returned
+    instead, regardless of the *disabled* argument.
+    """
+    _callerDepth = 2
+
+    def __new__(cls, msg=None, disabled='env', delayed=True):
+        if profilerRegistry._patterns:
+            name = msg if isinstance(msg, basestring) else _callerName(sys._getframe(1))
+            if profilerRegistry.isEnabled(name):
+                return AggregatingProfiler(name)
+        return pgdebug.Profiler.__new__(cls, msg, disabled, delayed)
+
+
+class AggregatingProfiler(object):
+    """Profiler that records mark timings in profilerRegistry rather than printing them."""
+    def __init__(self, name):
+        self._name = name
+        self._markCount = 0
+        self._finished = False
+        self._firstTime = self._lastTime = ptime.time()
+
+    def __call__(self, msg=None):
+        if msg is None:
+            msg = str(self._markCount)
+        self._markCount += 1
+        now = ptime.time()
+        profilerRegistry.record(self._name, msg, now - self._lastTime)
+        self._lastTime = now
+
+    def mark(self, msg=None):
+        self(msg)
+
+    def finish(self, msg=None):
+        if self._finished:
+            return
+        self._finished = True
+        if msg is not None:
+            self(msg)
+        profilerRegistry.record(self._name, '<total>', ptime.time() - self._firstTime)
+
+    def __del__(self):
+        self.finish()
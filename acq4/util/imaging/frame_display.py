@@ -2,7 +2,7 @@ from PyQt4 import QtCore, QtGui
 from acq4 import pyqtgraph as pg
 from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
-from acq4.util.debug import printExc
+from acq4.util.debug import printExc, Profiler
 
 
 class FrameDisplay(QtCore.QObject):
@@ -110,7 +110,7 @@ class FrameDisplay(QtCore.QObject):
                 #sys.stdout.write('-')
                 return
             
-            prof = pg.debug.Profiler()
+            prof = Profiler()
             ## We will now draw a new frame (even if the frame is unchanged)
             if self.lastDrawTime is not None:
                 fps = 1.0 / (t - self.lastDrawTime)
@@ -0,0 +1,156 @@
+import numpy as np
+import scipy.sparse
+import acq4.pyqtgraph as pg
+
+
+def roiSampleWeights(roi, shape, img):
+    """Return (indices, weights) describing the mean of roi.getArrayRegion().
+
+    For any array *data* whose first two axes have *shape* and are displayed by
+    *img*, ``(data.reshape(n, -1)[indices] * weights[:, None]).sum(axis=0)`` is the
+    mean of ``roi.getArrayRegion(data, img, axes=(0,1))`` over the two image axes
+    (with n = shape[0] * shape[1]). Indices are into the flattened image axes and
+    may repeat.
+
+    Returns None if getArrayRegion would return None (the ROI does not overlap
+    the image).
+    """
+    if isinstance(roi, pg.PolyLineROI):
+        ## region is the bounding slice of the ROI, multiplied by a rendered mask
+        ones = np.ones(shape)
+        sl = roi.getArraySlice(ones, img, axes=(0, 1))
+        if sl is None:
+            return None
+        mask = roi.getArrayRegion(ones, img, axes=(0, 1))
+        xi = np.arange(shape[0])[sl[0][0]]
+        yi = np.arange(shape[1])[sl[0][1]]
+        indices = (xi[:, None] * shape[1] + yi[None, :]).ravel()
+        return indices, mask.ravel() / max(mask.size, 1)
+
+    ## Region is sampled by bilinear interpolation on an affine grid;
+    ## this follows ROI.getAffineSliceParams, affineSlice, and interpolateArray.
+    size, vectors, origin = roi.getAffineSliceParams(np.empty(shape), img, axes=(0, 1))
+    size = [int(np.ceil(s)) for s in size]
+    vectors = np.array(vectors, dtype=float)
+    i, j = np.mgrid[0:size[0], 0:size[1]]
+    x = (origin[0] + i * vectors[0, 0] + j * vectors[1, 0]).ravel()
+    y = (origin[1] + i * vectors[0, 1] + j * vectors[1, 1]).ravel()
+    nSamples = x.size
+    if isinstance(roi, pg.EllipseROI):
+        if size[0] == 0 or size[1] == 0:
+            return None
+        w, h = size
+        ell = ((((i+0.5)/(w/2.)-1)**2 + ((j+0.5)/(h/2.)-1)**2)**0.5 < 1).ravel()
+    else:
+        ell = np.ones(nSamples, dtype=bool)
+
+    x0 = np.floor(x).astype(int)
+    y0 = np.floor(y).astype(int)
+    dx = x - x0
+    dy = y - y0
+    ## samples outside the image are 0
+    inside = ell & (x0 >= 0) & (x <= shape[0]-1) & (y0 >= 0) & (y <= shape[1]-1)
+    x0, y0, dx, dy = x0[inside], y0[inside], dx[inside], dy[inside]
+
+    indices = []
+    weights = []
+    for cx, cy, wt in [(x0, y0, (1-dx) * (1-dy)), (x0+1, y0, dx * (1-dy)),
+                       (x0, y0+1, (1-dx) * dy), (x0+1, y0+1, dx * dy)]:
+        ## the far corner is only out of bounds when its weight is 0
+        ok = (cx < shape[0]) & (cy < shape[1])
+        indices.append(cx[ok] * shape[1] + cy[ok])
+        weights.append(wt[ok])
+    return np.concatenate(indices), np.concatenate(weights) / max(nSamples, 1)
+
+
+class ROIMeans(object):
+    """Compute the mean of each of a list of ROIs for a series of images.
+
+    This gives the same values as calling ``roi.getArrayRegion(data, img).mean()``
+    for each ROI, but the sampling done by getArrayRegion is precomputed as a
+    sparse weight matrix so that all means for an image come from a single
+    matrix product. The matrix is rebuilt only when an ROI changes, when the ROIs
+    move relative to *img*, or when the image shape changes.
+
+    ROIs for which getArrayRegion returns None yield NaN.
+    """
+
+    def __init__(self, rois=()):
+        self.rois = []
+        self._matrix = None
+        self._missing = None
+        self._key = None
+        self.setROIs(rois)
+
+    def setROIs(self, rois):
+        for roi in self.rois:
+            roi.sigRegionChanged.disconnect(self.invalidate)
+        self.rois = list(rois)
+        for roi in self.rois:
+            roi.sigRegionChanged.connect(self.invalidate)
+        self.invalidate()
+
+    def invalidate(self, *args):
+        """Force the weight matrix to be rebuilt for the next image."""
+        self._matrix = None
+
+    def means(self, data, img):
+        """Return an array with the mean value within each ROI for *data*, which is
+        displayed by the ImageItem *img*."""
+        shape = data.shape[:2]
+        self._update(shape, img)
+        vals = self._matrix.dot(data.reshape(shape[0] * shape[1], -1))
+        vals = vals.mean(axis=1)
+        vals[self._missing] = np.nan
+        return vals
+
+    def traces(self, data, img):
+        """Return an array (nROIs, nFrames) with the mean value within each ROI for
+        every frame of the image stack *data*, whose last two axes are displayed by
+        the ImageItem *img*.
+
+        This is the mean of ``roi.getArrayRegion(data, img, axes=(1,2))`` over the
+        two image axes, computed for all ROIs with a single sparse matrix product.
+        """
+        shape = data.shape[1:3]
+        self._update(shape, img)
+        vals = self._matrix.dot(data.reshape(data.shape[0], shape[0] * shape[1]).T)
+        vals[self._missing] = np.nan
+        return vals
+
+    def _update(self, shape, img):
+        key = (shape, img.width(), img.height()) + self._mappingKey(img)
+        if self._matrix is None or key != self._key:
+            self._buildMatrix(shape, img)
+            self._key = key
+
+    def _mappingKey(self, img):
+        ## ROIs and image may each be moved by their parents; the matrix stays valid
+        ## as long as the mapping from image to ROI parent is unchanged.
+        key = []
+        parents = []
+        for roi in self.rois:
+            if roi.parentItem() not in parents:
+                parents.append(roi.parentItem())
+        for parent in parents:
+            tr = img.itemTransform(parent)[0]
+            key.append((tr.m11(), tr.m12(), tr.m13(), tr.m21(), tr.m22(), tr.m23(), tr.m31(), tr.m32(), tr.m33()))
+        return tuple(key)
+
+    def _buildMatrix(self, shape, img):
+        rows = []
+        cols = []
+        vals = []
+        missing = np.zeros(len(self.rois), dtype=bool)
+        for i, roi in enumerate(self.rois):
+            w = roiSampleWeights(roi, shape, img)
+            if w is None:
+                missing[i] = True
+                continue
+            rows.append(np.ones(len(w[0]), dtype=int) * i)
+            cols.append(w[0])
+            vals.append(w[1])
+        if len(rows) > 0:
+            rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        self._matrix = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.rois), shape[0] * shape[1]))
+        self._missing = missing
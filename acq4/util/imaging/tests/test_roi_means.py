@@ -0,0 +1,96 @@
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.util.imaging.roi_means import ROIMeans
+
+app = pg.mkQApp()
+
+
+def makeView(shape):
+    win = pg.GraphicsLayoutWidget()
+    view = win.addViewBox()
+    img = pg.ImageItem(np.zeros(shape))
+    view.addItem(img)
+    return win, view, img
+
+
+def regionMeans(rois, data, img):
+    out = []
+    for roi in rois:
+        d = roi.getArrayRegion(data, img, axes=(0, 1))
+        out.append(np.nan if d is None else (0 if d.size < 1 else d.mean()))
+    return np.array(out)
+
+
+def test_axisAlignedMeans():
+    shape = (128, 100)
+    win, view, img = makeView(shape)
+    rois = [pg.ROI([10, 20], [15, 8]), pg.ROI([0, 0], [1, 1]), pg.ROI([90, 70], [30, 40]),
+            pg.ROI([3.5, 7.25], [10, 12])]
+    for roi in rois:
+        view.addItem(roi)
+    means = ROIMeans(rois)
+
+    for i in range(3):
+        data = np.random.randint(0, 4096, size=shape).astype(np.uint16)
+        assert np.allclose(means.means(data, img), regionMeans(rois, data, img), rtol=1e-12)
+
+    # weights are only rebuilt when an ROI moves
+    matrix = means._matrix
+    means.means(data, img)
+    assert means._matrix is matrix
+    rois[0].setPos([40, 30])
+    assert np.allclose(means.means(data, img), regionMeans(rois, data, img), rtol=1e-12)
+    assert means._matrix is not matrix
+
+
+def test_transformedMeans():
+    shape = (64, 80)
+    win, view, img = makeView(shape)
+    img.setTransform(pg.QtGui.QTransform().scale(0.5, 2.0))
+    rois = [pg.ROI([5, 10], [12, 30], angle=20), pg.EllipseROI([8, 40], [10, 50]),
+            pg.PolyLineROI([[2, 2], [20, 10], [6, 60]], closed=True)]
+    for roi in rois:
+        view.addItem(roi)
+    means = ROIMeans(rois)
+    data = np.random.normal(size=shape)
+    assert np.allclose(means.means(data, img), regionMeans(rois, data, img))
+
+    # moving the image relative to the ROIs also rebuilds the weights
+    img.setTransform(pg.QtGui.QTransform().scale(0.5, 2.0).translate(3, 1))
+    assert np.allclose(means.means(data, img), regionMeans(rois, data, img))
+
+
+def test_throughput():
+    shape = (512, 512)
+    win, view, img = makeView(shape)
+    rng = np.random.RandomState(0)
+    rois = [pg.ROI(rng.uniform(0, 450, size=2), [30, 30]) for i in range(20)]
+    for roi in rois:
+        view.addItem(roi)
+    means = ROIMeans(rois)
+    frames = [rng.randint(0, 4096, size=shape).astype(np.uint16) for i in range(4)]
+    means.means(frames[0], img)
+
+    # the weights are computed once; each frame costs one sparse product over the
+    # samples inside the ROIs, independent of the image size
+    matrix = means._matrix
+    for i in range(100):
+        means.means(frames[i % len(frames)], img)
+    assert means._matrix is matrix
+    assert matrix.nnz <= len(rois) * 4 * 30 * 30
+
+
+def test_stackTraces():
+    shape = (50, 60, 40)
+    win, view, img = makeView(shape[1:])
+    rois = [pg.ROI([5, 10], [12, 20], angle=20), pg.EllipseROI([30, 5], [15, 25]), pg.ROI([80, 80], [5, 5])]
+    for roi in rois:
+        view.addItem(roi)
+    means = ROIMeans(rois)
+    data = np.random.normal(size=shape)
+    traces = means.traces(data, img)
+    assert traces.shape == (3, 50)
+    ref = rois[0].getArrayRegion(data, img, axes=(1, 2)).mean(axis=2).mean(axis=1)
+    assert np.allclose(traces[0], ref)
+    # frames of the stack give the same values as single images
+    assert np.allclose(traces[:, 7], means.means(data[7], img), equal_nan=True)
@@ -0,0 +1,138 @@
+import tempfile, shutil, atexit, os, time
+import numpy as np
+import acq4.pyqtgraph as pg
+import acq4.util.ImagePyramid as ip
+
+app = pg.mkQApp()
+
+root = tempfile.mkdtemp()
+def remove_tempdir():
+    shutil.rmtree(root)
+atexit.register(remove_tempdir)
+ip.setCacheDir(os.path.join(root, 'cache'))
+
+
+def test_buildLevels():
+    data = np.arange(600*520, dtype=np.uint16).reshape(600, 520)
+    levels = ip.buildLevels(data, minSize=64)
+    assert levels[0] is data
+    assert [l.shape for l in levels] == [(600, 520), (300, 260), (150, 130), (75, 65)]
+    assert all(l.dtype == np.uint16 for l in levels)
+    expect = data[:2, :2].mean()
+    assert levels[1][0, 0] == np.round(expect)
+
+    # color images are only downsampled along the image axes
+    rgb = np.random.normal(size=(256, 300, 3))
+    levels = ip.buildLevels(rgb, minSize=64)
+    assert levels[-1].shape == (64, 75, 3)
+    assert np.allclose(levels[1][3, 4], rgb[6:8, 8:10].mean(axis=0).mean(axis=0))
+
+    assert ip.isPyramidImage(rgb)
+    assert not ip.isPyramidImage(np.zeros((10, 256, 256)))
+    assert [ip.levelCount(sh, minSize=64) for sh in [(600, 520), (256, 300, 3), (100, 50)]] == [4, 3, 1]
+
+
+def test_memoryPyramid():
+    ip.setCacheDir(None)
+    try:
+        data = np.random.normal(size=(512, 400)).astype(np.float32)
+        pyr = ip.ImagePyramid(os.path.join(root, 'notWritten.dat'), minSize=100)
+        assert pyr.cachePath() is None
+        assert not pyr.isReady()
+
+        ready = []
+        pyr.sigReady.connect(ready.append)
+        pyr.generate(data, block=True)
+        app.processEvents()
+        assert pyr.isReady() and len(ready) == 1
+
+        ## levels are kept in memory; level 0 is the image itself
+        levels = pyr.levels()
+        assert levels[0] is data
+        assert [l.shape for l in levels] == [(512, 400), (256, 200), (128, 100)]
+        assert not isinstance(levels[1], np.memmap)
+        assert not os.path.exists(os.path.join(root, 'notWritten.dat'))
+
+        ## nothing is shared between pyramids for the same file
+        assert not ip.ImagePyramid(pyr.fileName, minSize=100).isReady()
+    finally:
+        ip.setCacheDir(os.path.join(root, 'cache'))
+
+
+def test_pyramidCache():
+    fname = os.path.join(root, 'image.dat')
+    data = np.random.normal(size=(512, 400)).astype(np.float32)
+    data.tofile(fname)
+
+    pyr = ip.ImagePyramid(fname, minSize=100)
+    assert not pyr.isReady()
+    assert pyr.levels() is None
+
+    ready = []
+    pyr.sigReady.connect(ready.append)
+    pyr.generate(data, block=True)
+    assert pyr.isReady()
+    app.processEvents()
+    assert len(ready) == 1
+
+    levels = pyr.levels()
+    assert [l.shape for l in levels] == [(512, 400), (256, 200), (128, 100)]
+    assert isinstance(levels[0], np.memmap)
+    assert np.all(levels[0] == data)
+    assert pyr.levelForDownsample(1) == 0
+    assert pyr.levelForDownsample(3) == 1
+    assert pyr.levelForDownsample(100) == 2
+    assert pyr.coarsestLevel(200).shape == (256, 200)
+
+    # a second pyramid object for the same file finds the cached levels
+    pyr2 = ip.ImagePyramid(fname, minSize=100)
+    assert pyr2.isReady()
+    assert np.all(pyr2.level(2) == levels[2])
+
+    # modifying the file invalidates the cache
+    time.sleep(0.01)
+    with open(fname, 'ab') as fh:
+        fh.write(b'\0' * 16)
+    pyr3 = ip.ImagePyramid(fname, minSize=100)
+    assert not pyr3.isReady()
+
+
+def test_pruneCache():
+    cache = os.path.join(root, 'prunedCache')
+    ip.setCacheDir(cache)
+    try:
+        pyrs = []
+        for i in range(3):
+            fname = os.path.join(root, 'prune%d.dat' % i)
+            data = np.random.normal(size=(256, 256)).astype(np.float32)
+            data.tofile(fname)
+            pyr = ip.ImagePyramid(fname, minSize=100)
+            pyr.generate(data, block=True)
+            pyrs.append(pyr)
+        size = sum(os.path.getsize(os.path.join(dp, f)) for dp, dn, fn in os.walk(cache) for f in fn)
+
+        ## mark the first pyramid as least recently used; opening the second makes it
+        ## more recently used than the third
+        past = time.time() - 100
+        for i, pyr in enumerate(pyrs):
+            os.utime(os.path.join(pyr.cachePath(), 'pyramid.json'), (past + i, past + i))
+        ip.ImagePyramid(pyrs[1].fileName, minSize=100).levels()
+
+        ## a limit that fits two pyramids evicts only the least recently used one
+        ip.pruneCache(maxSize=size * 2 // 3 + 1)
+        assert [pyr.isReady() for pyr in pyrs] == [False, True, True]
+        ip.pruneCache(maxSize=0, keep=[pyrs[1].cachePath()])
+        assert [pyr.isReady() for pyr in pyrs] == [False, True, False]
+
+        ## generating a new pyramid enforces the configured limit
+        ip.setMaxCacheSize(0)
+        pyrs[0].generate(np.zeros((256, 256), dtype=np.float32), block=True)
+        assert [pyr.isReady() for pyr in pyrs] == [True, False, False]
+
+        ip.setMaxCacheSize(None)
+        pyrs[1].generate(np.zeros((256, 256), dtype=np.float32), block=True)
+        ip.clearCache()
+        assert os.listdir(cache) == []
+    finally:
+        ip.setMaxCacheSize(2 * 1024**3)
+        ip.setCacheDir(os.path.join(root, 'cache'))
@@ -0,0 +1,58 @@
+import numpy as np
+from acq4.util.RingBuffer import RingBuffer
+
+
+def test_ringBuffer():
+    buf = RingBuffer(rowShape=(2,), size=12)
+    storage = buf._data
+    expect = []
+    for i in range(20):
+        buf.append([i, -i])
+        expect.append([i, -i])
+        if i % 3 == 0:
+            buf.popFront(2)
+            expect = expect[2:]
+        assert np.all(buf.data() == np.array(expect).reshape(-1, 2))
+    assert len(buf) == len(expect)
+
+    rows = np.arange(8).reshape(4, 2)
+    buf.extend(rows)
+    expect.extend(rows.tolist())
+    assert np.all(buf.data() == np.array(expect))
+    assert list(buf[0]) == expect[0]
+    assert list(buf[-1]) == [6, 7]
+
+    # the storage is never reallocated; a full buffer discards its oldest rows
+    rows = np.arange(10).reshape(5, 2) + 100
+    buf.extend(rows)
+    expect = (expect + rows.tolist())[-12:]
+    assert np.all(buf.data() == np.array(expect))
+    buf.append([200, 201])
+    expect = expect[1:] + [[200, 201]]
+    assert np.all(buf.data() == np.array(expect))
+    buf.extend(np.arange(40).reshape(20, 2))
+    assert np.all(buf.data() == np.arange(16, 40).reshape(12, 2))
+    assert buf._data is storage
+    assert buf.capacity() == len(buf) == 12
+
+    buf.clear()
+    assert len(buf) == 0
+    assert buf.data().shape == (0, 2)
+
+
+def test_searchsorted():
+    buf = RingBuffer(rowShape=(2,), size=10)
+    assert buf.searchsorted(1.0) == 0
+    # sorted keys with repeats, wrapped around the end of the storage
+    keys = [0, 1, 1, 2, 3, 5, 5, 5, 8, 9, 9, 12, 13, 13]
+    for k in keys:
+        buf.append([k, 10 * k])
+    assert buf._start != 0
+    data = buf.data()
+    for value in np.arange(-1, 15, 0.5):
+        assert buf.searchsorted(value) == np.searchsorted(data[:, 0], value)
+        assert buf.searchsorted(value * 10, column=1) == np.searchsorted(data[:, 1], value * 10)
+
+    scalars = RingBuffer(size=4)
+    scalars.extend([1, 2, 3, 4, 5])
+    assert scalars.searchsorted(3) == 1
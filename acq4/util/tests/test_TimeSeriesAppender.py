@@ -0,0 +1,77 @@
+import tempfile, shutil, atexit, os, time
+import numpy as np
+from acq4.util.metaarray import MetaArray
+from acq4.util.TimeSeriesAppender import TimeSeriesAppender
+
+root = tempfile.mkdtemp()
+def remove_tempdir():
+    shutil.rmtree(root)
+atexit.register(remove_tempdir)
+
+
+def makeRows(start, n):
+    t = np.arange(start, start+n, dtype=float)
+    info = [
+        {'name': 'Time', 'values': t, 'units': 's'},
+        {'name': 'Value', 'cols': [{'name': 'a'}, {'name': 'b'}]},
+    ]
+    data = np.empty((n, 2))
+    data[:, 0] = t
+    data[:, 1] = t * 2
+    return MetaArray(data, info=info)
+
+
+def test_appender():
+    fname = os.path.join(root, 'append_test.ma')
+    makeRows(0, 1).write(fname, appendAxis='Time')
+
+    app = TimeSeriesAppender(fname, flushRows=10, flushInterval=100.)
+    for i in range(1, 21):
+        app.append(makeRows(i, 1))
+
+    # full batches are written without waiting for the interval
+    start = time.time()
+    while app.rowsWritten < 20 and time.time() < start + 5:
+        time.sleep(0.01)
+    assert app.rowsWritten == 20
+
+    for i in range(21, 25):
+        app.append(makeRows(i, 1))
+    time.sleep(0.05)
+    assert app.pendingRows() == 4
+
+    app.flush()
+    assert app.pendingRows() == 0
+    assert app.rowsWritten == 24
+
+    app.close()
+    app.close()  # second close is harmless
+
+    result = MetaArray(file=fname)
+    assert result.shape == (25, 2)
+    assert np.all(result.xvals('Time') == np.arange(25))
+    assert np.all(result['Value': 'b'].asarray() == np.arange(25) * 2)
+
+
+def test_appender_interval():
+    fname = os.path.join(root, 'interval_test.ma')
+    makeRows(0, 1).write(fname, appendAxis='Time')
+
+    app = TimeSeriesAppender(fname, flushRows=1000, flushInterval=0.05)
+    app.append(makeRows(1, 2))
+    start = time.time()
+    while app.rowsWritten < 2 and time.time() < start + 5:
+        time.sleep(0.01)
+    assert app.rowsWritten == 2
+
+    # close writes anything still buffered
+    app.append(makeRows(3, 1))
+    app.close()
+    assert app.rowsWritten == 3
+    assert MetaArray(file=fname).shape == (4, 2)
+
+    try:
+        app.append(makeRows(4, 1))
+        raise AssertionError("append after close should raise")
+    except Exception as exc:
+        assert 'closed' in str(exc)
@@ -0,0 +1,81 @@
+import time
+import numpy as np
+import acq4.util.ptime as ptime
+import acq4.pyqtgraph.debug as pgdebug
+from acq4.util.debug import Profiler, ProfilerRegistry, profilerRegistry
+
+
+def profiledFunction(n):
+    prof = Profiler('ProfiledSite.run', disabled=True)
+    for i in range(n):
+        prof('step')
+    prof.finish()
+
+
+class Caller(object):
+    def method(self):
+        prof = Profiler(disabled=True)
+        prof('a')
+        prof('b')
+        prof.finish()
+
+
+def test_disabledOverhead():
+    profilerRegistry.disable()
+    assert Profiler('ProfiledSite.run', disabled=True) is pgdebug.Profiler._disabledProfiler
+
+    n = 20000
+    start = ptime.time()
+    for i in range(n):
+        prof = Profiler('ProfiledSite.run', disabled=True)
+        prof('step')
+        prof.finish()
+    perCall = (ptime.time() - start) / n
+    assert perCall < 20e-6
+
+
+def test_aggregation():
+    reg = ProfilerRegistry()
+    times = np.linspace(1e-3, 10e-3, 100)
+    for t in times:
+        reg.record('site', 'mark', t)
+    reg.record('site', 'other', 0.5)
+
+    s = reg.stats()['site']
+    assert list(s.keys()) == ['mark', 'other']
+    assert s['mark']['count'] == 100
+    assert np.allclose(s['mark']['mean'], times.mean())
+    assert np.allclose(s['mark']['total'], times.sum())
+    assert s['mark']['max'] == times.max()
+    p95 = np.percentile(times, 95)
+    assert p95 <= s['mark']['p95'] <= p95 * 10 ** (1.0 / reg.binsPerDecade)
+    assert s['other']['p95'] == 0.5  # never reported above the max
+
+    reg.reset()
+    assert reg.stats() == {}
+
+
+def test_enabledSites():
+    profilerRegistry.reset()
+    profilerRegistry.enable('ProfiledSite.*, Caller.method')
+    try:
+        for i in range(3):
+            profiledFunction(4)
+            Caller().method()
+        stats = profilerRegistry.stats()
+        assert stats['ProfiledSite.run']['step']['count'] == 12
+        assert stats['ProfiledSite.run']['<total>']['count'] == 3
+        # unnamed profilers are identified by their caller
+        assert list(stats['Caller.method'].keys()) == ['a', 'b', '<total>']
+        assert stats['Caller.method']['a']['count'] == 3
+
+        # disabling a pattern stops collection but keeps the statistics
+        profilerRegistry.disable('Caller.method')
+        Caller().method()
+        profiledFunction(1)
+        stats = profilerRegistry.stats()
+        assert stats['Caller.method']['a']['count'] == 3
+        assert stats['ProfiledSite.run']['step']['count'] == 13
+    finally:
+        profilerRegistry.disable()
+        profilerRegistry.reset()
@@ -0,0 +1,22 @@
+#!/usr/bin/python
+"""
+Run the ACQ4 performance benchmarks on simulated hardware and print JSON timings.
+
+    python tools/runBenchmarks.py [names] [--repeat N] [--output FILE]
+                                  [--compare BASELINE.json] [--tolerance 0.25]
+
+Exits with status 1 if any benchmark fails or is slower than the baseline by more
+than the given tolerance. No display is needed: Qt's offscreen platform is selected
+unless QT_QPA_PLATFORM is already set (Qt4 builds without platform plugins need
+an X server such as xvfb-run instead).
+"""
+import os, sys
+
+## must happen before acq4 creates the QApplication
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import acq4.benchmarks
+
+if __name__ == '__main__':
+    sys.exit(acq4.benchmarks.main(sys.argv[1:]))